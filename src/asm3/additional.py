@@ -1,5 +1,6 @@
 
 import asm3.al
+import asm3.cachedisk
 import asm3.utils
 
 from asm3.i18n import _, python2display
@@ -37,6 +38,15 @@ LOSTANIMAL_IN = "9, 10"
 FOUNDANIMAL_IN = "11, 12"
 WAITINGLIST_IN = "13, 14, 15"
 
+# All the link type names that can have additional fields
+LINKTYPES = [ "animal", "person", "incident", "lostanimal", "foundanimal", "waitinglist" ]
+
+# How long field definitions are cached for in seconds
+FIELD_DEFINITIONS_CACHE_TTL = 3600
+
+# The most link IDs sent in a single IN clause when reading values for a resultset
+VALUES_CHUNK_SIZE = 500
+
 # Field types
 YESNO = 0
 TEXT = 1
@@ -88,25 +98,59 @@ def get_additional_fields_ids(dbo, rows, linktype = "animal"):
     fields for lists of animals
     """
     inclause = clause_for_linktype(linktype)
-    links = []
-    for r in rows:
-        links.append(str(r.id))
+    links = [ str(r.id) for r in rows ]
     if len(links) == 0:
         links.append("0")
-    return dbo.query("SELECT af.*, a.LinkID, a.Value, " \
-        "CASE WHEN af.FieldType = 8 AND a.Value <> '' AND a.Value <> '0' THEN (SELECT AnimalName FROM animal WHERE %s = a.Value) ELSE '' END AS AnimalName, " \
-        "CASE WHEN af.FieldType = 9 AND a.Value <> '' AND a.Value <> '0' THEN (SELECT OwnerName FROM owner WHERE %s = a.Value) ELSE '' END AS OwnerName " \
-        "FROM additional a INNER JOIN additionalfield af ON af.ID = a.AdditionalFieldID " \
-        "WHERE a.LinkType IN (%s) AND a.LinkID IN (%s) " \
-        "ORDER BY af.DisplayIndex" % ( dbo.sql_cast_char("animal.ID"), dbo.sql_cast_char("owner.ID"), inclause, ",".join(links)))
+    results = []
+    for i in range(0, len(links), VALUES_CHUNK_SIZE):
+        results += dbo.query("SELECT af.*, a.LinkID, a.Value, " \
+            "CASE WHEN af.FieldType = 8 AND a.Value <> '' AND a.Value <> '0' THEN (SELECT AnimalName FROM animal WHERE %s = a.Value) ELSE '' END AS AnimalName, " \
+            "CASE WHEN af.FieldType = 9 AND a.Value <> '' AND a.Value <> '0' THEN (SELECT OwnerName FROM owner WHERE %s = a.Value) ELSE '' END AS OwnerName " \
+            "FROM additional a INNER JOIN additionalfield af ON af.ID = a.AdditionalFieldID " \
+            "WHERE a.LinkType IN (%s) AND a.LinkID IN (%s) " \
+            "ORDER BY af.DisplayIndex" % ( dbo.sql_cast_char("animal.ID"), dbo.sql_cast_char("owner.ID"), inclause, ",".join(links[i:i+VALUES_CHUNK_SIZE])))
+    if len(links) > VALUES_CHUNK_SIZE:
+        results.sort(key=lambda r: r.DISPLAYINDEX)
+    return results
+
+def get_additional_values_ids(dbo, ids, fieldids, linktype = "animal"):
+    """
+    Returns the additional field values for a list of link ids as a dict of 
+    linkid: { additionalfieldid: value }. Only values for the additional
+    field ids in fieldids are returned. The ids are read in chunks of 
+    VALUES_CHUNK_SIZE.
+    """
+    values = {}
+    ids = sorted(set(asm3.utils.cint(x) for x in ids))
+    if len(ids) == 0 or len(fieldids) == 0: return values
+    fieldclause = ",".join(str(x) for x in fieldids)
+    inclause = clause_for_linktype(linktype)
+    for i in range(0, len(ids), VALUES_CHUNK_SIZE):
+        for a in dbo.query("SELECT LinkID, AdditionalFieldID, Value FROM additional " \
+            "WHERE LinkType IN (%s) AND AdditionalFieldID IN (%s) AND LinkID IN (%s)" % (inclause, fieldclause, ",".join(str(x) for x in ids[i:i+VALUES_CHUNK_SIZE]))):
+            values.setdefault(a.LINKID, {})[a.ADDITIONALFIELDID] = a.VALUE
+    return values
 
 def get_field_definitions(dbo, linktype = "animal"):
     """
     Returns the field definition info for the linktype given,
     FIELDNAME, FIELDLABEL, LOOKUPVALUES, FIELDTYPE, TOOLTIP, SEARCHABLE, MANDATORY
+    Definitions are cached per database until they are changed.
     """
+    cache_key = "additionalfields:%s" % linktype
+    rows = asm3.cachedisk.get(cache_key, dbo.database, expectedtype=list)
+    if rows is not None: return rows
     inclause = clause_for_linktype(linktype)
-    return dbo.query("SELECT * FROM additionalfield WHERE LinkType IN (%s) ORDER BY DisplayIndex" % inclause)
+    rows = dbo.query("SELECT * FROM additionalfield WHERE LinkType IN (%s) ORDER BY DisplayIndex" % inclause)
+    asm3.cachedisk.put(cache_key, dbo.database, rows, FIELD_DEFINITIONS_CACHE_TTL)
+    return rows
+
+def clear_field_definitions_cache(dbo):
+    """
+    Removes the cached field definitions for all link types
+    """
+    for linktype in LINKTYPES:
+        asm3.cachedisk.delete("additionalfields:%s" % linktype, dbo.database)
 
 def get_fields(dbo):
     """
@@ -126,22 +170,31 @@ def append_to_results(dbo, rows, linktype = "animal"):
     """
     Goes through each row in rows and adds any additional fields to the resultset.
     Requires an ID column in the rows.
+    Values for the whole resultset are read at once and fields without
+    a value for a row are set to None.
     """
+    if len(rows) == 0: return rows
+    fields = get_field_definitions(dbo, linktype)
+    if len(fields) == 0: return rows
+    keys = []
+    for af in fields:
+        if af.fieldname.find("&") != -1:
+            # We've got unicode chars for the tag name - not allowed
+            keys.append( (af.id, "ADD" + str(af.id)) )
+        else:
+            keys.append( (af.id, af.fieldname.upper()) )
+    values = get_additional_values_ids(dbo, [ r.id for r in rows ], [ af.id for af in fields ], linktype)
     for r in rows:
-        add = get_additional_fields(dbo, r.id, linktype)
-        for af in add:
-            if af.fieldname.find("&") != -1:
-                # We've got unicode chars for the tag name - not allowed
-                r["ADD" + str(af.id)] = af.value
-            else:
-                r[af.fieldname.upper()] = af.value
+        rv = values.get(r.id, {})
+        for fid, key in keys:
+            r[key] = rv.get(fid)
     return rows
 
 def insert_field_from_form(dbo, username, post):
     """
     Creates an additional field
     """
-    return dbo.insert("additionalfield", {
+    fid = dbo.insert("additionalfield", {
         "FieldName":        post["name"],
         "FieldLabel":       post["label"],
         "ToolTip":          post["tooltip"],
@@ -154,6 +207,8 @@ def insert_field_from_form(dbo, username, post):
         "LinkType":         post.integer("link"),
         "DisplayIndex":     post.integer("displayindex")
     })
+    clear_field_definitions_cache(dbo)
+    return fid
 
 def update_field_from_form(dbo, username, post):
     """
@@ -174,6 +229,7 @@ def update_field_from_form(dbo, username, post):
         "LinkType":         post.integer("link"),
         "DisplayIndex":     post.integer("displayindex")
     })
+    clear_field_definitions_cache(dbo)
 
 def delete_field(dbo, username, fid):
     """
@@ -181,6 +237,7 @@ def delete_field(dbo, username, fid):
     """
     dbo.delete("additionalfield", fid, username)
     dbo.delete("additional", "AdditionalFieldID=%d" % fid)
+    clear_field_definitions_cache(dbo)
 
 def insert_additional(dbo, linktype, linkid, additionalfieldid, value):
     """ Inserts an additional field record """
@@ -211,6 +268,16 @@ def save_values_for_link(dbo, post, linkid, linktype = "animal", setdefaults=Fal
 
     dbo.delete("additional", "LinkType IN (%s) AND LinkID=%s" % (clause_for_linktype(linktype), linkid))
 
+    # Existing values have been cleared, so gather the new ones and write them together
+    rows = []
+    def add_value(f, value):
+        rows.append({
+            "LinkType":             f.LINKTYPE,
+            "LinkID":               linkid,
+            "AdditionalFieldID":    f.ID,
+            "Value":                value
+        })
+
     for f in get_field_definitions(dbo, linktype):
 
         key = "a.%s.%s" % (f.mandatory, f.id)
@@ -218,7 +285,7 @@ def save_values_for_link(dbo, post, linkid, linktype = "animal", setdefaults=Fal
 
         if key not in post and key2 not in post:
             if setdefaults and f.DEFAULTVALUE and f.DEFAULTVALUE != "": 
-                insert_additional(dbo, f.LINKTYPE, linkid, f.ID, f.DEFAULTVALUE)
+                add_value(f, f.DEFAULTVALUE)
             continue
 
         elif key not in post: key = key2
@@ -232,7 +299,15 @@ def save_values_for_link(dbo, post, linkid, linktype = "animal", setdefaults=Fal
             if len(val.strip()) > 0 and post.date(key) is None:
                 raise asm3.utils.ASMValidationError(_("Additional date field '{0}' contains an invalid date.", l).format(f.fieldname))
             val = python2display(dbo.locale, post.date(key))
-        insert_additional(dbo, f.LINKTYPE, linkid, f.ID, val)
+        add_value(f, val)
+
+    try:
+        dbo.insert_many("additional", rows, generateID=False, writeAudit=False)
+    except Exception as err:
+        # Don't lose every value because one is bad, save them one at a time instead
+        asm3.al.warn("Failed saving additional fields together, saving individually: %s" % err, "additional.save_values_for_link", dbo)
+        for r in rows:
+            insert_additional(dbo, r["LinkType"], linkid, r["AdditionalFieldID"], r["Value"])
 
 def merge_values_for_link(dbo, post, linkid, linktype = "animal"):
     """
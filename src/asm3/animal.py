@@ -4,7 +4,9 @@ import asm3.al
 import asm3.animalname
 import asm3.asynctask
 import asm3.audit
+import asm3.cachedisk
 import asm3.configuration
+import asm3.dbms.base
 import asm3.diary
 import asm3.dbfs
 import asm3.financial
@@ -26,6 +28,38 @@ DESCENDING = 1
 # ID type keys used in the ExtraIDs column
 IDTYPE_SAVOURLIFE = "savourlife"
 
+# The number of rows to send to the database at a time 
+# when doing batch updates of animal records
+UPDATE_BATCH_SIZE = 1000
+
+# Batch update queries for animal status/variable data
+UPDATE_STATUS_SQL = "UPDATE animal SET " \
+    "Archived = ?, " \
+    "OwnerID = ?, " \
+    "ActiveMovementID = ?, " \
+    "ActiveMovementDate = ?, " \
+    "ActiveMovementType = ?, " \
+    "ActiveMovementReturn = ?, " \
+    "DiedOffShelter = ?, " \
+    "DisplayLocation = ?, " \
+    "HasActiveReserve = ?, " \
+    "HasTrialAdoption = ?, " \
+    "HasPermanentFoster = ?, " \
+    "MostRecentEntryDate = ? " \
+    "WHERE ID = ?"
+
+UPDATE_VARIABLE_SQL = "UPDATE animal SET " \
+    "TimeOnShelter = ?, " \
+    "AgeGroup = ?, " \
+    "AgeGroupActiveMovement = ?, " \
+    "AnimalAge = ?, " \
+    "DaysOnShelter = ?, " \
+    "TotalTimeOnShelter = ?, " \
+    "TotalDaysOnShelter = ? " \
+    "WHERE ID = ?"
+
+UPDATE_DIARY_LINKINFO_SQL = "UPDATE diary SET LinkInfo = ? WHERE LinkType = ? AND LinkID = ?"
+
 def get_animal_query(dbo):
     """
     Returns a select for animal rows with resolved lookups
@@ -643,83 +677,210 @@ def get_animals_recently_deceased(dbo):
         "OR a.ActiveMovementType = 2) " \
         "AND a.DeceasedDate > ?", [dbo.today(offset=-30)])
 
-def get_alerts(dbo, locationfilter = "", siteid = 0, visibleanimalids = "", age = 120):
-    """
-    Returns the alert totals for the main screen.
-    """
-    futuremonth = dbo.sql_date(dbo.today(offset=31))
-    oneyear = dbo.sql_date(dbo.today(offset=-365))
-    onemonth = dbo.sql_date(dbo.today(offset=-31))
-    oneweek = dbo.sql_date(dbo.today(offset=-7))
-    today = dbo.sql_date(dbo.today())
-    tomorrow = dbo.sql_date(dbo.today(offset=1))
-    endoftoday = dbo.sql_date(dbo.today(settime="23:59:59"))
-    locationfilter = get_location_filter_clause(locationfilter=locationfilter, siteid=siteid, visibleanimalids=visibleanimalids, andprefix=True)
-    shelterfilter = ""
-    alertchip = asm3.configuration.alert_species_microchip(dbo)
-    alertneuter = asm3.configuration.alert_species_neuter(dbo)
-    if not asm3.configuration.include_off_shelter_medical(dbo):
-        shelterfilter = " AND (Archived = 0 OR ActiveMovementType = 2)"
-    sql = "SELECT " \
-        "(SELECT COUNT(*) FROM animalvaccination INNER JOIN animal ON animal.ID = animalvaccination.AnimalID " \
-            "LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation WHERE " \
-            "DateOfVaccination Is Null AND DeceasedDate Is Null %(shelterfilter)s AND " \
-            "DateRequired  >= %(oneyear)s AND DateRequired <= %(today)s %(locfilter)s) AS duevacc," \
-        "(SELECT COUNT(*) FROM animalvaccination av1 INNER JOIN animal ON animal.ID = av1.AnimalID " \
-            "LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation WHERE " \
-            "av1.DateOfVaccination Is Not Null AND DeceasedDate Is Null %(shelterfilter)s AND " \
-            "av1.DateExpires  >= %(oneyear)s AND av1.DateExpires <= %(today)s %(locfilter)s AND " \
-            "0 = (SELECT COUNT(*) FROM animalvaccination av2 WHERE av2.AnimalID = av1.AnimalID AND " \
-            "av2.ID <> av1.ID AND av2.DateRequired >= av1.DateOfVaccination AND av2.VaccinationID = av1.VaccinationID)) AS expvacc," \
-        "(SELECT COUNT(*) FROM animaltest INNER JOIN animal ON animal.ID = animaltest.AnimalID " \
-            "LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation WHERE " \
-            "DateOfTest Is Null AND DeceasedDate Is Null %(shelterfilter)s AND " \
-            "DateRequired >= %(oneyear)s AND DateRequired <= %(today)s %(locfilter)s) AS duetest," \
-        "(SELECT COUNT(*) FROM animalmedicaltreatment INNER JOIN animal ON animal.ID = animalmedicaltreatment.AnimalID " \
-            "INNER JOIN animalmedical ON animalmedicaltreatment.AnimalMedicalID = animalmedical.ID " \
-            "LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation WHERE " \
-            "DateGiven Is Null AND DeceasedDate Is Null %(shelterfilter)s AND " \
-            "Status = 0 AND DateRequired  >= %(oneyear)s AND DateRequired <= %(today)s %(locfilter)s) AS duemed," \
-        "(SELECT COUNT(*) FROM clinicappointment WHERE DateTime >= %(today)s AND DateTime <= %(tomorrow)s) AS dueclinic," \
+# The alerts shown on the home page, as ( name, tables, from, where ).
+# Alerts with a from clause count animals and can be filtered by location,
+# their counts are stored per shelter location, movement type and site 
+# so that any location filter can be worked out from them. The others 
+# have a single subquery in where that counts for the whole database.
+# Writing to any of tables makes the stored count out of date.
+ALERTS = [
+    ( "duevacc", [ "animalvaccination" ], "animalvaccination INNER JOIN animal ON animal.ID = animalvaccination.AnimalID",
+        "DateOfVaccination Is Null AND DeceasedDate Is Null %(shelterfilter)s AND " \
+        "DateRequired  >= %(oneyear)s AND DateRequired <= %(today)s" ),
+    ( "expvacc", [ "animalvaccination" ], "animalvaccination av1 INNER JOIN animal ON animal.ID = av1.AnimalID",
+        "av1.DateOfVaccination Is Not Null AND DeceasedDate Is Null %(shelterfilter)s AND " \
+        "av1.DateExpires  >= %(oneyear)s AND av1.DateExpires <= %(today)s AND " \
+        "0 = (SELECT COUNT(*) FROM animalvaccination av2 WHERE av2.AnimalID = av1.AnimalID AND " \
+        "av2.ID <> av1.ID AND av2.DateRequired >= av1.DateOfVaccination AND av2.VaccinationID = av1.VaccinationID)" ),
+    ( "duetest", [ "animaltest" ], "animaltest INNER JOIN animal ON animal.ID = animaltest.AnimalID",
+        "DateOfTest Is Null AND DeceasedDate Is Null %(shelterfilter)s AND " \
+        "DateRequired >= %(oneyear)s AND DateRequired <= %(today)s" ),
+    ( "duemed", [ "animalmedical", "animalmedicaltreatment" ], "animalmedicaltreatment INNER JOIN animal ON animal.ID = animalmedicaltreatment.AnimalID " \
+        "INNER JOIN animalmedical ON animalmedicaltreatment.AnimalMedicalID = animalmedical.ID",
+        "DateGiven Is Null AND DeceasedDate Is Null %(shelterfilter)s AND " \
+        "Status = 0 AND DateRequired  >= %(oneyear)s AND DateRequired <= %(today)s" ),
+    ( "dueclinic", [ "clinicappointment" ], "", 
+        "(SELECT COUNT(*) FROM clinicappointment WHERE DateTime >= %(today)s AND DateTime <= %(tomorrow)s)" ),
+    ( "urgentwl", [ "animalwaitinglist", "owner" ], "", 
         "(SELECT COUNT(*) FROM animalwaitinglist INNER JOIN owner ON owner.ID = animalwaitinglist.OwnerID " \
-            "WHERE Urgency = 1 AND DateRemovedFromList Is Null) AS urgentwl," \
+        "WHERE Urgency = 1 AND DateRemovedFromList Is Null)" ),
+    ( "rsvhck", [ "adoption", "owner" ], "",
         "(SELECT COUNT(*) FROM adoption INNER JOIN owner ON owner.ID = adoption.OwnerID WHERE " \
-            "MovementType = 0 AND ReservationDate Is Not Null AND ReservationCancelledDate Is Null AND IDCheck = 0) AS rsvhck," \
-        "(SELECT COUNT(DISTINCT OwnerID) FROM ownerdonation WHERE DateDue <= %(today)s AND Date Is Null) AS duedon," \
-        "(SELECT COUNT(*) FROM adoption WHERE IsTrial = 1 AND ReturnDate Is Null AND MovementType = 1 AND TrialEndDate <= %(today)s) AS endtrial," \
+        "MovementType = 0 AND ReservationDate Is Not Null AND ReservationCancelledDate Is Null AND IDCheck = 0)" ),
+    ( "duedon", [ "ownerdonation" ], "",
+        "(SELECT COUNT(DISTINCT OwnerID) FROM ownerdonation WHERE DateDue <= %(today)s AND Date Is Null)" ),
+    ( "endtrial", [ "adoption" ], "",
+        "(SELECT COUNT(*) FROM adoption WHERE IsTrial = 1 AND ReturnDate Is Null AND MovementType = 1 AND TrialEndDate <= %(today)s)" ),
+    ( "docunsigned", [ "log" ], "",
         "(SELECT COUNT(*) FROM log WHERE LinkType=1 AND Date >= %(onemonth)s AND Comments LIKE 'ES01%%') - " \
-        "(SELECT COUNT(*) FROM log WHERE LinkType=1 AND Date >= %(onemonth)s AND Comments LIKE 'ES02%%') AS docunsigned, " \
-        "(SELECT COUNT(*) FROM log WHERE LinkType=1 AND Date >= %(oneweek)s AND Comments LIKE 'ES02%%') AS docsigned, " \
+        "(SELECT COUNT(*) FROM log WHERE LinkType=1 AND Date >= %(onemonth)s AND Comments LIKE 'ES02%%')" ),
+    ( "docsigned", [ "log" ], "",
+        "(SELECT COUNT(*) FROM log WHERE LinkType=1 AND Date >= %(oneweek)s AND Comments LIKE 'ES02%%')" ),
+    ( "longrsv", [ "adoption", "animal" ], "",
         "(SELECT COUNT(*) FROM adoption INNER JOIN animal ON adoption.AnimalID = animal.ID WHERE " \
-            "Archived = 0 AND DeceasedDate Is Null AND ReservationDate Is Not Null AND ReservationDate <= %(oneweek)s " \
-            "AND ReservationCancelledDate Is Null AND MovementType = 0 AND MovementDate Is Null) AS longrsv," \
-        "(SELECT COUNT(*) FROM animal LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation " \
-            "WHERE Neutered = 0 AND ActiveMovementType = 1 AND " \
-            "ActiveMovementDate > %(onemonth)s %(locfilter)s AND SpeciesID IN ( %(alertneuter)s ) ) AS notneu," \
-        "(SELECT COUNT(*) FROM animal LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation " \
-            "WHERE Identichipped = 0 AND Archived = 0 %(locfilter)s AND SpeciesID IN ( %(alertchip)s ) ) AS notchip, " \
-        "(SELECT COUNT(*) FROM animal LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation " \
-            "WHERE Archived = 0 AND IsNotAvailableForAdoption = 1 %(locfilter)s) AS notadopt, " \
-        "(SELECT COUNT(*) FROM animal WHERE Archived = 0 AND IsHold = 1 AND HoldUntilDate = %(tomorrow)s) AS holdtoday, " \
-        "(SELECT COUNT(DISTINCT CollationID) FROM onlineformincoming) AS inform, " \
-        "(SELECT COUNT(*) FROM ownercitation WHERE FineDueDate Is Not Null AND FineDueDate <= %(today)s AND FinePaidDate Is Null) AS acunfine, " \
-        "(SELECT COUNT(*) FROM animalcontrol WHERE CompletedDate Is Null AND DispatchDateTime Is Null AND CallDateTime Is Not Null) AS acundisp, " \
-        "(SELECT COUNT(*) FROM animalcontrol WHERE CompletedDate Is Null) AS acuncomp, " \
+        "Archived = 0 AND DeceasedDate Is Null AND ReservationDate Is Not Null AND ReservationDate <= %(oneweek)s " \
+        "AND ReservationCancelledDate Is Null AND MovementType = 0 AND MovementDate Is Null)" ),
+    ( "notneu", [], "animal",
+        "Neutered = 0 AND ActiveMovementType = 1 AND " \
+        "ActiveMovementDate > %(onemonth)s AND SpeciesID IN ( %(alertneuter)s )" ),
+    ( "notchip", [], "animal",
+        "Identichipped = 0 AND Archived = 0 AND SpeciesID IN ( %(alertchip)s )" ),
+    ( "notadopt", [], "animal",
+        "Archived = 0 AND IsNotAvailableForAdoption = 1" ),
+    ( "holdtoday", [ "animal" ], "",
+        "(SELECT COUNT(*) FROM animal WHERE Archived = 0 AND IsHold = 1 AND HoldUntilDate = %(tomorrow)s)" ),
+    ( "inform", [ "onlineformincoming" ], "",
+        "(SELECT COUNT(DISTINCT CollationID) FROM onlineformincoming)" ),
+    ( "acunfine", [ "ownercitation" ], "",
+        "(SELECT COUNT(*) FROM ownercitation WHERE FineDueDate Is Not Null AND FineDueDate <= %(today)s AND FinePaidDate Is Null)" ),
+    ( "acundisp", [ "animalcontrol" ], "",
+        "(SELECT COUNT(*) FROM animalcontrol WHERE CompletedDate Is Null AND DispatchDateTime Is Null AND CallDateTime Is Not Null)" ),
+    ( "acuncomp", [ "animalcontrol" ], "",
+        "(SELECT COUNT(*) FROM animalcontrol WHERE CompletedDate Is Null)" ),
+    ( "acfoll", [ "animalcontrol" ], "",
         "(SELECT COUNT(*) FROM animalcontrol WHERE (" \
-            "(FollowupDateTime Is Not Null AND FollowupDateTime <= %(endoftoday)s AND NOT FollowupComplete = 1) OR " \
-            "(FollowupDateTime2 Is Not Null AND FollowupDateTime2 <= %(endoftoday)s AND NOT FollowupComplete2 = 1) OR " \
-            "(FollowupDateTime3 Is Not Null AND FollowupDateTime3 <= %(endoftoday)s) AND NOT FollowupComplete3 = 1)) AS acfoll, " \
-        "(SELECT COUNT(*) FROM ownertraploan WHERE ReturnDueDate Is Not Null AND ReturnDueDate <= %(today)s AND ReturnDate Is Null) AS tlover, " \
-        "(SELECT COUNT(*) FROM stocklevel WHERE Balance > 0 AND Expiry Is Not Null AND Expiry > %(today)s AND Expiry <= %(futuremonth)s) AS stexpsoon, " \
-        "(SELECT COUNT(*) FROM stocklevel WHERE Balance > 0 AND Expiry Is Not Null AND Expiry <= %(today)s) AS stexp, " \
-        "(SELECT COUNT(*) FROM animaltransport WHERE (DriverOwnerID = 0 OR DriverOwnerID Is Null) AND Status < 10) AS trnodrv, " \
-        "(SELECT COUNT(*) FROM animal LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation " \
-            "WHERE Archived = 0 AND DaysOnShelter > 182 %(locfilter)s) AS lngterm, " \
-        "(SELECT COUNT(*) FROM publishlog WHERE Alerts > 0 AND PublishDateTime >= %(today)s) AS publish " \
-        "FROM lksmovementtype WHERE ID=1" \
-            % { "today": today, "endoftoday": endoftoday, "tomorrow": tomorrow, "oneweek": oneweek, "oneyear": oneyear, "onemonth": onemonth, 
-                "futuremonth": futuremonth, "locfilter": locationfilter, "shelterfilter": shelterfilter, "alertchip": alertchip, "alertneuter": alertneuter }
-    return dbo.query_cache(sql, age=age)
+        "(FollowupDateTime Is Not Null AND FollowupDateTime <= %(endoftoday)s AND NOT FollowupComplete = 1) OR " \
+        "(FollowupDateTime2 Is Not Null AND FollowupDateTime2 <= %(endoftoday)s AND NOT FollowupComplete2 = 1) OR " \
+        "(FollowupDateTime3 Is Not Null AND FollowupDateTime3 <= %(endoftoday)s) AND NOT FollowupComplete3 = 1))" ),
+    ( "tlover", [ "ownertraploan" ], "",
+        "(SELECT COUNT(*) FROM ownertraploan WHERE ReturnDueDate Is Not Null AND ReturnDueDate <= %(today)s AND ReturnDate Is Null)" ),
+    ( "stexpsoon", [ "stocklevel" ], "",
+        "(SELECT COUNT(*) FROM stocklevel WHERE Balance > 0 AND Expiry Is Not Null AND Expiry > %(today)s AND Expiry <= %(futuremonth)s)" ),
+    ( "stexp", [ "stocklevel" ], "",
+        "(SELECT COUNT(*) FROM stocklevel WHERE Balance > 0 AND Expiry Is Not Null AND Expiry <= %(today)s)" ),
+    ( "trnodrv", [ "animaltransport" ], "",
+        "(SELECT COUNT(*) FROM animaltransport WHERE (DriverOwnerID = 0 OR DriverOwnerID Is Null) AND Status < 10)" ),
+    ( "lngterm", [], "animal",
+        "Archived = 0 AND DaysOnShelter > 182" ),
+    ( "publish", [ "publishlog" ], "",
+        "(SELECT COUNT(*) FROM publishlog WHERE Alerts > 0 AND PublishDateTime >= %(today)s)" )
+]
+
+# Tables that every location filtered alert depends on
+ALERTS_LOCATION_TABLES = [ "animal", "configuration", "internallocation" ]
+
+def get_alerts_params(dbo):
+    """
+    Returns the values substituted into the ALERTS queries
+    """
+    shelterfilter = ""
+    if not asm3.configuration.include_off_shelter_medical(dbo):
+        shelterfilter = " AND (Archived = 0 OR ActiveMovementType = 2)"
+    return { 
+        "futuremonth": dbo.sql_date(dbo.today(offset=31)),
+        "oneyear": dbo.sql_date(dbo.today(offset=-365)),
+        "onemonth": dbo.sql_date(dbo.today(offset=-31)),
+        "oneweek": dbo.sql_date(dbo.today(offset=-7)),
+        "today": dbo.sql_date(dbo.today()),
+        "tomorrow": dbo.sql_date(dbo.today(offset=1)),
+        "endoftoday": dbo.sql_date(dbo.today(settime="23:59:59")),
+        "shelterfilter": shelterfilter,
+        "alertchip": asm3.configuration.alert_species_microchip(dbo),
+        "alertneuter": asm3.configuration.alert_species_neuter(dbo)
+    }
+
+def get_alerts_query(dbo, locationfilter = "", siteid = 0, visibleanimalids = ""):
+    """
+    Returns a query that calculates all the alert totals for the main screen
+    in one go. 
+    """
+    params = get_alerts_params(dbo)
+    locationfilter = get_location_filter_clause(locationfilter=locationfilter, siteid=siteid, visibleanimalids=visibleanimalids, andprefix=True)
+    cols = []
+    for name, tables, fromclause, where in ALERTS:
+        if fromclause != "":
+            cols.append("(SELECT COUNT(*) FROM %s LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation " \
+                "WHERE %s %s) AS %s" % (fromclause, where % params, locationfilter, name))
+        else:
+            cols.append("%s AS %s" % (where % params, name))
+    return "SELECT %s FROM lksmovementtype WHERE ID=1" % ", ".join(cols)
+
+def get_alerts(dbo, locationfilter = "", siteid = 0, visibleanimalids = "", age = 120):
+    """
+    Returns the alert totals for the main screen.
+    They are worked out from the counters kept by get_alert_counters,
+    unless the user is limited to a set of animals (eg: my fosters), 
+    in which case the alerts query is run and cached for age seconds.
+    """
+    if visibleanimalids != "" or "-12" in locationfilter.split(","):
+        return dbo.query_cache(get_alerts_query(dbo, locationfilter, siteid, visibleanimalids), age=age)
+    locs = [ asm3.utils.cint(x) for x in locationfilter.split(",") if x != "" ]
+    mts = [ 0 ] + [ -x for x in locs if x in (-1, -2, -8) ]
+    def location_match(loc, mt, site):
+        """ Mirrors the clause from get_location_filter_clause """
+        if len(locs) == 0 and siteid == 0: return True
+        return (len(locs) > 0 and (loc in locs or mt in mts)) or (siteid != 0 and site == siteid)
+    r = asm3.dbms.base.ResultRow()
+    for name, value in get_alert_counters(dbo).items():
+        if type(value) == list:
+            value = sum([ total for loc, mt, site, total in value if location_match(loc, mt, site) ])
+        r[name.upper()] = value
+    return [ r ]
+
+def get_alert_counters(dbo):
+    """
+    Returns a dict of alert name to the count for the whole database or,
+    for alerts that can be filtered by location, a list of 
+    ( shelterlocation, activemovementtype, siteid, count ). 
+    The counters are kept in the disk cache and any that have been
+    made out of date by writes to their tables, or by the date 
+    changing, are recalculated.
+    """
+    params = get_alerts_params(dbo)
+    counters = asm3.cachedisk.get("alertcounters", dbo.database, expectedtype=dict)
+    if counters is None or counters["day"] != params["today"]:
+        counters = { "day": params["today"], "alerts": {} }
+    stamps = {}
+    def changed(tables):
+        for t in tables:
+            if t not in stamps: stamps[t] = dbo.get_table_changed([t])
+        return max([ stamps[t] for t in tables ])
+    dirty = []
+    for name, tables, fromclause, where in ALERTS:
+        if fromclause != "": tables = tables + ALERTS_LOCATION_TABLES
+        stamp = changed(tables)
+        if name not in counters["alerts"] or counters["alerts"][name][0] < stamp:
+            dirty.append(( name, stamp, fromclause, where ))
+    if len(dirty) > 0:
+        asm3.al.debug("recalculating %s" % ", ".join([ x[0] for x in dirty ]), "animal.get_alert_counters", dbo)
+        cols = []
+        for name, stamp, fromclause, where in dirty:
+            if fromclause != "":
+                rows = dbo.query("SELECT animal.ShelterLocation AS loc, animal.ActiveMovementType AS mt, il.SiteID AS site, COUNT(*) AS total " \
+                    "FROM %s LEFT OUTER JOIN internallocation il ON il.ID = animal.ShelterLocation WHERE %s " \
+                    "GROUP BY animal.ShelterLocation, animal.ActiveMovementType, il.SiteID" % (fromclause, where % params))
+                counters["alerts"][name] = ( stamp, [ ( r.LOC, r.MT, r.SITE, r.TOTAL ) for r in rows ] )
+            else:
+                cols.append("%s AS %s" % (where % params, name))
+        if len(cols) > 0:
+            r = dbo.first_row(dbo.query("SELECT %s FROM lksmovementtype WHERE ID=1" % ", ".join(cols)))
+            for name, stamp, fromclause, where in dirty:
+                if fromclause == "": counters["alerts"][name] = ( stamp, r[name.upper()] )
+        asm3.cachedisk.put("alertcounters", dbo.database, counters, 86400)
+    return dict([ (k, v[1]) for k, v in counters["alerts"].items() ])
+
+def check_alert_counters(dbo):
+    """
+    Verifies the alert counters against the alerts query for the whole
+    database, each location and each site. If any differ, they are logged
+    and the counters thrown away so they will be rebuilt.
+    Returns the number of differences found.
+    """
+    filters = [ ("", 0) ]
+    filters += [ (str(r.ID), 0) for r in dbo.query("SELECT ID FROM internallocation ORDER BY ID") ]
+    filters += [ ("-1,-2,-8", 0) ]
+    filters += [ ("", r.ID) for r in dbo.query("SELECT ID FROM site ORDER BY ID") ]
+    differences = 0
+    for locationfilter, siteid in filters:
+        expected = dbo.first_row(dbo.query(get_alerts_query(dbo, locationfilter, siteid)))
+        actual = get_alerts(dbo, locationfilter, siteid)[0]
+        for k, v in expected.items():
+            if v != actual[k]:
+                asm3.al.error("alert %s (locationfilter='%s', siteid=%s) counter=%s, query=%s" % (k, locationfilter, siteid, actual[k], v), "animal.check_alert_counters", dbo)
+                differences += 1
+    if differences > 0:
+        asm3.cachedisk.delete("alertcounters", dbo.database)
+    return differences
 
 def get_stats(dbo, age=120):
     """
@@ -1026,7 +1187,8 @@ def calc_total_days_on_shelter(dbo, animalid, a = None, movements = None):
     Returns the total number of days an animal has been on the shelter (counting all stays) as an int
     (int) animalid: The animal to get the number of days on shelter for
     a: The animal already loaded, needs Archived, DateBroughtIn, DeceasedDate, ActiveMovementDate
-    movements: A list of movements that includes MovementDate and ReturnDate for this (and possibly other) animal(s) ordered by animalid
+    movements: A list of movements that includes MovementDate and ReturnDate for this (and possibly other) animal(s) ordered by animalid,
+               or an index of movements by animal ID from index_movements
     """
     stop = dbo.now()
     if a is None:
@@ -1052,6 +1214,7 @@ def calc_total_days_on_shelter(dbo, animalid, a = None, movements = None):
             "WHERE AnimalID = ? AND MovementType <> 2 " \
             "AND MovementDate Is Not Null AND ReturnDate Is Not Null " \
             "ORDER BY AnimalID", [animalid])
+    movements = get_indexed_movements(movements, animalid)
     seen = False
     for m in movements:
         if m.animalid == animalid:
@@ -1066,6 +1229,44 @@ def calc_total_days_on_shelter(dbo, animalid, a = None, movements = None):
 
     return daysonshelter
 
+def index_movements(movements):
+    """
+    Groups a list of movement rows by their AnimalID so that the
+    movements for a single animal can be found without scanning
+    the whole list. The order of movements for each animal is kept.
+    Returns a dict of animalid: [ movements ]
+    """
+    idx = {}
+    for m in movements:
+        if m.animalid in idx:
+            idx[m.animalid].append(m)
+        else:
+            idx[m.animalid] = [ m ]
+    return idx
+
+def get_indexed_movements(movements, animalid):
+    """
+    movements: Either a list of movements or an index from index_movements
+    Returns the movements to look at for animalid. For an index this is
+    just the animal's movements, a list is returned untouched.
+    """
+    if isinstance(movements, dict):
+        return movements.get(animalid, [])
+    return movements
+
+def execute_batch(dbo, sql, batch, flush = False):
+    """
+    Sends a batch of update parameters to the database with execute_many
+    once it reaches UPDATE_BATCH_SIZE rows (or straight away if flush is True), 
+    then empties it so the caller can keep appending to it. 
+    Returns the number of rows affected.
+    """
+    if len(batch) == 0: return 0
+    if not flush and len(batch) < UPDATE_BATCH_SIZE: return 0
+    rv = dbo.execute_many(sql, batch)
+    del batch[:]
+    return rv or 0
+
 def calc_age_group(dbo, animalid, a = None, bands = None, todate = None):
     """
     Returns the age group the animal fits into based on its
@@ -2496,7 +2697,7 @@ def update_diary_linkinfo(dbo, animalid, a = None, diaryupdatebatch = None):
     if diaryupdatebatch is not None:
         diaryupdatebatch.append( (diaryloc, asm3.diary.ANIMAL, animalid) )
     else:
-        dbo.execute("UPDATE diary SET LinkInfo = ? WHERE LinkType = ? AND LinkID = ?", (diaryloc, asm3.diary.ANIMAL, animalid))
+        dbo.execute(UPDATE_DIARY_LINKINFO_SQL, (diaryloc, asm3.diary.ANIMAL, animalid))
 
 def update_location_unit(dbo, username, animalid, newlocationid, newunit = ""):
     """
@@ -2631,16 +2832,19 @@ def clone_animal(dbo, username, animalid):
         "MostRecentEntryDate": a.mostrecententrydate
     }, username, writeAudit=False)
     # Additional Fields
+    rows = []
     for af in dbo.query("SELECT * FROM additional WHERE LinkID = %d AND LinkType IN (%s)" % (animalid, asm3.additional.ANIMAL_IN)):
-        dbo.insert("additional", {
+        rows.append({
             "LinkType":             af.linktype,
             "LinkID":               nid,
             "AdditionalFieldID":    af.additionalfieldid,
             "Value":                af.value
-        }, generateID=False, writeAudit=False, setRecordVersion=False)
+        })
+    dbo.insert_many("additional", rows, generateID=False, writeAudit=False, setRecordVersion=False)
     # Vaccinations
+    rows = []
     for v in dbo.query("SELECT * FROM animalvaccination WHERE AnimalID = ?", [animalid]):
-        dbo.insert("animalvaccination", {
+        rows.append({
             "AnimalID":             nid,
             "VaccinationID":        v.vaccinationid,
             "DateOfVaccination":    v.dateofvaccination,
@@ -2651,10 +2855,12 @@ def clone_animal(dbo, username, animalid):
             "Manufacturer":         v.manufacturer,
             "Cost":                 v.cost,
             "Comments":             v.comments
-        }, username, writeAudit=False)
+        })
+    dbo.insert_many("animalvaccination", rows, username, writeAudit=False)
     # Tests
+    rows = []
     for t in dbo.query("SELECT * FROM animaltest WHERE AnimalID = ?", [animalid]):
-        dbo.insert("animaltest", {
+        rows.append({
             "AnimalID":             nid,
             "TestTypeID":           t.testtypeid,
             "TestResultID":         t.testresultid,
@@ -2663,10 +2869,13 @@ def clone_animal(dbo, username, animalid):
             "AdministeringVetID":   t.administeringvetid,
             "Cost":                 t.cost,
             "Comments":             t.comments
-        }, username, writeAudit=False)
+        })
+    dbo.insert_many("animaltest", rows, username, writeAudit=False)
     # Medical
-    for am in dbo.query("SELECT * FROM animalmedical WHERE AnimalID = ?", [animalid]):
-        namid = dbo.insert("animalmedical", {
+    rows = []
+    ams = dbo.query("SELECT * FROM animalmedical WHERE AnimalID = ?", [animalid])
+    for am in ams:
+        rows.append({
             "AnimalID":             nid,
             "MedicalProfileID":     am.medicalprofileid,
             "TreatmentName":        am.treatmentname,
@@ -2682,39 +2891,50 @@ def clone_animal(dbo, username, animalid):
             "TreatmentsRemaining":  am.treatmentsremaining,
             "Status":               am.status,
             "Comments":             am.comments
-        }, username, writeAudit=False)
-        for amt in dbo.query("SELECT * FROM animalmedicaltreatment WHERE AnimalMedicalID = ?", [am.id]):
-            dbo.insert("animalmedicaltreatment", {
-                "AnimalID":         nid,
-                "AnimalMedicalID":  namid,
-                "DateRequired":     amt.daterequired,
-                "DateGiven":        amt.dategiven,
-                "TreatmentNumber":  amt.treatmentnumber,
-                "TotalTreatments":  amt.totaltreatments,
-                "AdministeringVetID": amt.administeringvetid,
-                "GivenBy":          amt.givenby,
-                "Comments":         amt.comments
-            }, username, writeAudit=False)
+        })
+    namids = dict(zip([ am.id for am in ams ], dbo.insert_many("animalmedical", rows, username, writeAudit=False)))
+    rows = []
+    amts = []
+    if len(namids) > 0:
+        amts = dbo.query("SELECT * FROM animalmedicaltreatment WHERE AnimalMedicalID IN (%s) ORDER BY AnimalMedicalID, ID" % ",".join(str(x) for x in namids.keys()))
+    for amt in amts:
+        rows.append({
+            "AnimalID":         nid,
+            "AnimalMedicalID":  namids[amt.animalmedicalid],
+            "DateRequired":     amt.daterequired,
+            "DateGiven":        amt.dategiven,
+            "TreatmentNumber":  amt.treatmentnumber,
+            "TotalTreatments":  amt.totaltreatments,
+            "AdministeringVetID": amt.administeringvetid,
+            "GivenBy":          amt.givenby,
+            "Comments":         amt.comments
+        })
+    dbo.insert_many("animalmedicaltreatment", rows, username, writeAudit=False)
     # Diet
+    rows = []
     for d in dbo.query("SELECT * FROM animaldiet WHERE AnimalID = ?", [animalid]):
-        dbo.insert("animaldiet", {
+        rows.append({
             "AnimalID":             nid,
             "DietID":               d.dietid,
             "DateStarted":          d.datestarted,
             "Comments":             d.comments
-        }, username, writeAudit=False)
+        })
+    dbo.insert_many("animaldiet", rows, username, writeAudit=False)
     # Costs
+    rows = []
     for c in dbo.query("SELECT * FROM animalcost WHERE AnimalID = ?", [animalid]):
-        dbo.insert("animalcost", {
+        rows.append({
             "AnimalID":             nid,
             "CostTypeID":           c.costtypeid,
             "CostDate":             c.costdate,
             "CostAmount":           c.costamount,
             "Description":          c.description
-        }, username, writeAudit=False)
+        })
+    dbo.insert_many("animalcost", rows, username, writeAudit=False)
     # Donations
+    rows = []
     for dt in dbo.query("SELECT * FROM ownerdonation WHERE AnimalID = ?", [animalid]):
-        dbo.insert("ownerdonation", {
+        rows.append({
             "AnimalID":             nid,
             "OwnerID":              dt.ownerid,
             "MovementID":           0,
@@ -2732,10 +2952,13 @@ def clone_animal(dbo, username, animalid):
             "VATRate":              dt.vatrate,
             "VATAmount":            dt.vatamount,
             "Comments":             dt.comments
-        }, username, writeAudit=False)
+        })
+    dbo.insert_many("ownerdonation", rows, username, writeAudit=False)
     # Diary
+    rows = []
+    linkinfo = asm3.diary.get_link_info(dbo, asm3.diary.ANIMAL, nid)
     for di in dbo.query("SELECT * FROM diary WHERE LinkType = 1 AND LinkID = ?", [animalid]):
-        dbo.insert("diary", {
+        rows.append({
             "LinkID":               nid,
             "LinkType":             asm3.diary.ANIMAL,
             "DiaryDateTime":        di.diarydatetime,
@@ -2743,8 +2966,9 @@ def clone_animal(dbo, username, animalid):
             "Subject":              di.subject,
             "Note":                 di.note,
             "DateCompleted":        di.datecompleted,
-            "LinkInfo":             asm3.diary.get_link_info(dbo, asm3.diary.ANIMAL, nid)
-        }, username, writeAudit=False)
+            "LinkInfo":             linkinfo
+        })
+    dbo.insert_many("diary", rows, username, writeAudit=False)
     # Media
     for me in dbo.query("SELECT * FROM media WHERE LinkTypeID = ? AND LinkID = ?", (asm3.media.ANIMAL, animalid)):
         ext = me.medianame
@@ -2982,12 +3206,14 @@ def delete_animal(dbo, username, animalid, ignore_movements=False):
     l = dbo.locale
     if not ignore_movements and dbo.query_int("SELECT COUNT(ID) FROM adoption WHERE AnimalID=?", [animalid]):
         raise asm3.utils.ASMValidationError(_("This animal has movements and cannot be removed.", l))
+    asm3.media.delete_thumbnails_for_link(dbo, asm3.media.ANIMAL, animalid)
     dbo.delete("media", "LinkID=%d AND LinkTypeID=%d" % (animalid, asm3.media.ANIMAL), username)
     dbo.delete("diary", "LinkID=%d AND LinkType=%d" % (animalid, asm3.diary.ANIMAL), username)
     dbo.delete("log", "LinkID=%d AND LinkType=%d" % (animalid, asm3.log.ANIMAL), username)
     dbo.execute("DELETE FROM additional WHERE LinkID = %d AND LinkType IN (%s)" % (animalid, asm3.additional.ANIMAL_IN))
     dbo.execute("DELETE FROM animalcontrolanimal WHERE AnimalID = ?", [animalid])
     dbo.execute("DELETE FROM animalpublished WHERE AnimalID = ?", [animalid])
+    dbo.execute("DELETE FROM animalpublishedfingerprint WHERE AnimalID = ?", [animalid])
     for t in [ "adoption", "animalmedical", "animalmedicaltreatment", "animaltest", "animaltransport", "animalvaccination", "clinicappointment" ]:
         dbo.delete(t, "AnimalID=%d" % animalid, username)
     dbo.delete("animal", animalid, username)
@@ -3230,7 +3456,7 @@ def update_variable_animal_data(dbo, animalid, a = None, animalupdatebatch = Non
     a: An animal result to use instead of looking it up from the id
     animalupdatebatch: A batch of update parameters
     bands: List of loaded age group bands
-    movements: List of loaded movements
+    movements: List of loaded movements or an index of them from index_movements
     """
     if animalupdatebatch is not None:
         animalupdatebatch.append((
@@ -3279,20 +3505,15 @@ def update_all_variable_animal_data(dbo):
         "WHERE ad.MovementType NOT IN (2,8) AND ad.MovementDate Is Not Null AND ad.ReturnDate Is Not Null " \
         "ORDER BY AnimalID")
 
+    movements = index_movements(movements)
+
     asm3.asynctask.set_progress_max(dbo, len(animals))
     for a in animals:
         update_variable_animal_data(dbo, a.id, a, animalupdatebatch, bands, movements)
+        execute_batch(dbo, UPDATE_VARIABLE_SQL, animalupdatebatch)
         asm3.asynctask.increment_progress_value(dbo)
 
-    dbo.execute_many("UPDATE animal SET " \
-        "TimeOnShelter = ?, " \
-        "AgeGroup = ?, " \
-        "AgeGroupActiveMovement = ?, " \
-        "AnimalAge = ?, " \
-        "DaysOnShelter = ?, " \
-        "TotalTimeOnShelter = ?, " \
-        "TotalDaysOnShelter = ? " \
-        "WHERE ID = ?", animalupdatebatch)
+    execute_batch(dbo, UPDATE_VARIABLE_SQL, animalupdatebatch, flush=True)
 
     asm3.al.debug("updated variable data for %d animals (locale %s)" % (len(animals), l), "animal.update_all_variable_animal_data", dbo)
     return "OK %d" % len(animals)
@@ -3319,19 +3540,13 @@ def update_on_shelter_variable_animal_data(dbo):
         "WHERE a.Archived = 0 AND ad.MovementType NOT IN (2,8) " \
         "AND ad.MovementDate Is Not Null AND ad.ReturnDate Is Not Null " \
         "ORDER BY a.ID")
+    movements = index_movements(movements)
 
     for a in animals:
         update_variable_animal_data(dbo, a.id, a, animalupdatebatch, bands, movements)
+        execute_batch(dbo, UPDATE_VARIABLE_SQL, animalupdatebatch)
 
-    dbo.execute_many("UPDATE animal SET " \
-        "TimeOnShelter = ?, " \
-        "AgeGroup = ?, " \
-        "AgeGroupActiveMovement = ?, " \
-        "AnimalAge = ?, " \
-        "DaysOnShelter = ?, " \
-        "TotalTimeOnShelter = ?, " \
-        "TotalDaysOnShelter = ? " \
-        "WHERE ID = ?", animalupdatebatch)
+    execute_batch(dbo, UPDATE_VARIABLE_SQL, animalupdatebatch, flush=True)
 
     asm3.al.debug("updated variable data for %d animals (locale %s)" % (len(animals), l), "animal.update_on_shelter_variable_animal_data", dbo)
     return "OK %d" % len(animals)
@@ -3362,19 +3577,13 @@ def update_offshelter_young_variable_animal_data(dbo):
         "WHERE a.Archived = 0 AND ad.MovementType NOT IN (2,8) " \
         "AND ad.MovementDate Is Not Null AND ad.ReturnDate Is Not Null " \
         "ORDER BY a.ID")
+    movements = index_movements(movements)
 
     for a in animals:
         update_variable_animal_data(dbo, a.id, a, animalupdatebatch, bands, movements)
+        execute_batch(dbo, UPDATE_VARIABLE_SQL, animalupdatebatch)
 
-    dbo.execute_many("UPDATE animal SET " \
-        "TimeOnShelter = ?, " \
-        "AgeGroup = ?, " \
-        "AgeGroupActiveMovement = ?, " \
-        "AnimalAge = ?, " \
-        "DaysOnShelter = ?, " \
-        "TotalTimeOnShelter = ?, " \
-        "TotalDaysOnShelter = ? " \
-        "WHERE ID = ?", animalupdatebatch)
+    execute_batch(dbo, UPDATE_VARIABLE_SQL, animalupdatebatch, flush=True)
 
     asm3.al.debug("updated variable data for %d animals (locale %s)" % (len(animals), l), "animal.update_offshelter_young_variable_animal_data", dbo)
     return "OK %d" % len(animals)
@@ -3393,27 +3602,18 @@ def update_all_animal_statuses(dbo):
         "trial_on_shelter": asm3.configuration.trial_on_shelter(dbo),
         "softrelease_on_shelter": asm3.configuration.softrelease_on_shelter(dbo)
     }
+    movements = index_movements(movements)
+    aff = 0
 
     asm3.asynctask.set_progress_max(dbo, len(animals))
     for a in animals:
         update_animal_status(dbo, a.id, a, movements, animalupdatebatch, diaryupdatebatch, cfg)
+        aff += execute_batch(dbo, UPDATE_STATUS_SQL, animalupdatebatch)
+        execute_batch(dbo, UPDATE_DIARY_LINKINFO_SQL, diaryupdatebatch)
         asm3.asynctask.increment_progress_value(dbo)
 
-    aff = dbo.execute_many("UPDATE animal SET " \
-        "Archived = ?, " \
-        "OwnerID = ?, " \
-        "ActiveMovementID = ?, " \
-        "ActiveMovementDate = ?, " \
-        "ActiveMovementType = ?, " \
-        "ActiveMovementReturn = ?, " \
-        "DiedOffShelter = ?, " \
-        "DisplayLocation = ?, " \
-        "HasActiveReserve = ?, " \
-        "HasTrialAdoption = ?, " \
-        "HasPermanentFoster = ?, " \
-        "MostRecentEntryDate = ? " \
-        "WHERE ID = ?", animalupdatebatch)
-    dbo.execute_many("UPDATE diary SET LinkInfo = ? WHERE LinkType = ? AND LinkID = ?", diaryupdatebatch)
+    aff += execute_batch(dbo, UPDATE_STATUS_SQL, animalupdatebatch, flush=True)
+    execute_batch(dbo, UPDATE_DIARY_LINKINFO_SQL, diaryupdatebatch, flush=True)
     asm3.al.debug("updated %d animal statuses (%d)" % (aff, len(animals)), "animal.update_all_animal_statuses", dbo)
     return "OK %d" % len(animals)
 
@@ -3435,25 +3635,16 @@ def update_foster_animal_statuses(dbo):
         "trial_on_shelter": asm3.configuration.trial_on_shelter(dbo),
         "softrelease_on_shelter": asm3.configuration.softrelease_on_shelter(dbo)
     }
+    movements = index_movements(movements)
+    aff = 0
 
     for a in animals:
         update_animal_status(dbo, a.id, a, movements, animalupdatebatch, diaryupdatebatch, cfg)
+        aff += execute_batch(dbo, UPDATE_STATUS_SQL, animalupdatebatch)
+        execute_batch(dbo, UPDATE_DIARY_LINKINFO_SQL, diaryupdatebatch)
 
-    aff = dbo.execute_many("UPDATE animal SET " \
-        "Archived = ?, " \
-        "OwnerID = ?, " \
-        "ActiveMovementID = ?, " \
-        "ActiveMovementDate = ?, " \
-        "ActiveMovementType = ?, " \
-        "ActiveMovementReturn = ?, " \
-        "DiedOffShelter = ?, " \
-        "DisplayLocation = ?, " \
-        "HasActiveReserve = ?, " \
-        "HasTrialAdoption = ?, " \
-        "HasPermanentFoster = ?, " \
-        "MostRecentEntryDate = ? " \
-        "WHERE ID = ?", animalupdatebatch)
-    dbo.execute_many("UPDATE diary SET LinkInfo = ? WHERE LinkType = ? AND LinkID = ?", diaryupdatebatch)
+    aff += execute_batch(dbo, UPDATE_STATUS_SQL, animalupdatebatch, flush=True)
+    execute_batch(dbo, UPDATE_DIARY_LINKINFO_SQL, diaryupdatebatch, flush=True)
     asm3.al.debug("updated %d fostered animal statuses (%d)" % (aff, len(animals)), "animal.update_foster_animal_statuses", dbo)
     return "OK %d" % len(animals)
 
@@ -3474,27 +3665,18 @@ def update_on_shelter_animal_statuses(dbo):
         "trial_on_shelter": asm3.configuration.trial_on_shelter(dbo),
         "softrelease_on_shelter": asm3.configuration.softrelease_on_shelter(dbo)
     }
+    movements = index_movements(movements)
+    aff = 0
 
     asm3.asynctask.set_progress_max(dbo, len(animals))
     for a in animals:
         update_animal_status(dbo, a.id, a, movements, animalupdatebatch, diaryupdatebatch, cfg)
+        aff += execute_batch(dbo, UPDATE_STATUS_SQL, animalupdatebatch)
+        execute_batch(dbo, UPDATE_DIARY_LINKINFO_SQL, diaryupdatebatch)
         asm3.asynctask.increment_progress_value(dbo)
 
-    aff = dbo.execute_many("UPDATE animal SET " \
-        "Archived = ?, " \
-        "OwnerID = ?, " \
-        "ActiveMovementID = ?, " \
-        "ActiveMovementDate = ?, " \
-        "ActiveMovementType = ?, " \
-        "ActiveMovementReturn = ?, " \
-        "DiedOffShelter = ?, " \
-        "DisplayLocation = ?, " \
-        "HasActiveReserve = ?, " \
-        "HasTrialAdoption = ?, " \
-        "HasPermanentFoster = ?, " \
-        "MostRecentEntryDate = ? " \
-        "WHERE ID = ?", animalupdatebatch)
-    dbo.execute_many("UPDATE diary SET LinkInfo = ? WHERE LinkType = ? AND LinkID = ?", diaryupdatebatch)
+    aff += execute_batch(dbo, UPDATE_STATUS_SQL, animalupdatebatch, flush=True)
+    execute_batch(dbo, UPDATE_DIARY_LINKINFO_SQL, diaryupdatebatch, flush=True)
     asm3.al.debug("updated %d on shelter animal statuses (%d)" % (aff, len(animals)), "animal.update_on_shelter_animal_statuses", dbo)
     return "OK %d" % len(animals)
 
@@ -3505,7 +3687,8 @@ def update_animal_status(dbo, animalid, a = None, movements = None, animalupdate
         DiedOffShelter, Archived and DisplayLocation.
 
     a can be an already loaded animal record
-    movements is a list of movements for this animal (and can be for other animals too)
+    movements is a list of movements for this animal (and can be for other animals too),
+        or an index of movements by animal from index_movements
     animalupdatebatch and diaryupdatebatch are lists of parameters that can be passed to
     dbo.execute_many to do all updates in one hit where necessary. If they are passed, we'll
     append our changes to them. If they aren't passed, then we do any database updates now.
@@ -3539,6 +3722,7 @@ def update_animal_status(dbo, animalid, a = None, movements = None, animalupdate
     if movements is None: 
         movements = dbo.query(get_animal_movement_status_query(dbo) + \
             " WHERE AnimalID = ? ORDER BY MovementDate DESC", [animalid])
+    movements = get_indexed_movements(movements, animalid)
 
     # Start at first intake for most recent entry date
     mostrecententrydate = a.datebroughtin
@@ -3798,6 +3982,76 @@ def get_number_animals_on_foster(dbo, date, speciesid = 0, animaltypeid = 0):
     sql += " AND (ReturnDate > %s OR ReturnDate Is Null))" % sdate
     return dbo.query_int(sql)
 
+def get_animal_figures_inventory(dbo, month, year):
+    """
+    Calculates the daily inventory counts for the animal figures report
+    for a whole month. Rather than running COUNT queries for every day, species
+    and type, the intake, death, movement and litter records that overlap the 
+    month are read once and each day is evaluated against them in memory.
+    The counts are the same as get_number_animals_on_shelter, 
+    get_number_animals_on_foster and get_number_litters_on_shelter give
+    for each day of the month.
+    Returns a dict of figures code (SP_ONSHELTER, SP_ONFOSTER, SP_LITTERS,
+    AT_ONSHELTER and AT_ONFOSTER) to a dict of species or type id to a list
+    of counts, where element 1 is the first of the month.
+    """
+    fom = datetime.datetime(year, month, 1)
+    lom = last_of_month(fom).replace(hour=23, minute=59, second=59)
+    days = lom.day
+    # Inventory on shelter is taken at the end of each day, foster and litters
+    # are compared to the date (midnight at the start of the day)
+    ends = [ datetime.datetime(year, month, i, 23, 59, 59) for i in range(1, days + 1) ]
+    starts = [ datetime.datetime(year, month, i) for i in range(1, days + 1) ]
+    inventory = {}
+    for code in ( "SP_ONSHELTER", "SP_ONFOSTER", "SP_LITTERS", "AT_ONSHELTER", "AT_ONFOSTER" ):
+        inventory[code] = {}
+    def counts(code, key):
+        if key not in inventory[code]: inventory[code][key] = [0] * (days + 1)
+        return inventory[code][key]
+    animals = dbo.query("SELECT ID, SpeciesID, AnimalTypeID, DateBroughtIn, DeceasedDate FROM animal " \
+        "WHERE NonShelterAnimal = 0 AND DateBroughtIn <= %s AND (DeceasedDate Is Null OR DeceasedDate >= %s)" % \
+        (dbo.sql_date(lom), dbo.sql_date(fom)))
+    movements = index_movements(dbo.query("SELECT AnimalID, MovementType, MovementDate, ReturnDate FROM adoption " \
+        "WHERE MovementType > 0 AND MovementDate Is Not Null AND MovementDate <= %s " \
+        "AND (ReturnDate Is Null OR ReturnDate >= %s)" % (dbo.sql_date(lom), dbo.sql_date(fom))))
+    for a in animals:
+        if a.DATEBROUGHTIN is None: continue
+        am = movements.get(a.ID, [])
+        spshelter = counts("SP_ONSHELTER", a.SPECIESID)
+        atshelter = counts("AT_ONSHELTER", a.ANIMALTYPEID)
+        spfoster = counts("SP_ONFOSTER", a.SPECIESID)
+        atfoster = counts("AT_ONFOSTER", a.ANIMALTYPEID)
+        for i in range(0, days):
+            # On shelter at the end of the day - in and not dead or out on a movement
+            e = ends[i]
+            if a.DATEBROUGHTIN <= e and (a.DECEASEDDATE is None or a.DECEASEDDATE >= e):
+                out = False
+                for m in am:
+                    if m.MOVEMENTDATE <= e and (m.RETURNDATE is None or m.RETURNDATE >= e):
+                        out = True
+                        break
+                if not out:
+                    spshelter[i+1] += 1
+                    atshelter[i+1] += 1
+            # On an open foster movement
+            d = starts[i]
+            if a.DATEBROUGHTIN <= d and (a.DECEASEDDATE is None or a.DECEASEDDATE > d):
+                for m in am:
+                    if m.MOVEMENTTYPE == asm3.movement.FOSTER and m.MOVEMENTDATE <= d and (m.RETURNDATE is None or m.RETURNDATE > d):
+                        spfoster[i+1] += 1
+                        atfoster[i+1] += 1
+                        break
+    litters = dbo.query("SELECT SpeciesID, Date, InvalidDate FROM animallitter " \
+        "WHERE Date <= %s AND (InvalidDate Is Null OR InvalidDate > %s)" % (dbo.sql_date(lom), dbo.sql_date(fom)))
+    for li in litters:
+        if li.DATE is None: continue
+        splitters = counts("SP_LITTERS", li.SPECIESID)
+        for i in range(0, days):
+            d = starts[i]
+            if li.DATE <= d and (li.INVALIDDATE is None or li.INVALIDDATE > d):
+                splitters[i+1] += 1
+    return inventory
+
 def update_animal_figures(dbo, month = 0, year = 0):
     """
     Updates the animal figures table for the month and year given.
@@ -3808,13 +4062,23 @@ def update_animal_figures(dbo, month = 0, year = 0):
     batch = []
     nid = dbo.get_id_max("animalfigures")
 
-    def sql_days(sql):
-        """ Returns a query with THEDATE and TOTAL as a dictionary for add_row """
+    keyedrows = {}
+    def keyed_days(sql, key):
+        """ 
+        Returns the rows for key from a query with KEYID, THEDATE and TOTAL 
+        as a dictionary for add_row. The query covers all species or types
+        and is only run once, subsequent calls for other keys use the 
+        same results.
+        """
+        if sql not in keyedrows:
+            keyedrows[sql] = {}
+            for r in dbo.query(sql):
+                if r.KEYID not in keyedrows[sql]: keyedrows[sql][r.KEYID] = []
+                keyedrows[sql][r.KEYID].append(r)
         d = {}
         for i in range(1, 32):
             d["D%d" % i] = 0
-        rows = dbo.query(sql)
-        for r in rows:
+        for r in keyedrows[sql].get(key, []):
             dk = "D%d" % r["THEDATE"].day
             if dk not in d: d[dk] = 0
             d[dk] += int(r["TOTAL"])
@@ -3835,6 +4099,14 @@ def update_animal_figures(dbo, month = 0, year = 0):
                     d[dk] = int(d[dk]) + int(cd[dk])
         return d
 
+    def inventory_days(code, key):
+        """ Returns the day dictionary for add_row from our inventory counts """
+        d = {}
+        c = inventory[code].get(key, None)
+        for i in range(1, loopdays):
+            d["D%d" % i] = c is not None and c[i] or 0
+        return d
+
     def is_zero_days(days):
         """ Returns true if a map of day counts is all zero """
         for i in range(1, 32):
@@ -3948,6 +4220,7 @@ def update_animal_figures(dbo, month = 0, year = 0):
     lastofmonth = dbo.sql_date(lom)
     daysinmonth = lom.day
     loopdays = daysinmonth + 1
+    inventory = get_animal_figures_inventory(dbo, month, year)
 
     # Species =====================================
     allspecies = asm3.lookups.get_species(dbo)
@@ -3960,29 +4233,17 @@ def update_animal_figures(dbo, month = 0, year = 0):
             continue
 
         # On Shelter
-        onshelter = {}
-        for i in range(1, loopdays):
-            d = datetime.datetime(year, month, i)
-            dk = "D%d" % i
-            onshelter[dk] = get_number_animals_on_shelter(dbo, d, speciesid)
+        onshelter = inventory_days("SP_ONSHELTER", speciesid)
         add_row(1, "SP_ONSHELTER", 0, speciesid, daysinmonth, _("On Shelter", l), 0, False, onshelter)
 
         # On Foster
-        onfoster = {}
-        for i in range(1, loopdays):
-            d = datetime.datetime(year, month, i)
-            dk = "D%d" % i
-            onfoster[dk] = get_number_animals_on_foster(dbo, d, speciesid)
+        onfoster = inventory_days("SP_ONFOSTER", speciesid)
         add_row(2, "SP_ONFOSTER", 0, speciesid, daysinmonth, _("On Foster (in figures)", l), 0, False, onfoster)
         #sheltertotal = add_days((onshelter, onfoster))
         sheltertotal = onshelter
 
         # Litters
-        litters = {}
-        for i in range(1, loopdays):
-            d = datetime.datetime(year, month, i)
-            dk = "D%d" % i
-            litters[dk] = get_number_litters_on_shelter(dbo, d, speciesid)
+        litters = inventory_days("SP_LITTERS", speciesid)
         add_row(3, "SP_LITTERS", 0, speciesid, daysinmonth, _("Litters", l), 0, False, litters)
 
         # Start of day total - handled at the end.
@@ -3995,50 +4256,50 @@ def update_animal_figures(dbo, month = 0, year = 0):
             idx = 5
             broughtin = {}
             for er in reasons:
-                erline = sql_days("SELECT DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
-                    "SpeciesID = %d AND DateBroughtIn >= %s AND DateBroughtIn <= %s " \
+                erline = keyed_days("SELECT SpeciesID AS KeyID, DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
+                    "DateBroughtIn >= %s AND DateBroughtIn <= %s " \
                     "AND IsTransfer = 0 AND NonShelterAnimal = 0 AND EntryReasonID = %d " \
-                    "GROUP BY DateBroughtIn" % (speciesid, firstofmonth, lastofmonth, er["ID"]))
+                    "GROUP BY SpeciesID, DateBroughtIn" % (firstofmonth, lastofmonth, er["ID"]), speciesid)
                 if not is_zero_days(erline):
                     add_row(idx, "SP_ER_%d" % er["ID"], 0, speciesid, daysinmonth, er["REASONNAME"], 0, True, erline)
                     idx += 1
                     broughtin = add_days((broughtin, erline))
         else:
-            broughtin = sql_days("SELECT DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
-                "SpeciesID = %d AND DateBroughtIn >= %s AND DateBroughtIn <= %s " \
+            broughtin = keyed_days("SELECT SpeciesID AS KeyID, DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
+                "DateBroughtIn >= %s AND DateBroughtIn <= %s " \
                 "AND IsTransfer = 0 AND NonShelterAnimal = 0 " \
-                "GROUP BY DateBroughtIn" % (speciesid, firstofmonth, lastofmonth))
+                "GROUP BY SpeciesID, DateBroughtIn" % (firstofmonth, lastofmonth), speciesid)
             add_row(5, "SP_BROUGHTIN", 0, speciesid, daysinmonth, _("Incoming", l), 0, True, broughtin)
 
         # Returned
-        returned = sql_days("SELECT ReturnDate AS TheDate, COUNT(animal.ID) AS Total FROM adoption " \
+        returned = keyed_days("SELECT SpeciesID AS KeyID, ReturnDate AS TheDate, COUNT(animal.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON adoption.AnimalID = animal.ID " \
-            "WHERE SpeciesID = %d AND ReturnDate >= %s AND ReturnDate <= %s " \
+            "WHERE ReturnDate >= %s AND ReturnDate <= %s " \
             "AND MovementType = %d " \
-            "GROUP BY ReturnDate" % (speciesid, firstofmonth, lastofmonth, asm3.movement.ADOPTION))
+            "GROUP BY SpeciesID, ReturnDate" % (firstofmonth, lastofmonth, asm3.movement.ADOPTION), speciesid)
         add_row(106, "SP_RETURNED", 0, speciesid, daysinmonth, _("Returned", l), 0, True, returned)
 
         # Transferred In
-        transferin = sql_days("SELECT DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
-            "SpeciesID = %d AND DateBroughtIn >= %s AND DateBroughtIn <= %s " \
+        transferin = keyed_days("SELECT SpeciesID AS KeyID, DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
+            "DateBroughtIn >= %s AND DateBroughtIn <= %s " \
             "AND IsTransfer <> 0 AND NonShelterAnimal = 0 " \
-            "GROUP BY DateBroughtIn" % (speciesid, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, DateBroughtIn" % (firstofmonth, lastofmonth), speciesid)
         add_row(107, "SP_TRANSFERIN", 0, speciesid, daysinmonth, _("Transferred In", l), 0, True, transferin)
 
         # Returned From Fostering
-        returnedfoster = sql_days("SELECT ReturnDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        returnedfoster = keyed_days("SELECT SpeciesID AS KeyID, ReturnDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND ReturnDate >= %s AND ReturnDate <= %s " \
-            "GROUP BY ReturnDate" % (speciesid, asm3.movement.FOSTER, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, ReturnDate" % (asm3.movement.FOSTER, firstofmonth, lastofmonth), speciesid)
         add_row(108, "SP_RETURNEDFOSTER", 0, speciesid, daysinmonth, _("From Fostering", l), 0, True, returnedfoster)
 
         # Returned From Other
-        returnedother = sql_days("SELECT ReturnDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        returnedother = keyed_days("SELECT SpeciesID AS KeyID, ReturnDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType <> %d AND MovementType <> %d " \
+            "MovementType <> %d AND MovementType <> %d " \
             "AND ReturnDate >= %s AND ReturnDate <= %s " \
-            "GROUP BY ReturnDate" % (speciesid, asm3.movement.FOSTER, asm3.movement.ADOPTION, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, ReturnDate" % (asm3.movement.FOSTER, asm3.movement.ADOPTION, firstofmonth, lastofmonth), speciesid)
         add_row(109, "SP_RETURNEDOTHER", 0, speciesid, daysinmonth, _("From Other", l), 0, True, returnedother)
 
         # In subtotal
@@ -4046,89 +4307,89 @@ def update_animal_figures(dbo, month = 0, year = 0):
         add_row(110, "SP_INTOTAL", 0, speciesid, daysinmonth, _("In SubTotal", l), 1, False, insubtotal)
 
         # Adopted
-        adopted = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        adopted = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, asm3.movement.ADOPTION, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (asm3.movement.ADOPTION, firstofmonth, lastofmonth), speciesid)
         add_row(111, "SP_ADOPTED", 0, speciesid, daysinmonth, _("Adopted", l), 0, True, adopted)
 
         # Reclaimed
-        reclaimed = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        reclaimed = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, asm3.movement.RECLAIMED, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (asm3.movement.RECLAIMED, firstofmonth, lastofmonth), speciesid)
         add_row(112, "SP_RECLAIMED", 0, speciesid, daysinmonth, _("Returned To Owner", l), 0, True, reclaimed)
 
         # Escaped
-        escaped = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        escaped = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, asm3.movement.ESCAPED, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (asm3.movement.ESCAPED, firstofmonth, lastofmonth), speciesid)
         add_row(113, "SP_ESCAPED", 0, speciesid, daysinmonth, _("Escaped", l), 0, True, escaped)
 
         # Stolen
-        stolen = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        stolen = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, asm3.movement.STOLEN, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (asm3.movement.STOLEN, firstofmonth, lastofmonth), speciesid)
         add_row(114, "SP_STOLEN", 0, speciesid, daysinmonth, _("Stolen", l), 0, True, stolen)
 
         # Released
-        released = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        released = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, asm3.movement.RELEASED, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (asm3.movement.RELEASED, firstofmonth, lastofmonth), speciesid)
         add_row(115, "SP_RELEASED", 0, speciesid, daysinmonth, _("Released To Wild", l), 0, True, released)
 
         # Transferred
-        transferred = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        transferred = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, asm3.movement.TRANSFER, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (asm3.movement.TRANSFER, firstofmonth, lastofmonth), speciesid)
         add_row(116, "SP_TRANSFERRED", 0, speciesid, daysinmonth, _("Transferred Out", l), 0, True, transferred)
 
         # Fostered
-        fostered = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        fostered = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, asm3.movement.FOSTER, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (asm3.movement.FOSTER, firstofmonth, lastofmonth), speciesid)
         add_row(117, "SP_FOSTERED", 0, speciesid, daysinmonth, _("To Fostering", l), 0, True, fostered)
 
         # Retailer
-        retailer = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        retailer = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, asm3.movement.RETAILER, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (asm3.movement.RETAILER, firstofmonth, lastofmonth), speciesid)
         add_row(118, "SP_RETAILER", 0, speciesid, daysinmonth, _("To Retailer", l), 0, True, retailer)
 
         # Died
-        died = sql_days("SELECT DeceasedDate AS TheDate, COUNT(animal.ID) AS Total FROM animal WHERE " \
-            "SpeciesID = %d AND DeceasedDate >= %s AND DeceasedDate <= %s " \
+        died = keyed_days("SELECT SpeciesID AS KeyID, DeceasedDate AS TheDate, COUNT(animal.ID) AS Total FROM animal WHERE " \
+            "DeceasedDate >= %s AND DeceasedDate <= %s " \
             "AND PutToSleep = 0 AND DiedOffShelter = 0 AND NonShelterAnimal = 0 " \
-            "GROUP BY DeceasedDate" % (speciesid, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, DeceasedDate" % (firstofmonth, lastofmonth), speciesid)
         add_row(119, "SP_DIED", 0, speciesid, daysinmonth, _("Died", l), 0, True, died)
 
         # PTS
-        pts = sql_days("SELECT DeceasedDate AS TheDate, COUNT(animal.ID) AS Total FROM animal WHERE " \
-            "SpeciesID = %d AND DeceasedDate >= %s AND DeceasedDate <= %s " \
+        pts = keyed_days("SELECT SpeciesID AS KeyID, DeceasedDate AS TheDate, COUNT(animal.ID) AS Total FROM animal WHERE " \
+            "DeceasedDate >= %s AND DeceasedDate <= %s " \
             "AND PutToSleep <> 0 AND DiedOffShelter = 0 AND NonShelterAnimal = 0 " \
-            "GROUP BY DeceasedDate" % (speciesid, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, DeceasedDate" % (firstofmonth, lastofmonth), speciesid)
         add_row(120, "SP_PTS", 0, speciesid, daysinmonth, _("Euthanized", l), 0, True, pts)
 
         # Other
-        toother = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        toother = keyed_days("SELECT SpeciesID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "SpeciesID = %d AND MovementType NOT IN (1, 2, 3, 4, 5, 6, 7, 8) " \
+            "MovementType NOT IN (1, 2, 3, 4, 5, 6, 7, 8) " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (speciesid, firstofmonth, lastofmonth))
+            "GROUP BY SpeciesID, MovementDate" % (firstofmonth, lastofmonth), speciesid)
         add_row(121, "SP_OUTOTHER", 0, speciesid, daysinmonth, _("To Other", l), 0, True, toother)
 
         # Out subtotal
@@ -4156,19 +4417,11 @@ def update_animal_figures(dbo, month = 0, year = 0):
             continue
 
         # On Shelter
-        onshelter = {}
-        for i in range(1, loopdays):
-            d = datetime.datetime(year, month, i)
-            dk = "D%d" % i
-            onshelter[dk] = get_number_animals_on_shelter(dbo, d, 0, typeid)
+        onshelter = inventory_days("AT_ONSHELTER", typeid)
         add_row(1, "AT_ONSHELTER", typeid, 0, daysinmonth, _("On Shelter", l), 0, False, onshelter)
 
         # On Foster
-        onfoster = {}
-        for i in range(1, loopdays):
-            d = datetime.datetime(year, month, i)
-            dk = "D%d" % i
-            onfoster[dk] = get_number_animals_on_foster(dbo, d, 0, typeid)
+        onfoster = inventory_days("AT_ONFOSTER", typeid)
         add_row(2, "AT_ONFOSTER", typeid, 0, daysinmonth, _("On Foster (in figures)", l), 0, False, onfoster)
         #sheltertotal = add_days((onshelter, onfoster))
         sheltertotal = onshelter
@@ -4183,51 +4436,51 @@ def update_animal_figures(dbo, month = 0, year = 0):
             broughtin = {}
             idx = 5
             for er in reasons:
-                erline = sql_days("SELECT DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
-                    "AnimalTypeID = %d AND DateBroughtIn >= %s AND DateBroughtIn <= %s " \
+                erline = keyed_days("SELECT AnimalTypeID AS KeyID, DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
+                    "DateBroughtIn >= %s AND DateBroughtIn <= %s " \
                     "AND IsTransfer = 0 AND NonShelterAnimal = 0 AND EntryReasonID = %d " \
-                    "GROUP BY DateBroughtIn" % (typeid, firstofmonth, lastofmonth, er["ID"]))
+                    "GROUP BY AnimalTypeID, DateBroughtIn" % (firstofmonth, lastofmonth, er["ID"]), typeid)
                 if not is_zero_days(erline):
                     add_row(idx, "AT_ER_%d" % er["ID"], typeid, 0, daysinmonth, er["REASONNAME"], 0, True, erline)
                     broughtin = add_days((broughtin, erline))
                     idx += 1
         else:
             # Brought In
-            broughtin = sql_days("SELECT DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
-                "AnimalTypeID = %d AND DateBroughtIn >= %s AND DateBroughtIn <= %s " \
+            broughtin = keyed_days("SELECT AnimalTypeID AS KeyID, DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
+                "DateBroughtIn >= %s AND DateBroughtIn <= %s " \
                 "AND IsTransfer = 0 AND NonShelterAnimal = 0 " \
-                "GROUP BY DateBroughtIn" % (typeid, firstofmonth, lastofmonth))
+                "GROUP BY AnimalTypeID, DateBroughtIn" % (firstofmonth, lastofmonth), typeid)
             add_row(5, "AT_BROUGHTIN", typeid, 0, daysinmonth, _("Incoming", l), 0, True, broughtin)
 
         # Returned
-        returned = sql_days("SELECT ReturnDate AS TheDate, COUNT(animal.ID) AS Total FROM adoption " \
+        returned = keyed_days("SELECT AnimalTypeID AS KeyID, ReturnDate AS TheDate, COUNT(animal.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON adoption.AnimalID = animal.ID " \
-            "WHERE AnimalTypeID = %d AND ReturnDate >= %s AND ReturnDate <= %s " \
+            "WHERE ReturnDate >= %s AND ReturnDate <= %s " \
             "AND MovementType = %d " \
-            "GROUP BY ReturnDate" % (typeid, firstofmonth, lastofmonth, asm3.movement.ADOPTION))
+            "GROUP BY AnimalTypeID, ReturnDate" % (firstofmonth, lastofmonth, asm3.movement.ADOPTION), typeid)
         add_row(6, "AT_RETURNED", typeid, 0, daysinmonth, _("Returned", l), 0, True, returned)
 
         # Transferred In
-        transferin = sql_days("SELECT DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
-            "AnimalTypeID = %d AND DateBroughtIn >= %s AND DateBroughtIn <= %s " \
+        transferin = keyed_days("SELECT AnimalTypeID AS KeyID, DateBroughtIn AS TheDate, COUNT(ID) AS Total FROM animal WHERE " \
+            "DateBroughtIn >= %s AND DateBroughtIn <= %s " \
             "AND IsTransfer <> 0 AND NonShelterAnimal = 0 " \
-            "GROUP BY DateBroughtIn" % (typeid, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, DateBroughtIn" % (firstofmonth, lastofmonth), typeid)
         add_row(7, "AT_TRANSFERIN", typeid, 0, daysinmonth, _("Transferred In", l), 0, True, transferin)
 
         # Returned From Fostering
-        returnedfoster = sql_days("SELECT ReturnDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        returnedfoster = keyed_days("SELECT AnimalTypeID AS KeyID, ReturnDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND ReturnDate >= %s AND ReturnDate <= %s " \
-            "GROUP BY ReturnDate" % (typeid, asm3.movement.FOSTER, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, ReturnDate" % (asm3.movement.FOSTER, firstofmonth, lastofmonth), typeid)
         add_row(8, "AT_RETURNEDFOSTER", typeid, 0, daysinmonth, _("From Fostering", l), 0, True, returnedfoster)
 
         # Returned From Other
-        returnedother = sql_days("SELECT ReturnDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        returnedother = keyed_days("SELECT AnimalTypeID AS KeyID, ReturnDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType <> %d AND MovementType <> %d " \
+            "MovementType <> %d AND MovementType <> %d " \
             "AND ReturnDate >= %s AND ReturnDate <= %s " \
-            "GROUP BY ReturnDate" % (typeid, asm3.movement.FOSTER, asm3.movement.ADOPTION, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, ReturnDate" % (asm3.movement.FOSTER, asm3.movement.ADOPTION, firstofmonth, lastofmonth), typeid)
         add_row(9, "AT_RETURNEDOTHER", typeid, 0, daysinmonth, _("From Other", l), 0, True, returnedother)
 
         # In subtotal
@@ -4235,89 +4488,89 @@ def update_animal_figures(dbo, month = 0, year = 0):
         add_row(10, "AT_INTOTAL", typeid, 0, daysinmonth, _("SubTotal", l), 1, False, insubtotal)
 
         # Adopted
-        adopted = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        adopted = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, asm3.movement.ADOPTION, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (asm3.movement.ADOPTION, firstofmonth, lastofmonth), typeid)
         add_row(11, "AT_ADOPTED", typeid, 0, daysinmonth, _("Adopted", l), 0, True, adopted)
 
         # Reclaimed
-        reclaimed = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        reclaimed = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, asm3.movement.RECLAIMED, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (asm3.movement.RECLAIMED, firstofmonth, lastofmonth), typeid)
         add_row(12, "AT_RECLAIMED", typeid, 0, daysinmonth, _("Returned To Owner", l), 0, True, reclaimed)
 
         # Escaped
-        escaped = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        escaped = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, asm3.movement.ESCAPED, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (asm3.movement.ESCAPED, firstofmonth, lastofmonth), typeid)
         add_row(13, "AT_ESCAPED", typeid, 0, daysinmonth, _("Escaped", l), 0, True, escaped)
 
         # Stolen
-        stolen = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        stolen = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, asm3.movement.STOLEN, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (asm3.movement.STOLEN, firstofmonth, lastofmonth), typeid)
         add_row(14, "AT_STOLEN", typeid, 0, daysinmonth, _("Stolen", l), 0, True, stolen)
 
         # Released
-        released = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        released = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, asm3.movement.RELEASED, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (asm3.movement.RELEASED, firstofmonth, lastofmonth), typeid)
         add_row(15, "AT_RELEASED", typeid, 0, daysinmonth, _("Released To Wild", l), 0, True, released)
 
         # Transferred
-        transferred = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        transferred = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, asm3.movement.TRANSFER, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (asm3.movement.TRANSFER, firstofmonth, lastofmonth), typeid)
         add_row(16, "AT_TRANSFERRED", typeid, 0, daysinmonth, _("Transferred Out", l), 0, True, transferred)
 
         # Fostered
-        fostered = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        fostered = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, asm3.movement.FOSTER, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (asm3.movement.FOSTER, firstofmonth, lastofmonth), typeid)
         add_row(17, "AT_FOSTERED", typeid, 0, daysinmonth, _("To Fostering", l), 0, True, fostered)
 
         # Retailer
-        retailer = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        retailer = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType = %d " \
+            "MovementType = %d " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, asm3.movement.RETAILER, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (asm3.movement.RETAILER, firstofmonth, lastofmonth), typeid)
         add_row(18, "AT_RETAILER", typeid, 0, daysinmonth, _("To Retailer", l), 0, True, retailer)
 
         # Died
-        died = sql_days("SELECT DeceasedDate AS TheDate, COUNT(animal.ID) AS Total FROM animal WHERE " \
-            "AnimalTypeID = %d AND DeceasedDate >= %s AND DeceasedDate <= %s " \
+        died = keyed_days("SELECT AnimalTypeID AS KeyID, DeceasedDate AS TheDate, COUNT(animal.ID) AS Total FROM animal WHERE " \
+            "DeceasedDate >= %s AND DeceasedDate <= %s " \
             "AND PutToSleep = 0 AND DiedOffShelter = 0 AND NonShelterAnimal = 0 " \
-            "GROUP BY DeceasedDate" % (typeid, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, DeceasedDate" % (firstofmonth, lastofmonth), typeid)
         add_row(19, "AT_DIED", typeid, 0, daysinmonth, _("Died", l), 0, True, died)
 
         # PTS
-        pts = sql_days("SELECT DeceasedDate AS TheDate, COUNT(animal.ID) AS Total FROM animal WHERE " \
-            "AnimalTypeID = %d AND DeceasedDate >= %s AND DeceasedDate <= %s " \
+        pts = keyed_days("SELECT AnimalTypeID AS KeyID, DeceasedDate AS TheDate, COUNT(animal.ID) AS Total FROM animal WHERE " \
+            "DeceasedDate >= %s AND DeceasedDate <= %s " \
             "AND PutToSleep <> 0 AND DiedOffShelter = 0 AND NonShelterAnimal = 0 " \
-            "GROUP BY DeceasedDate" % (typeid, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, DeceasedDate" % (firstofmonth, lastofmonth), typeid)
         add_row(20, "AT_PTS", typeid, 0, daysinmonth, _("Euthanized", l), 0, True, pts)
 
         # Other
-        toother = sql_days("SELECT MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
+        toother = keyed_days("SELECT AnimalTypeID AS KeyID, MovementDate AS TheDate, COUNT(adoption.ID) AS Total FROM adoption " \
             "INNER JOIN animal ON animal.ID = adoption.AnimalID WHERE " \
-            "AnimalTypeID = %d AND MovementType NOT IN (1, 2, 3, 4, 5, 6, 7, 8) " \
+            "MovementType NOT IN (1, 2, 3, 4, 5, 6, 7, 8) " \
             "AND MovementDate >= %s AND MovementDate <= %s " \
-            "GROUP BY MovementDate" % (typeid, firstofmonth, lastofmonth))
+            "GROUP BY AnimalTypeID, MovementDate" % (firstofmonth, lastofmonth), typeid)
         add_row(21, "AT_OUTOTHER", typeid, 0, daysinmonth, _("To Other", l), 0, True, toother)
 
         # Out subtotal
@@ -4377,11 +4630,22 @@ def update_animal_figures_annual(dbo, year = 0):
             months[12]
         ))
 
-    def sql_months(sql, babysplit = False, babymonths = 4):
+    def keyed_rows(sql):
+        """
+            Executes a query that has a KEYID column (the species, type
+            or entry reason) and returns the rows as a dictionary of KEYID 
+            to a list of rows.
+        """
+        d = {}
+        for r in dbo.query(sql):
+            if r.KEYID not in d: d[r.KEYID] = []
+            d[r.KEYID].append(r)
+        return d
+
+    def sql_months(rows, babysplit = False, babymonths = 4):
         """ 
-            Executes a query and returns two sets of months based on the
-            results. 
-            Query should have three columns - THEDATE, DOB and TOTAL.
+            Returns two sets of months based on query result rows.
+            Rows should have three columns - THEDATE, DOB and TOTAL.
             If babysplit is True, then babymonths is used to figure out
             whether the animal was a baby at the date in the result and
             if so, returns it in the second set.
@@ -4389,7 +4653,6 @@ def update_animal_figures_annual(dbo, year = 0):
         """
         d = [0] * 13
         d2 = [0] * 13
-        rows = dbo.query(sql)
         for r in rows:
             dk = r["THEDATE"].month - 1
             if not babysplit:
@@ -4409,39 +4672,66 @@ def update_animal_figures_annual(dbo, year = 0):
         d2[12] = total
         return d, d2
 
-    def entryreason_line(sql, entryreasonid, reasonname, code, group, orderindex, showbabies, babymonths):
+    def entryreason_line(rows, entryreasonid, reasonname, code, group, orderindex, showbabies, babymonths):
         """
         Adds a line for a particular entry reason.
-        sql: The query to run
+        rows: The query results for this entry reason
         """
         babyname = _("{0} (under {1} months)", l).format(reasonname, babymonths)
-        lines = sql_months(sql, showbabies, babymonths)
+        lines = sql_months(rows, showbabies, babymonths)
         add_row(orderindex, code, 0, 0, entryreasonid, group, reasonname, 0, lines[0])
         if showbabies: add_row(orderindex, code + "_BABY", 0, 0, entryreasonid, group, babyname, 0, lines[1])
 
-    def species_line(sql, speciesid, speciesname, code, group, orderindex, showbabies, babymonths):
+    def species_line(rows, speciesid, speciesname, code, group, orderindex, showbabies, babymonths):
         """
         Adds a line for a particular species.
-        sql: The query to run
+        rows: The query results for this species
         """
         babyname = ""
         if speciesid == 1: babyname = _("Puppies (under {0} months)", l).format(babymonths)
         if speciesid == 2: babyname = _("Kittens (under {0} months)", l).format(babymonths)
         babysplit = babyname != "" and showbabies
-        lines = sql_months(sql, babysplit, babymonths)
+        lines = sql_months(rows, babysplit, babymonths)
         add_row(orderindex, code, 0, speciesid, 0, group, speciesname, 0, lines[0])
         if babysplit: add_row(orderindex, code + "_BABY", 0, speciesid, 0, group, babyname, 0, lines[1])
 
-    def type_line(sql, typeid, typename, code, group, orderindex, showbabies, babymonths):
+    def type_line(rows, typeid, typename, code, group, orderindex, showbabies, babymonths):
         """
         Adds a line for a particular type.
-        sql: The query to run
+        rows: The query results for this type
         """
         babyname = _("{0} (under {1} months)", l).format(typename, babymonths)
-        lines = sql_months(sql, showbabies, babymonths)
+        lines = sql_months(rows, showbabies, babymonths)
         add_row(orderindex, code, typeid, 0, 0, group, typename, 0, lines[0])
         if showbabies: add_row(orderindex, code + "_BABY", typeid, 0, 0, group, babyname, 0, lines[1])
 
+    def species_lines(sql, code, group, orderindex):
+        """
+        Adds a line for every species from one query grouped by species.
+        sql: The query to run, with the SpeciesID as KEYID
+        """
+        rows = keyed_rows(sql)
+        for sp in allspecies:
+            species_line(rows.get(sp["ID"], []), sp["ID"], sp["SPECIESNAME"], code, group, orderindex, showbabies, babymonths)
+
+    def type_lines(sql, code, group, orderindex):
+        """
+        Adds a line for every animal type from one query grouped by type.
+        sql: The query to run, with the AnimalTypeID as KEYID
+        """
+        rows = keyed_rows(sql)
+        for at in alltypes:
+            type_line(rows.get(at["ID"], []), at["ID"], at["ANIMALTYPE"], code, group, orderindex, at["SHOWSPLIT"], babymonths)
+
+    def entryreason_lines(sql, code, group, orderindex):
+        """
+        Adds a line for every entry reason from one query grouped by reason.
+        sql: The query to run, with the EntryReasonID as KEYID
+        """
+        rows = keyed_rows(sql)
+        for er in allreasons:
+            entryreason_line(rows.get(er["ID"], []), er["ID"], er["REASONNAME"], code, group, orderindex, er["SHOWSPLIT"], babymonths)
+
     def update_db(year):
         """ Writes all of our figures to the database """
         dbo.execute("DELETE FROM animalfiguresannual WHERE Year = ?", [year])
@@ -4477,170 +4767,152 @@ def update_animal_figures_annual(dbo, year = 0):
     # Species =====================================
     allspecies = asm3.lookups.get_species(dbo)
     group = _("Intakes {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.IsTransfer = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_BROUGHTIN", group, 10, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.IsTransfer = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.SpeciesID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_BROUGHTIN", group, 10)
 
     group = _("Born on Shelter {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_BORNSHELTER", group, 20, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
+        "GROUP BY a.SpeciesID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_BORNSHELTER", group, 20)
 
     group = _("Born on Foster {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
-            "AND EXISTS(SELECT m.ID FROM adoption m WHERE m.MovementDate = a.DateBroughtIn AND " \
-                "m.AnimalID = a.ID AND m.MovementType = 2) " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_BORNFOSTER", group, 30, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
+        "AND EXISTS(SELECT m.ID FROM adoption m WHERE m.MovementDate = a.DateBroughtIn AND " \
+            "m.AnimalID = a.ID AND m.MovementType = 2) " \
+        "GROUP BY a.SpeciesID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_BORNFOSTER", group, 30)
 
     group = _("Returns {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT ad.ReturnDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.SpeciesID = %d AND ad.ReturnDate Is Not Null AND ad.ReturnDate >= %s AND ad.ReturnDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType NOT IN (2, 8) AND ad.IsTrial = 0 " \
-            "GROUP BY ad.ReturnDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_RETURN", group, 40, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, ad.ReturnDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.ReturnDate Is Not Null AND ad.ReturnDate >= %s AND ad.ReturnDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType NOT IN (2, 8) AND ad.IsTrial = 0 " \
+        "GROUP BY a.SpeciesID, ad.ReturnDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_RETURN", group, 40)
 
     group = _("Adoptions {0}", l).format(year)
-    for sp in allspecies:
-        adoptionsplittransferclause = splitadoptions and "AND IsTransfer = 0 " or ""
-        species_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.SpeciesID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "%sAND a.NonShelterAnimal = 0 AND ad.MovementType = %d AND ad.IsTrial = 0 " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear, adoptionsplittransferclause, asm3.movement.ADOPTION),
-            sp["ID"], sp["SPECIESNAME"], "SP_ADOPTED", group, 50, showbabies, babymonths)
+    adoptionsplittransferclause = splitadoptions and "AND IsTransfer = 0 " or ""
+    species_lines("SELECT a.SpeciesID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "%sAND a.NonShelterAnimal = 0 AND ad.MovementType = %d AND ad.IsTrial = 0 " \
+        "GROUP BY a.SpeciesID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, adoptionsplittransferclause, asm3.movement.ADOPTION),
+        "SP_ADOPTED", group, 50)
 
     group = _("Euthanized {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 1 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_EUTHANIZED", group, 60, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 1 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.SpeciesID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_EUTHANIZED", group, 60)
 
     group = _("Died {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_DIED", group, 70, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.SpeciesID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_DIED", group, 70)
 
     group = _("DOA {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 1 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_DOA", group, 80, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 1 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.SpeciesID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_DOA", group, 80)
 
     group = _("Returned to Owner {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.SpeciesID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear, asm3.movement.RECLAIMED),
-            sp["ID"], sp["SPECIESNAME"], "SP_RECLAIMED", group, 90, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.SpeciesID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.RECLAIMED),
+        "SP_RECLAIMED", group, 90)
 
     group = _("Transferred Out {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.SpeciesID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear, asm3.movement.TRANSFER),
-            sp["ID"], sp["SPECIESNAME"], "SP_TRANSFEROUT", group, 100, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.SpeciesID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.TRANSFER),
+        "SP_TRANSFEROUT", group, 100)
 
     group = _("Escaped {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.SpeciesID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear, asm3.movement.ESCAPED),
-            sp["ID"], sp["SPECIESNAME"], "SP_ESCAPED", group, 110, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.SpeciesID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ESCAPED),
+        "SP_ESCAPED", group, 110)
 
     group = _("Stolen {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.SpeciesID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear, asm3.movement.STOLEN),
-            sp["ID"], sp["SPECIESNAME"], "SP_STOLEN", group, 120, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.SpeciesID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.STOLEN),
+        "SP_STOLEN", group, 120)
 
     group = _("Released To Wild {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.SpeciesID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear, asm3.movement.RELEASED),
-            sp["ID"], sp["SPECIESNAME"], "SP_STOLEN", group, 130, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.SpeciesID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.RELEASED),
+        "SP_STOLEN", group, 130)
 
     group = _("Transferred In {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_TRANSFERIN", group, 140, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.SpeciesID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_TRANSFERIN", group, 140)
 
     if splitadoptions:
         group = _("Adopted Transferred In {0}", l).format(year)
-        for sp in allspecies:
-            species_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-                "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-                "a.SpeciesID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-                "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-                "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear, asm3.movement.ADOPTION),
-                sp["ID"], sp["SPECIESNAME"], "SP_TRANSFERINADOPTED", group, 150, showbabies, babymonths)
+        species_lines("SELECT a.SpeciesID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+            "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+            "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+            "GROUP BY a.SpeciesID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ADOPTION),
+            "SP_TRANSFERINADOPTED", group, 150)
 
     group = _("Live Releases {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.SpeciesID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType IN (%d, %d,  %d) " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear, asm3.movement.ADOPTION, asm3.movement.TRANSFER, asm3.movement.RECLAIMED),
-            sp["ID"], sp["SPECIESNAME"], "SP_LIVERELEASE", group, 160, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType IN (%d, %d,  %d) " \
+        "GROUP BY a.SpeciesID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ADOPTION, asm3.movement.TRANSFER, asm3.movement.RECLAIMED),
+        "SP_LIVERELEASE", group, 160)
 
     group = _("Neutered/Spayed Shelter Animals In {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.NeuteredDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.NeuteredDate >= %s AND a.NeuteredDate <= %s " \
-            "AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.NeuteredDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_NEUTERSPAYSA", group, 170, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.NeuteredDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.NeuteredDate >= %s AND a.NeuteredDate <= %s " \
+        "AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.SpeciesID, a.NeuteredDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_NEUTERSPAYSA", group, 170)
 
     group = _("Neutered/Spayed Non-Shelter Animals In {0}", l).format(year)
-    for sp in allspecies:
-        species_line("SELECT a.NeuteredDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.SpeciesID = %d AND a.NeuteredDate >= %s AND a.NeuteredDate <= %s " \
-            "AND a.NonShelterAnimal = 1 " \
-            "GROUP BY a.NeuteredDate, a.DateOfBirth" % (int(sp["ID"]), firstofyear, lastofyear),
-            sp["ID"], sp["SPECIESNAME"], "SP_NEUTERSPAYNS", group, 180, showbabies, babymonths)
+    species_lines("SELECT a.SpeciesID AS KeyID, a.NeuteredDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.NeuteredDate >= %s AND a.NeuteredDate <= %s " \
+        "AND a.NonShelterAnimal = 1 " \
+        "GROUP BY a.SpeciesID, a.NeuteredDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "SP_NEUTERSPAYNS", group, 180)
 
     asm3.asynctask.set_progress_value(dbo, 1)
 
@@ -4655,152 +4927,136 @@ def update_animal_figures_annual(dbo, year = 0):
         if showbabiestype and (at["SPECIESID"] == 1 or at["SPECIESID"] == 2):
             at["SHOWSPLIT"] = True
     group = _("Intakes {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.AnimalTypeID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.IsTransfer = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear),
-            at["ID"], at["ANIMALTYPE"], "AT_BROUGHTIN", group, 10, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.IsTransfer = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.AnimalTypeID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "AT_BROUGHTIN", group, 10)
 
     group = _("Born on Shelter {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.AnimalTypeID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear),
-            at["ID"], at["ANIMALTYPE"], "AT_BORNSHELTER", group, 20, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
+        "GROUP BY a.AnimalTypeID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "AT_BORNSHELTER", group, 20)
 
     group = _("Born on Foster {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.AnimalTypeID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
-            "AND EXISTS(SELECT m.ID FROM adoption m WHERE m.MovementDate = a.DateBroughtIn AND " \
-                "m.AnimalID = a.ID AND m.MovementType = 2) " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear),
-            at["ID"], at["ANIMALTYPE"], "AT_BORNFOSTER", group, 30, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
+        "AND EXISTS(SELECT m.ID FROM adoption m WHERE m.MovementDate = a.DateBroughtIn AND " \
+            "m.AnimalID = a.ID AND m.MovementType = 2) " \
+        "GROUP BY a.AnimalTypeID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "AT_BORNFOSTER", group, 30)
 
     group = _("Returns {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT ad.ReturnDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.AnimalTypeID = %d AND ad.ReturnDate Is Not Null AND ad.ReturnDate >= %s AND ad.ReturnDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType NOT IN (2, 8) AND ad.IsTrial = 0 " \
-            "GROUP BY ad.ReturnDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear),
-            at["ID"], at["ANIMALTYPE"], "AT_RETURN", group, 40, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, ad.ReturnDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.ReturnDate Is Not Null AND ad.ReturnDate >= %s AND ad.ReturnDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType NOT IN (2, 8) AND ad.IsTrial = 0 " \
+        "GROUP BY a.AnimalTypeID, ad.ReturnDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "AT_RETURN", group, 40)
 
     group = _("Adoptions {0}", l).format(year)
-    for at in alltypes:
-        adoptionsplittransferclause = splitadoptions and "AND IsTransfer = 0 " or ""
-        type_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.AnimalTypeID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "%sAND a.NonShelterAnimal = 0 AND ad.MovementType = %d AND ad.IsTrial = 0 " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear, adoptionsplittransferclause, asm3.movement.ADOPTION),
-            at["ID"], at["ANIMALTYPE"], "AT_ADOPTED", group, 50, at["SHOWSPLIT"], babymonths)
+    adoptionsplittransferclause = splitadoptions and "AND IsTransfer = 0 " or ""
+    type_lines("SELECT a.AnimalTypeID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "%sAND a.NonShelterAnimal = 0 AND ad.MovementType = %d AND ad.IsTrial = 0 " \
+        "GROUP BY a.AnimalTypeID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, adoptionsplittransferclause, asm3.movement.ADOPTION),
+        "AT_ADOPTED", group, 50)
 
     group = _("Euthanized {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.AnimalTypeID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 1 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear),
-            at["ID"], at["ANIMALTYPE"], "AT_EUTHANIZED", group, 60, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 1 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.AnimalTypeID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "AT_EUTHANIZED", group, 60)
 
     group = _("Died {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.AnimalTypeID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear),
-            at["ID"], at["ANIMALTYPE"], "AT_DIED", group, 70, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.AnimalTypeID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "AT_DIED", group, 70)
 
     group = _("DOA {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.AnimalTypeID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 1 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear),
-            at["ID"], at["ANIMALTYPE"], "AT_DOA", group, 80, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 1 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.AnimalTypeID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "AT_DOA", group, 80)
 
     group = _("Returned to Owner {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.AnimalTypeID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.IsTransfer = 0 AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear, asm3.movement.RECLAIMED),
-            at["ID"], at["ANIMALTYPE"], "AT_RECLAIMED", group, 90, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.IsTransfer = 0 AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.AnimalTypeID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.RECLAIMED),
+        "AT_RECLAIMED", group, 90)
 
     group = _("Transferred Out {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.AnimalTypeID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear, asm3.movement.TRANSFER),
-            at["ID"], at["ANIMALTYPE"], "AT_TRANSFEROUT", group, 100, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.AnimalTypeID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.TRANSFER),
+        "AT_TRANSFEROUT", group, 100)
 
     group = _("Escaped {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.AnimalTypeID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear, asm3.movement.ESCAPED),
-            at["ID"], at["ANIMALTYPE"], "AT_ESCAPED", group, 110, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.AnimalTypeID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ESCAPED),
+        "AT_ESCAPED", group, 110)
 
     group = _("Stolen {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.AnimalTypeID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear, asm3.movement.STOLEN),
-            at["ID"], at["ANIMALTYPE"], "AT_STOLEN", group, 120, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.AnimalTypeID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.STOLEN),
+        "AT_STOLEN", group, 120)
 
     group = _("Released To Wild {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.AnimalTypeID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear, asm3.movement.RELEASED),
-            at["ID"], at["ANIMALTYPE"], "AT_STOLEN", group, 130, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.AnimalTypeID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.RELEASED),
+        "AT_STOLEN", group, 130)
 
     group = _("Transferred In {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.AnimalTypeID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear),
-            at["ID"], at["ANIMALTYPE"], "AT_TRANSFERIN", group, 140, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.AnimalTypeID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "AT_TRANSFERIN", group, 140)
 
     if splitadoptions:
         group = _("Adopted Transferred In {0}", l).format(year)
-        for at in alltypes:
-            type_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-                "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-                "a.AnimalTypeID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-                "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-                "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear, asm3.movement.ADOPTION),
-                at["ID"], at["ANIMALTYPE"], "AT_TRANSFERINADOPTED", group, 150, at["SHOWSPLIT"], babymonths)
+        type_lines("SELECT a.AnimalTypeID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+            "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+            "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+            "GROUP BY a.AnimalTypeID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ADOPTION),
+            "AT_TRANSFERINADOPTED", group, 150)
 
     group = _("Live Releases {0}", l).format(year)
-    for at in alltypes:
-        type_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.AnimalTypeID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType in (%d, %d, %d) " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(at["ID"]), firstofyear, lastofyear, asm3.movement.ADOPTION, asm3.movement.TRANSFER, asm3.movement.RECLAIMED),
-            at["ID"], at["ANIMALTYPE"], "AT_LIVERELEASE", group, 160, at["SHOWSPLIT"], babymonths)
+    type_lines("SELECT a.AnimalTypeID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType in (%d, %d, %d) " \
+        "GROUP BY a.AnimalTypeID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ADOPTION, asm3.movement.TRANSFER, asm3.movement.RECLAIMED),
+        "AT_LIVERELEASE", group, 160)
 
     asm3.asynctask.set_progress_value(dbo, 2)
 
@@ -4815,152 +5071,136 @@ def update_animal_figures_annual(dbo, year = 0):
         if showbabiestype and (er["SPECIESID"] == 1 or er["SPECIESID"] == 2):
             er["SHOWSPLIT"] = True
     group = _("Intakes {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.EntryReasonID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.IsTransfer = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear),
-            er["ID"], er["REASONNAME"], "ER_BROUGHTIN", group, 10, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.IsTransfer = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.EntryReasonID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "ER_BROUGHTIN", group, 10)
 
     group = _("Born on Shelter {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.EntryReasonID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear),
-            er["ID"], er["REASONNAME"], "ER_BORNSHELTER", group, 20, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
+        "GROUP BY a.EntryReasonID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "ER_BORNSHELTER", group, 20)
 
     group = _("Born on Foster {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.EntryReasonID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
-            "AND EXISTS(SELECT m.ID FROM adoption m WHERE m.MovementDate = a.DateBroughtIn AND " \
-                "m.AnimalID = a.ID AND m.MovementType = 2) " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear),
-            er["ID"], er["REASONNAME"], "ER_BORNFOSTER", group, 30, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.NonShelterAnimal = 0 AND a.DateBroughtIn = a.DateOfBirth " \
+        "AND EXISTS(SELECT m.ID FROM adoption m WHERE m.MovementDate = a.DateBroughtIn AND " \
+            "m.AnimalID = a.ID AND m.MovementType = 2) " \
+        "GROUP BY a.EntryReasonID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "ER_BORNFOSTER", group, 30)
 
     group = _("Returns {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT ad.ReturnDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.EntryReasonID = %d AND ad.ReturnDate Is Not Null AND ad.ReturnDate >= %s AND ad.ReturnDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType NOT IN (2, 8) AND ad.IsTrial = 0 " \
-            "GROUP BY ad.ReturnDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear),
-            er["ID"], er["REASONNAME"], "ER_RETURN", group, 40, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.ReturnDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.ReturnDate Is Not Null AND ad.ReturnDate >= %s AND ad.ReturnDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType NOT IN (2, 8) AND ad.IsTrial = 0 " \
+        "GROUP BY a.EntryReasonID, ad.ReturnDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "ER_RETURN", group, 40)
 
     group = _("Adoptions {0}", l).format(year)
-    for er in allreasons:
-        adoptionsplittransferclause = splitadoptions and "AND IsTransfer = 0 " or ""
-        entryreason_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.EntryReasonID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "%sAND a.NonShelterAnimal = 0 AND ad.MovementType = %d AND ad.IsTrial = 0 " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear, adoptionsplittransferclause, asm3.movement.ADOPTION),
-            er["ID"], er["REASONNAME"], "ER_ADOPTED", group, 50, er["SHOWSPLIT"], babymonths)
+    adoptionsplittransferclause = splitadoptions and "AND IsTransfer = 0 " or ""
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "%sAND a.NonShelterAnimal = 0 AND ad.MovementType = %d AND ad.IsTrial = 0 " \
+        "GROUP BY a.EntryReasonID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, adoptionsplittransferclause, asm3.movement.ADOPTION),
+        "ER_ADOPTED", group, 50)
 
     group = _("Euthanized {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.EntryReasonID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 1 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear),
-            er["ID"], er["REASONNAME"], "ER_EUTHANIZED", group, 60, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 1 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.EntryReasonID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "ER_EUTHANIZED", group, 60)
 
     group = _("Died {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.EntryReasonID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear),
-            er["ID"], er["REASONNAME"], "ER_DIED", group, 70, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 0 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.EntryReasonID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "ER_DIED", group, 70)
 
     group = _("DOA {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.EntryReasonID = %d AND a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
-            "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 1 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DeceasedDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear),
-            er["ID"], er["REASONNAME"], "ER_DOA", group, 80, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, a.DeceasedDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DeceasedDate >= %s AND a.DeceasedDate <= %s " \
+        "AND a.DiedOffShelter = 0 AND a.PutToSleep = 0 AND a.IsDOA = 1 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.EntryReasonID, a.DeceasedDate, a.DateOfBirth" % (firstofyear, lastofyear),
+        "ER_DOA", group, 80)
 
     group = _("Returned to Owner {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.EntryReasonID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear, asm3.movement.RECLAIMED),
-            er["ID"], er["REASONNAME"], "ER_RECLAIMED", group, 90, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.EntryReasonID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.RECLAIMED),
+        "ER_RECLAIMED", group, 90)
 
     group = _("Transferred Out {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.EntryReasonID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear, asm3.movement.TRANSFER),
-            er["ID"], er["REASONNAME"], "ER_TRANSFEROUT", group, 100, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.EntryReasonID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.TRANSFER),
+        "ER_TRANSFEROUT", group, 100)
 
     group = _("Escaped {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.EntryReasonID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear, asm3.movement.ESCAPED),
-            er["ID"], er["REASONNAME"], "ER_ESCAPED", group, 110, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.EntryReasonID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ESCAPED),
+        "ER_ESCAPED", group, 110)
 
     group = _("Stolen {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.EntryReasonID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear, asm3.movement.STOLEN),
-            er["ID"], er["REASONNAME"], "ER_STOLEN", group, 120, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.EntryReasonID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.STOLEN),
+        "ER_STOLEN", group, 120)
 
     group = _("Released To Wild {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.EntryReasonID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear, asm3.movement.RELEASED),
-            er["ID"], er["REASONNAME"], "ER_STOLEN", group, 130, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+        "GROUP BY a.EntryReasonID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.RELEASED),
+        "ER_STOLEN", group, 130)
 
     group = _("Transferred In {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(a.ID) AS Total FROM animal a WHERE " \
-            "a.EntryReasonID = %d AND a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
-            "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 " \
-            "GROUP BY a.DateBroughtIn, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear),
-            er["ID"], er["REASONNAME"], "ER_TRANSFERIN", group, 140, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, a.DateBroughtIn AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(a.ID) AS Total FROM animal a WHERE " \
+        "a.DateBroughtIn >= %s AND a.DateBroughtIn <= %s " \
+        "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 " \
+        "GROUP BY a.EntryReasonID, a.DateBroughtIn, a.DateOfBirth" % (firstofyear, lastofyear),
+        "ER_TRANSFERIN", group, 140)
 
     if splitadoptions:
         group = _("Adopted Transferred In {0}", l).format(year)
-        for er in allreasons:
-            entryreason_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-                "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-                "a.EntryReasonID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-                "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
-                "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear, asm3.movement.ADOPTION),
-                er["ID"], er["REASONNAME"], "ER_TRANSFERINADOPTED", group, 150, er["SHOWSPLIT"], babymonths)
+        entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+            "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+            "AND a.IsTransfer = 1 AND a.NonShelterAnimal = 0 AND ad.MovementType = %d " \
+            "GROUP BY a.EntryReasonID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ADOPTION),
+            "ER_TRANSFERINADOPTED", group, 150)
 
     group = _("Live Releases {0}", l).format(year)
-    for er in allreasons:
-        entryreason_line("SELECT ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
-            "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
-            "a.EntryReasonID = %d AND ad.MovementDate >= %s AND ad.MovementDate <= %s " \
-            "AND a.NonShelterAnimal = 0 AND ad.MovementType IN (%d, %d, %d) " \
-            "GROUP BY ad.MovementDate, a.DateOfBirth" % (int(er["ID"]), firstofyear, lastofyear, asm3.movement.ADOPTION, asm3.movement.TRANSFER, asm3.movement.RECLAIMED),
-            er["ID"], er["REASONNAME"], "ER_LIVERELEASE", group, 160, er["SHOWSPLIT"], babymonths)
+    entryreason_lines("SELECT a.EntryReasonID AS KeyID, ad.MovementDate AS TheDate, a.DateOfBirth AS DOB, " \
+        "COUNT(ad.ID) AS Total FROM animal a INNER JOIN adoption ad ON ad.AnimalID = a.ID WHERE " \
+        "ad.MovementDate >= %s AND ad.MovementDate <= %s " \
+        "AND a.NonShelterAnimal = 0 AND ad.MovementType IN (%d, %d, %d) " \
+        "GROUP BY a.EntryReasonID, ad.MovementDate, a.DateOfBirth" % (firstofyear, lastofyear, asm3.movement.ADOPTION, asm3.movement.TRANSFER, asm3.movement.RECLAIMED),
+        "ER_LIVERELEASE", group, 160)
     
     asm3.asynctask.set_progress_value(dbo, 3)
 
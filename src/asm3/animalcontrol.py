@@ -1,5 +1,6 @@
 
 import asm3.additional
+import asm3.al
 import asm3.audit
 import asm3.configuration
 import asm3.dbfs
@@ -10,6 +11,7 @@ import asm3.media
 import asm3.users
 import asm3.utils
 from asm3.i18n import _, python2display, format_time_now
+from asm3.sitedefs import GEO_BATCH, GEO_LIMIT
 
 ASCENDING = 0
 DESCENDING = 1
@@ -323,11 +325,13 @@ def get_traploan_two_dates(dbo, start, end):
     return dbo.query(get_traploan_query(dbo) + \
         "WHERE ReturnDate Is Null AND ReturnDueDate >= ? AND ReturnDueDate <= ?", (start, end))
 
-def update_dispatch_geocode(dbo, incidentid, latlon="", address="", town="", county="", postcode="", country=""):
+def update_dispatch_geocode(dbo, incidentid, latlon="", address="", town="", county="", postcode="", country="", background=False):
     """
     Looks up the geocode for this incident with the address info given.
     If latlon is already set to a value, checks the address hash to see if it
     matches and does not do the geocode if it does.
+    If background is True, the geocode is queued to be looked up and written
+    later by asm3.geo and latlon is returned unchanged.
     """
     # If an address hasn't been specified, look it up from the incidentid given
     if address == "":
@@ -348,6 +352,9 @@ def update_dispatch_geocode(dbo, incidentid, latlon="", address="", town="", cou
         if latlon.find(asm3.geo.address_hash(address, town, county, postcode, country)) != -1:
             return latlon
     # Do the geocode
+    if background:
+        asm3.geo.queue_lat_long(dbo, "animalcontrol", incidentid, address, town, county, postcode, country)
+        return latlon
     latlon = asm3.geo.get_lat_long(dbo, address, town, county, postcode)
     update_dispatch_latlong(dbo, incidentid, latlon)
     return latlon
@@ -358,6 +365,21 @@ def update_dispatch_latlong(dbo, incidentid, latlong):
     """
     dbo.update("animalcontrol", incidentid, { "DispatchLatLong": latlong })
 
+def update_missing_dispatch_geocodes(dbo):
+    """
+    Completes missing geocodes for incidents with a dispatch address,
+    up to GEO_LIMIT per call, by queuing them with asm3.geo.
+    """
+    if not GEO_BATCH:
+        asm3.al.warn("GEO_BATCH is False, skipping", "update_missing_dispatch_geocodes", dbo)
+        return
+    rows = dbo.query("SELECT ID, DispatchAddress, DispatchTown, DispatchCounty, DispatchPostcode " \
+        "FROM animalcontrol WHERE (DispatchLatLong Is Null OR DispatchLatLong = '') " \
+        "AND DispatchAddress Is Not Null AND DispatchAddress <> '' ORDER BY CreatedDate DESC", limit=GEO_LIMIT)
+    georequests = [ asm3.geo.queue_lat_long(dbo, "animalcontrol", r.ID, r.DISPATCHADDRESS, r.DISPATCHTOWN, r.DISPATCHCOUNTY, r.DISPATCHPOSTCODE) for r in rows ]
+    asm3.geo.wait_lat_long(georequests)
+    asm3.al.debug("updated %d incident geocodes" % len(rows), "animalcontrol.update_missing_dispatch_geocodes", dbo)
+
 def update_animalcontrol_completenow(dbo, acid, username, completetype):
     """
     Updates an animal control incident record, marking it completed now with the type specified
@@ -439,7 +461,7 @@ def update_animalcontrol_from_form(dbo, post, username, geocode=True):
     update_animalcontrol_roles(dbo, acid, post.integer_list("viewroles"), post.integer_list("editroles"))
 
     # Check/update the geocode for the dispatch address
-    if geocode: update_dispatch_geocode(dbo, acid, post["dispatchlatlong"], post["dispatchaddress"], post["dispatchtown"], post["dispatchcounty"], post["dispatchpostcode"])
+    if geocode: update_dispatch_geocode(dbo, acid, post["dispatchlatlong"], post["dispatchaddress"], post["dispatchtown"], post["dispatchcounty"], post["dispatchpostcode"], background=True)
 
 def update_animalcontrol_roles(dbo, acid, viewroles, editroles):
     """
@@ -533,7 +555,7 @@ def insert_animalcontrol_from_form(dbo, post, username, geocode=True):
     update_animalcontrol_roles(dbo, nid, post.integer_list("viewroles"), post.integer_list("editroles"))
 
     # Look up a geocode for the dispatch address
-    if geocode: update_dispatch_geocode(dbo, nid, "", post["dispatchaddress"], post["dispatchtown"], post["dispatchcounty"], post["dispatchpostcode"])
+    if geocode: update_dispatch_geocode(dbo, nid, "", post["dispatchaddress"], post["dispatchtown"], post["dispatchcounty"], post["dispatchpostcode"], background=True)
 
     return nid
 
@@ -541,6 +563,7 @@ def delete_animalcontrol(dbo, username, acid):
     """
     Deletes an animal control record
     """
+    asm3.media.delete_thumbnails_for_link(dbo, asm3.media.ANIMALCONTROL, acid)
     dbo.delete("media", "LinkID=%d AND LinkTypeID=%d" % (acid, asm3.media.ANIMALCONTROL), username)
     dbo.delete("diary", "LinkID=%d AND LinkType=%d" % (acid, asm3.diary.ANIMALCONTROL), username)
     dbo.delete("log", "LinkID=%d AND LinkType=%d" % (acid, asm3.log.ANIMALCONTROL), username)
@@ -1,151 +1,306 @@
 
 """
 Module for helping run tasks asynchronously and updating/getting progress.
-Only allows one async task per database to be run at a time.
+
+Each task has an id and its own name, progress, cancel flag, return value
+and last error. Several tasks can run against a database at the same time
+(up to MAX_TASKS, but only one with any given name).
+
+The values for a task are kept in memory by the process running it and
+copied to the disk cache so that other processes can poll them. Progress
+values are copied at most every FLUSH_INTERVAL seconds and the cancel flag
+is read back at the same rate, so it's fine to increment the progress or
+check for cancellation once per record.
+
+Functions that take a taskid act on the task given. If it is blank,
+code running inside a task uses its own task, pollers use the task most
+recently started for the database. Code that reports progress without
+being started by function_task (eg: publishers) uses a default task
+for the database.
 
 For many tasks, it should be as simple as calling their function as
-an argument to function_task, and having the function code call 
+an argument to function_task, and having the function code call
 async.set_progress_value(>100) or async.increment_progress_value()
 """
 
 import asm3.cachedisk
+import asm3.utils
 
 import threading
+import time
+
+DEFAULT_TASK = "default" # Task used by code not started with function_task
+FLUSH_INTERVAL = 0.25 # Most often progress is written to/cancel read from the disk cache (seconds)
+MAX_TASKS = 4 # Most tasks that can run at once against a database
+TASK_TTL = 3600 # How long task values are kept in the disk cache
+
+current = threading.local() # The task running in this thread
+running = {} # (database, taskid): TaskState for tasks running in this process
+runninglock = threading.Lock()
+taskslock = threading.Lock() # Held while reading and rewriting the list of task ids
+
+class TaskState(object):
+    """ The values for a task running in this process """
+    def __init__(self, database, taskid, values):
+        self.database = database
+        self.taskid = taskid
+        self.values = values
+        self.cancel = False
+        self.lastflush = 0
+        self.lastcancel = 0
+        self.lock = threading.Lock()
+
+    def flush(self, force = False):
+        """ Writes the values to the disk cache if forced or they
+            have not been written for FLUSH_INTERVAL seconds """
+        now = time.time()
+        with self.lock:
+            if not force and now - self.lastflush < FLUSH_INTERVAL: return
+            self.lastflush = now
+            values = dict(self.values)
+        asm3.cachedisk.put("task:%s" % self.taskid, self.database, values, TASK_TTL)
+
+    def get_cancel(self):
+        """ Returns the cancel flag, checking the disk cache for it
+            at most every FLUSH_INTERVAL seconds """
+        now = time.time()
+        if not self.cancel and now - self.lastcancel >= FLUSH_INTERVAL:
+            self.lastcancel = now
+            self.cancel = asm3.cachedisk.get("taskcancel:%s" % self.taskid, self.database) is True
+        return self.cancel
+
+def new_values(taskname = ""):
+    """ Returns the values for a new task """
+    return { "taskname": taskname, "taskmax": 0, "taskval": 0, "tasklasterror": "", "taskreturnvalue": "" }
+
+def get_current_id(dbo):
+    """ Returns the id of the task running in this thread or None """
+    if getattr(current, "database", None) == dbo.database:
+        return current.taskid
+    return None
+
+def get_latest_id(dbo):
+    """ Returns the id of the task most recently started for this database """
+    v = asm3.cachedisk.get("tasklatest", dbo.database)
+    if v is None: return DEFAULT_TASK
+    return v
+
+def get_task_ids(dbo):
+    """ Returns the ids of all tasks started for this database and still running """
+    v = asm3.cachedisk.get("tasks", dbo.database, expectedtype=list)
+    if v is None: v = []
+    return [ DEFAULT_TASK ] + v
 
-lc = {}
+def set_task_ids(dbo, ids):
+    """ Replaces the list of running task ids, call with taskslock held """
+    asm3.cachedisk.put("tasks", dbo.database, [ x for x in ids if x != DEFAULT_TASK ], TASK_TTL)
 
-def get(dbo, k):
+def reader_id(dbo, taskid):
+    """ The task to read: taskid, this thread's task or the latest task """
+    return taskid or get_current_id(dbo) or get_latest_id(dbo)
+
+def writer_id(dbo, taskid):
+    """ The task to write: taskid, this thread's task or the default task """
+    return taskid or get_current_id(dbo) or DEFAULT_TASK
+
+def get_local(dbo, taskid, create = False):
+    """ Returns the TaskState for taskid if it is running in this process.
+        If create is True and it isn't, starts tracking it here with
+        the values from the disk cache. """
+    key = (dbo.database, taskid)
+    with runninglock:
+        t = running.get(key)
+        if t is not None or not create: return t
+        values = asm3.cachedisk.get("task:%s" % taskid, dbo.database, expectedtype=dict)
+        t = TaskState(dbo.database, taskid, values or new_values())
+        running[key] = t
+        return t
+
+def get(dbo, k, taskid = ""):
     """ Retrieve a task value for this database """
-    return asm3.cachedisk.get(k, dbo.database)
+    taskid = reader_id(dbo, taskid)
+    t = get_local(dbo, taskid)
+    if t is not None:
+        return t.values.get(k)
+    v = asm3.cachedisk.get("task:%s" % taskid, dbo.database, expectedtype=dict)
+    if v is None: return None
+    return v.get(k)
 
-def put(dbo, k, v):
+def put(dbo, k, v, taskid = ""):
     """ Store a task value for this database """
-    asm3.cachedisk.put(k, dbo.database, v, 3600)
-
-def is_task_running(dbo):
-    """ Returns True if a task is running """
-    name = get(dbo, "taskname")
-    mx = get(dbo, "taskmax")
-    v = get(dbo, "taskval")
-    if v is not None and v == mx:
+    taskid = writer_id(dbo, taskid)
+    t = get_local(dbo, taskid, create=True)
+    with t.lock:
+        changed = t.values.get(k) != v
+        t.values[k] = v
+    t.flush(force = changed and k != "taskval")
+    if changed and k == "taskname" and v != "":
+        asm3.cachedisk.put("tasklatest", dbo.database, taskid, TASK_TTL)
+
+def is_running(values):
+    """ Returns True if a set of task values are for a running task """
+    if values is None: return False
+    if values.get("taskval") is not None and values.get("taskval") == values.get("taskmax"):
         return False
-    if name is not None and name != "":
-        return True
-    return False
-
-def reset(dbo):
-    """ Clear all task related values (except lasterror and returnvalue) """
-    put(dbo, "taskname", "")
-    put(dbo, "taskmax", 0)
-    put(dbo, "taskval", 0)
-    put(dbo, "taskcancel", False)
-    # tasklasterror, taskreturnvalue deliberately not cleared
-
-def get_task_name(dbo):
+    return values.get("taskname") is not None and values.get("taskname") != ""
+
+def is_task_running(dbo, taskid = ""):
+    """ Returns True if task taskid is running. If taskid is blank,
+        returns True if any task is running for this database. """
+    if taskid != "":
+        return is_running({ "taskname": get(dbo, "taskname", taskid), "taskmax": get(dbo, "taskmax", taskid), "taskval": get(dbo, "taskval", taskid) })
+    return len(get_running_tasks(dbo)) > 0
+
+def get_running_tasks(dbo):
+    """ Returns a list of (taskid, taskname) for the tasks running against this database """
+    rv = []
+    for taskid in get_task_ids(dbo):
+        t = get_local(dbo, taskid)
+        values = t is not None and t.values or asm3.cachedisk.get("task:%s" % taskid, dbo.database, expectedtype=dict)
+        if is_running(values): rv.append((taskid, values["taskname"]))
+    return rv
+
+def reset(dbo, taskid = ""):
+    """ Clear all task related values (except lasterror and returnvalue)
+        and stop tracking the task """
+    taskid = writer_id(dbo, taskid)
+    t = get_local(dbo, taskid, create=True)
+    with t.lock:
+        t.values["taskname"] = ""
+        t.values["taskmax"] = 0
+        t.values["taskval"] = 0
+        # tasklasterror, taskreturnvalue deliberately not cleared
+    t.flush(force=True)
+    asm3.cachedisk.put("taskcancel:%s" % taskid, dbo.database, False, TASK_TTL)
+    with runninglock:
+        running.pop((dbo.database, taskid), None)
+    if taskid != DEFAULT_TASK:
+        with taskslock:
+            set_task_ids(dbo, [ x for x in get_task_ids(dbo) if x != taskid ])
+
+def get_task_name(dbo, taskid = ""):
     """ Get the task name """
-    v = get(dbo, "taskname")
+    v = get(dbo, "taskname", taskid)
     if v is None or v == "":
         return "NONE"
     return v
 
-def set_task_name(dbo, v):
+def set_task_name(dbo, v, taskid = ""):
     """ Set the task name """
-    put(dbo, "taskname", v)
+    put(dbo, "taskname", v, taskid)
 
-def get_progress_max(dbo):
+def get_progress_max(dbo, taskid = ""):
     """ Get the max value for the progress meter """
-    return get(dbo, "taskmax")
-   
-def set_progress_max(dbo, progressmax):
+    return get(dbo, "taskmax", taskid)
+
+def set_progress_max(dbo, progressmax, taskid = ""):
     """ Set a value for the maximum progress meter """
-    put(dbo, "taskmax", progressmax)
+    put(dbo, "taskmax", progressmax, taskid)
 
-def get_progress_value(dbo):
+def get_progress_value(dbo, taskid = ""):
     """ Get a value for the progress meter """
-    return get(dbo, "taskval")
+    return get(dbo, "taskval", taskid)
 
-def get_progress_percent(dbo):
-    m = get_progress_max(dbo)
-    v = get_progress_value(dbo)
+def get_progress_percent(dbo, taskid = ""):
+    taskid = reader_id(dbo, taskid)
+    m = get_progress_max(dbo, taskid)
+    v = get_progress_value(dbo, taskid)
     if m is not None and v is not None and m != 0:
         return int((float(v) / float(m)) * 100)
     return 0
 
-def set_progress_value(dbo, v):
+def set_progress_value(dbo, v, taskid = ""):
     """ Set a value for the progress meter """
-    return put(dbo, "taskval", v)
+    return put(dbo, "taskval", v, taskid)
 
-def increment_progress_value(dbo):
+def increment_progress_value(dbo, taskid = ""):
     """ Adds one to the progress value """
-    v = get_progress_value(dbo)
-    if v is not None: 
-        v += 1
-        set_progress_value(dbo, v)
+    t = get_local(dbo, writer_id(dbo, taskid), create=True)
+    with t.lock:
+        t.values["taskval"] += 1
+    t.flush()
 
-def get_cancel(dbo):
+def get_cancel(dbo, taskid = ""):
     """ Returns whether the running task should stop """
-    v = get(dbo, "taskcancel")
-    if v is None: return False
-    return v
+    taskid = writer_id(dbo, taskid)
+    t = get_local(dbo, taskid)
+    if t is not None: return t.get_cancel()
+    return asm3.cachedisk.get("taskcancel:%s" % taskid, dbo.database) is True
 
-def set_cancel(dbo, v):
+def set_cancel(dbo, v, taskid = ""):
     """ Set to True to tell the running task to stop """
-    put(dbo, "taskcancel", v)
+    # A task calls this on itself to clear the flag, pollers to set it
+    if v: taskid = reader_id(dbo, taskid)
+    else: taskid = writer_id(dbo, taskid)
+    asm3.cachedisk.put("taskcancel:%s" % taskid, dbo.database, v, TASK_TTL)
+    t = get_local(dbo, taskid)
+    if t is not None: t.cancel = v
 
-def get_return_value(dbo):
+def get_return_value(dbo, taskid = ""):
     """ Get the return value """
-    v = get(dbo, "taskreturnvalue")
+    v = get(dbo, "taskreturnvalue", taskid)
     if v is None: return ""
     return v
 
-def set_return_value(dbo, v):
+def set_return_value(dbo, v, taskid = ""):
     """ Set the return value """
-    put(dbo, "taskreturnvalue", v)
+    put(dbo, "taskreturnvalue", v, taskid)
 
-def get_last_error(dbo):
+def get_last_error(dbo, taskid = ""):
     """ Get the last error message """
-    v = get(dbo, "tasklasterror")
+    v = get(dbo, "tasklasterror", taskid)
     if v is None: return ""
     return v
 
-def set_last_error(dbo, e):
+def set_last_error(dbo, e, taskid = ""):
     """ Set the last error message """
-    put(dbo, "tasklasterror", e)
+    put(dbo, "tasklasterror", e, taskid)
 
 class FuncThread(threading.Thread):
     """ Class that wraps calling a function in a new thread.
-        Calls our reset method after the task is done, 
+        Calls our reset method after the task is done,
         handles putting exceptions in lasterror and storing the returnvalue too.
     """
-    def __init__(self, dbo, target, *args):
+    def __init__(self, dbo, taskid, target, *args):
         self.target = target
         self.args = args
         self.dbo = dbo
+        self.taskid = taskid
         threading.Thread.__init__(self)
- 
+
     def run(self):
+        current.database = self.dbo.database
+        current.taskid = self.taskid
         try:
             set_return_value(self.dbo, self.target(*self.args))
         except Exception as err:
             set_last_error(self.dbo, str(err))
         finally:
             reset(self.dbo)
+            current.taskid = None
 
 def function_task(dbo, taskname, fn, *args):
-    """ Runs the function fn with tuple of args, wrapping it as an async task 
+    """ Runs the function fn with tuple of args, wrapping it as an async task
         taskname: a name for the task
         fn: The function to call
         *args: arguments to pass to the function.
 
         functions can still call async.set_progress_value, but they don't
         need any other boiler plate async code and will work just as well sync.
-    """
-    if is_task_running(dbo): return # do nothing if a task is already going
-    set_last_error(dbo, "")
-    set_return_value(dbo, "")
-    set_task_name(dbo, taskname)
-    set_cancel(dbo, False)
-    set_progress_max(dbo, 100) # override in called function
-    set_progress_value(dbo, 0)
-    FuncThread(dbo, fn, *args).start()
 
+        Returns the id of the new task, or None if a task with the same name
+        or MAX_TASKS tasks are already running.
+    """
+    with taskslock:
+        tasks = get_running_tasks(dbo)
+        if len(tasks) >= MAX_TASKS or taskname in [ x[1] for x in tasks ]: return None
+        taskid = asm3.utils.uuid_str()
+        t = get_local(dbo, taskid, create=True)
+        t.values = new_values(taskname)
+        t.values["taskmax"] = 100 # override in called function
+        t.flush(force=True)
+        asm3.cachedisk.put("taskcancel:%s" % taskid, dbo.database, False, TASK_TTL)
+        asm3.cachedisk.put("tasklatest", dbo.database, taskid, TASK_TTL)
+        set_task_ids(dbo, get_task_ids(dbo) + [ taskid ])
+    FuncThread(dbo, taskid, fn, *args).start()
+    return taskid
@@ -107,6 +107,13 @@ def dump_row(dbo, tablename, rowid):
 def dump_rows(dbo, tablename, condition):
     return str(dbo.query("SELECT * FROM %s WHERE %s" % (tablename, condition)))
 
+def dump_values(values):
+    """
+    Returns the same output as dump_row for a dict of column values that
+    have just been written, without reading the row back from the database.
+    """
+    return str([ dict( (k.upper(), v) for k, v in values.items() ) ])
+
 def create(dbo, username, tablename, linkid, parentlinks, description):
     action(dbo, ADD, username, tablename, linkid, parentlinks, description)
 
@@ -160,11 +167,17 @@ def action(dbo, action, username, tablename, linkid, parentlinks, description):
     """
     Adds an audit record
     """
+    dbo.insert("audittrail", action_values(dbo, action, username, tablename, linkid, parentlinks, description), generateID=False, writeAudit=False)
+
+def action_values(dbo, action, username, tablename, linkid, parentlinks, description):
+    """
+    Returns the audittrail column values for an audit record so that 
+    callers writing in bulk can send many of them at once.
+    """
     # Truncate description field to 16k if it's very long
     if len(description) > 16384:
         description = description[0:16384]
-
-    dbo.insert("audittrail", {
+    return {
         "Action":       action,
         "AuditDate":    dbo.now(),
         "UserName":     username,
@@ -172,7 +185,7 @@ def action(dbo, action, username, tablename, linkid, parentlinks, description):
         "LinkID":       linkid,
         "ParentLinks":  parentlinks,
         "Description":  description
-    }, generateID=False, writeAudit=False)
+    }
 
 def clean(dbo):
     """
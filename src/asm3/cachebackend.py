@@ -0,0 +1,410 @@
+
+"""
+Storage backends for asm3.cachemem and asm3.cachedisk.
+
+Every backend stores values under a namespace and key with a time to
+live in seconds and keeps hit/miss/eviction counters for the current
+process. Available backends:
+
+    lru      - size bounded, in process dictionary (not shared between processes)
+    sqlite   - a single SQLite file under DISK_CACHE, shared by all processes on the host
+    file     - one pickle file per key under DISK_CACHE (the original disk cache)
+    memcache - memcached via bmemcached (shared between hosts)
+"""
+
+import asm3.al
+
+import collections
+import fcntl
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+
+from asm3.sitedefs import DISK_CACHE, CACHE_LRU_MAX_ITEMS, CACHE_SQLITE_FILE, CACHE_SQLITE_MAX_ITEMS
+
+class CacheBackend(object):
+    """
+    Base class for cache backends. Subclasses must implement
+    get_entry, put, delete and increment.
+    """
+    name = ""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, namespace, key):
+        """ Returns the value for key or None if it does not exist or has expired """
+        e = self.get_entry(namespace, key)
+        if e is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return e[0]
+
+    def get_entry(self, namespace, key):
+        """ Returns a tuple of (value, expiry time) or None if the key does not exist or has expired """
+        raise NotImplementedError()
+
+    def put(self, namespace, key, value, ttl):
+        """ Stores value for ttl seconds """
+        raise NotImplementedError()
+
+    def delete(self, namespace, key):
+        """ Removes key """
+        raise NotImplementedError()
+
+    def exists(self, namespace, key):
+        """ Returns True if key is in the cache and has not expired """
+        return self.get_entry(namespace, key) is not None
+
+    def increment(self, namespace, key, delta=1):
+        """ Increments an integer value by delta and returns it, or None if it does not exist """
+        raise NotImplementedError()
+
+    def remove_expired(self, namespace):
+        """ Removes expired entries for namespace. Returns a tuple of (checked, removed) """
+        return (0, 0)
+
+    def stats(self):
+        """ Returns a dict of counters for this process """
+        total = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitratio": total > 0 and float(self.hits) / total or 0.0
+        }
+
+class LRUCacheBackend(CacheBackend):
+    """
+    In process cache holding at most maxitems entries. When full, the
+    least recently used entry is evicted. Entries also expire after their ttl.
+    Values are stored by reference.
+    """
+    name = "lru"
+
+    def __init__(self, maxitems = CACHE_LRU_MAX_ITEMS):
+        CacheBackend.__init__(self)
+        self.maxitems = maxitems
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_entry(self, namespace, key):
+        k = (namespace, key)
+        with self.lock:
+            e = self.items.get(k)
+            if e is None: return None
+            if e[1] < time.time():
+                del self.items[k]
+                return None
+            self.items.move_to_end(k)
+            return (e[0], e[1])
+
+    def put(self, namespace, key, value, ttl):
+        k = (namespace, key)
+        with self.lock:
+            self.items[k] = [value, time.time() + ttl]
+            self.items.move_to_end(k)
+            while len(self.items) > self.maxitems:
+                self.items.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def delete(self, namespace, key):
+        with self.lock:
+            self.items.pop((namespace, key), None)
+
+    def increment(self, namespace, key, delta=1):
+        k = (namespace, key)
+        with self.lock:
+            e = self.items.get(k)
+            if e is None or e[1] < time.time(): return None
+            e[0] += delta
+            self.items.move_to_end(k)
+            return e[0]
+
+    def remove_expired(self, namespace):
+        now = time.time()
+        with self.lock:
+            keys = [ k for k in self.items.keys() if k[0] == namespace ]
+            expired = [ k for k in keys if self.items[k][1] < now ]
+            for k in expired:
+                del self.items[k]
+        return (len(keys), len(expired))
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Cache stored in a single SQLite database file so that all worker
+    processes on a host share the same entries. Values are pickled.
+    The file is opened in WAL mode and memory mapped so that readers
+    do not block each other or the writer.
+    Once the table grows past maxitems, expired entries and then the
+    entries closest to expiry are removed.
+    """
+    name = "sqlite"
+
+    # Check the size of the table every time this many values are written
+    SWEEP_EVERY = 500
+
+    def __init__(self, filename = CACHE_SQLITE_FILE, maxitems = CACHE_SQLITE_MAX_ITEMS):
+        CacheBackend.__init__(self)
+        self.filename = filename
+        self.maxitems = maxitems
+        self.local = threading.local()
+        self.writes = 0
+
+    def _conn(self):
+        """ Returns the connection for the current thread, creating the database if necessary """
+        c = getattr(self.local, "conn", None)
+        if c is None:
+            path = os.path.dirname(self.filename)
+            if path != "" and not os.path.exists(path):
+                os.makedirs(path)
+            c = sqlite3.connect(self.filename, timeout=10, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("PRAGMA mmap_size=67108864")
+            c.execute("CREATE TABLE IF NOT EXISTS cache (ns TEXT NOT NULL, k TEXT NOT NULL, expires REAL NOT NULL, v BLOB, PRIMARY KEY (ns, k))")
+            c.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+            self.local.conn = c
+        return c
+
+    def get_entry(self, namespace, key):
+        r = self._conn().execute("SELECT v, expires FROM cache WHERE ns=? AND k=?", (namespace, key)).fetchone()
+        if r is None: return None
+        if r[1] < time.time():
+            self.delete(namespace, key)
+            return None
+        return (pickle.loads(r[0]), r[1])
+
+    def put(self, namespace, key, value, ttl):
+        c = self._conn()
+        c.execute("INSERT OR REPLACE INTO cache (ns, k, expires, v) VALUES (?,?,?,?)",
+            (namespace, key, time.time() + ttl, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))))
+        self.writes += 1
+        if self.writes % self.SWEEP_EVERY == 0:
+            self.sweep()
+        return True
+
+    def delete(self, namespace, key):
+        self._conn().execute("DELETE FROM cache WHERE ns=? AND k=?", (namespace, key))
+
+    def increment(self, namespace, key, delta=1):
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            r = c.execute("SELECT v, expires FROM cache WHERE ns=? AND k=?", (namespace, key)).fetchone()
+            if r is None or r[1] < time.time():
+                c.execute("COMMIT")
+                return None
+            v = pickle.loads(r[0]) + delta
+            c.execute("UPDATE cache SET v=? WHERE ns=? AND k=?", (sqlite3.Binary(pickle.dumps(v, pickle.HIGHEST_PROTOCOL)), namespace, key))
+            c.execute("COMMIT")
+            return v
+        except:
+            c.execute("ROLLBACK")
+            raise
+
+    def remove_expired(self, namespace):
+        c = self._conn()
+        checked = c.execute("SELECT COUNT(*) FROM cache WHERE ns=?", (namespace,)).fetchone()[0]
+        removed = c.execute("DELETE FROM cache WHERE ns=? AND expires < ?", (namespace, time.time())).rowcount
+        return (checked, removed)
+
+    def sweep(self):
+        """ Removes expired entries and keeps the table within maxitems """
+        c = self._conn()
+        c.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+        over = c.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.maxitems
+        if over > 0:
+            c.execute("DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY expires LIMIT ?)", (over,))
+            self.evictions += over
+
+class FileCacheBackend(CacheBackend):
+    """
+    Pickles every value to a file under DISK_CACHE/namespace,
+    using md5sums of the key as filenames.
+    """
+    name = "file"
+
+    def __init__(self, root = DISK_CACHE):
+        CacheBackend.__init__(self)
+        self.root = root
+        self.threadlock = threading.Lock()
+
+    def _lrunpickle(self, fname):
+        """ Reads a file and returns the unpickled contents, using flock to lock the file """
+        with self.threadlock:
+            with open(fname, "rb") as fd:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                return pickle.load(fd)
+
+    def _lwpickle(self, fname, o):
+        """ Pickles and writes o to fname, using flock to lock the file """
+        with self.threadlock:
+            with open(fname, "wb") as fd:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                pickle.dump(o, fd)
+
+    def _getfilename(self, key, path, mkpath=False):
+        """
+        Calculates the filename from the key (md5 hash)
+        If mkpath is True, creates any missing path directories.
+        """
+        # Is the key already a hash? ie. 32 or 40 chars and hex?
+        # If so, don't waste time hashing it again.
+        if (len(key) == 32 or len(key) == 40) and _is_hex(key):
+            pass
+        else:
+            m = hashlib.md5()
+            if isinstance(key, str): key = key.encode("utf-8")
+            m.update(key)
+            key = m.hexdigest()
+        if not os.path.exists(self.root):
+            os.mkdir(self.root)
+        if path != "":
+            path = _sanitise_path(path)
+            path = os.path.join(self.root, path)
+            if mkpath and not os.path.exists(path):
+                os.mkdir(path)
+        else:
+            path = self.root
+        return os.path.join(path, key)
+
+    def get_entry(self, namespace, key):
+        fname = self._getfilename(key, namespace)
+        if not os.path.exists(fname): return None
+        o = self._lrunpickle(fname)
+        if o["expires"] < time.time():
+            self.delete(namespace, key)
+            return None
+        return (o["value"], o["expires"])
+
+    def put(self, namespace, key, value, ttl):
+        fname = self._getfilename(key, namespace, mkpath=True)
+        self._lwpickle(fname, { "expires": time.time() + ttl, "value": value })
+        return True
+
+    def delete(self, namespace, key):
+        fname = self._getfilename(key, namespace)
+        if os.path.exists(fname): os.unlink(fname)
+
+    def exists(self, namespace, key):
+        """ Does not unpack the file and check expiry """
+        return os.path.exists(self._getfilename(key, namespace))
+
+    def increment(self, namespace, key, delta=1):
+        e = self.get_entry(namespace, key)
+        if e is None: return None
+        v = e[0] + delta
+        self.put(namespace, key, v, e[1] - time.time())
+        return v
+
+    def remove_expired(self, namespace):
+        if self.root == "": return (0, 0)
+        cache_path = os.path.join(self.root, namespace)
+        checked = 0
+        removed = 0
+        for root, dummy, files in os.walk(cache_path):
+            for name in files:
+                if name.startswith("."): continue
+                checked += 1
+                try:
+                    fpath = os.path.join(root, name)
+                    with open(fpath, "rb") as f:
+                        o = pickle.load(f)
+                    if o["expires"] < time.time():
+                        os.unlink(fpath)
+                        removed += 1
+                except:
+                    # Move to the next entry if there are problems
+                    pass
+        self.evictions += removed
+        return (checked, removed)
+
+class MemcacheBackend(CacheBackend):
+    """
+    Stores values in memcached, configured with the MEMCACHIER_* environment variables.
+    Memcache does not have namespaces, so they are prefixed to the key.
+    """
+    name = "memcache"
+
+    def __init__(self):
+        CacheBackend.__init__(self)
+        self.client = None
+
+    def _mc(self):
+        if self.client is None:
+            import bmemcached
+            servers = os.environ.get('MEMCACHIER_SERVERS', '').split(',')
+            user = os.environ.get('MEMCACHIER_USERNAME', '')
+            passw = os.environ.get('MEMCACHIER_PASSWORD', '')
+            self.client = bmemcached.Client(servers, username=user, password=passw)
+            self.client.enable_retry_delay(True)
+        return self.client
+
+    def _key(self, namespace, key):
+        if namespace == "": return key
+        return "%s:%s" % (namespace, key)
+
+    def get(self, namespace, key):
+        v = self._mc().get(self._key(namespace, key))
+        if v is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return v
+
+    def get_entry(self, namespace, key):
+        # memcache does not tell us when a key expires
+        v = self._mc().get(self._key(namespace, key))
+        if v is None: return None
+        return (v, 0)
+
+    def put(self, namespace, key, value, ttl):
+        rv = self._mc().set(self._key(namespace, key), value, time = ttl)
+        if not rv: asm3.al.error("failed writing value to memcache (ttl=%s,key=%s,val=%s)" % (ttl, key, value), "MemcacheBackend.put")
+        return rv
+
+    def delete(self, namespace, key):
+        return self._mc().delete(self._key(namespace, key))
+
+    def increment(self, namespace, key, delta=1):
+        return self._mc().incr(self._key(namespace, key), delta)
+
+def _sanitise_path(path):
+    """
+    Make sure the path we've been given is safe to use, it should only
+    contain letters and numbers
+    """
+    return re.sub(r'[\W_]+', '', path)
+
+def _is_hex(s):
+    try:
+        int(s, 16)
+        return True
+    except:
+        return False
+
+def memcache_available():
+    return len(os.environ.get('MEMCACHIER_SERVERS', '')) > 3
+
+BACKENDS = {
+    "lru":      LRUCacheBackend,
+    "sqlite":   SQLiteCacheBackend,
+    "file":     FileCacheBackend,
+    "memcache": MemcacheBackend
+}
+
+def get_backend(name):
+    """ Returns a new backend object for name """
+    if name not in BACKENDS:
+        raise KeyError("Unknown cache backend '%s', should be one of: %s" % (name, ", ".join(BACKENDS.keys())))
+    return BACKENDS[name]()
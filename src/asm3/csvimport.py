@@ -14,10 +14,15 @@ import asm3.movement
 import asm3.person
 import asm3.utils
 
+from asm3.sitedefs import CSV_IMPORT_CHUNK_SIZE
+
 import datetime
+import hashlib
 import re
 import sys
 
+CHECKPOINT_TTL = 86400 * 7 # How long the position of an unfinished import is kept for resuming
+
 VALID_FIELDS = [
     "ANIMALNAME", "ANIMALSEX", "ANIMALTYPE", "ANIMALCOLOR", "ANIMALBREED1", 
     "ANIMALBREED2", "ANIMALDOB", "ANIMALLOCATION", "ANIMALUNIT", 
@@ -144,33 +149,75 @@ def gkynu(m, f):
     if m[f].upper().startswith("N") or m[f] == "1": return "1"
     return "2"
 
-def gkbr(dbo, m, f, speciesid, create):
+class LookupCache(object):
+    """
+    The names and IDs in lookup tables, read once per table for an
+    import rather than queried for every value.
+    """
+    def __init__(self, dbo):
+        self.dbo = dbo
+        self.tables = {}
+
+    def key(self, name):
+        """ Returns name as it is compared by gkl: lower case with
+            apostrophes as backticks, the way it is stored """
+        return (name or "").replace("`", "&bt;").replace("'", "`").lower()
+
+    def names(self, table, namefield):
+        """ Returns a dict of name keys to IDs for table """
+        k = "%s.%s" % (table, namefield)
+        if k not in self.tables:
+            d = {}
+            for r in self.dbo.query("SELECT ID, %s AS Name FROM %s ORDER BY ID" % (namefield, table)):
+                d.setdefault(self.key(r.NAME), r.ID)
+            self.tables[k] = d
+        return self.tables[k]
+
+    def find(self, table, namefield, value):
+        """ Returns the ID for value in table or 0 if there isn't one """
+        return self.names(table, namefield).get(value.strip().lower().replace("'", "`"), 0)
+
+    def added(self, table, namefield, lid):
+        """ Adds a row that has just been created in table """
+        name = self.dbo.query_string("SELECT %s FROM %s WHERE ID = ?" % (namefield, table), [lid])
+        self.names(table, namefield).setdefault(self.key(name), lid)
+
+def gkbr(dbo, m, f, speciesid, create, lookups = None):
     """ reads lookup field f from map m, returning a str(int) that
         corresponds to a lookup match for BreedName in breed.
         if create is True, adds a row to the table if it doesn't
         find a match and then returns str(newid)
         speciesid is the linked species for any newly created breed
+        lookups is an optional LookupCache to find the match in
         returns "0" if key not present, or if no match was found and create is off """
     if f not in m: return "0"
     lv = m[f]
-    matchid = dbo.query_int("SELECT ID FROM breed WHERE LOWER(BreedName) = ?", [ lv.strip().lower().replace("'", "`")] )
+    if lookups is not None:
+        matchid = lookups.find("breed", "BreedName", lv)
+    else:
+        matchid = dbo.query_int("SELECT ID FROM breed WHERE LOWER(BreedName) = ?", [ lv.strip().lower().replace("'", "`")] )
     if matchid == 0 and create:
         nextid = dbo.get_id("breed")
         sql = "INSERT INTO breed (ID, SpeciesID, BreedName) VALUES (?,?,?)"
         dbo.execute(sql, (nextid, speciesid, lv.replace("'", "`")))
+        if lookups is not None: lookups.added("breed", "BreedName", nextid)
         return str(nextid)
     return str(matchid)
 
-def gkl(dbo, m, f, table, namefield, create):
+def gkl(dbo, m, f, table, namefield, create, lookups = None):
     """ reads lookup field f from map m, returning a str(int) that
         corresponds to a lookup match for namefield in table.
         if create is True, adds a row to the table if it doesn't
         find a match and then returns str(newid)
         if the value is an empty string, (blank) is used instead.
+        lookups is an optional LookupCache to find the match in
         returns "0" if key not present, or if no match was found and create is off """
     if f not in m: return "0"
     lv = m[f]
-    matchid = dbo.query_int("SELECT ID FROM %s WHERE LOWER(%s) = ?" % (table, namefield), [ lv.strip().lower().replace("'", "`") ])
+    if lookups is not None:
+        matchid = lookups.find(table, namefield, lv)
+    else:
+        matchid = dbo.query_int("SELECT ID FROM %s WHERE LOWER(%s) = ?" % (table, namefield), [ lv.strip().lower().replace("'", "`") ])
     if matchid == 0 and create:
         if lv.strip() == "":
             l = dbo.locale
@@ -178,6 +225,7 @@ def gkl(dbo, m, f, table, namefield, create):
         nextid = dbo.insert(table, {
             namefield:  lv
         }, setRecordVersion=False, setCreated=False, writeAudit=False)
+        if lookups is not None: lookups.added(table, namefield, nextid)
         return str(nextid)
     return str(matchid)
 
@@ -196,18 +244,20 @@ def gksx(m, f):
 def create_additional_fields(dbo, row, errors, rowno, csvkey = "ANIMALADDITIONAL", linktype = "animal", linkid = 0):
     # Identify any additional fields that may have been specified with
     # ANIMALADDITIONAL<fieldname>
+    rows = []
     for a in asm3.additional.get_field_definitions(dbo, linktype):
         v = gks(row, csvkey + str(a.fieldname).upper())
         if v != "":
-            try:
-                dbo.insert("additional", {
-                    "LinkType":             a.linktype,
-                    "LinkID":               linkid,
-                    "AdditionalFieldID":    a.id,
-                    "Value":                v
-                }, generateID=False)
-            except Exception as e:
-                errors.append( (rowno, str(row), str(e)) )
+            rows.append({
+                "LinkType":             a.linktype,
+                "LinkID":               linkid,
+                "AdditionalFieldID":    a.id,
+                "Value":                v
+            })
+    try:
+        dbo.insert_many("additional", rows, generateID=False)
+    except Exception as e:
+        errors.append( (rowno, str(row), str(e)) )
 
 def row_error(errors, rowtype, rowno, row, e, dbo, exinfo):
     """ 
@@ -227,22 +277,53 @@ def row_error(errors, rowtype, rowno, row, e, dbo, exinfo):
     asm3.al.error("row %d %s: (%s): %s" % (rowno, rowtype, str(row), errmsg), "csvimport.row_error", dbo, exinfo)
     errors.append( (rowno, str(row), errmsg) )
 
+def csv_source(csvdata):
+    """ Returns csvdata ready to be read from the start by asm3.utils.csv_reader """
+    if hasattr(csvdata, "seek"): csvdata.seek(0)
+    return csvdata
+
+def csv_checksum(csvdata, *args):
+    """ Returns a checksum of csvdata (a string or binary file) and any 
+        options in args, which identifies an import for resuming it """
+    if hasattr(csvdata, "read"):
+        m = hashlib.md5()
+        csvdata.seek(0)
+        for b in iter(lambda: csvdata.read(1048576), b""):
+            m.update(b)
+        h = m.hexdigest()
+    else:
+        h = asm3.utils.md5_hash_hex(csvdata)
+    return asm3.utils.md5_hash_hex("%s %s" % (h, args))
+
 def csvimport(dbo, csvdata, encoding = "utf-8-sig", user = "", createmissinglookups = False, cleartables = False, checkduplicates = False):
     """
-    Imports csvdata (bytes string, encoded with encoding)
+    Imports csvdata (bytes string or binary file, encoded with encoding)
     createmissinglookups: If a lookup value is given that's not in our data, add it
     cleartables: Clear down the animal, owner and adoption tables before import
+    Rows are read and imported one at a time and committed in transactions
+    of CSV_IMPORT_CHUNK_SIZE rows. If an import is cancelled or fails part way, 
+    importing the same file with the same options again carries on after the
+    last rows that were committed.
     """
 
+    # The transactions are run on our own Database object. The one we 
+    # were given may belong to a session and be used by its other requests.
+    dbo = dbo.clone()
+
     if user == "":
         user = "import"
     else:
         user = "import/%s" % user
 
-    rows = asm3.utils.csv_parse( asm3.utils.cunicode(csvdata, encoding=encoding) )
+    # Count the rows first for the progress meter and results
+    rowcount = 0
+    firstrow = None
+    for row in asm3.utils.csv_reader(csv_source(csvdata), encoding):
+        if firstrow is None: firstrow = row
+        rowcount += 1
 
     # Make sure we have a valid header
-    if len(rows) == 0:
+    if rowcount == 0:
         asm3.asynctask.set_last_error(dbo, "Your CSV file is empty")
         return
 
@@ -263,7 +344,7 @@ def csvimport(dbo, csvdata, encoding = "utf-8-sig", user = "", createmissinglook
     hasdonationamount = False
     hasoriginalowner = False
     hasoriginalownerlastname = False
-    cols = rows[0].keys()
+    cols = firstrow.keys()
     for col in cols:
         if col in VALID_FIELDS: onevalid = True
         if col.startswith("ANIMAL"): hasanimal = True
@@ -342,349 +423,420 @@ def csvimport(dbo, csvdata, encoding = "utf-8-sig", user = "", createmissinglook
     if haslicence and not (haspersonlastname or haspersonname):
         asm3.asynctask.set_last_error(dbo, "Your CSV file has license fields, but no person to apply the license to")
 
-    asm3.al.debug("reading CSV data, found %d rows" % len(rows), "csvimport.csvimport", dbo)
+    asm3.al.debug("reading CSV data, found %d rows" % rowcount, "csvimport.csvimport", dbo)
+
+    # Are we carrying on from an import of this file that didn't finish?
+    checkpointkey = "csvimport:%s" % csv_checksum(csvdata, encoding, createmissinglookups, cleartables, checkduplicates)
+    checkpoint = asm3.cachedisk.get(checkpointkey, dbo.database, expectedtype=dict)
+    startrow = 0
+    errors = []
+    if checkpoint is not None:
+        startrow = checkpoint["rowno"]
+        errors = checkpoint["errors"]
+        asm3.al.info("resuming import after row %d of %d" % (startrow, rowcount), "csvimport.csvimport", dbo)
 
     # If we're clearing down tables first, do it now
-    if cleartables:
+    if cleartables and startrow == 0:
         asm3.al.warn("Resetting the database by removing all non-lookup data", "csvimport.csvimport", dbo)
         asm3.dbupdate.reset_db(dbo)
 
-    # Now that we've read them in, go through all the rows
-    # and start importing.
-    errors = []
-    rowno = 1
-    asm3.asynctask.set_progress_max(dbo, len(rows))
-    for row in rows:
-
-        asm3.al.debug("import csv: row %d of %d" % (rowno, len(rows)), "csvimport.csvimport", dbo)
-        asm3.asynctask.increment_progress_value(dbo)
-
-        # Should we stop?
-        if asm3.asynctask.get_cancel(dbo): break
-
-        # Do we have animal data to read?
-        animalid = 0
-        if hasanimal and gks(row, "ANIMALNAME") != "":
-            a = {}
-            a["animalname"] = gks(row, "ANIMALNAME")
-            a["sheltercode"] = gks(row, "ANIMALCODE")
-            a["shortcode"] = gks(row, "ANIMALCODE")
-            if gks(row, "ANIMALSEX") == "": 
-                a["sex"] = "2" # Default unknown if not set
-            else:
-                a["sex"] = gksx(row, "ANIMALSEX")
-            a["basecolour"] = gkl(dbo, row, "ANIMALCOLOR", "basecolour", "BaseColour", createmissinglookups)
-            if a["basecolour"] == "0":
-                a["basecolour"] = str(asm3.configuration.default_colour(dbo))
-            a["species"] = gkl(dbo, row, "ANIMALSPECIES", "species", "SpeciesName", createmissinglookups)
-            if a["species"] == "0":
-                a["species"] = str(asm3.configuration.default_species(dbo))
-            a["animaltype"] = gkl(dbo, row, "ANIMALTYPE", "animaltype", "AnimalType", createmissinglookups)
-            if a["animaltype"] == "0":
-                a["animaltype"] = str(asm3.configuration.default_type(dbo))
-            a["breed1"] = gkbr(dbo, row, "ANIMALBREED1", a["species"], createmissinglookups)
-            if a["breed1"] == "0":
-                a["breed1"] = str(asm3.configuration.default_breed(dbo))
-            a["breed2"] = gkbr(dbo, row, "ANIMALBREED2", a["species"], createmissinglookups)
-            if a["breed2"] != "0" and a["breed2"] != a["breed1"]:
-                a["crossbreed"] = "on"
-            a["size"] = gkl(dbo, row, "ANIMALSIZE", "lksize", "Size", False)
-            if gks(row, "ANIMALSIZE") == "": 
-                a["size"] = str(asm3.configuration.default_size(dbo))
-            a["internallocation"] = gkl(dbo, row, "ANIMALLOCATION", "internallocation", "LocationName", createmissinglookups)
-            if a["internallocation"] == "0":
-                a["internallocation"] = str(asm3.configuration.default_location(dbo))
-            a["unit"] = gks(row, "ANIMALUNIT")
-            a["comments"] = gks(row, "ANIMALCOMMENTS")
-            a["markings"] = gks(row, "ANIMALMARKINGS")
-            a["hiddenanimaldetails"] = gks(row, "ANIMALHIDDENDETAILS")
-            a["healthproblems"] = gks(row, "ANIMALHEALTHPROBLEMS")
-            a["notforadoption"] = gkbi(row, "ANIMALNOTFORADOPTION")
-            a["nonshelter"] = gkbc(row, "ANIMALNONSHELTER")
-            a["housetrained"] = gkynu(row, "ANIMALHOUSETRAINED")
-            a["goodwithcats"] = gkynu(row, "ANIMALGOODWITHCATS")
-            a["goodwithdogs"] = gkynu(row, "ANIMALGOODWITHDOGS")
-            a["goodwithkids"] = gkynu(row, "ANIMALGOODWITHKIDS")
-            a["reasonforentry"] = gks(row, "ANIMALREASONFORENTRY")
-            a["estimatedage"] = gks(row, "ANIMALAGE")
-            a["dateofbirth"] = gkd(dbo, row, "ANIMALDOB", True)
-            if gks(row, "ANIMALDOB") == "" and a["estimatedage"] != "":
-                a["dateofbirth"] = "" # if we had an age and dob was blank, prefer the age
-            a["datebroughtin"] = gkd(dbo, row, "ANIMALENTRYDATE", True)
-            a["deceaseddate"] = gkd(dbo, row, "ANIMALDECEASEDDATE")
-            a["neutered"] = gkbc(row, "ANIMALNEUTERED")
-            a["neutereddate"] = gkd(dbo, row, "ANIMALNEUTEREDDATE")
-            if a["neutereddate"] != "": a["neutered"] = "on"
-            a["microchipnumber"] = gks(row, "ANIMALMICROCHIP")
-            if a["microchipnumber"] != "": a["microchipped"] = "on"
-            a["microchipdate"] = gkd(dbo, row, "ANIMALMICROCHIPDATE")
-            a["flags"] = gks(row, "ANIMALFLAGS")
-            # image data if any was supplied
-            imagedata = gks(row, "ANIMALIMAGE")
-            if imagedata.startswith("http"):
-                # It's a URL, get the image from the remote server
-                r = asm3.utils.get_image_url(imagedata, timeout=5000)
-                if r["status"] == 200:
-                    asm3.al.debug("retrieved image from %s (%s bytes)" % (imagedata, len(r["response"])), "csvimport.csvimport", dbo)
-                    imagedata = "data:image/jpeg;base64,%s" % asm3.utils.base64encode(r["response"])
+    # Index everyone already on file once rather than querying for similar people on every row
+    personindex = None
+    if checkduplicates:
+        personindex = asm3.person.PersonIndex(dbo)
+
+    # Read lookup tables once rather than querying for every value
+    lookups = LookupCache(dbo)
+
+    def commit_chunk(rowno):
+        """ Commits the rows imported so far and remembers where we got to """
+        dbo.commit()
+        asm3.cachedisk.put(checkpointkey, dbo.database, { "rowno": rowno, "errors": errors }, CHECKPOINT_TTL)
+
+    # Each part of a row has a savepoint so that a database error in
+    # it does not lose the rest of the chunk (PostgreSQL aborts the 
+    # transaction on an error).
+    def keep_section():
+        """ Called after each part of a row. Keeps what it wrote if the
+            database can, returns False if it had to be rolled back """
+        try:
+            dbo.release_savepoint("csvrow")
+            return True
+        except:
+            dbo.rollback_savepoint("csvrow")
+            return False
+
+    # Go through all the rows and start importing.
+    asm3.asynctask.set_progress_max(dbo, rowcount)
+    asm3.asynctask.set_progress_value(dbo, startrow)
+    rowno = 0
+    cancelled = False
+    dbo.begin()
+    try:
+        for row in asm3.utils.csv_reader(csv_source(csvdata), encoding):
+            rowno += 1
+            if rowno <= startrow: continue
+            if (rowno - 1) % CSV_IMPORT_CHUNK_SIZE == 0 and rowno - 1 > startrow:
+                commit_chunk(rowno - 1)
+                dbo.begin()
+
+            asm3.al.debug("import csv: row %d of %d" % (rowno, rowcount), "csvimport.csvimport", dbo)
+            asm3.asynctask.increment_progress_value(dbo)
+
+            # Should we stop?
+            if asm3.asynctask.get_cancel(dbo): 
+                cancelled = True
+                rowno -= 1
+                break
+
+            # Do we have animal data to read?
+            animalid = 0
+            if hasanimal and gks(row, "ANIMALNAME") != "":
+                a = {}
+                a["animalname"] = gks(row, "ANIMALNAME")
+                a["sheltercode"] = gks(row, "ANIMALCODE")
+                a["shortcode"] = gks(row, "ANIMALCODE")
+                if gks(row, "ANIMALSEX") == "": 
+                    a["sex"] = "2" # Default unknown if not set
                 else:
-                    row_error(errors, "animal", rowno, row, "error reading image from '%s': %s" % (imagedata, r), dbo, sys.exc_info())
-                    continue
-            elif imagedata.startswith("data:image"):
-                # It's a base64 encoded data URI - do nothing as attach_file requires it
-                pass
-            else:
-                # We don't know what it is, don't try and do anything with it
-                imagedata = ""
-            # If an original owner is specified, create a person record
-            # for them and attach it to the animal as original owner
-            if gks(row, "ORIGINALOWNERLASTNAME") != "":
+                    a["sex"] = gksx(row, "ANIMALSEX")
+                a["basecolour"] = gkl(dbo, row, "ANIMALCOLOR", "basecolour", "BaseColour", createmissinglookups, lookups)
+                if a["basecolour"] == "0":
+                    a["basecolour"] = str(asm3.configuration.default_colour(dbo))
+                a["species"] = gkl(dbo, row, "ANIMALSPECIES", "species", "SpeciesName", createmissinglookups, lookups)
+                if a["species"] == "0":
+                    a["species"] = str(asm3.configuration.default_species(dbo))
+                a["animaltype"] = gkl(dbo, row, "ANIMALTYPE", "animaltype", "AnimalType", createmissinglookups, lookups)
+                if a["animaltype"] == "0":
+                    a["animaltype"] = str(asm3.configuration.default_type(dbo))
+                a["breed1"] = gkbr(dbo, row, "ANIMALBREED1", a["species"], createmissinglookups, lookups)
+                if a["breed1"] == "0":
+                    a["breed1"] = str(asm3.configuration.default_breed(dbo))
+                a["breed2"] = gkbr(dbo, row, "ANIMALBREED2", a["species"], createmissinglookups, lookups)
+                if a["breed2"] != "0" and a["breed2"] != a["breed1"]:
+                    a["crossbreed"] = "on"
+                a["size"] = gkl(dbo, row, "ANIMALSIZE", "lksize", "Size", False, lookups)
+                if gks(row, "ANIMALSIZE") == "": 
+                    a["size"] = str(asm3.configuration.default_size(dbo))
+                a["internallocation"] = gkl(dbo, row, "ANIMALLOCATION", "internallocation", "LocationName", createmissinglookups, lookups)
+                if a["internallocation"] == "0":
+                    a["internallocation"] = str(asm3.configuration.default_location(dbo))
+                a["unit"] = gks(row, "ANIMALUNIT")
+                a["comments"] = gks(row, "ANIMALCOMMENTS")
+                a["markings"] = gks(row, "ANIMALMARKINGS")
+                a["hiddenanimaldetails"] = gks(row, "ANIMALHIDDENDETAILS")
+                a["healthproblems"] = gks(row, "ANIMALHEALTHPROBLEMS")
+                a["notforadoption"] = gkbi(row, "ANIMALNOTFORADOPTION")
+                a["nonshelter"] = gkbc(row, "ANIMALNONSHELTER")
+                a["housetrained"] = gkynu(row, "ANIMALHOUSETRAINED")
+                a["goodwithcats"] = gkynu(row, "ANIMALGOODWITHCATS")
+                a["goodwithdogs"] = gkynu(row, "ANIMALGOODWITHDOGS")
+                a["goodwithkids"] = gkynu(row, "ANIMALGOODWITHKIDS")
+                a["reasonforentry"] = gks(row, "ANIMALREASONFORENTRY")
+                a["estimatedage"] = gks(row, "ANIMALAGE")
+                a["dateofbirth"] = gkd(dbo, row, "ANIMALDOB", True)
+                if gks(row, "ANIMALDOB") == "" and a["estimatedage"] != "":
+                    a["dateofbirth"] = "" # if we had an age and dob was blank, prefer the age
+                a["datebroughtin"] = gkd(dbo, row, "ANIMALENTRYDATE", True)
+                a["deceaseddate"] = gkd(dbo, row, "ANIMALDECEASEDDATE")
+                a["neutered"] = gkbc(row, "ANIMALNEUTERED")
+                a["neutereddate"] = gkd(dbo, row, "ANIMALNEUTEREDDATE")
+                if a["neutereddate"] != "": a["neutered"] = "on"
+                a["microchipnumber"] = gks(row, "ANIMALMICROCHIP")
+                if a["microchipnumber"] != "": a["microchipped"] = "on"
+                a["microchipdate"] = gkd(dbo, row, "ANIMALMICROCHIPDATE")
+                a["flags"] = gks(row, "ANIMALFLAGS")
+                # image data if any was supplied
+                imagedata = gks(row, "ANIMALIMAGE")
+                if imagedata.startswith("http"):
+                    # It's a URL, get the image from the remote server
+                    r = asm3.utils.get_image_url(imagedata, timeout=5000)
+                    if r["status"] == 200:
+                        asm3.al.debug("retrieved image from %s (%s bytes)" % (imagedata, len(r["response"])), "csvimport.csvimport", dbo)
+                        imagedata = "data:image/jpeg;base64,%s" % asm3.utils.base64encode(r["response"])
+                    else:
+                        row_error(errors, "animal", rowno, row, "error reading image from '%s': %s" % (imagedata, r), dbo, sys.exc_info())
+                        continue
+                elif imagedata.startswith("data:image"):
+                    # It's a base64 encoded data URI - do nothing as attach_file requires it
+                    pass
+                else:
+                    # We don't know what it is, don't try and do anything with it
+                    imagedata = ""
+                # If an original owner is specified, create a person record
+                # for them and attach it to the animal as original owner
+                if gks(row, "ORIGINALOWNERLASTNAME") != "":
+                    p = {}
+                    p["title"] = gks(row, "ORIGINALOWNERTITLE")
+                    p["initials"] = gks(row, "ORIGINALOWNERINITIALS")
+                    p["forenames"] = gks(row, "ORIGINALOWNERFIRSTNAME")
+                    p["surname"] = gks(row, "ORIGINALOWNERLASTNAME")
+                    p["address"] = gks(row, "ORIGINALOWNERADDRESS")
+                    p["town"] = gks(row, "ORIGINALOWNERCITY")
+                    p["county"] = gks(row, "ORIGINALOWNERSTATE")
+                    p["postcode"] = gks(row, "ORIGINALOWNERZIPCODE")
+                    p["jurisdiction"] = gkl(dbo, row, "ORIGINALOWNERJURISDICTION", "jurisdiction", "JurisdictionName", createmissinglookups, lookups)
+                    p["hometelephone"] = gks(row, "ORIGINALOWNERHOMEPHONE")
+                    p["worktelephone"] = gks(row, "ORIGINALOWNERWORKPHONE")
+                    p["mobiletelephone"] = gks(row, "ORIGINALOWNERCELLPHONE")
+                    p["emailaddress"] = gks(row, "ORIGINALOWNEREMAIL")
+                    dbo.savepoint("csvrow")
+                    try:
+                        if checkduplicates:
+                            dups = asm3.person.get_person_similar(dbo, p["emailaddress"], p["mobiletelephone"], p["surname"], p["forenames"], p["address"], personindex)
+                            if len(dups) > 0:
+                                a["originalowner"] = str(dups[0]["ID"])
+                        if "originalowner" not in a:
+                            ooid = asm3.person.insert_person_from_form(dbo, asm3.utils.PostedData(p, dbo.locale), user, geocode=False)
+                            a["originalowner"] = str(ooid)
+                            if personindex is not None: personindex.update(dbo, ooid)
+                            # Identify an ORIGINALOWNERADDITIONAL additional fields and create them
+                            create_additional_fields(dbo, row, errors, rowno, "ORIGINALOWNERADDITIONAL", "person", ooid)
+                    except Exception as e:
+                        row_error(errors, "originalowner", rowno, row, e, dbo, sys.exc_info())
+                    if not keep_section(): a.pop("originalowner", None)
+                dbo.savepoint("csvrow")
+                try:
+                    if checkduplicates:
+                        dup = asm3.animal.get_animal_sheltercode(dbo, a["sheltercode"])
+                        if dup is not None:
+                            animalid = dup.ID
+                            # The animal is a duplicate. Update certain key fields if they are present
+                            values = {}
+                            if a["healthproblems"] != "":
+                                values["HealthProblems"] = a["healthproblems"]
+                            if a["microchipnumber"] != "":
+                                values["Identichipped"] = 1
+                                values["IdentichipNumber"] = a["microchipnumber"]
+                                values["IdentichipDate"] = asm3.i18n.display2python(dbo.locale, a["microchipdate"])
+                            if a["neutered"] == "on":
+                                values["Neutered"] = 1
+                                values["NeuteredDate"] = asm3.i18n.display2python(dbo.locale, a["neutereddate"])
+                            if len(values) > 0:
+                                dbo.update_many("animal", [ (dup.ID, values) ], user)
+                            if a["flags"] != "":
+                                asm3.animal.update_flags(dbo, user, dup.ID, a["flags"])
+                    if animalid == 0:
+                        animalid, dummy = asm3.animal.insert_animal_from_form(dbo, asm3.utils.PostedData(a, dbo.locale), user)
+                        # Identify any ANIMALADDITIONAL additional fields and create them
+                        create_additional_fields(dbo, row, errors, rowno, "ANIMALADDITIONAL", "animal", animalid)
+                        # Add any flags that were set
+                        if a["flags"] != "":
+                            asm3.animal.update_flags(dbo, user, animalid, a["flags"])
+                    # If we have some image data, add it to the animal
+                    if len(imagedata) > 0:
+                        imagepost = asm3.utils.PostedData({ "filename": "image.jpg", "filetype": "image/jpeg", "filedata": imagedata }, dbo.locale)
+                        asm3.media.attach_file_from_form(dbo, user, asm3.media.ANIMAL, animalid, imagepost)
+                except Exception as e:
+                    row_error(errors, "animal", rowno, row, e, dbo, sys.exc_info())
+                if not keep_section(): animalid = 0
+
+            # Person data?
+            personid = 0
+            if hasperson and (gks(row, "PERSONLASTNAME") != "" or gks(row, "PERSONNAME") != ""):
                 p = {}
-                p["title"] = gks(row, "ORIGINALOWNERTITLE")
-                p["initials"] = gks(row, "ORIGINALOWNERINITIALS")
-                p["forenames"] = gks(row, "ORIGINALOWNERFIRSTNAME")
-                p["surname"] = gks(row, "ORIGINALOWNERLASTNAME")
-                p["address"] = gks(row, "ORIGINALOWNERADDRESS")
-                p["town"] = gks(row, "ORIGINALOWNERCITY")
-                p["county"] = gks(row, "ORIGINALOWNERSTATE")
-                p["postcode"] = gks(row, "ORIGINALOWNERZIPCODE")
-                p["jurisdiction"] = gkl(dbo, row, "ORIGINALOWNERJURISDICTION", "jurisdiction", "JurisdictionName", createmissinglookups)
-                p["hometelephone"] = gks(row, "ORIGINALOWNERHOMEPHONE")
-                p["worktelephone"] = gks(row, "ORIGINALOWNERWORKPHONE")
-                p["mobiletelephone"] = gks(row, "ORIGINALOWNERCELLPHONE")
-                p["emailaddress"] = gks(row, "ORIGINALOWNEREMAIL")
+                p["ownertype"] = gks(row, "PERSONCLASS")
+                if p["ownertype"] != "1" and p["ownertype"] != "2": 
+                    p["ownertype"] = "1"
+                p["title"] = gks(row, "PERSONTITLE")
+                p["initials"] = gks(row, "PERSONINITIALS")
+                p["forenames"] = gks(row, "PERSONFIRSTNAME")
+                p["surname"] = gks(row, "PERSONLASTNAME")
+                # If we have a person name, all upto the last space is first names,
+                # everything after the last name
+                if gks(row, "PERSONNAME") != "":
+                    pname = gks(row, "PERSONNAME")
+                    if pname.find(" ") != -1:
+                        p["forenames"] = pname[0:pname.rfind(" ")]
+                        p["surname"] = pname[pname.rfind(" ")+1:]
+                    else:
+                        p["surname"] = pname
+                p["address"] = gks(row, "PERSONADDRESS")
+                p["town"] = gks(row, "PERSONCITY")
+                p["county"] = gks(row, "PERSONSTATE")
+                p["postcode"] = gks(row, "PERSONZIPCODE")
+                p["jurisdiction"] = gkl(dbo, row, "PERSONJURISDICTION", "jurisdiction", "JurisdictionName", createmissinglookups, lookups)
+                p["hometelephone"] = gks(row, "PERSONHOMEPHONE")
+                p["worktelephone"] = gks(row, "PERSONWORKPHONE")
+                p["mobiletelephone"] = gks(row, "PERSONCELLPHONE")
+                p["emailaddress"] = gks(row, "PERSONEMAIL")
+                p["gdprcontactoptin"] = gks(row, "PERSONGDPRCONTACTOPTIN")
+                flags = gks(row, "PERSONFLAGS")
+                if gkb(row, "PERSONFOSTERER"): flags += ",fosterer"
+                if gkb(row, "PERSONMEMBER"): flags += ",member"
+                if gkb(row, "PERSONDONOR"): flags += ",donor"
+                p["flags"] = flags
+                p["comments"] = gks(row, "PERSONCOMMENTS")
+                p["membershipnumber"] = gks(row, "PERSONMEMBERSHIPNUMBER")
+                p["membershipexpires"] = gkd(dbo, row, "PERSONMEMBERSHIPEXPIRY")
+                p["matchactive"] = gkbi(row, "PERSONMATCHACTIVE")
+                if p["matchactive"] == "1":
+                    if "PERSONMATCHADDED" in cols: p["matchadded"] = gkd(dbo, row, "PERSONMATCHADDED")
+                    if "PERSONMATCHEXPIRES" in cols: p["matchexpires"] = gkd(dbo, row, "PERSONMATCHEXPIRES")
+                    if "PERSONMATCHSEX" in cols: p["matchsex"] = gksx(row, "PERSONMATCHSEX")
+                    if "PERSONMATCHSIZE" in cols: p["matchsize"] = gkl(dbo, row, "PERSONMATCHSIZE", "lksize", "Size", False, lookups)
+                    if "PERSONMATCHCOLOR" in cols: p["matchcolour"] = gkl(dbo, row, "PERSONMATCHCOLOR", "basecolour", "BaseColour", createmissinglookups, lookups)
+                    if "PERSONMATCHAGEFROM" in cols: p["agedfrom"] = gks(row, "PERSONMATCHAGEFROM")
+                    if "PERSONMATCHAGETO" in cols: p["agedto"] = gks(row, "PERSONMATCHAGETO")
+                    if "PERSONMATCHTYPE" in cols: p["matchanimaltype"] = gkl(dbo, row, "PERSONMATCHTYPE", "animaltype", "AnimalType", createmissinglookups, lookups)
+                    if "PERSONMATCHSPECIES" in cols: p["matchspecies"] = gkl(dbo, row, "PERSONMATCHSPECIES", "species", "SpeciesName", createmissinglookups, lookups)
+                    if "PERSONMATCHBREED1" in cols: p["matchbreed"] = gkbr(dbo, row, "PERSONMATCHBREED1", p["matchspecies"], createmissinglookups, lookups)
+                    if "PERSONMATCHBREED2" in cols: p["matchbreed2"] = gkbr(dbo, row, "PERSONMATCHBREED2", p["matchspecies"], createmissinglookups, lookups)
+                    if "PERSONMATCHGOODWITHCATS" in cols: p["matchgoodwithcats"] = gkynu(row, "PERSONMATCHGOODWITHCATS")
+                    if "PERSONMATCHGOODWITHDOGS" in cols: p["matchgoodwithdogs"] = gkynu(row, "PERSONMATCHGOODWITHDOGS")
+                    if "PERSONMATCHGOODWITHCHILDREN" in cols: p["matchgoodwithchildren"] = gkynu(row, "PERSONMATCHGOODWITHCHILDREN")
+                    if "PERSONMATCHHOUSETRAINED" in cols: p["matchhousetrained"] = gkynu(row, "PERSONMATCHHOUSETRAINED")
+                    if "PERSONMATCHCOMMENTSCONTAIN" in cols: p["matchcommentscontain"] = gks(row, "PERSONMATCHCOMMENTSCONTAIN")
+                dbo.savepoint("csvrow")
                 try:
                     if checkduplicates:
-                        dups = asm3.person.get_person_similar(dbo, p["emailaddress"], p["mobiletelephone"], p["surname"], p["forenames"], p["address"])
+                        dups = asm3.person.get_person_similar(dbo, p["emailaddress"], p["mobiletelephone"], p["surname"], p["forenames"], p["address"], personindex)
                         if len(dups) > 0:
-                            a["originalowner"] = str(dups[0]["ID"])
-                    if "originalowner" not in a:
-                        ooid = asm3.person.insert_person_from_form(dbo, asm3.utils.PostedData(p, dbo.locale), user, geocode=False)
-                        a["originalowner"] = str(ooid)
-                        # Identify an ORIGINALOWNERADDITIONAL additional fields and create them
-                        create_additional_fields(dbo, row, errors, rowno, "ORIGINALOWNERADDITIONAL", "person", ooid)
+                            personid = dups[0].ID
+                            # Merge flags and any extra details
+                            asm3.person.merge_flags(dbo, user, personid, flags)
+                            asm3.person.merge_gdpr_flags(dbo, user, personid, p["gdprcontactoptin"])
+                            # If we deduplicated on the email address, and address details are
+                            # present, assume that they are newer than the ones we had and update them
+                            # (we do this by setting force=True parameter to merge_person_details,
+                            # otherwise we do a regular merge which only fills in any blanks)
+                            asm3.person.merge_person_details(dbo, user, personid, p, force=dups[0].EMAILADDRESS == p["emailaddress"])
+                    if personid == 0:
+                        personid = asm3.person.insert_person_from_form(dbo, asm3.utils.PostedData(p, dbo.locale), user, geocode=False)
+                        # Identify any PERSONADDITIONAL additional fields and create them
+                        create_additional_fields(dbo, row, errors, rowno, "PERSONADDITIONAL", "person", personid)
+                    if personindex is not None: personindex.update(dbo, personid)
                 except Exception as e:
-                    row_error(errors, "originalowner", rowno, row, e, dbo, sys.exc_info())
-            try:
-                if checkduplicates:
-                    dup = asm3.animal.get_animal_sheltercode(dbo, a["sheltercode"])
-                    if dup is not None:
-                        animalid = dup.ID
-                        # The animal is a duplicate. Update certain key fields if they are present
-                        if a["healthproblems"] != "":
-                            dbo.update("animal", dup.ID, { "HealthProblems": a["healthproblems"] }, user)
-                        if a["microchipnumber"] != "":
-                            dbo.update("animal", dup.ID, { 
-                                "Identichipped": 1,
-                                "IdentichipNumber": a["microchipnumber"],
-                                "IdentichipDate": asm3.i18n.display2python(dbo.locale, a["microchipdate"])
-                            }, user)
-                        if a["neutered"] == "on":
-                            dbo.update("animal", dup.ID, { 
-                                "Neutered": 1, 
-                                "NeuteredDate": asm3.i18n.display2python(dbo.locale, a["neutereddate"]) 
-                            }, user)
-                        if a["flags"] != "":
-                            asm3.animal.update_flags(dbo, user, dup.ID, a["flags"])
-                if animalid == 0:
-                    animalid, dummy = asm3.animal.insert_animal_from_form(dbo, asm3.utils.PostedData(a, dbo.locale), user)
-                    # Identify any ANIMALADDITIONAL additional fields and create them
-                    create_additional_fields(dbo, row, errors, rowno, "ANIMALADDITIONAL", "animal", animalid)
-                    # Add any flags that were set
-                    if a["flags"] != "":
-                        asm3.animal.update_flags(dbo, user, animalid, a["flags"])
-                # If we have some image data, add it to the animal
-                if len(imagedata) > 0:
-                    imagepost = asm3.utils.PostedData({ "filename": "image.jpg", "filetype": "image/jpeg", "filedata": imagedata }, dbo.locale)
-                    asm3.media.attach_file_from_form(dbo, user, asm3.media.ANIMAL, animalid, imagepost)
-            except Exception as e:
-                row_error(errors, "animal", rowno, row, e, dbo, sys.exc_info())
-
-        # Person data?
-        personid = 0
-        if hasperson and (gks(row, "PERSONLASTNAME") != "" or gks(row, "PERSONNAME") != ""):
-            p = {}
-            p["ownertype"] = gks(row, "PERSONCLASS")
-            if p["ownertype"] != "1" and p["ownertype"] != "2": 
-                p["ownertype"] = "1"
-            p["title"] = gks(row, "PERSONTITLE")
-            p["initials"] = gks(row, "PERSONINITIALS")
-            p["forenames"] = gks(row, "PERSONFIRSTNAME")
-            p["surname"] = gks(row, "PERSONLASTNAME")
-            # If we have a person name, all upto the last space is first names,
-            # everything after the last name
-            if gks(row, "PERSONNAME") != "":
-                pname = gks(row, "PERSONNAME")
-                if pname.find(" ") != -1:
-                    p["forenames"] = pname[0:pname.rfind(" ")]
-                    p["surname"] = pname[pname.rfind(" ")+1:]
-                else:
-                    p["surname"] = pname
-            p["address"] = gks(row, "PERSONADDRESS")
-            p["town"] = gks(row, "PERSONCITY")
-            p["county"] = gks(row, "PERSONSTATE")
-            p["postcode"] = gks(row, "PERSONZIPCODE")
-            p["jurisdiction"] = gkl(dbo, row, "PERSONJURISDICTION", "jurisdiction", "JurisdictionName", createmissinglookups)
-            p["hometelephone"] = gks(row, "PERSONHOMEPHONE")
-            p["worktelephone"] = gks(row, "PERSONWORKPHONE")
-            p["mobiletelephone"] = gks(row, "PERSONCELLPHONE")
-            p["emailaddress"] = gks(row, "PERSONEMAIL")
-            p["gdprcontactoptin"] = gks(row, "PERSONGDPRCONTACTOPTIN")
-            flags = gks(row, "PERSONFLAGS")
-            if gkb(row, "PERSONFOSTERER"): flags += ",fosterer"
-            if gkb(row, "PERSONMEMBER"): flags += ",member"
-            if gkb(row, "PERSONDONOR"): flags += ",donor"
-            p["flags"] = flags
-            p["comments"] = gks(row, "PERSONCOMMENTS")
-            p["membershipnumber"] = gks(row, "PERSONMEMBERSHIPNUMBER")
-            p["membershipexpires"] = gkd(dbo, row, "PERSONMEMBERSHIPEXPIRY")
-            p["matchactive"] = gkbi(row, "PERSONMATCHACTIVE")
-            if p["matchactive"] == "1":
-                if "PERSONMATCHADDED" in cols: p["matchadded"] = gkd(dbo, row, "PERSONMATCHADDED")
-                if "PERSONMATCHEXPIRES" in cols: p["matchexpires"] = gkd(dbo, row, "PERSONMATCHEXPIRES")
-                if "PERSONMATCHSEX" in cols: p["matchsex"] = gksx(row, "PERSONMATCHSEX")
-                if "PERSONMATCHSIZE" in cols: p["matchsize"] = gkl(dbo, row, "PERSONMATCHSIZE", "lksize", "Size", False)
-                if "PERSONMATCHCOLOR" in cols: p["matchcolour"] = gkl(dbo, row, "PERSONMATCHCOLOR", "basecolour", "BaseColour", createmissinglookups)
-                if "PERSONMATCHAGEFROM" in cols: p["agedfrom"] = gks(row, "PERSONMATCHAGEFROM")
-                if "PERSONMATCHAGETO" in cols: p["agedto"] = gks(row, "PERSONMATCHAGETO")
-                if "PERSONMATCHTYPE" in cols: p["matchanimaltype"] = gkl(dbo, row, "PERSONMATCHTYPE", "animaltype", "AnimalType", createmissinglookups)
-                if "PERSONMATCHSPECIES" in cols: p["matchspecies"] = gkl(dbo, row, "PERSONMATCHSPECIES", "species", "SpeciesName", createmissinglookups)
-                if "PERSONMATCHBREED1" in cols: p["matchbreed"] = gkbr(dbo, row, "PERSONMATCHBREED1", p["matchspecies"], createmissinglookups)
-                if "PERSONMATCHBREED2" in cols: p["matchbreed2"] = gkbr(dbo, row, "PERSONMATCHBREED2", p["matchspecies"], createmissinglookups)
-                if "PERSONMATCHGOODWITHCATS" in cols: p["matchgoodwithcats"] = gkynu(row, "PERSONMATCHGOODWITHCATS")
-                if "PERSONMATCHGOODWITHDOGS" in cols: p["matchgoodwithdogs"] = gkynu(row, "PERSONMATCHGOODWITHDOGS")
-                if "PERSONMATCHGOODWITHCHILDREN" in cols: p["matchgoodwithchildren"] = gkynu(row, "PERSONMATCHGOODWITHCHILDREN")
-                if "PERSONMATCHHOUSETRAINED" in cols: p["matchhousetrained"] = gkynu(row, "PERSONMATCHHOUSETRAINED")
-                if "PERSONMATCHCOMMENTSCONTAIN" in cols: p["matchcommentscontain"] = gks(row, "PERSONMATCHCOMMENTSCONTAIN")
-            try:
-                if checkduplicates:
-                    dups = asm3.person.get_person_similar(dbo, p["emailaddress"], p["mobiletelephone"], p["surname"], p["forenames"], p["address"])
-                    if len(dups) > 0:
-                        personid = dups[0].ID
-                        # Merge flags and any extra details
-                        asm3.person.merge_flags(dbo, user, personid, flags)
-                        asm3.person.merge_gdpr_flags(dbo, user, personid, p["gdprcontactoptin"])
-                        # If we deduplicated on the email address, and address details are
-                        # present, assume that they are newer than the ones we had and update them
-                        # (we do this by setting force=True parameter to merge_person_details,
-                        # otherwise we do a regular merge which only fills in any blanks)
-                        asm3.person.merge_person_details(dbo, user, personid, p, force=dups[0].EMAILADDRESS == p["emailaddress"])
-                if personid == 0:
-                    personid = asm3.person.insert_person_from_form(dbo, asm3.utils.PostedData(p, dbo.locale), user, geocode=False)
-                    # Identify any PERSONADDITIONAL additional fields and create them
-                    create_additional_fields(dbo, row, errors, rowno, "PERSONADDITIONAL", "person", personid)
-            except Exception as e:
-                row_error(errors, "person", rowno, row, e, dbo, sys.exc_info())
-
-        # Movement to tie animal/person together?
-        movementid = 0
-        if hasmovement and personid != 0 and animalid != 0 and gks(row, "MOVEMENTDATE") != "":
-            m = {}
-            m["person"] = str(personid)
-            m["animal"] = str(animalid)
-            movetype = gks(row, "MOVEMENTTYPE")
-            if movetype == "": movetype = "1" # Default to adoption if not supplied
-            m["type"] = str(movetype)
-            m["movementdate"] = gkd(dbo, row, "MOVEMENTDATE", True)
-            m["returndate"] = gkd(dbo, row, "MOVEMENTRETURNDATE")
-            m["comments"] = gks(row, "MOVEMENTCOMMENTS")
-            m["returncategory"] = str(asm3.configuration.default_entry_reason(dbo))
-            try:
-                movementid = asm3.movement.insert_movement_from_form(dbo, user, asm3.utils.PostedData(m, dbo.locale))
-            except Exception as e:
-                row_error(errors, "movement", rowno, row, e, dbo, sys.exc_info())
+                    row_error(errors, "person", rowno, row, e, dbo, sys.exc_info())
+                if not keep_section(): personid = 0
+
+            # Movement to tie animal/person together?
+            movementid = 0
+            if hasmovement and personid != 0 and animalid != 0 and gks(row, "MOVEMENTDATE") != "":
+                m = {}
+                m["person"] = str(personid)
+                m["animal"] = str(animalid)
+                movetype = gks(row, "MOVEMENTTYPE")
+                if movetype == "": movetype = "1" # Default to adoption if not supplied
+                m["type"] = str(movetype)
+                m["movementdate"] = gkd(dbo, row, "MOVEMENTDATE", True)
+                m["returndate"] = gkd(dbo, row, "MOVEMENTRETURNDATE")
+                m["comments"] = gks(row, "MOVEMENTCOMMENTS")
+                m["returncategory"] = str(asm3.configuration.default_entry_reason(dbo))
+                dbo.savepoint("csvrow")
+                try:
+                    movementid = asm3.movement.insert_movement_from_form(dbo, user, asm3.utils.PostedData(m, dbo.locale))
+                except Exception as e:
+                    row_error(errors, "movement", rowno, row, e, dbo, sys.exc_info())
+                if not keep_section(): movementid = 0
+
+            # Donation?
+            if hasdonation and personid != 0 and gkc(row, "DONATIONAMOUNT") != 0:
+                d = {}
+                d["person"] = str(personid)
+                d["animal"] = str(animalid)
+                d["movement"] = str(movementid)
+                d["amount"] = str(gkc(row, "DONATIONAMOUNT"))
+                d["fee"] = str(gkc(row, "DONATIONFEE"))
+                d["comments"] = gks(row, "DONATIONCOMMENTS")
+                d["received"] = gkd(dbo, row, "DONATIONDATE", True)
+                d["chequenumber"] = gks(row, "DONATIONCHECKNUMBER")
+                d["type"] = gkl(dbo, row, "DONATIONTYPE", "donationtype", "DonationName", createmissinglookups, lookups)
+                if d["type"] == "0":
+                    d["type"] = str(asm3.configuration.default_donation_type(dbo))
+                d["giftaid"] = gkbc(row, "DONATIONGIFTAID")
+                d["payment"] = gkl(dbo, row, "DONATIONPAYMENT", "donationpayment", "PaymentName", createmissinglookups, lookups)
+                if d["payment"] == "0":
+                    d["payment"] = "1"
+                dbo.savepoint("csvrow")
+                try:
+                    asm3.financial.insert_donation_from_form(dbo, user, asm3.utils.PostedData(d, dbo.locale))
+                except Exception as e:
+                    row_error(errors, "payment", rowno, row, e, dbo, sys.exc_info())
+                keep_section()
+                if movementid != 0: asm3.movement.update_movement_donation(dbo, movementid)
+
+            # Vaccination?
+            if hasvacc and animalid != 0 and gks(row, "VACCINATIONDUEDATE") != "":
+                v = {}
+                v["animal"] = str(animalid)
+                v["type"] = gkl(dbo, row, "VACCINATIONTYPE", "vaccinationtype", "VaccinationType", createmissinglookups, lookups)
+                if v["type"] == "0":
+                    v["type"] = str(asm3.configuration.default_vaccination_type(dbo))
+                v["required"] = gkd(dbo, row, "VACCINATIONDUEDATE", True)
+                v["given"] = gkd(dbo, row, "VACCINATIONGIVENDATE")
+                v["expires"] = gkd(dbo, row, "VACCINATIONEXPIRESDATE")
+                v["batchnumber"] = gks(row, "VACCINATIONBATCHNUMBER")
+                v["manufacturer"] = gks(row, "VACCINATIONMANUFACTURER")
+                v["comments"] = gks(row, "VACCINATIONCOMMENTS")
+                dbo.savepoint("csvrow")
+                try:
+                    asm3.medical.insert_vaccination_from_form(dbo, user, asm3.utils.PostedData(v, dbo.locale))
+                except Exception as e:
+                    row_error(errors, "vaccination", rowno, row, e, dbo, sys.exc_info())
+                keep_section()
+
+            # Test?
+            if hastest and animalid != 0 and gks(row, "TESTDUEDATE") != "":
+                v = {}
+                v["animal"] = str(animalid)
+                v["type"] = gkl(dbo, row, "TESTTYPE", "testtype", "TestName", createmissinglookups, lookups)
+                v["result"] = gkl(dbo, row, "TESTRESULT", "testresult", "ResultName", createmissinglookups, lookups)
+                v["required"] = gkd(dbo, row, "TESTDUEDATE", True)
+                v["given"] = gkd(dbo, row, "TESTPERFORMEDDATE")
+                v["comments"] = gks(row, "TESTCOMMENTS")
+                dbo.savepoint("csvrow")
+                try:
+                    asm3.medical.insert_test_from_form(dbo, user, asm3.utils.PostedData(v, dbo.locale))
+                except Exception as e:
+                    row_error(errors, "test", rowno, row, e, dbo, sys.exc_info())
+                keep_section()
+
+            # Medical?
+            if hasmed and animalid != 0 and gks(row, "MEDICALGIVENDATE") != "" and gks(row, "MEDICALNAME") != "":
+                m = {}
+                m["animal"] = str(animalid)
+                m["treatmentname"] = gks(row, "MEDICALNAME")
+                m["dosage"] = gks(row, "MEDICALDOSAGE")
+                m["startdate"] = gkd(dbo, row, "MEDICALGIVENDATE")
+                m["comments"] = gks(row, "MEDICALCOMMENTS")
+                m["singlemulti"] = "0" # single treatment
+                m["status"] = "2" # completed
+                dbo.savepoint("csvrow")
+                try:
+                    asm3.medical.insert_regimen_from_form(dbo, user, asm3.utils.PostedData(m, dbo.locale))
+                except Exception as e:
+                    row_error(errors, "medical", rowno, row, e, dbo, sys.exc_info())
+                keep_section()
+
+            # License?
+            if haslicence and personid != 0 and gks(row, "LICENSENUMBER") != "":
+                l = {}
+                l["person"] = str(personid)
+                l["animal"] = str(animalid)
+                l["type"] = gkl(dbo, row, "LICENSETYPE", "licencetype", "LicenceTypeName", createmissinglookups, lookups)
+                if l["type"] == "0": l["type"] = 1
+                l["number"] = gks(row, "LICENSENUMBER")
+                l["fee"] = str(gkc(row, "LICENSEFEE"))
+                l["issuedate"] = gkd(dbo, row, "LICENSEISSUEDATE")
+                l["expirydate"] = gkd(dbo, row, "LICENSEEXPIRESDATE")
+                l["comments"] = gks(row, "LICENSECOMMENTS")
+                dbo.savepoint("csvrow")
+                try:
+                    asm3.financial.insert_licence_from_form(dbo, user, asm3.utils.PostedData(l, dbo.locale))
+                except Exception as e:
+                    row_error(errors, "license", rowno, row, e, dbo, sys.exc_info())
+                keep_section()
 
-        # Donation?
-        if hasdonation and personid != 0 and gkc(row, "DONATIONAMOUNT") != 0:
-            d = {}
-            d["person"] = str(personid)
-            d["animal"] = str(animalid)
-            d["movement"] = str(movementid)
-            d["amount"] = str(gkc(row, "DONATIONAMOUNT"))
-            d["fee"] = str(gkc(row, "DONATIONFEE"))
-            d["comments"] = gks(row, "DONATIONCOMMENTS")
-            d["received"] = gkd(dbo, row, "DONATIONDATE", True)
-            d["chequenumber"] = gks(row, "DONATIONCHECKNUMBER")
-            d["type"] = gkl(dbo, row, "DONATIONTYPE", "donationtype", "DonationName", createmissinglookups)
-            if d["type"] == "0":
-                d["type"] = str(asm3.configuration.default_donation_type(dbo))
-            d["giftaid"] = gkbc(row, "DONATIONGIFTAID")
-            d["payment"] = gkl(dbo, row, "DONATIONPAYMENT", "donationpayment", "PaymentName", createmissinglookups)
-            if d["payment"] == "0":
-                d["payment"] = "1"
-            try:
-                asm3.financial.insert_donation_from_form(dbo, user, asm3.utils.PostedData(d, dbo.locale))
-            except Exception as e:
-                row_error(errors, "payment", rowno, row, e, dbo, sys.exc_info())
-            if movementid != 0: asm3.movement.update_movement_donation(dbo, movementid)
-
-        # Vaccination?
-        if hasvacc and animalid != 0 and gks(row, "VACCINATIONDUEDATE") != "":
-            v = {}
-            v["animal"] = str(animalid)
-            v["type"] = gkl(dbo, row, "VACCINATIONTYPE", "vaccinationtype", "VaccinationType", createmissinglookups)
-            if v["type"] == "0":
-                v["type"] = str(asm3.configuration.default_vaccination_type(dbo))
-            v["required"] = gkd(dbo, row, "VACCINATIONDUEDATE", True)
-            v["given"] = gkd(dbo, row, "VACCINATIONGIVENDATE")
-            v["expires"] = gkd(dbo, row, "VACCINATIONEXPIRESDATE")
-            v["batchnumber"] = gks(row, "VACCINATIONBATCHNUMBER")
-            v["manufacturer"] = gks(row, "VACCINATIONMANUFACTURER")
-            v["comments"] = gks(row, "VACCINATIONCOMMENTS")
-            try:
-                asm3.medical.insert_vaccination_from_form(dbo, user, asm3.utils.PostedData(v, dbo.locale))
-            except Exception as e:
-                row_error(errors, "vaccination", rowno, row, e, dbo, sys.exc_info())
-
-        # Test?
-        if hastest and animalid != 0 and gks(row, "TESTDUEDATE") != "":
-            v = {}
-            v["animal"] = str(animalid)
-            v["type"] = gkl(dbo, row, "TESTTYPE", "testtype", "TestName", createmissinglookups)
-            v["result"] = gkl(dbo, row, "TESTRESULT", "testresult", "ResultName", createmissinglookups)
-            v["required"] = gkd(dbo, row, "TESTDUEDATE", True)
-            v["given"] = gkd(dbo, row, "TESTPERFORMEDDATE")
-            v["comments"] = gks(row, "TESTCOMMENTS")
-            try:
-                asm3.medical.insert_test_from_form(dbo, user, asm3.utils.PostedData(v, dbo.locale))
-            except Exception as e:
-                row_error(errors, "test", rowno, row, e, dbo, sys.exc_info())
-
-        # Medical?
-        if hasmed and animalid != 0 and gks(row, "MEDICALGIVENDATE") != "" and gks(row, "MEDICALNAME") != "":
-            m = {}
-            m["animal"] = str(animalid)
-            m["treatmentname"] = gks(row, "MEDICALNAME")
-            m["dosage"] = gks(row, "MEDICALDOSAGE")
-            m["startdate"] = gkd(dbo, row, "MEDICALGIVENDATE")
-            m["comments"] = gks(row, "MEDICALCOMMENTS")
-            m["singlemulti"] = "0" # single treatment
-            m["status"] = "2" # completed
-            try:
-                asm3.medical.insert_regimen_from_form(dbo, user, asm3.utils.PostedData(m, dbo.locale))
-            except Exception as e:
-                row_error(errors, "medical", rowno, row, e, dbo, sys.exc_info())
-
-        # License?
-        if haslicence and personid != 0 and gks(row, "LICENSENUMBER") != "":
-            l = {}
-            l["person"] = str(personid)
-            l["animal"] = str(animalid)
-            l["type"] = gkl(dbo, row, "LICENSETYPE", "licencetype", "LicenceTypeName", createmissinglookups)
-            if l["type"] == "0": l["type"] = 1
-            l["number"] = gks(row, "LICENSENUMBER")
-            l["fee"] = str(gkc(row, "LICENSEFEE"))
-            l["issuedate"] = gkd(dbo, row, "LICENSEISSUEDATE")
-            l["expirydate"] = gkd(dbo, row, "LICENSEEXPIRESDATE")
-            l["comments"] = gks(row, "LICENSECOMMENTS")
-            try:
-                asm3.financial.insert_licence_from_form(dbo, user, asm3.utils.PostedData(l, dbo.locale))
-            except Exception as e:
-                row_error(errors, "license", rowno, row, e, dbo, sys.exc_info())
+        commit_chunk(rowno)
+    except:
+        dbo.rollback()
+        raise
 
-        rowno += 1
+    # Keep the checkpoint of a cancelled import so it can be carried on
+    if not cancelled: asm3.cachedisk.delete(checkpointkey, dbo.database)
 
-    h = [ "<p>%d success, %d errors</p><table>" % (len(rows) - len(errors), len(errors)) ]
+    h = [ "<p>%d success, %d errors</p><table>" % (rowcount - len(errors), len(errors)) ]
     for rowno, row, err in errors:
         h.append("<tr><td>%s</td><td>%s</td><td>%s</td></tr>" % (rowno, row, err))
     h.append("</table>")
@@ -715,6 +867,7 @@ def csvimport_paypal(dbo, csvdata, donationtypeid, donationpaymentid, flags, use
     errors = []
     rowno = 1
     asm3.asynctask.set_progress_max(dbo, len(rows))
+    personindex = asm3.person.PersonIndex(dbo)
 
     if len(rows) == 0:
         asm3.asynctask.set_last_error(dbo, "CSV file is empty")
@@ -770,7 +923,7 @@ def csvimport_paypal(dbo, csvdata, donationtypeid, donationpaymentid, flags, use
         p["emailaddress"] = v(r, "From Email Address")
         p["flags"] = flags
         try:
-            dups = asm3.person.get_person_similar(dbo, p["emailaddress"], p["hometelephone"], p["surname"], p["forenames"], p["address"])
+            dups = asm3.person.get_person_similar(dbo, p["emailaddress"], p["hometelephone"], p["surname"], p["forenames"], p["address"], personindex)
             if len(dups) > 0:
                 personid = dups[0]["ID"]
                 # Merge flags and any extra details
@@ -778,6 +931,7 @@ def csvimport_paypal(dbo, csvdata, donationtypeid, donationpaymentid, flags, use
                 asm3.person.merge_person_details(dbo, user, personid, p)
             if personid == 0:
                 personid = asm3.person.insert_person_from_form(dbo, asm3.utils.PostedData(p, dbo.locale), user, geocode=False)
+            personindex.update(dbo, personid)
         except Exception as e:
             row_error(errors, "person", rowno, r, e, dbo, sys.exc_info())
 
@@ -824,15 +978,15 @@ def csvexport_animals(dbo, dataset, animalids = "", includephoto = False):
     includephoto: Output a base64 encoded version of the animal's photo if True
     """
     l = dbo.locale
-    q = ""
+    where = ""
     out = asm3.utils.stringio()
     
-    if dataset == "all": q = "SELECT ID FROM animal ORDER BY ID"
-    elif dataset == "shelter": q = "SELECT ID FROM animal WHERE Archived=0 ORDER BY ID"
-    elif dataset == "nonshelter": q = "SELECT ID FROM animal WHERE NonShelterAnimal=1 ORDER BY ID"
-    elif dataset == "selshelter": q = "SELECT ID FROM animal WHERE ID IN (%s) ORDER BY ID" % animalids
+    if dataset == "all": where = ""
+    elif dataset == "shelter": where = "WHERE a.Archived=0"
+    elif dataset == "nonshelter": where = "WHERE a.NonShelterAnimal=1"
+    elif dataset == "selshelter": where = "WHERE a.ID IN (%s)" % animalids
     
-    ids = dbo.query(q)
+    total = dbo.query_int("SELECT COUNT(*) FROM animal a %s" % where)
 
     keys = [ "ANIMALCODE", "ANIMALNAME", "ANIMALIMAGE", "ANIMALSEX", "ANIMALTYPE", "ANIMALCOLOR", "ANIMALBREED1",
         "ANIMALBREED2", "ANIMALDOB", "ANIMALLOCATION", "ANIMALUNIT", "ANIMALSPECIES", "ANIMALCOMMENTS",
@@ -858,8 +1012,9 @@ def csvexport_animals(dbo, dataset, animalids = "", includephoto = False):
         return ",".join(r) + "\n"
 
     firstrow = True
-    asm3.asynctask.set_progress_max(dbo, len(ids))
-    for aid in ids:
+    asm3.asynctask.set_progress_max(dbo, total)
+    # Stream the animal rows rather than loading them all up front
+    for a in dbo.query_stream("%s %s ORDER BY a.ID" % (asm3.animal.get_animal_query(dbo), where)):
 
         # Should we stop?
         if asm3.asynctask.get_cancel(dbo): break
@@ -869,9 +1024,6 @@ def csvexport_animals(dbo, dataset, animalids = "", includephoto = False):
             out.write(",".join(keys) + "\n")
 
         row = {}
-        a = asm3.animal.get_animal(dbo, aid.ID)
-        if a is None: continue
-
         asm3.asynctask.increment_progress_value(dbo)
 
         row["ANIMALCODE"] = a["SHELTERCODE"]
@@ -975,6 +1127,6 @@ def csvexport_animals(dbo, dataset, animalids = "", includephoto = False):
     key = asm3.utils.uuid_str()
     asm3.cachedisk.put(key, dbo.database, out.getvalue(), 3600)
     h = '<p>%s <a target="_blank" href="csvexport_animals?get=%s"><b>%s</b></p>' % ( \
-        asm3.i18n._("Export complete ({0} entries).", l).format(len(ids)), key, asm3.i18n._("Download File", l) )
+        asm3.i18n._("Export complete ({0} entries).", l).format(total), key, asm3.i18n._("Download File", l) )
     return h
 
@@ -1,6 +1,7 @@
 
 import asm3.al
 import asm3.cachedisk
+import asm3.media
 import asm3.smcom
 import asm3.utils
 from asm3.sitedefs import DBFS_STORE, DBFS_FILESTORAGE_FOLDER, DBFS_S3_BUCKET
@@ -423,6 +424,16 @@ def delete(dbo, name, path = ""):
         o = DBFSStorage(dbo, r.url)
         o.delete(r.url)
 
+def delete_like(dbo, name, path):
+    """
+    Deletes all items in path with a name matching the pattern given (use % like db)
+    """
+    rows = dbo.query("SELECT ID, URL FROM dbfs WHERE Name LIKE ? AND Path=?", (name, path))
+    dbo.execute("DELETE FROM dbfs WHERE Name LIKE ? AND Path=?", (name, path))
+    for r in rows:
+        o = DBFSStorage(dbo, r.url)
+        o.delete(r.url)
+
 def delete_filepath(dbo, filepath):
     """
     Deletes the dbfs entry for the filepath
@@ -522,7 +533,8 @@ def upload_document_repository(dbo, path, filename, filedata):
 
 def delete_orphaned_media(dbo):
     """
-    Removes all dbfs content should have an entry in the media table and doesn't
+    Removes all dbfs content should have an entry in the media table and doesn't,
+    and any thumbnails of images that are no longer in the media table.
     """
     where = "WHERE " \
         "(Path LIKE '/animal%' OR Path LIKE '/owner%' OR Path LIKE '/lostanimal%' OR Path LIKE '/foundanimal%' " \
@@ -535,6 +547,13 @@ def delete_orphaned_media(dbo):
         o = DBFSStorage(dbo, r.url)
         o.delete(r.url)
     asm3.al.debug("Removed %s orphaned dbfs/media records" % len(rows), "dbfs.delete_orphaned_media", dbo)
+    # Thumbnails are named DBFSID-SIZE.jpg, remove any whose image is no longer in the media table
+    dbfsids = set(r.dbfsid for r in dbo.query("SELECT DBFSID FROM media"))
+    thumbs = [ r for r in dbo.query("SELECT ID, Name, URL FROM dbfs WHERE Path = ?", [asm3.media.THUMBNAIL_PATH])
+        if asm3.utils.atoi(r.name.split("-")[0]) not in dbfsids ]
+    for r in thumbs:
+        delete_id(dbo, r.id)
+    asm3.al.debug("Removed %s orphaned thumbnails" % len(thumbs), "dbfs.delete_orphaned_media", dbo)
 
 def switch_storage(dbo):
     """ Goes through all files in dbfs and swaps them into the current storage scheme """
@@ -3,15 +3,32 @@ import asm3.al
 import asm3.audit
 import asm3.cachemem
 import asm3.cachedisk
+import asm3.dbms.pool
 import asm3.i18n
 import asm3.utils
 
+import copy
 import datetime
+import re
 import sys
 import time
 from urllib.parse import urlparse
 
-from asm3.sitedefs import DATABASE_URL, DB_HAS_ASM2_PK_TABLE, DB_DECODE_HTML_ENTITIES, DB_EXEC_LOG, DB_EXPLAIN_QUERIES, DB_TIME_QUERIES, DB_TIME_LOG_OVER, DB_TIMEOUT, CACHE_COMMON_QUERIES
+from asm3.sitedefs import DATABASE_URL, DB_HAS_ASM2_PK_TABLE, DB_DECODE_HTML_ENTITIES, DB_EXEC_LOG, DB_EXPLAIN_QUERIES, DB_TIME_QUERIES, DB_TIME_LOG_OVER, DB_TIMEOUT, DB_STREAM_BATCH_SIZE, DB_WRITE_BATCH_SIZE, DB_DUMP_BATCH_SIZE, CACHE_COMMON_QUERIES
+
+# Tables that have the time of their last change recorded in the disk cache,
+# so that values built from them (eg: the publisher animal data and home 
+# page alert counters) can tell when they are out of date. 
+# See Database.get_table_changed
+PUBLISH_DATA_TABLES = ( "additional", "adoption", "animal", "configuration", "media" ) # read by publishers.base.get_animal_data
+TRACKED_TABLES = PUBLISH_DATA_TABLES + ( "animalcontrol", "animalmedical", "animalmedicaltreatment", 
+    "animaltest", "animaltransport", "animalvaccination", "animalwaitinglist", "clinicappointment", 
+    "internallocation", "log", "onlineformincoming", "owner", "ownercitation", "ownerdonation", 
+    "ownertraploan", "publishlog", "stocklevel" )
+TRACKED_CHANGED_TTL = 86400 * 7
+
+# Matches the table name in an INSERT, UPDATE or DELETE query
+WRITE_TABLE = re.compile(r"\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)", re.IGNORECASE)
 
 class ResultRow(dict):
     """
@@ -40,6 +57,77 @@ class ResultRow(dict):
     def __repr__(self):
         return '<ResultRow ' + dict.__repr__(self) + '>'
 
+class StreamRow(object):
+    """
+    A lightweight, read mostly row returned by Database.query_stream.
+    The values are held in a tuple and all rows from the same query 
+    share one map of uppercased column name to index, so no per-row 
+    dictionary is built.
+    Supports the same `obj.foo` and `obj['FOO']` access as ResultRow. 
+    Existing columns can be assigned to, but new ones cannot be added 
+    (use copy() to get a ResultRow for that).
+    """
+    __slots__ = ( "_cols", "_values" )
+
+    def __init__(self, cols, values):
+        object.__setattr__(self, "_cols", cols)
+        object.__setattr__(self, "_values", values)
+
+    def _index(self, key):
+        try:
+            return self._cols[key]
+        except KeyError:
+            return self._cols[key.upper()]
+
+    def __getitem__(self, key):
+        return self._values[self._index(key)]
+
+    def __setitem__(self, key, value):
+        i = self._index(key)
+        if type(self._values) is tuple: 
+            object.__setattr__(self, "_values", list(self._values))
+        self._values[i] = value
+
+    def __getattr__(self, key):
+        try:
+            return self._values[self._index(key)]
+        except KeyError as k:
+            raise AttributeError(k)
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __contains__(self, key):
+        return key in self._cols or key.upper() in self._cols
+
+    def __iter__(self):
+        return iter(self._cols)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return '<StreamRow ' + repr(dict(self.items())) + '>'
+
+    def copy(self):
+        """ Returns the row as a ResultRow """
+        return ResultRow(self.items())
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return zip(self._cols, self._values)
+
+    def keys(self):
+        return self._cols.keys()
+
+    def values(self):
+        return list(self._values)
+
 class QueryBuilder(object):
     """
     Build a query from component parts, keeping track of params eg:
@@ -130,6 +218,11 @@ class Database(object):
     is_large_db = False
     timeout = DB_TIMEOUT
     connection = None
+    in_transaction = False
+    transaction_connection = False
+    transaction_changes = None # TRACKED_TABLES written in the open transaction
+    pool_connections = True
+    max_params = 32767 # most parameters allowed in a single statement
 
     type_shorttext = "VARCHAR(1024)"
     type_longtext = "TEXT"
@@ -142,29 +235,91 @@ class Database(object):
         """ Virtual: Connect to the database and return the connection """
         raise NotImplementedError()
 
+    def connection_ping(self, c):
+        """ Returns True if connection c is still usable """
+        try:
+            s = c.cursor()
+            s.execute("SELECT 1")
+            s.fetchall()
+            s.close()
+            c.commit()
+            return True
+        except:
+            return False
+
     def cursor_open(self):
         """ Returns a tuple containing an open connection and cursor.
             If the dbo object contains an active connection, we'll just use
             that to get a cursor to save time.
+            If connection pooling is on (DB_POOL_SIZE), the connection
+            comes from the pool for this database.
         """
         if self.connection is not None:
             c = self.connection
             s = self.connection.cursor()
         else:
-            c = self.connect()
+            pool = asm3.dbms.pool.get_pool(self)
+            if pool is not None:
+                c = pool.acquire(self)
+            else:
+                c = self.connect()
             s = c.cursor()
         return c, s
 
+    def cursor_open_stream(self):
+        """ Returns a tuple containing an open connection and a cursor for 
+            streaming a large resultset with query_stream.
+            The connection is never the one cached in self.connection, 
+            since other queries committing on it while we are still reading
+            would break the stream. Close with cursor_close_stream.
+            Providers override cursor_stream to return a server side cursor.
+        """
+        pool = asm3.dbms.pool.get_pool(self)
+        if pool is not None:
+            c = pool.acquire(self)
+        else:
+            c = self.connect()
+        return c, self.cursor_stream(c)
+
+    def cursor_stream(self, c):
+        """ Virtual: Returns a cursor on connection c that fetches rows
+            from the server as they are asked for rather than all at once.
+        """
+        return c.cursor()
+
+    def cursor_close_stream(self, c, s):
+        """ Closes a connection and cursor pair from cursor_open_stream """
+        try:
+            s.close()
+        except:
+            pass
+        pool = asm3.dbms.pool.get_pool(self)
+        if pool is not None:
+            pool.release(c)
+            return
+        try:
+            c.close()
+        except:
+            pass
+
     def cursor_close(self, c, s):
         """ Closes a connection and cursor pair. If self.connection exists, then
             c must be it, so don't close it. Connection caching in this object
             is done by processes called via cron.py as they do not use pooling.
+            Pooled connections are returned to their pool instead of closed. 
+            Call this once for each pair from cursor_open, normally in a 
+            finally block. A pooled connection released twice could be in
+            use by another thread by the time of the second release.
         """
         try:
             s.close()
         except:
             pass
         if self.connection is None:
+            pool = asm3.dbms.pool.get_pool(self)
+            if pool is not None:
+                pool.release(c)
+                return
             try:
                 c.close()
             except:
@@ -281,6 +436,90 @@ class Database(object):
         s = s.replace("'", "`")
         return s
 
+    def clone(self):
+        """ Returns a new Database for the same database with the same settings
+            (locale, timezone, etc), but without this one's connection or open 
+            transaction. Use it to work with the database from another thread.
+        """
+        dbo = copy.copy(self)
+        dbo.connection = None
+        dbo.in_transaction = False
+        dbo.transaction_connection = False
+        dbo.transaction_changes = None
+        return dbo
+
+    def begin(self):
+        """ Starts a transaction. Until commit or rollback is called, every
+            query runs on one connection (held in self.connection) and action
+            queries join the transaction instead of committing on their own.
+            A failing query does not roll the transaction back, callers that 
+            carry on after errors should use savepoints.
+        """
+        if self.in_transaction: return
+        if self.connection is None:
+            pool = asm3.dbms.pool.get_pool(self)
+            if pool is not None:
+                self.connection = pool.acquire(self)
+            else:
+                self.connection = self.connect()
+            self.transaction_connection = True
+        self.in_transaction = True
+        self.transaction_changes = set()
+
+    def commit(self):
+        """ Commits and ends the transaction started with begin """
+        self._end_transaction(True)
+
+    def rollback(self):
+        """ Rolls back and ends the transaction started with begin """
+        self._end_transaction(False)
+
+    def _end_transaction(self, commit):
+        if not self.in_transaction: return
+        c = self.connection
+        changes = self.transaction_changes
+        self.in_transaction = False
+        self.transaction_changes = None
+        try:
+            if commit: 
+                c.commit()
+                # Record the tables changed now that other connections can see the changes
+                self._record_changes(changes)
+            else:
+                c.rollback()
+        finally:
+            if self.transaction_connection:
+                self.transaction_connection = False
+                self.connection = None
+                self.cursor_close(c, None)
+
+    def _commit(self, c):
+        """ Commits connection c unless a transaction is open on it """
+        if not self.in_transaction: c.commit()
+
+    def _rollback(self, c):
+        """ Rolls back connection c unless a transaction is open on it """
+        if not self.in_transaction: c.rollback()
+
+    def savepoint(self, name):
+        """ Sets a savepoint in the transaction started with begin """
+        self._execute_transaction("SAVEPOINT %s" % name)
+
+    def release_savepoint(self, name):
+        """ Keeps everything done since savepoint name and forgets it """
+        self._execute_transaction("RELEASE SAVEPOINT %s" % name)
+
+    def rollback_savepoint(self, name):
+        """ Undoes everything done since savepoint name """
+        self._execute_transaction("ROLLBACK TO SAVEPOINT %s" % name)
+
+    def _execute_transaction(self, sql):
+        s = self.connection.cursor()
+        try:
+            s.execute(sql)
+        finally:
+            s.close()
+
     def escape_xss(self, s):
         """ XSS escapes a string """
         return s.replace("<", "&lt;").replace(">", "&gt;")
@@ -303,9 +542,9 @@ class Database(object):
             else:
                 s.execute(sql)
             rv = s.rowcount
-            c.commit()
-            self.cursor_close(c, s)
+            self._commit(c)
             self._log_sql(sql, params)
+            self._track_changes([ (sql, rv) ])
             return rv
         except Exception as err:
             asm3.al.error(str(err), "Database.execute", self, sys.exc_info())
@@ -313,7 +552,7 @@ class Database(object):
             try:
                 # An error can leave a connection in unusable state, 
                 # rollback any attempted changes.
-                c.rollback()
+                self._rollback(c)
             except:
                 pass
             raise err
@@ -347,8 +586,8 @@ class Database(object):
             sql = self.switch_param_placeholder(sql)
             s.executemany(sql, params)
             rv = s.rowcount
-            c.commit()
-            self.cursor_close(c, s)
+            self._commit(c)
+            self._track_changes([ (sql, rv) ])
             return rv
         except Exception as err:
             asm3.al.error(str(err), "Database.execute_many", self, sys.exc_info())
@@ -356,7 +595,51 @@ class Database(object):
             try:
                 # An error can leave a connection in unusable state, 
                 # rollback any attempted changes.
-                c.rollback()
+                self._rollback(c)
+            except:
+                pass
+            raise err
+        finally:
+            try:
+                self.cursor_close(c, s)
+            except:
+                pass
+
+    def execute_batch(self, statements, override_lock=False):
+        """
+            Runs a list of action queries in a single transaction, either 
+            they all succeed or none of them are applied. 
+            statements: A list of (sql, params) tuples. If params is a list 
+                        of tuples, the query is run once for each with executemany.
+            Returns the total rows affected
+        """
+        if not override_lock and self.locked: return 0
+        if len(statements) == 0: return 0
+        sql = ""
+        params = None
+        try:
+            c, s = self.cursor_open()
+            rv = 0
+            changes = []
+            for sql, params in statements:
+                sql = self.switch_param_placeholder(sql)
+                if params and type(params[0]) in (list, tuple):
+                    s.executemany(sql, params)
+                else:
+                    s.execute(sql, params or ())
+                if s.rowcount > 0: rv += s.rowcount
+                changes.append((sql, s.rowcount))
+                self._log_sql(sql, params)
+            self._commit(c)
+            self._track_changes(changes)
+            return rv
+        except Exception as err:
+            asm3.al.error(str(err), "Database.execute_batch", self, sys.exc_info())
+            asm3.al.error("failing sql: %s %s" % (sql, params), "Database.execute_batch", self)
+            try:
+                # An error can leave a connection in unusable state, 
+                # rollback any attempted changes.
+                self._rollback(c)
             except:
                 pass
             raise err
@@ -391,6 +674,35 @@ class Database(object):
         """ Returns the next ID for a table using MAX(ID) """
         return self.query_int("SELECT MAX(ID) FROM %s" % table) + 1
 
+    def get_ids(self, table, count):
+        """ Allocates a block of count IDs for a table at once and returns them as a list """
+        if count <= 0: return []
+        cache_key = "%s_pk_%s" % (self.database, table)
+        lastid = asm3.cachemem.increment(cache_key, count)
+        if lastid is None:
+            lastid = self.get_id_max(table) + count - 1
+            asm3.cachemem.put(cache_key, lastid, 86400)
+        self.update_asm2_primarykey(table, lastid)
+        asm3.al.debug("get_ids: %s -> %d-%d (cache_pk)" % (table, lastid - count + 1, lastid), "Database.get_ids", self)
+        return list(range(lastid - count + 1, lastid + 1))
+
+    def get_table_changed(self, tables):
+        """ Returns the time of the most recent change to any of tables, 
+            which must be in TRACKED_TABLES. If we have no record of a table
+            changing, it is treated as having changed now. """
+        latest = 0
+        for t in tables:
+            changed = asm3.cachedisk.get("tablechanged:%s" % t, self.database, expectedtype=float)
+            if changed is None: changed = self.set_table_changed(t)
+            latest = max(latest, changed)
+        return latest
+
+    def set_table_changed(self, table):
+        """ Records that table has just changed. Returns the change time """
+        changed = time.time()
+        asm3.cachedisk.put("tablechanged:%s" % table, self.database, changed, TRACKED_CHANGED_TTL)
+        return changed
+
     def get_query_builder(self):
         return QueryBuilder(self)
 
@@ -471,6 +783,109 @@ class Database(object):
             asm3.audit.edit(self, user, table, iid, asm3.audit.get_parent_links(values, table), asm3.audit.map_diff(preaudit, postaudit, asm3.audit.get_readable_fields_for_table(table)))
         return rows_affected
 
+    def insert_many(self, table, rows, user="", generateID=True, setOverrideDBLock=False, setRecordVersion=True, setCreated=True, writeAudit=True):
+        """ Inserts multiple rows into a table in a single transaction.
+            The IDs for all rows are allocated in one go, rows are sent in multi-row
+            INSERT statements of up to DB_WRITE_BATCH_SIZE rows and the audit records
+            are built from the values passed rather than reading the rows back.
+            table: The table to insert into
+            rows: A list of dicts of column names with values
+            The other arguments are the same as for insert()
+            Returns a list of the IDs of the inserted records, in the same order as rows
+        """
+        if len(rows) == 0: return []
+        ids = [ 0 ] * len(rows)
+        if generateID: 
+            ids = self.get_ids(table, len(rows))
+        now = self.now()
+        recordversion = self.get_recordversion()
+        audits = []
+        for i, values in enumerate(rows):
+            if user != "" and setCreated:
+                values["CreatedBy"] = user
+                values["LastChangedBy"] = user
+                values["CreatedDate"] = now
+                values["LastChangedDate"] = now
+                if setRecordVersion: values["RecordVersion"] = recordversion
+            if generateID:
+                values["ID"] = ids[i]
+            elif "ID" in values:
+                ids[i] = values["ID"]
+            values = self.encode_str_before_write(values)
+            rows[i] = values
+            if writeAudit and ids[i] != 0 and user != "":
+                # The audit record shows the values as they would be read back
+                readback = dict( (k, self.encode_str_after_read(v)) for k, v in values.items() )
+                audits.append(asm3.audit.action_values(self, asm3.audit.ADD, user, table, ids[i], asm3.audit.get_parent_links(values, table), asm3.audit.dump_values(readback)))
+        statements = self._insert_statements(table, rows)
+        if len(audits) > 0:
+            statements += self._insert_statements("audittrail", audits)
+        self.execute_batch(statements, override_lock=setOverrideDBLock)
+        return ids
+
+    def _insert_statements(self, table, rows):
+        """ Returns a list of (sql, params) multi-row INSERT statements for a list of value dicts.
+            Rows are grouped by their set of columns, preserving order within each group. """
+        groups = {}
+        for values in rows:
+            groups.setdefault(tuple(values.keys()), []).append(values)
+        statements = []
+        for cols, grows in groups.items():
+            size = max(1, min(DB_WRITE_BATCH_SIZE, self.max_params // len(cols)))
+            for i in range(0, len(grows), size):
+                chunk = grows[i:i+size]
+                placeholders = "(%s)" % self.sql_placeholders(cols)
+                params = []
+                for values in chunk:
+                    params.extend(values[k] for k in cols)
+                statements.append(("INSERT INTO %s (%s) VALUES %s" % (table, ",".join(cols), ",".join([placeholders] * len(chunk))), params))
+        return statements
+
+    def update_many(self, table, rows, user="", setOverrideDBLock=False, setRecordVersion=True, setLastChanged=True, writeAudit=True):
+        """ Updates multiple rows in a table by ID in a single transaction.
+            The rows are read once up front (only if auditing) and the audit 
+            differences are calculated from the new values in memory.
+            table: The table to update
+            rows: A list of (id, values) tuples, where values is a dict of column names with values
+            The other arguments are the same as for update()
+            Returns the number of rows updated
+        """
+        if len(rows) == 0: return 0
+        now = self.now()
+        recordversion = self.get_recordversion()
+        audit = user != "" and writeAudit
+        prerows = {}
+        if audit:
+            ids = [ asm3.utils.cint(iid) for iid, values in rows ]
+            for i in range(0, len(ids), DB_WRITE_BATCH_SIZE):
+                chunk = ids[i:i+DB_WRITE_BATCH_SIZE]
+                for r in self.query("SELECT * FROM %s WHERE ID IN (%s)" % (table, ",".join(str(x) for x in chunk))):
+                    prerows[r.ID] = r
+        groups = {}
+        audits = []
+        for iid, values in rows:
+            iid = asm3.utils.cint(iid)
+            if user != "" and setLastChanged:
+                values["LastChangedBy"] = user
+                values["LastChangedDate"] = now
+                if setRecordVersion: values["RecordVersion"] = recordversion
+            values = self.encode_str_before_write(values)
+            cols = tuple(values.keys())
+            groups.setdefault(cols, []).append(tuple(values[k] for k in cols) + (iid,))
+            if audit and iid in prerows:
+                preaudit = prerows[iid]
+                postaudit = preaudit.copy()
+                for k, v in values.items():
+                    postaudit[k.upper()] = self.encode_str_after_read(v)
+                audits.append(asm3.audit.action_values(self, asm3.audit.EDIT, user, table, iid, asm3.audit.get_parent_links(values, table), 
+                    asm3.audit.map_diff([preaudit], [postaudit], asm3.audit.get_readable_fields_for_table(table))))
+        statements = []
+        for cols, params in groups.items():
+            statements.append(("UPDATE %s SET %s WHERE ID=?" % (table, ",".join( ["%s=?" % x for x in cols] )), params))
+        if len(audits) > 0:
+            statements += self._insert_statements("audittrail", audits)
+        return self.execute_batch(statements, override_lock=setOverrideDBLock)
+
     def delete(self, table, where, user="", writeAudit=True, writeDeletion=True):
         """ Deletes row ID=iid from table 
             table: The table to delete from
@@ -492,6 +907,26 @@ class Database(object):
         """ Install any supporting stored procedures (typically for reports) needed for this backend """
         pass
 
+    def _track_changes(self, statements):
+        """ statements is a list of (sql, rowcount) that have just been run. 
+            Records a change to each of TRACKED_TABLES they wrote to, once per 
+            table. Statements that changed no rows are ignored. In a transaction, 
+            the tables are held and recorded when it is committed. """
+        tables = set()
+        for sql, rowcount in statements:
+            if rowcount == 0: continue
+            m = WRITE_TABLE.match(sql)
+            if m is not None and m.group(1).lower() in TRACKED_TABLES:
+                tables.add(m.group(1).lower())
+        if self.in_transaction:
+            self.transaction_changes.update(tables)
+        else:
+            self._record_changes(tables)
+
+    def _record_changes(self, tables):
+        for t in tables:
+            self.set_table_changed(t)
+
     def _log_sql(self, sql, params):
         """ If outputting statements to a log is enabled, write the statement
             substitutes any parameters """
@@ -565,7 +1000,7 @@ class Database(object):
                 s.execute(sql, params)
             else:
                 s.execute(sql)
-            c.commit()
+            self._commit(c)
             d = s.fetchall()
             l = []
             cols = []
@@ -587,7 +1022,6 @@ class Database(object):
                         l.append(rowmap)
                 else:
                     l.append(rowmap)
-            self.cursor_close(c, s)
             if DB_TIME_QUERIES:
                 tt = time.time() - start
                 if tt > DB_TIME_LOG_OVER:
@@ -596,6 +1030,12 @@ class Database(object):
         except Exception as err:
             asm3.al.error(str(err), "Database.query", self, sys.exc_info())
             asm3.al.error("failing sql: %s %s" % (sql, params), "Database.query", self)
+            try:
+                # An error can leave a connection in unusable state, 
+                # rollback so it is safe to use again.
+                self._rollback(c)
+            except:
+                pass
             raise err
         finally:
             try:
@@ -634,16 +1074,21 @@ class Database(object):
                 s.execute(sql, params)
             else:
                 s.execute(sql)
-            c.commit()
+            self._commit(c)
             # Build a list of the column names
             cn = []
             for col in s.description:
                 cn.append(col[0].upper())
-            self.cursor_close(c, s)
             return cn
         except Exception as err:
             asm3.al.error(str(err), "Database.query_columns", self, sys.exc_info())
             asm3.al.error("failing sql: %s %s" % (sql, params), "Database.query_columns", self)
+            try:
+                # An error can leave a connection in unusable state, 
+                # rollback so it is safe to use again.
+                self._rollback(c)
+            except:
+                pass
             raise err
         finally:
             try:
@@ -676,7 +1121,7 @@ class Database(object):
                 s.execute(sql, params)
             else:
                 s.execute(sql)
-            c.commit()
+            self._commit(c)
             cols = []
             # Get the list of column names
             for i in s.description:
@@ -690,10 +1135,15 @@ class Database(object):
                     rowmap[cols[i]] = v
                 yield rowmap
                 row = s.fetchone()
-            self.cursor_close(c, s)
         except Exception as err:
             asm3.al.error(str(err), "Database.query_generator", self, sys.exc_info())
             asm3.al.error("failing sql: %s %s" % (sql, params), "Database.query_generator", self)
+            try:
+                # An error can leave a connection in unusable state, 
+                # rollback so it is safe to use again.
+                self._rollback(c)
+            except:
+                pass
             raise err
         finally:
             try:
@@ -701,6 +1151,56 @@ class Database(object):
             except:
                 pass
 
+    def query_stream(self, sql, params=None, batchsize=DB_STREAM_BATCH_SIZE):
+        """ Runs the query given and yields the resultset a row at a time
+            as StreamRow objects.
+            Rows are read from a server side cursor batchsize at a time, so
+            the whole resultset is never held in memory at once. 
+            Use this instead of query for very large resultsets that are only 
+            read once, eg: exports and dumps.
+            generator function.
+        """
+        c = None
+        s = None
+        try:
+            c, s = self.cursor_open_stream()
+            if params:
+                sql = self.switch_param_placeholder(sql)
+                s.execute(sql, params)
+            else:
+                s.execute(sql)
+            # Server side cursors may not have a description until 
+            # the first rows have been fetched
+            rows = s.fetchmany(batchsize)
+            cols = {}
+            for i, d in enumerate(s.description):
+                cols[d[0].upper()] = i
+            encode = self.encode_str_after_read
+            while rows:
+                for row in rows:
+                    yield StreamRow(cols, tuple([ encode(v) if v is not None else None for v in row ]))
+                rows = s.fetchmany(batchsize)
+            c.commit()
+        except Exception as err:
+            asm3.al.error(str(err), "Database.query_stream", self, sys.exc_info())
+            asm3.al.error("failing sql: %s %s" % (sql, params), "Database.query_stream", self)
+            try:
+                # An error can leave a connection in unusable state, 
+                # rollback so it is safe to use again.
+                c.rollback()
+            except:
+                pass
+            raise err
+        finally:
+            if c is not None:
+                try:
+                    # If the caller stopped reading early, end the transaction
+                    # holding the server side cursor before releasing
+                    c.rollback()
+                except:
+                    pass
+                self.cursor_close_stream(c, s)
+
     def query_named_params(self, sql, params, age=0):
         """ Allows use of :named :params in a query (must terminate with space, comma or right parentheses). params should be a dict. 
             if age is not zero, uses query_cache instead.
@@ -738,9 +1238,77 @@ class Database(object):
         returned by running sql (a list containing dictionaries)
         escapeCR: Turn line feed chars into this character
         """
-        for r in self.query_generator(sql):
+        for r in self.query_stream(sql):
             yield self.row_to_insert_sql(table, r, escapeCR)
 
+    def query_to_insert_batches(self, sql, table, escapeCR = "", batchsize = DB_DUMP_BATCH_SIZE):
+        """
+        Generator function that writes multi-row INSERT queries of up to 
+        batchsize rows for the rows returned by running sql. The rows are
+        read with query_stream so the resultset is never held in memory.
+        A batchsize of 1 writes a single row INSERT for each row.
+        escapeCR: Turn line feed chars into this character
+        """
+        cols = None
+        batch = []
+        for r in self.query_stream(sql):
+            if cols is None: cols = sorted(r.keys())
+            batch.append([ r[k] for k in cols ])
+            if len(batch) >= batchsize:
+                yield self.rows_to_insert_sql(table, cols, batch, escapeCR)
+                batch = []
+        if len(batch) > 0:
+            yield self.rows_to_insert_sql(table, cols, batch, escapeCR)
+
+    def query_to_copy(self, sql, table, batchsize = DB_DUMP_BATCH_SIZE):
+        """
+        Generator function that writes the rows returned by running sql in 
+        the PostgreSQL COPY text format (a COPY header, one tab separated line
+        per row and a terminator), batchsize rows at a time. 
+        Nothing is written if there are no rows. Load with copy_rows.
+        """
+        cols = None
+        batch = []
+        for r in self.query_stream(sql):
+            if cols is None: 
+                cols = sorted(r.keys())
+                yield "COPY %s (%s) FROM stdin;\n" % (table, ", ".join(cols))
+            batch.append("\t".join([ self.copy_value(r[k]) for k in cols ]) + "\n")
+            if len(batch) >= batchsize:
+                yield "".join(batch)
+                batch = []
+        if len(batch) > 0:
+            yield "".join(batch)
+        if cols is not None:
+            yield "\\.\n"
+
+    def copy_value(self, v):
+        """ Given a value v, writes it in COPY text format """
+        if v is None:
+            return "\\N"
+        elif asm3.utils.is_unicode(v) or asm3.utils.is_str(v):
+            return v.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+        elif type(v) == datetime.datetime:
+            return self.sql_date(v, wrapParens=False)
+        else:
+            return str(v)
+
+    def copy_unescape(self, s):
+        """ Reads a value written by copy_value back as a string or None """
+        if s == "\\N": return None
+        if s.find("\\") == -1: return s
+        return re.sub(r"\\(.)", lambda m: { "t": "\t", "n": "\n", "r": "\r" }.get(m.group(1), m.group(1)), s)
+
+    def copy_rows(self, s, table, cols, lines):
+        """
+        Loads lines in COPY text format (as written by query_to_copy) into 
+        table with cursor s. Uses a single executemany of INSERT statements,
+        providers that support COPY override this to use it.
+        """
+        rows = [ [ self.copy_unescape(v) for v in x.rstrip("\n").split("\t") ] for x in lines ]
+        sql = self.switch_param_placeholder("INSERT INTO %s (%s) VALUES (%s)" % (table, ",".join(cols), self.sql_placeholders(cols)))
+        s.executemany(sql, rows)
+
     def query_tuple(self, sql, params=None, limit=0):
         """ Runs the query given and returns the resultset
             as a tuple of tuples.
@@ -757,12 +1325,17 @@ class Database(object):
             else:
                 s.execute(sql)
             d = s.fetchall()
-            c.commit()
-            self.cursor_close(c, s)
+            self._commit(c)
             return d
         except Exception as err:
             asm3.al.error(str(err), "Database.query_tuple", self, sys.exc_info())
             asm3.al.error("failing sql: %s %s" % (sql, params), "Database.query_tuple", self)
+            try:
+                # An error can leave a connection in unusable state, 
+                # rollback so it is safe to use again.
+                self._rollback(c)
+            except:
+                pass
             raise err
         finally:
             try:
@@ -786,16 +1359,21 @@ class Database(object):
             else:
                 s.execute(sql)
             d = s.fetchall()
-            c.commit()
+            self._commit(c)
             # Build a list of the column names
             cn = []
             for col in s.description:
                 cn.append(col[0].upper())
-            self.cursor_close(c, s)
             return (d, cn)
         except Exception as err:
             asm3.al.error(str(err), "Database.query_tuple_columns", self, sys.exc_info())
             asm3.al.error("failing sql: %s %s" % (sql, params), "Database.query_tuple_columns", self)
+            try:
+                # An error can leave a connection in unusable state, 
+                # rollback so it is safe to use again.
+                self._rollback(c)
+            except:
+                pass
             raise err
         finally:
             try:
@@ -839,6 +1417,18 @@ class Database(object):
         except:
             return None
 
+    def rows_to_insert_sql(self, table, cols, rows, escapeCR = ""):
+        """
+        function that writes a single INSERT query for a list of rows, 
+        each a list of values in the same order as cols
+        """
+        values = []
+        for row in rows:
+            v = ",".join([ self.sql_value(x) for x in row ])
+            if escapeCR != "": v = v.replace("\n", escapeCR)
+            values.append("(%s)" % v)
+        return "INSERT INTO %s (%s) VALUES %s;\n" % (table, ",".join(cols), ",\n".join(values))
+
     def row_to_insert_sql(self, table, r, escapeCR = ""):
         """
         function that Writes an INSERT query for a result row
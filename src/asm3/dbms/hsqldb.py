@@ -8,6 +8,7 @@ class DatabaseHSQLDB(Database):
     type_datetime = "TIMESTAMP"
     type_integer = "INTEGER"
     type_float = "DOUBLE"
+    pool_connections = False # we never connect to HSQLDB
    
     def connect(self):
         # We can't connect to HSQL databases from Python. This class exists
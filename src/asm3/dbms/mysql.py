@@ -4,6 +4,7 @@ from .base import Database
 
 try:
     import MySQLdb
+    import MySQLdb.cursors
 except:
     pass
 
@@ -17,16 +18,27 @@ class DatabaseMySQL(Database):
 
     def connect(self):
         if self.password != "":
-            return MySQLdb.connect(host=self.host, port=self.port, user=self.username, passwd=self.password, db=self.database, charset="utf8", use_unicode=True)
+            c = MySQLdb.connect(host=self.host, port=self.port, user=self.username, passwd=self.password, db=self.database, charset="utf8", use_unicode=True)
         else:
-            return MySQLdb.connect(host=self.host, port=self.port, user=self.username, db=self.database, charset="utf8", use_unicode=True)
-
-    def cursor_open(self):
-        """ Overridden to apply timeout """
-        c, s = Database.cursor_open(self)
+            c = MySQLdb.connect(host=self.host, port=self.port, user=self.username, db=self.database, charset="utf8", use_unicode=True)
+        # Apply the timeout once for the session rather than every time a cursor is opened
         if self.timeout > 0: 
+            s = c.cursor()
             s.execute("SET SESSION max_execution_time=%d" % self.timeout)
-        return c, s
+            s.close()
+        return c
+
+    def connection_ping(self, c):
+        """ Returns True if connection c is still usable """
+        try:
+            c.ping()
+            return True
+        except:
+            return False
+
+    def cursor_stream(self, c):
+        """ Returns an unbuffered cursor that leaves the resultset on the server """
+        return c.cursor(MySQLdb.cursors.SSCursor)
 
     def ddl_add_index(self, name, table, column, unique = False, partial = False):
         u = ""
@@ -0,0 +1,166 @@
+
+"""
+Thread-safe pools of open database connections.
+
+One pool is kept per physical database (dbtype, host, port, username and
+database name), so every Database object returned by asm3.db.get_database
+for the same alias - or for different aliases that resolve to the same
+database - shares the same set of connections.
+"""
+
+import asm3.al
+
+import threading
+import time
+
+from asm3.sitedefs import DB_POOL_SIZE, DB_POOL_IDLE_TIMEOUT, DB_POOL_WAIT
+
+# If a connection has been sitting in the pool for longer than this
+# many seconds, make sure it still works before handing it out.
+PING_AFTER = 30
+
+class ConnectionPool(object):
+    """
+    A bounded pool of open connections to a single database.
+    At most maxsize connections can be checked out at once, callers
+    that go over that wait up to DB_POOL_WAIT seconds for one to be
+    returned.
+    """
+    def __init__(self, key, maxsize = DB_POOL_SIZE, idletimeout = DB_POOL_IDLE_TIMEOUT):
+        self.key = key
+        self.maxsize = maxsize
+        self.idletimeout = idletimeout
+        self.idle = [] # list of [connection, time returned to the pool]
+        self.checkedout = {} # id of each connection currently in use: the thread using it
+        self.cond = threading.Condition()
+
+    def acquire(self, dbo):
+        """
+        Returns an open connection for dbo, reusing an idle one if
+        possible. New connections are created with dbo.connect(),
+        which also applies any per-connection session settings.
+        """
+        c = None
+        lastused = 0
+        with self.cond:
+            self._evict_idle()
+            start = time.time()
+            while True:
+                if len(self.idle) > 0:
+                    c, lastused = self.idle.pop()
+                    break
+                if len(self.checkedout) < self.maxsize:
+                    break
+                remaining = DB_POOL_WAIT - (time.time() - start)
+                if remaining <= 0:
+                    raise PoolExhaustedError("no free connections in pool %s after %s seconds (size=%s)" % (self.key, DB_POOL_WAIT, self.maxsize))
+                self.cond.wait(remaining)
+            # Reserve our slot before releasing the lock so that we can connect
+            # outside it without another thread going over maxsize
+            reserved = object()
+            self.checkedout[id(reserved)] = threading.get_ident()
+        try:
+            if c is not None and time.time() - lastused > PING_AFTER and not dbo.connection_ping(c):
+                asm3.al.debug("discarding dead connection from pool %s" % self.key, "ConnectionPool.acquire", dbo)
+                self._close(c)
+                c = None
+            if c is None:
+                c = dbo.connect()
+        except:
+            with self.cond:
+                self.checkedout.pop(id(reserved), None)
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.checkedout.pop(id(reserved), None)
+            self.checkedout[id(c)] = threading.get_ident()
+        return c
+
+    def release(self, c, discard = False):
+        """
+        Returns connection c to the pool. If discard is True or the connection
+        has been closed, it is thrown away instead.
+        Only the thread that checked c out can release it. Releasing a connection
+        that is not checked out of this pool, or that has already been released
+        and checked out again by another thread, does nothing.
+        """
+        with self.cond:
+            if self.checkedout.get(id(c)) != threading.get_ident():
+                asm3.al.warn("ignoring release of connection not checked out by this thread from pool %s" % self.key, "ConnectionPool.release")
+                return
+            del self.checkedout[id(c)]
+            if not discard and not self._is_closed(c) and len(self.idle) < self.maxsize:
+                self.idle.append([c, time.time()])
+                c = None
+            self.cond.notify()
+        if c is not None:
+            self._close(c)
+
+    def close_all(self):
+        """ Closes all idle connections in the pool """
+        with self.cond:
+            idle = self.idle
+            self.idle = []
+        for c, dummy in idle:
+            self._close(c)
+
+    def stats(self):
+        """ Returns a dict of the number of connections idle and in use """
+        with self.cond:
+            return { "key": self.key, "idle": len(self.idle), "inuse": len(self.checkedout), "maxsize": self.maxsize }
+
+    def _evict_idle(self):
+        """ Closes connections that have been idle for longer than idletimeout.
+            Must be called with the lock held. """
+        if self.idletimeout <= 0: return
+        cutoff = time.time() - self.idletimeout
+        keep = []
+        for c, lastused in self.idle:
+            if lastused < cutoff:
+                self._close(c)
+            else:
+                keep.append([c, lastused])
+        self.idle = keep
+
+    def _close(self, c):
+        try:
+            c.close()
+        except:
+            pass
+
+    def _is_closed(self, c):
+        # psycopg2 exposes a closed attribute that is non-zero once the
+        # connection has gone away. Other drivers are checked on acquire.
+        try:
+            return getattr(c, "closed", 0) != 0
+        except:
+            return True
+
+class PoolExhaustedError(Exception):
+    pass
+
+pools = {}
+poolslock = threading.Lock()
+
+def get_pool_key(dbo):
+    """ Returns the key identifying the physical database dbo points at """
+    return "%s:%s:%s:%s:%s" % (dbo.dbtype, dbo.host, dbo.port, dbo.username, dbo.database)
+
+def get_pool(dbo):
+    """
+    Returns the pool for dbo's database, creating it if necessary.
+    Returns None if pooling is disabled or unsupported by dbo.
+    """
+    if DB_POOL_SIZE <= 0 or not dbo.pool_connections: return None
+    key = get_pool_key(dbo)
+    with poolslock:
+        if key not in pools:
+            pools[key] = ConnectionPool(key)
+        return pools[key]
+
+def close_all():
+    """ Closes all idle connections in all pools """
+    with poolslock:
+        allpools = list(pools.values())
+    for p in allpools:
+        p.close_all()
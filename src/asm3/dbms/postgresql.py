@@ -1,6 +1,9 @@
 
 import asm3.al
+import asm3.utils
 from .base import Database
+from asm3.sitedefs import DB_STREAM_BATCH_SIZE
+import io
 import os
 
 try:
@@ -25,14 +28,28 @@ class DatabasePostgreSQL(Database):
         else:
             c = psycopg2.connect(host=self.host, port=self.port, user=self.username, password=self.password, database=self.database)
         c.set_client_encoding("UTF8")
-        return c
-
-    def cursor_open(self):
-        """ Overridden to apply timeout """
-        c, s = Database.cursor_open(self)
+        # Apply the timeout once for the session rather than every time a cursor is opened
         if self.timeout > 0:
+            s = c.cursor()
             s.execute("SET statement_timeout=%d" % self.timeout)
-        return c, s
+            s.close()
+            c.commit()
+        return c
+
+    def connection_ping(self, c):
+        """ Returns True if connection c is still usable """
+        if c.closed != 0: return False
+        return Database.connection_ping(self, c)
+
+    def cursor_stream(self, c):
+        """ Returns a named cursor, which PostgreSQL keeps on the server """
+        s = c.cursor(name="asm_stream_%s" % asm3.utils.uuid_str().replace("-", ""))
+        s.itersize = DB_STREAM_BATCH_SIZE
+        return s
+
+    def copy_rows(self, s, table, cols, lines):
+        """ Loads lines in COPY text format with COPY """
+        s.copy_expert("COPY %s (%s) FROM STDIN" % (table, ",".join(cols)), io.StringIO("".join(lines)))
 
     def ddl_add_index(self, name, table, column, unique = False, partial = False):
         u = ""
@@ -69,6 +86,15 @@ class DatabasePostgreSQL(Database):
         asm3.al.debug("get_id: %s -> %d (sequence)" % (table, nextid), "DatabasePostgreSQL.get_id", self)
         return nextid
 
+    def get_ids(self, table, count):
+        """ Returns a block of count IDs for a table from its sequence in one query
+        """
+        if count <= 0: return []
+        ids = [ r[0] for r in self.query_tuple("SELECT nextval('seq_%s') FROM generate_series(1, %d)" % (table, count)) ]
+        self.update_asm2_primarykey(table, max(ids))
+        asm3.al.debug("get_ids: %s -> %d ids (sequence)" % (table, count), "DatabasePostgreSQL.get_ids", self)
+        return ids
+
     def install_stored_procedures(self):
         """ Extra PG report procedures to cast a value to date and integer while ignoring errors """
         self.execute_dbupdate(\
@@ -13,10 +13,19 @@ class DatabaseSQLite3(Database):
     type_datetime = "TIMESTAMP"
     type_integer = "INTEGER"
     type_float = "REAL"
+    pool_connections = False # connections cannot be shared between threads
+    max_params = 999 # SQLITE_MAX_VARIABLE_NUMBER for versions before 3.32
    
     def connect(self):
         return sqlite3.connect(self.database, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
 
+    def begin(self):
+        """ Opens the transaction explicitly, otherwise releasing the first
+            savepoint in it would commit everything so far """
+        Database.begin(self)
+        if not self.connection.in_transaction:
+            self._execute_transaction("BEGIN")
+
     def sql_greatest(self, items):
         """ SQLite does not have a GREATEST() function, MAX() should be used instead """
         return "MAX(%s)" % ",".join(items)
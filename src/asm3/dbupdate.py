@@ -15,8 +15,13 @@ import asm3.dbfs
 import asm3.smcom
 import asm3.utils
 from asm3.i18n import _
+from asm3.sitedefs import DB_DUMP_BATCH_SIZE, DB_DUMP_WORKERS
 
+import concurrent.futures
+import gzip
+import io
 import os, sys
+import tempfile
 
 VERSIONS = ( 
     2870, 3000, 3001, 3002, 3003, 3004, 3005, 3006, 3007, 3008, 3009, 3010, 3050,
@@ -37,18 +42,18 @@ VERSIONS = (
     34013, 34014, 34015, 34016, 34017, 34018, 34019, 34020, 34021, 34022, 34100,
     34101, 34102, 34103, 34104, 34105, 34106, 34107, 34108, 34109, 34110, 34111,
     34112, 34200, 34201, 34202, 34203, 34204, 34300, 34301, 34302, 34303, 34304,
-    34305, 34306, 34400, 34401, 34402, 34403, 34404, 34405, 34406, 34407
+    34305, 34306, 34400, 34401, 34402, 34403, 34404, 34405, 34406, 34407, 34408, 34409, 34410
 )
 
 LATEST_VERSION = VERSIONS[-1]
 
 # All ASM3 tables
-TABLES = ( "accounts", "accountsrole", "accountstrx", "additional", "additionalfield",
+TABLES = ( "accounts", "accountsbalance", "accountsrole", "accountstrx", "additional", "additionalfield",
     "adoption", "animal", "animalcontrol", "animalcontrolanimal", "animalcontrolrole", "animalcost", 
     "animaldiet", "animalfigures", "animalfiguresannual",  
     "animalfound", "animalcontrolanimal", "animallitter", "animallost", "animallostfoundmatch", 
     "animalmedical", "animalmedicaltreatment", "animalname", "animalpublished", 
-    "animaltype", "animaltest", "animaltransport", "animalvaccination", "animalwaitinglist", "audittrail", 
+    "animalpublishedfingerprint", "animaltype", "animaltest", "animaltransport", "animalvaccination", "animalwaitinglist", "audittrail", 
     "basecolour", "breed", "citationtype", "clinicappointment", "clinicinvoiceitem", "configuration", 
     "costtype", "customreport", "customreportrole", "dbfs", "deathreason", "deletion", "diary", 
     "diarytaskdetail", "diarytaskhead", "diet", "donationpayment", "donationtype", 
@@ -61,7 +66,7 @@ TABLES = ( "accounts", "accountsrole", "accountstrx", "additional", "additionalf
     "ownerlicence", "ownerlookingfor", "ownerrota", "ownertraploan", "ownervoucher", "pickuplocation", "publishlog", 
     "reservationstatus", "role", "site", "species", "stocklevel", "stocklocation", "stockusage", "stockusagetype", 
     "templatedocument", "templatehtml", "testtype", "testresult", "transporttype", "traptype", "userrole", "users", 
-    "vaccinationtype", "voucher" )
+    "usertoken", "vaccinationtype", "voucher" )
 
 # ASM2_COMPATIBILITY This is used for dumping tables in ASM2/HSQLDB format. 
 # These are the tables present in ASM2. users is not included due to the
@@ -78,9 +83,9 @@ TABLES_ASM2 = ( "accounts", "accountstrx", "additional", "additionalfield",
     "species", "vaccinationtype", "voucher" )
 
 # Tables that don't have an ID column (we don't create sequences for these tables for supporting dbs like postgres)
-TABLES_NO_ID_COLUMN = ( "accountsrole", "additional", "audittrail", "animalcontrolanimal", 
-    "animalcontrolrole", "animallostfoundmatch", "animalpublished", "configuration", "customreportrole", 
-    "deletion", "onlineformincoming", "ownerlookingfor", "userrole" )
+TABLES_NO_ID_COLUMN = ( "accountsbalance", "accountsrole", "additional", "audittrail", "animalcontrolanimal", 
+    "animalcontrolrole", "animallostfoundmatch", "animalpublished", "animalpublishedfingerprint", "configuration", 
+    "customreportrole", "deletion", "onlineformincoming", "ownerlookingfor", "userrole" )
 
 VIEWS = ( "v_adoption", "v_animal", "v_animalcontrol", "v_animalfound", "v_animallost", 
     "v_animalmedicaltreatment", "v_animaltest", "v_animalvaccination", "v_animalwaitinglist", 
@@ -133,6 +138,15 @@ def sql_structure(dbo):
     sql += index("accounts_CostTypeID", "accounts", "CostTypeID")
     sql += index("accounts_DonationTypeID", "accounts", "DonationTypeID")
  
+    sql += table("accountsbalance", (
+        fint("AccountID"),
+        fdate("BalanceMonth", True),
+        fint("Deposit"),
+        fint("Withdrawal"),
+        fint("ReconciledDeposit"),
+        fint("ReconciledWithdrawal") ), False)
+    sql += index("accountsbalance_AccountIDBalanceMonth", "accountsbalance", "AccountID, BalanceMonth")
+
     sql += table("accountsrole", (
         fint("AccountID"),
         fint("RoleID"),
@@ -153,6 +167,8 @@ def sql_structure(dbo):
     sql += index("accountstrx_TrxDate", "accountstrx", "TrxDate")
     sql += index("accountstrx_Source", "accountstrx", "SourceAccountID")
     sql += index("accountstrx_Dest", "accountstrx", "DestinationAccountID")
+    sql += index("accountstrx_SourceTrxDate", "accountstrx", "SourceAccountID, TrxDate")
+    sql += index("accountstrx_DestTrxDate", "accountstrx", "DestinationAccountID, TrxDate")
     sql += index("accountstrx_Cost", "accountstrx", "AnimalCostID")
     sql += index("accountstrx_Donation", "accountstrx", "OwnerDonationID")
 
@@ -662,6 +678,15 @@ def sql_structure(dbo):
     sql += index("animalpublished_AnimalIDPublishedTo", "animalpublished", "AnimalID,PublishedTo", True)
     sql += index("animalpublished_SentDate", "animalpublished", "SentDate")
 
+    sql += table("animalpublishedfingerprint", (
+        fint("AnimalID"),
+        fstr("PublishedTo"),
+        fstr("DataHash"),
+        fstr("ImageHash"),
+        fdate("SentDate") ), False)
+    sql += index("animalpublishedfingerprint_AnimalIDPublishedTo", "animalpublishedfingerprint", "AnimalID,PublishedTo", True)
+    sql += index("animalpublishedfingerprint_PublishedTo", "animalpublishedfingerprint", "PublishedTo")
+
     sql += table("animaltest", (
         fid(),
         fint("AnimalID"),
@@ -1542,6 +1567,16 @@ def sql_structure(dbo):
         fint("RoleID")), False)
     sql += index("userrole_UserIDRoleID", "userrole", "UserID, RoleID", True)
 
+    sql += table("usertoken", (
+        fid(),
+        fint("UserID"),
+        fstr("TokenHash"),
+        fstr("Description", True),
+        fdate("Expires", True),
+        fint("Revoked") ))
+    sql += index("usertoken_UserID", "usertoken", "UserID")
+    sql += index("usertoken_TokenHash", "usertoken", "TokenHash", True)
+
     sql += table("voucher", (
         fid(),
         fstr("VoucherName"),
@@ -2462,7 +2497,7 @@ def reinstall_default_data(dbo):
     database first, but leaves the configuration and dbfs tables intact.
     """
     for table in TABLES:
-        if table != "dbfs" and table != "configuration" and table != "users" and table != "role" and table != "userrole":
+        if table != "dbfs" and table != "configuration" and table != "users" and table != "role" and table != "userrole" and table != "usertoken":
             print("DELETE FROM %s" % table)
             dbo.execute_dbupdate("DELETE FROM %s" % table)
     install_default_data(dbo, True)
@@ -2567,7 +2602,7 @@ def install(dbo):
 
 def dump(dbo, includeConfig = True, includeDBFS = True, includeCustomReport = True, \
         includeNonASM2 = True, includeUsers = True, includeLKS = True, deleteDBV = False, deleteFirst = True, deleteViewSeq = False, \
-        escapeCR = "", uppernames = False, wrapTransaction = True):
+        escapeCR = "", uppernames = False, wrapTransaction = True, batchSize = DB_DUMP_BATCH_SIZE, copyFormat = False, workers = DB_DUMP_WORKERS):
     """
     Dumps all of the data in the database as DELETE/INSERT statements.
     includeConfig - include the config table
@@ -2581,33 +2616,82 @@ def dump(dbo, includeConfig = True, includeDBFS = True, includeCustomReport = Tr
     escapeCR - A substitute for any \n characters found in values
     uppernames - upper case table names in the output
     wrapTransaction - wrap a transaction around the dump
+    batchSize - number of rows in each INSERT statement (1 for single row INSERTs)
+    copyFormat - write the rows as PostgreSQL COPY blocks instead of INSERTs
+    workers - dump this many tables at once in separate threads
 
-    This is a generator function to save memory.
+    This is a generator function to save memory. Tables are read with
+    streaming queries. When workers > 1, each table is written to a 
+    temporary file and the files are output in table order.
     """
-    if wrapTransaction: yield "BEGIN;\n"
+    tables = []
     for t in TABLES:
         if not includeDBFS and t == "dbfs": continue
         if not includeCustomReport and t == "customreport": continue
         if not includeConfig and t == "configuration": continue
-        if not includeUsers and (t == "users" or t == "userrole" or t == "role" or t == "accountsrole" or t == "customreportrole"): continue
+        if not includeUsers and (t == "users" or t == "userrole" or t == "usertoken" or t == "role" or t == "accountsrole" or t == "customreportrole"): continue
         if not includeLKS and t.startswith("lks"): continue
         # ASM2_COMPATIBILITY
         if not includeNonASM2 and t not in TABLES_ASM2 : continue
+        tables.append(t)
+    def table(t):
         outtable = t
         if uppernames: outtable = t.upper()
-        if deleteFirst: 
-            yield "DELETE FROM %s;\n" % outtable
-        try:
-            sys.stderr.write("dumping %s.., \n" % t)
-            for x in dbo.query_to_insert_sql("SELECT * FROM %s" % t, outtable, escapeCR):
-                yield x
-        except:
-            em = str(sys.exc_info())
-            sys.stderr.write("%s: WARN: %s\n" % (t, em))
+        return dump_table(dbo, t, outtable, deleteFirst, escapeCR, batchSize, copyFormat)
+    if wrapTransaction: yield "BEGIN;\n"
+    if workers > 1:
+        for x in dump_parallel(tables, table, workers): yield x
+    else:
+        for t in tables:
+            for x in table(t): yield x
     if deleteViewSeq: yield "DELETE FROM configuration WHERE ItemName LIKE 'DBViewSeqVersion';\n"
     if deleteDBV: yield "DELETE FROM configuration WHERE ItemName LIKE 'DBV';\n"
     if wrapTransaction: yield "COMMIT;\n"
 
+def dump_table(dbo, table, outtable, deleteFirst = True, escapeCR = "", batchSize = DB_DUMP_BATCH_SIZE, copyFormat = False):
+    """
+    Dumps the rows of a table as multi-row INSERT statements (or
+    COPY blocks if copyFormat is set), preceded by a DELETE FROM 
+    if deleteFirst is set. Generator function.
+    """
+    if deleteFirst: 
+        yield "DELETE FROM %s;\n" % outtable
+    try:
+        sys.stderr.write("dumping %s.., \n" % table)
+        if copyFormat:
+            for x in dbo.query_to_copy("SELECT * FROM %s" % table, outtable, batchSize):
+                yield x
+        else:
+            for x in dbo.query_to_insert_batches("SELECT * FROM %s" % table, outtable, escapeCR, batchSize):
+                yield x
+    except:
+        em = str(sys.exc_info())
+        sys.stderr.write("%s: WARN: %s\n" % (table, em))
+
+def dump_parallel(items, fn, workers):
+    """
+    Calls the generator function fn for each of items in up to workers 
+    threads, spooling the output of each to a temporary file, and
+    yields the output in the same order as items.
+    """
+    def spool(item):
+        f = tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
+        for x in fn(item):
+            f.write(x)
+        f.seek(0)
+        return f
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ ex.submit(spool, x) for x in items ]
+        for future in futures:
+            f = future.result()
+            try:
+                while True:
+                    chunk = f.read(65536)
+                    if chunk == "": break
+                    yield chunk
+            finally:
+                f.close()
+
 def dump_dbfs_base64(dbo):
     """
     Generator function that dumps the DBFS table, reading every single
@@ -2615,8 +2699,7 @@ def dump_dbfs_base64(dbo):
     This can be used to get an old style dbfs from newer storage mechanisms for export.
     """
     yield "DELETE FROM dbfs;\n"
-    rows = dbo.query("SELECT ID, Name, Path FROM dbfs ORDER BY ID")
-    for r in rows:
+    for r in dbo.query_stream("SELECT ID, Name, Path FROM dbfs ORDER BY ID"):
         content = ""
         url = ""
         # Only try and read the dbfs file if it has an extension and is actually a file
@@ -2635,12 +2718,13 @@ def dump_dbfs_base64(dbo):
 def dump_hsqldb(dbo, includeDBFS = True):
     """
     Produces a dump in hsqldb format for use with ASM2
-    generator function.
+    generator function. HSQLDB scripts have one statement per line,
+    so rows are written as single row INSERTs with line breaks removed.
     """
     # ASM2_COMPATIBILITY
     hdbo = asm3.db.get_dbo("HSQLDB")
     yield sql_structure(hdbo)
-    for x in dump(dbo, includeNonASM2 = False, includeDBFS = includeDBFS, escapeCR = " ", includeUsers = False, wrapTransaction = False):
+    for x in dump(dbo, includeNonASM2 = False, includeDBFS = includeDBFS, escapeCR = " ", includeUsers = False, wrapTransaction = False, batchSize = 1):
         yield x
     yield "DELETE FROM users;\n"
     yield "INSERT INTO users (ID, UserName, RealName, Password, SuperUser, OwnerID, SecurityMap, RecordVersion) VALUES " \
@@ -2648,24 +2732,24 @@ def dump_hsqldb(dbo, includeDBFS = True):
     yield "DELETE FROM configuration WHERE ItemName LIKE 'DatabaseVersion' OR ItemName LIKE 'SMDBLocked';\n"
     yield "INSERT INTO configuration (ItemName, ItemValue) VALUES ('DatabaseVersion', '2870');\n"
 
-def dump_smcom(dbo):
+def dump_smcom(dbo, copyFormat = False, workers = DB_DUMP_WORKERS):
     """
     Dumps the database in a convenient format for import to sheltermanager.com
     generator function.
     """
-    for x in dump(dbo, includeDBFS = False, includeConfig = False, includeUsers = True, includeLKS = False, deleteDBV = True, deleteViewSeq = True, wrapTransaction = True):
+    for x in dump(dbo, includeDBFS = False, includeConfig = False, includeUsers = True, includeLKS = False, deleteDBV = True, deleteViewSeq = True, wrapTransaction = True, \
+            copyFormat = copyFormat, workers = workers):
         yield x
 
-def dump_merge(dbo, deleteViewSeq = True):
+def dump_merge(dbo, deleteViewSeq = True, batchSize = DB_DUMP_BATCH_SIZE):
     """
     Produces a special type of dump - it renumbers the IDs into a higher range 
     so that they can be inserted into another database.
+    generator function, rows are written in multi-row INSERTs of batchSize.
     """
     ID_OFFSET = 100000
-    s = []
-    def fix_and_dump(table, fields):
-        rows = dbo.query("SELECT * FROM %s" % table)
-        for r in rows:
+    def fix(table, fields):
+        for r in dbo.query_stream("SELECT * FROM %s" % table):
             # Add ID_OFFSET to all ID fields in the rows
             for f in fields:
                 f = f.upper()
@@ -2677,56 +2761,164 @@ def dump_merge(dbo, deleteViewSeq = True):
             # Make any lookup values we copy over inactive
             if "ISRETIRED" in r: 
                 r.ISRETIRED = 1 
-            s.append(dbo.row_to_insert_sql(table, r, escapeCR = ""))
-
-    fix_and_dump("additional", [ "AdditionalFieldID", "LinkID" ])
-    fix_and_dump("additionalfield", [ "ID" ])
-    fix_and_dump("adoption", [ "ID", "AnimalID", "AdoptionNumber", "OwnerID", "RetailerID", "OriginalRetailerMovementID" ])
-    fix_and_dump("animal", [ "ID", "AnimalTypeID", "ShelterLocation", "ShelterCode", "BondedAnimalID", "BondedAnimal2ID", "OwnersVetID", "CurrentVetID", "OriginalOwnerID", "BroughtInByOwnerID", "ActiveMovementID" ])
-    fix_and_dump("animalcontrol", [ "ID", "CallerID", "VictimID", "OwnerID", "Owner2ID", "Owner3ID" ])
-    fix_and_dump("animalcontrolanimal", [ "AnimalID", "AnimalControlID" ])
-    fix_and_dump("animalcost", [ "ID", "AnimalID", "CostTypeID" ])
-    fix_and_dump("costtype", [ "ID", ])
-    fix_and_dump("animaldiet", [ "ID", "AnimalID" ])
-    fix_and_dump("animalfound", [ "ID", "OwnerID" ])
-    fix_and_dump("animallitter", [ "ID", "ParentAnimalID" ])
-    fix_and_dump("animallost", [ "ID", "OwnerID" ])
-    fix_and_dump("animalmedical", [ "ID", "AnimalID", "MedicalProfileID" ])
-    fix_and_dump("animalmedicaltreatment", [ "ID", "AnimalID", "AnimalMedicalID" ])
-    fix_and_dump("animalpublished", [ "AnimalID" ])
-    fix_and_dump("animaltest", [ "ID", "AnimalID", "TestTypeID", "TestResultID" ])
-    fix_and_dump("animaltype", [ "ID", ])
-    fix_and_dump("animaltransport", [ "ID", "AnimalID", "DriverOwnerID", "PickupOwnerID", "DropoffOwnerID" ])
-    fix_and_dump("animalvaccination", [ "ID", "AnimalID", "VaccinationID" ])
-    fix_and_dump("animalwaitinglist", [ "ID", "OwnerID" ])
-    fix_and_dump("diary", [ "ID", "LinkID" ])
-    fix_and_dump("internallocation", [ "ID", ])
-    fix_and_dump("lkanimalflags", [ "ID", ])
-    fix_and_dump("lkownerflags", [ "ID", ])
-    fix_and_dump("lkworktype", [ "ID", ])
-    fix_and_dump("log", [ "ID", "LinkID" ])
-    fix_and_dump("medicalprofile", [ "ID" ])
-    fix_and_dump("owner", [ "ID", "HomeCheckedBy" ])
-    fix_and_dump("ownercitation", [ "ID", "OwnerID", "AnimalControlID" ])
-    fix_and_dump("ownerdonation", [ "ID", "AnimalID", "OwnerID", "MovementID", "DonationTypeID" ])
-    fix_and_dump("donationtype", [ "ID", ])
-    fix_and_dump("ownerinvestigation", [ "ID", "OwnerID" ])
-    fix_and_dump("ownerlicence", [ "ID", "OwnerID", "AnimalID", "LicenceTypeID" ])
-    fix_and_dump("licencetype", [ "ID", ])
-    fix_and_dump("ownerrota", [ "ID", "OwnerID" ])
-    fix_and_dump("ownertraploan", [ "ID", "OwnerID" ])
-    fix_and_dump("ownervoucher", [ "ID", "OwnerID", "VoucherID" ])
-    fix_and_dump("stocklevel", [ "ID", "StockLocationID" ])
-    fix_and_dump("stocklocation", [ "ID", ])
-    fix_and_dump("stockusage", [ "ID", "StockLevelID" ])
-    fix_and_dump("templatedocument", [ "ID", ])
-    fix_and_dump("templatehtml", [ "ID", ])
-    fix_and_dump("testtype", [ "ID", ])
-    fix_and_dump("testresult", [ "ID", ])
-    fix_and_dump("vaccinationtype", [ "ID", ])
-    fix_and_dump("voucher", [ "ID", ])
-    if deleteViewSeq: s.append("DELETE FROM configuration WHERE ItemName LIKE 'DBViewSeqVersion';\n")
-    return "".join(s)
+            yield r
+
+    def fix_and_dump(table, fields):
+        cols = None
+        batch = []
+        for r in fix(table, fields):
+            if cols is None: cols = sorted(r.keys())
+            batch.append([ r[k] for k in cols ])
+            if len(batch) >= batchSize:
+                yield dbo.rows_to_insert_sql(table, cols, batch)
+                batch = []
+        if len(batch) > 0:
+            yield dbo.rows_to_insert_sql(table, cols, batch)
+
+    merges = [
+        ("additional", [ "AdditionalFieldID", "LinkID" ]),
+        ("additionalfield", [ "ID" ]),
+        ("adoption", [ "ID", "AnimalID", "AdoptionNumber", "OwnerID", "RetailerID", "OriginalRetailerMovementID" ]),
+        ("animal", [ "ID", "AnimalTypeID", "ShelterLocation", "ShelterCode", "BondedAnimalID", "BondedAnimal2ID", "OwnersVetID", "CurrentVetID", "OriginalOwnerID", "BroughtInByOwnerID", "ActiveMovementID" ]),
+        ("animalcontrol", [ "ID", "CallerID", "VictimID", "OwnerID", "Owner2ID", "Owner3ID" ]),
+        ("animalcontrolanimal", [ "AnimalID", "AnimalControlID" ]),
+        ("animalcost", [ "ID", "AnimalID", "CostTypeID" ]),
+        ("costtype", [ "ID", ]),
+        ("animaldiet", [ "ID", "AnimalID" ]),
+        ("animalfound", [ "ID", "OwnerID" ]),
+        ("animallitter", [ "ID", "ParentAnimalID" ]),
+        ("animallost", [ "ID", "OwnerID" ]),
+        ("animalmedical", [ "ID", "AnimalID", "MedicalProfileID" ]),
+        ("animalmedicaltreatment", [ "ID", "AnimalID", "AnimalMedicalID" ]),
+        ("animalpublished", [ "AnimalID" ]),
+        ("animaltest", [ "ID", "AnimalID", "TestTypeID", "TestResultID" ]),
+        ("animaltype", [ "ID", ]),
+        ("animaltransport", [ "ID", "AnimalID", "DriverOwnerID", "PickupOwnerID", "DropoffOwnerID" ]),
+        ("animalvaccination", [ "ID", "AnimalID", "VaccinationID" ]),
+        ("animalwaitinglist", [ "ID", "OwnerID" ]),
+        ("diary", [ "ID", "LinkID" ]),
+        ("internallocation", [ "ID", ]),
+        ("lkanimalflags", [ "ID", ]),
+        ("lkownerflags", [ "ID", ]),
+        ("lkworktype", [ "ID", ]),
+        ("log", [ "ID", "LinkID" ]),
+        ("medicalprofile", [ "ID" ]),
+        ("owner", [ "ID", "HomeCheckedBy" ]),
+        ("ownercitation", [ "ID", "OwnerID", "AnimalControlID" ]),
+        ("ownerdonation", [ "ID", "AnimalID", "OwnerID", "MovementID", "DonationTypeID" ]),
+        ("donationtype", [ "ID", ]),
+        ("ownerinvestigation", [ "ID", "OwnerID" ]),
+        ("ownerlicence", [ "ID", "OwnerID", "AnimalID", "LicenceTypeID" ]),
+        ("licencetype", [ "ID", ]),
+        ("ownerrota", [ "ID", "OwnerID" ]),
+        ("ownertraploan", [ "ID", "OwnerID" ]),
+        ("ownervoucher", [ "ID", "OwnerID", "VoucherID" ]),
+        ("stocklevel", [ "ID", "StockLocationID" ]),
+        ("stocklocation", [ "ID", ]),
+        ("stockusage", [ "ID", "StockLevelID" ]),
+        ("templatedocument", [ "ID", ]),
+        ("templatehtml", [ "ID", ]),
+        ("testtype", [ "ID", ]),
+        ("testresult", [ "ID", ]),
+        ("vaccinationtype", [ "ID", ]),
+        ("voucher", [ "ID", ])
+    ]
+    for table, fields in merges:
+        for x in fix_and_dump(table, fields): yield x
+    if deleteViewSeq: yield "DELETE FROM configuration WHERE ItemName LIKE 'DBViewSeqVersion';\n"
+
+def write_dump(dump, f, compress = False):
+    """
+    Writes the output of one of the dump generator functions to the 
+    binary file f as UTF-8, gzip compressing it as it goes if compress is set.
+    """
+    if compress: 
+        f = gzip.GzipFile(fileobj=f, mode="wb")
+    try:
+        for x in dump:
+            f.write(x.encode("utf-8"))
+    finally:
+        if compress: f.close()
+
+def read_dump(f):
+    """
+    Returns a text file for reading the dump in binary file f, 
+    decompressing it if it is gzipped.
+    """
+    f = io.BufferedReader(f) if not hasattr(f, "peek") else f
+    if f.peek(2)[:2] == b"\x1f\x8b":
+        f = gzip.GzipFile(fileobj=f, mode="rb")
+    return io.TextIOWrapper(f, encoding="utf-8", newline="")
+
+def read_statements(f):
+    """
+    Reads the statements in a dump from text file f. Generator function 
+    that yields (sql, None) for each statement and (copy header, lines) 
+    for each COPY block. Statements end with a semi-colon at the end 
+    of a line outside a quoted string.
+    """
+    lines = []
+    instr = False
+    copy = None
+    for line in f:
+        if copy is not None:
+            if line == "\\.\n" or line == "\\.":
+                yield (copy, lines)
+                copy = None
+                lines = []
+            else:
+                lines.append(line)
+            continue
+        if not instr and len(lines) == 0 and line.startswith("COPY "):
+            copy = line.strip()
+            continue
+        lines.append(line)
+        if line.count("'") % 2 == 1: instr = not instr
+        if not instr and line.rstrip().endswith(";"):
+            yield ("".join(lines).strip(), None)
+            lines = []
+    if len(lines) > 0 and "".join(lines).strip() != "":
+        yield ("".join(lines).strip(), None)
+
+def load(dbo, f, commitEvery = 0):
+    """
+    Bulk loads a dump produced by dump (or dump_smcom, dump_merge, etc) 
+    from text file f. INSERT statements are run as they are, COPY blocks
+    are loaded with COPY on PostgreSQL and executemany on everything else.
+    The load runs in one transaction that is committed at the COMMIT 
+    statement in the dump (or the end of it), so if it fails part way 
+    nothing is changed. 
+    commitEvery: If non-zero, also commit every commitEvery statements or 
+        COPY blocks. A failure then leaves the tables loaded so far.
+    Returns the number of statements and COPY blocks loaded.
+    """
+    c, s = dbo.cursor_open()
+    loaded = 0
+    try:
+        for sql, lines in read_statements(f):
+            if lines is None:
+                if sql.upper() == "BEGIN;": continue
+                if sql.upper() == "COMMIT;":
+                    c.commit()
+                    asm3.al.debug("committed %d statements" % loaded, "dbupdate.load", dbo)
+                    continue
+                s.execute(sql)
+            else:
+                table, cols = sql[len("COPY "):sql.find(" FROM stdin")].split(" ", 1)
+                cols = [ x.strip() for x in cols.strip("()").split(",") ]
+                dbo.copy_rows(s, table, cols, lines)
+            loaded += 1
+            if commitEvery > 0 and loaded % commitEvery == 0: 
+                c.commit()
+                asm3.al.debug("committed %d statements" % loaded, "dbupdate.load", dbo)
+        c.commit()
+        return loaded
+    except Exception as err:
+        asm3.al.error("failed loading dump after %d statements: %s" % (loaded, err), "dbupdate.load", dbo, sys.exc_info())
+        c.rollback()
+        raise
+    finally:
+        dbo.cursor_close(c, s)
 
 def diagnostic(dbo):
     """
@@ -2808,10 +3000,10 @@ def reset_db(dbo):
     """
     Resets a database by removing all data from non-lookup tables.
     """
-    deltables = [ "accountstrx", "additional", "adoption", "animal", "animalcontrol", "animalcost",
+    deltables = [ "accountsbalance", "accountstrx", "additional", "adoption", "animal", "animalcontrol", "animalcost",
         "animaldiet", "animalfigures", "animalfiguresannual", 
         "animalfound", "animallitter", "animallost", "animalmedical", "animalmedicaltreatment", "animalname",
-        "animaltest", "animaltransport", "animalvaccination", "animalwaitinglist", "diary", "log",
+        "animalpublishedfingerprint", "animaltest", "animaltransport", "animalvaccination", "animalwaitinglist", "diary", "log",
         "media", "messages", "owner", "ownercitation", "ownerdonation", "ownerinvestigation", "ownerlicence", 
         "ownertraploan", "ownervoucher", "stocklevel", "stockusage" ]
     for t in deltables:
@@ -5255,3 +5447,52 @@ def update_34407(dbo):
         "(SELECT JurisdictionID FROM owner WHERE ID = animal.BroughtInByOwnerID) WHERE JurisdictionID Is Null")
     dbo.execute_dbupdate("UPDATE animal SET JurisdictionID = 0 WHERE JurisdictionID Is Null")
 
+def update_34408(dbo):
+    # Add usertoken table for service API tokens
+    fields = ",".join([
+        dbo.ddl_add_table_column("ID", dbo.type_integer, False, pk=True),
+        dbo.ddl_add_table_column("UserID", dbo.type_integer, False),
+        dbo.ddl_add_table_column("TokenHash", dbo.type_shorttext, False),
+        dbo.ddl_add_table_column("Description", dbo.type_shorttext, True),
+        dbo.ddl_add_table_column("Expires", dbo.type_datetime, True),
+        dbo.ddl_add_table_column("Revoked", dbo.type_integer, False),
+        dbo.ddl_add_table_column("RecordVersion", dbo.type_integer, True),
+        dbo.ddl_add_table_column("CreatedBy", dbo.type_shorttext, False),
+        dbo.ddl_add_table_column("CreatedDate", dbo.type_datetime, False),
+        dbo.ddl_add_table_column("LastChangedBy", dbo.type_shorttext, False),
+        dbo.ddl_add_table_column("LastChangedDate", dbo.type_datetime, False)
+    ])
+    dbo.execute_dbupdate( dbo.ddl_add_table("usertoken", fields) )
+    dbo.execute_dbupdate( dbo.ddl_add_index("usertoken_UserID", "usertoken", "UserID") )
+    dbo.execute_dbupdate( dbo.ddl_add_index("usertoken_TokenHash", "usertoken", "TokenHash", True) )
+
+def update_34409(dbo):
+    # Add accountsbalance table of monthly totals for calculating account balances
+    fields = ",".join([
+        dbo.ddl_add_table_column("AccountID", dbo.type_integer, False),
+        dbo.ddl_add_table_column("BalanceMonth", dbo.type_datetime, True),
+        dbo.ddl_add_table_column("Deposit", dbo.type_integer, False),
+        dbo.ddl_add_table_column("Withdrawal", dbo.type_integer, False),
+        dbo.ddl_add_table_column("ReconciledDeposit", dbo.type_integer, False),
+        dbo.ddl_add_table_column("ReconciledWithdrawal", dbo.type_integer, False)
+    ])
+    dbo.execute_dbupdate( dbo.ddl_add_table("accountsbalance", fields) )
+    add_index(dbo, "accountsbalance_AccountIDBalanceMonth", "accountsbalance", "AccountID, BalanceMonth")
+    # Index transactions by account and date for summing the part of a month not in accountsbalance
+    add_index(dbo, "accountstrx_SourceTrxDate", "accountstrx", "SourceAccountID, TrxDate")
+    add_index(dbo, "accountstrx_DestTrxDate", "accountstrx", "DestinationAccountID, TrxDate")
+    # Build it from the existing transactions
+    asm3.financial.rebuild_balance_index(dbo)
+
+def update_34410(dbo):
+    # Add animalpublishedfingerprint table of what was last sent to each publisher
+    fields = ",".join([
+        dbo.ddl_add_table_column("AnimalID", dbo.type_integer, False),
+        dbo.ddl_add_table_column("PublishedTo", dbo.type_shorttext, False),
+        dbo.ddl_add_table_column("DataHash", dbo.type_shorttext, False),
+        dbo.ddl_add_table_column("ImageHash", dbo.type_shorttext, False),
+        dbo.ddl_add_table_column("SentDate", dbo.type_datetime, False)
+    ])
+    dbo.execute_dbupdate( dbo.ddl_add_table("animalpublishedfingerprint", fields) )
+    add_index(dbo, "animalpublishedfingerprint_AnimalIDPublishedTo", "animalpublishedfingerprint", "AnimalID, PublishedTo", True)
+    add_index(dbo, "animalpublishedfingerprint_PublishedTo", "animalpublishedfingerprint", "PublishedTo")
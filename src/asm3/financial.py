@@ -8,6 +8,7 @@ import asm3.paymentprocessor.paypal
 import asm3.paymentprocessor.stripeh
 import asm3.utils
 
+import datetime
 import sys
 
 BANK = 1
@@ -165,10 +166,10 @@ def get_accounts(dbo, onlyactive = False, onlybank = False, onlyexpense = False,
     onlyexpense: If set to true, only accounts with ACCOUNTTYPE = 4 are returned
     """
     l = dbo.locale
-    pfilter = ""
+    periodstart = None
     aperiod = asm3.configuration.accounting_period(dbo)
     if aperiod != "":
-        pfilter = " AND TrxDate >= %s" % dbo.sql_date(asm3.i18n.display2python(l, aperiod), wrapParens=True, includeTime=False)
+        periodstart = asm3.i18n.display2python(l, aperiod)
     afilter = ""
     if onlyactive:
         afilter = "AND a.Archived = 0"
@@ -183,25 +184,15 @@ def get_accounts(dbo, onlyactive = False, onlybank = False, onlyexpense = False,
         ifilter = "AND a.AccountType = %d" % INCOME
     roles = dbo.query("SELECT ar.*, r.RoleName FROM accountsrole ar INNER JOIN role r ON ar.RoleID = r.ID")
     accounts = dbo.query("SELECT a.*, at.AccountType AS AccountTypeName, " \
-        "dt.DonationName, " \
-        "(SELECT SUM(Amount) FROM accountstrx WHERE DestinationAccountID = a.ID%s) AS dest," \
-        "(SELECT SUM(Amount) FROM accountstrx WHERE SourceAccountID = a.ID%s) AS src," \
-        "(SELECT SUM(Amount) FROM accountstrx WHERE Reconciled = 1 AND DestinationAccountID = a.ID%s) AS recdest," \
-        "(SELECT SUM(Amount) FROM accountstrx WHERE Reconciled = 1 AND SourceAccountID = a.ID%s) AS recsrc " \
+        "dt.DonationName " \
         "FROM accounts a " \
         "INNER JOIN lksaccounttype at ON at.ID = a.AccountType " \
         "LEFT OUTER JOIN donationtype dt ON dt.ID = a.DonationTypeID " \
         "WHERE a.ID > 0 %s %s %s %s " \
-        "ORDER BY a.AccountType, a.Code" % (pfilter, pfilter, pfilter, pfilter, afilter, bfilter, efilter, ifilter))
+        "ORDER BY a.AccountType, a.Code" % (afilter, bfilter, efilter, ifilter))
+    totals = get_account_totals(dbo, periodstart)
     for a in accounts:
-        dest = a.dest
-        src = a.src
-        recdest = a.recdest
-        recsrc = a.recsrc
-        if dest is None: dest = 0
-        if src is None: src = 0
-        if recdest is None: recdest = 0
-        if recsrc is None: recsrc = 0
+        dest, src, recdest, recsrc = totals.get(a.id, (0, 0, 0, 0))
         a.balance = dest - src
         a.reconciled = recdest - recsrc
         if a.accounttype == INCOME or a.accounttype == EXPENSE:
@@ -228,25 +219,31 @@ def get_balance_to_date(dbo, accountid, todate, reconciled=BOTH):
     """
     Returns the balance of accountid to todate.
     reconciled: One of RECONCILED, NONRECONCILED or BOTH to indicate the transactions to include in the balance.
+    The monthly totals in the balance index are used for every month before todate's month,
+    so only the transactions from the start of that month are summed from accountstrx.
     """
     aid = int(accountid)
+    month = month_start(todate)
     recfilter = ""
+    deposit = "Deposit"
+    withdrawal = "Withdrawal"
     if reconciled == RECONCILED:
         recfilter = " AND Reconciled = 1"
+        deposit = "ReconciledDeposit"
+        withdrawal = "ReconciledWithdrawal"
     elif reconciled == NONRECONCILED:
         recfilter = " AND Reconciled = 0"
+        deposit = "Deposit - ReconciledDeposit"
+        withdrawal = "Withdrawal - ReconciledWithdrawal"
     r = dbo.first_row( dbo.query("SELECT a.AccountType, " \
-        "(SELECT SUM(Amount) FROM accountstrx WHERE SourceAccountID = a.ID AND TrxDate < ? %s) AS withdrawal," \
-        "(SELECT SUM(Amount) FROM accountstrx WHERE DestinationAccountID = a.ID AND TrxDate < ? %s) AS deposit " \
+        "(SELECT SUM(%s) FROM accountsbalance WHERE AccountID = a.ID AND BalanceMonth < ?) AS monthdeposit," \
+        "(SELECT SUM(%s) FROM accountsbalance WHERE AccountID = a.ID AND BalanceMonth < ?) AS monthwithdrawal," \
+        "(SELECT SUM(Amount) FROM accountstrx WHERE SourceAccountID = a.ID AND TrxDate >= ? AND TrxDate < ? %s) AS withdrawal," \
+        "(SELECT SUM(Amount) FROM accountstrx WHERE DestinationAccountID = a.ID AND TrxDate >= ? AND TrxDate < ? %s) AS deposit " \
         "FROM accounts a " \
-        "WHERE a.ID = ?" % (recfilter, recfilter), (todate, todate, aid)) )
-    deposit = r.deposit
-    withdrawal = r.withdrawal
-    if deposit is None: deposit = 0
-    if withdrawal is None: withdrawal = 0
-    balance = deposit - withdrawal
-    #if r.accounttype == INCOME or r.accounttype == EXPENSE: balance = abs(balance)
-    return balance
+        "WHERE a.ID = ?" % (deposit, withdrawal, recfilter, recfilter), (month, month, month, todate, month, todate, aid)) )
+    if r is None: return 0
+    return (r.monthdeposit or 0) - (r.monthwithdrawal or 0) + (r.deposit or 0) - (r.withdrawal or 0)
 
 def get_balance_fromto_date(dbo, accountid, fromdate, todate, reconciled=BOTH):
     """
@@ -254,31 +251,154 @@ def get_balance_fromto_date(dbo, accountid, fromdate, todate, reconciled=BOTH):
     reconciled: One of RECONCILED, NONRECONCILED or BOTH to indicate the transactions to include in the balance.
     """
     aid = int(accountid)
+    if month_start(fromdate) == month_start(todate):
+        return get_trx_balance(dbo, aid, fromdate, todate, reconciled)
+    return get_balance_to_date(dbo, aid, todate, reconciled) - get_balance_to_date(dbo, aid, fromdate, reconciled)
+
+def get_trx_balance(dbo, accountid, fromdate, todate, reconciled=BOTH):
+    """
+    Returns the balance of the transactions for accountid from fromdate to todate,
+    summed from the accountstrx table.
+    """
     recfilter = ""
     if reconciled == RECONCILED:
         recfilter = " AND Reconciled = 1"
     elif reconciled == NONRECONCILED:
         recfilter = " AND Reconciled = 0"
-    r = dbo.first_row( dbo.query("SELECT a.AccountType, " \
-        "(SELECT SUM(Amount) FROM accountstrx WHERE SourceAccountID = a.ID AND TrxDate >= ? AND TrxDate < ? %s) AS withdrawal," \
-        "(SELECT SUM(Amount) FROM accountstrx WHERE DestinationAccountID = a.ID AND TrxDate >= ? AND TrxDate < ? %s) AS deposit " \
-        "FROM accounts a " \
-        "WHERE a.ID = ?" % (recfilter, recfilter), (fromdate, todate, fromdate, todate, aid)) )
-    deposit = r.deposit
-    withdrawal = r.withdrawal
-    if deposit is None: deposit = 0
-    if withdrawal is None: withdrawal = 0
-    balance = deposit - withdrawal
-    #if r.accounttype == INCOME or r.accounttype == EXPENSE: balance = abs(balance)
-    return balance
+    r = dbo.first_row( dbo.query("SELECT " \
+        "(SELECT SUM(Amount) FROM accountstrx WHERE SourceAccountID = ? AND TrxDate >= ? AND TrxDate < ? %s) AS withdrawal," \
+        "(SELECT SUM(Amount) FROM accountstrx WHERE DestinationAccountID = ? AND TrxDate >= ? AND TrxDate < ? %s) AS deposit " \
+        "FROM accounts WHERE ID = ?" % (recfilter, recfilter), (accountid, fromdate, todate, accountid, fromdate, todate, accountid)) )
+    if r is None: return 0
+    return (r.deposit or 0) - (r.withdrawal or 0)
+
+def get_account_totals(dbo, fromdate = None):
+    """
+    Returns a dictionary of account ID to a tuple of the (deposit, withdrawal, 
+    reconciled deposit, reconciled withdrawal) totals for all transactions
+    on or after fromdate (or all transactions if fromdate is None).
+    Whole months are read from the balance index, if fromdate is part way
+    through a month the transactions before it in that month are taken off.
+    """
+    totals = {}
+    def add(accountid, values, sign = 1):
+        t = totals.get(accountid, (0, 0, 0, 0))
+        totals[accountid] = tuple( x + (sign * (y or 0)) for x, y in zip(t, values) )
+    mfilter = ""
+    params = []
+    if fromdate is not None:
+        mfilter = "WHERE BalanceMonth >= ?"
+        params = [ month_start(fromdate) ]
+    for r in dbo.query("SELECT AccountID, SUM(Deposit) AS deposit, SUM(Withdrawal) AS withdrawal, " \
+        "SUM(ReconciledDeposit) AS recdeposit, SUM(ReconciledWithdrawal) AS recwithdrawal " \
+        "FROM accountsbalance %s GROUP BY AccountID" % mfilter, params):
+        add(r.accountid, (r.deposit, r.withdrawal, r.recdeposit, r.recwithdrawal))
+    if fromdate is not None and fromdate != month_start(fromdate):
+        rows = dbo.query("SELECT SourceAccountID, DestinationAccountID, TrxDate, Amount, Reconciled " \
+            "FROM accountstrx WHERE TrxDate >= ? AND TrxDate < ?", (month_start(fromdate), fromdate))
+        for (accountid, month), values in get_balance_index_totals(rows).items():
+            add(accountid, values, -1)
+    return totals
+
+def month_start(d):
+    """
+    Returns the first day of the month d is in, as used for BalanceMonth in the balance index
+    """
+    if d is None: return None
+    return datetime.datetime(d.year, d.month, 1)
+
+def get_balance_index_totals(rows):
+    """
+    Totals a set of accountstrx rows for the balance index. 
+    rows must have SOURCEACCOUNTID, DESTINATIONACCOUNTID, TRXDATE, AMOUNT and RECONCILED columns.
+    Returns a dictionary of (account ID, month) to a list of 
+    [ deposit, withdrawal, reconciled deposit, reconciled withdrawal ]
+    Transactions without a date are totalled under a month of None.
+    """
+    totals = {}
+    for r in rows:
+        month = month_start(r.TRXDATE)
+        amount = r.AMOUNT or 0
+        reconciled = r.RECONCILED == 1
+        for accountid, col in ( (r.DESTINATIONACCOUNTID, 0), (r.SOURCEACCOUNTID, 1) ):
+            t = totals.setdefault((accountid, month), [ 0, 0, 0, 0 ])
+            t[col] += amount
+            if reconciled: t[col + 2] += amount
+    return totals
+
+def update_balance_index(dbo, where, sign = 1):
+    """
+    Adds the accountstrx rows matching the where clause to the balance index. 
+    Call it with sign = -1 to take them off again before the rows are changed or deleted.
+    """
+    rows = dbo.query("SELECT SourceAccountID, DestinationAccountID, TrxDate, Amount, Reconciled FROM accountstrx WHERE %s" % where)
+    for (accountid, month), t in get_balance_index_totals(rows).items():
+        deposit, withdrawal, recdeposit, recwithdrawal = [ sign * x for x in t ]
+        mwhere = "BalanceMonth = ?"
+        params = [ deposit, withdrawal, recdeposit, recwithdrawal, accountid ]
+        if month is None: 
+            mwhere = "BalanceMonth Is Null"
+        else:
+            params.append(month)
+        if 0 == dbo.execute("UPDATE accountsbalance SET Deposit = Deposit + ?, Withdrawal = Withdrawal + ?, " \
+            "ReconciledDeposit = ReconciledDeposit + ?, ReconciledWithdrawal = ReconciledWithdrawal + ? " \
+            "WHERE AccountID = ? AND %s" % mwhere, params):
+            dbo.execute("INSERT INTO accountsbalance (AccountID, BalanceMonth, Deposit, Withdrawal, ReconciledDeposit, ReconciledWithdrawal) " \
+                "VALUES (?, ?, ?, ?, ?, ?)", (accountid, month, deposit, withdrawal, recdeposit, recwithdrawal))
+
+def rebuild_balance_index(dbo, accountid = 0):
+    """
+    Recalculates the balance index from accountstrx for accountid,
+    or every account if accountid is 0.
+    Returns the number of monthly totals written.
+    """
+    where = ""
+    if accountid != 0:
+        where = "WHERE SourceAccountID = %d OR DestinationAccountID = %d" % (accountid, accountid)
+    totals = get_balance_index_totals(dbo.query_stream("SELECT SourceAccountID, DestinationAccountID, TrxDate, Amount, Reconciled FROM accountstrx %s" % where))
+    if accountid != 0:
+        totals = dict( (k, v) for k, v in totals.items() if k[0] == accountid )
+        dbo.execute("DELETE FROM accountsbalance WHERE AccountID = ?", [accountid])
+    else:
+        dbo.execute("DELETE FROM accountsbalance")
+    dbo.execute_many("INSERT INTO accountsbalance (AccountID, BalanceMonth, Deposit, Withdrawal, ReconciledDeposit, ReconciledWithdrawal) " \
+        "VALUES (?, ?, ?, ?, ?, ?)", [ (k[0], k[1], t[0], t[1], t[2], t[3]) for k, t in totals.items() ])
+    return len(totals)
+
+def check_balance_index(dbo):
+    """
+    Verifies the balance index against the totals calculated from accountstrx. 
+    Any account with a month that differs is logged and has its index rebuilt.
+    Returns the number of differences found.
+    """
+    expected = get_balance_index_totals(dbo.query_stream("SELECT SourceAccountID, DestinationAccountID, TrxDate, Amount, Reconciled FROM accountstrx"))
+    actual = {}
+    for r in dbo.query_stream("SELECT AccountID, BalanceMonth, Deposit, Withdrawal, ReconciledDeposit, ReconciledWithdrawal FROM accountsbalance"):
+        t = actual.setdefault((r.ACCOUNTID, r.BALANCEMONTH), [ 0, 0, 0, 0 ])
+        for i, v in enumerate((r.DEPOSIT, r.WITHDRAWAL, r.RECONCILEDDEPOSIT, r.RECONCILEDWITHDRAWAL)):
+            t[i] += v or 0
+    differences = 0
+    rebuild = set()
+    for k in set(expected.keys()) | set(actual.keys()):
+        e = expected.get(k, [ 0, 0, 0, 0 ])
+        a = actual.get(k, [ 0, 0, 0, 0 ])
+        if e != a:
+            asm3.al.error("balance index for account %s, month %s is %s, accountstrx totals are %s" % (k[0], k[1], a, e), "financial.check_balance_index", dbo)
+            differences += 1
+            rebuild.add(k[0])
+    for accountid in sorted(rebuild):
+        rebuild_balance_index(dbo, accountid)
+    return differences
 
 def mark_reconciled(dbo, trxid):
     """
     Marks a transaction reconciled.
     """
+    update_balance_index(dbo, "ID=%d" % trxid, -1)
     dbo.update("accountstrx", trxid, {
         "Reconciled": 1
     })
+    update_balance_index(dbo, "ID=%d" % trxid)
 
 def get_transactions(dbo, accountid, datefrom, dateto, reconciled=BOTH):
     """
@@ -711,6 +831,7 @@ def delete_donation(dbo, username, did):
     Deletes a payment record
     """
     movementid = dbo.query_int("SELECT MovementID FROM ownerdonation WHERE ID = ?", [did])
+    update_balance_index(dbo, "OwnerDonationID = %d" % did, -1)
     dbo.delete("accountstrx", "OwnerDonationID = %d" % did, username) # remove matching trx if exists
     dbo.delete("ownerdonation", did, username)
     asm3.movement.update_movement_donation(dbo, movementid)
@@ -819,7 +940,9 @@ def update_matching_cost_transaction(dbo, username, acid, destinationaccount = 0
     trxid = dbo.query_int("SELECT ID FROM accountstrx WHERE AnimalCostID = ?", [acid])
     if trxid != 0:
         asm3.al.debug("Already have an existing transaction, updating amount to %d" % c.COSTAMOUNT, "financial.update_matching_cost_transaction", dbo)
+        update_balance_index(dbo, "ID=%d" % trxid, -1)
         dbo.update("accountstrx", trxid, { "Amount": c.COSTAMOUNT })
+        update_balance_index(dbo, "ID=%d" % trxid)
         return
 
     # Get the target account for this type of cost, use the first expense account on file for that type
@@ -871,6 +994,7 @@ def update_matching_cost_transaction(dbo, username, acid, destinationaccount = 0
         "OwnerDonationID":  0,
         "AnimalCostID":     acid
     }, username)
+    update_balance_index(dbo, "ID=%d" % tid)
     asm3.al.debug("Trx created with ID %d" % tid, "financial.update_matching_cost_transaction", dbo)
 
 def update_matching_donation_transaction(dbo, username, odid, destinationaccount = 0):
@@ -905,7 +1029,9 @@ def update_matching_donation_transaction(dbo, username, odid, destinationaccount
     trxid = dbo.query_int("SELECT ID FROM accountstrx WHERE OwnerDonationID = ? ORDER BY ID", [odid])
     if trxid != 0:
         asm3.al.debug("Already have an existing transaction, updating amount to %d" % abs(d.DONATION), "financial.update_matching_donation_transaction", dbo)
+        update_balance_index(dbo, "ID=%d" % trxid, -1)
         dbo.execute("UPDATE accountstrx SET Amount = ? WHERE ID = ?", (abs(d.DONATION), trxid))
+        update_balance_index(dbo, "ID=%d" % trxid)
         return
 
     # Get the source account for this type of donation, use the first income account on file for that type
@@ -964,6 +1090,7 @@ def update_matching_donation_transaction(dbo, username, odid, destinationaccount
         "AnimalCostID":         0,
         "OwnerDonationID":      odid
     }, username)
+    update_balance_index(dbo, "ID=%d" % tid)
     asm3.al.debug("Trx created with ID %d" % int(tid), "financial.update_matching_donation_transaction", dbo)
 
     # Is there a vat/tax portion of this payment that we need to create a transaction for?
@@ -982,6 +1109,7 @@ def update_matching_donation_transaction(dbo, username, odid, destinationaccount
             "AnimalCostID":         0,
             "OwnerDonationID":      odid
         }, username)
+        update_balance_index(dbo, "ID=%d" % tid)
         asm3.al.debug("VAT trx created with ID %d" % int(tid), "financial.update_matching_donation_transaction", dbo)
 
     # Is there a fee on this payment that we need to create a transaction for?
@@ -1000,6 +1128,7 @@ def update_matching_donation_transaction(dbo, username, odid, destinationaccount
             "AnimalCostID":         0,
             "OwnerDonationID":      odid
         }, username)
+        update_balance_index(dbo, "ID=%d" % tid)
         asm3.al.debug("Fee trx created with ID %d" % int(tid), "financial.update_matching_donation_transaction", dbo)
 
 def insert_account_from_costtype(dbo, ctid, name, desc):
@@ -1112,7 +1241,9 @@ def delete_account(dbo, username, aid):
     """
     Deletes an account
     """
+    update_balance_index(dbo, "SourceAccountID=%d OR DestinationAccountID=%d" % (aid, aid), -1)
     dbo.delete("accountstrx", "SourceAccountID=%d OR DestinationAccountID=%d" % (aid, aid), username)
+    dbo.delete("accountsbalance", "AccountID=%d" % aid)
     dbo.delete("accountsrole", "AccountID=%d" % aid)
     dbo.delete("accounts", aid, username)
 
@@ -1143,7 +1274,7 @@ def insert_trx_from_form(dbo, username, post):
         source = account
         target = other
 
-    return dbo.insert("accountstrx", {
+    trxid = dbo.insert("accountstrx", {
         "TrxDate":              post.date("trxdate"),
         "Description":          post["description"],
         "Reconciled":           post.boolean("reconciled"),
@@ -1152,6 +1283,8 @@ def insert_trx_from_form(dbo, username, post):
         "DestinationAccountID": target,
         "OwnerDonationID":      0
     }, username)
+    update_balance_index(dbo, "ID=%d" % trxid)
+    return trxid
 
 def update_trx_from_form(dbo, username, post):
     """
@@ -1178,7 +1311,8 @@ def update_trx_from_form(dbo, username, post):
         source = account
         target = other
 
-    return dbo.update("accountstrx", trxid, {
+    update_balance_index(dbo, "ID=%d" % trxid, -1)
+    rv = dbo.update("accountstrx", trxid, {
         "TrxDate":              post.date("trxdate"),
         "Description":          post["description"],
         "Reconciled":           post.boolean("reconciled"),
@@ -1186,11 +1320,14 @@ def update_trx_from_form(dbo, username, post):
         "SourceAccountID":      source,
         "DestinationAccountID": target
     }, username)
+    update_balance_index(dbo, "ID=%d" % trxid)
+    return rv
 
 def delete_trx(dbo, username, tid):
     """
     Deletes a transaction
     """
+    update_balance_index(dbo, "ID=%d" % tid, -1)
     dbo.delete("accountstrx", tid, username)
 
 def insert_voucher_from_form(dbo, username, post):
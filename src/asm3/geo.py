@@ -1,23 +1,48 @@
 
 """
-    Geocoding module. Supports google and nominatim
+    Geocoding module. Supports google, nominatim and sheltermanager.com
+
+    Geocodes are kept in a persistent store (a SQLite file shared by all
+    databases and processes on the host) keyed on provider and address.
+    Requests to each provider are throttled by a token bucket, so that
+    lookups for different addresses do not queue behind each other 
+    until the provider's rate limit is reached.
+
+    queue_lat_long puts a lookup on a background queue. Worker threads 
+    look the addresses up and write the results back to owner.LatLong or 
+    animalcontrol.DispatchLatLong in batches, using their own Database
+    objects rather than the caller's (and its connection). 
+    Pass the requests queue_lat_long returns to wait_lat_long to wait for them.
 """
 
 import asm3.al
-import asm3.cachedisk
 import asm3.configuration
 import asm3.i18n
 import asm3.utils
-from asm3.sitedefs import BASE_URL, GEO_PROVIDER, GEO_PROVIDER_KEY, GEO_LOOKUP_TIMEOUT, GEO_SLEEP_AFTER, GEO_SMCOM_URL
+from asm3.sitedefs import BASE_URL, GEO_PROVIDER, GEO_PROVIDER_KEY, GEO_LOOKUP_TIMEOUT, GEO_SLEEP_AFTER, GEO_SMCOM_URL, \
+    GEO_RATE_LIMITS, GEO_STORE_FILE, GEO_STORE_TTL, GEO_WORKERS, GEO_WRITE_BATCH
 
+import hashlib
 import json
+import os
+import queue
+import sqlite3
 import threading
 import time
 
 GEO_NOMINATIM_URL = "https://nominatim.openstreetmap.org/search?format=json&street={street}&city={city}&state={state}&postalcode={zipcode}&country={country}"
 GEO_GOOGLE_URL = "https://maps.googleapis.com/maps/api/geocode/json?address={q}&sensor=false&key={key}"
 
-lat_long_lock = threading.Lock()
+GEO_NOT_FOUND_TTL = 86400 # How long to keep addresses the provider could not find before trying again
+
+# The columns geocodes are written back to for each table
+WRITE_BACK = { "owner": "LatLong", "animalcontrol": "DispatchLatLong" }
+
+buckets = {} # provider: TokenBucket
+bucketslock = threading.Lock()
+requests = queue.Queue() # GeoRequest objects waiting for the workers
+workers = []
+workerslock = threading.Lock()
 
 class GeoProvider(object):
     """ Geocoding provider base class """
@@ -147,6 +172,120 @@ class Smcom(GeoProvider):
             asm3.al.error("couldn't find geocode in smcom response. Response was %s" % self.response, "geo.parse_google", self.dbo)
             return "0,0,%s" % h
 
+class Stub(GeoProvider):
+    """ Local geocoding for tests. Never makes a request, the position is made
+        from a hash of the address. Addresses containing "nowhere" are not found. """
+    def __init__(self, dbo, address, town, county, postcode, country):
+        self.url = "stub:{q}"
+        GeoProvider.__init__(self, dbo, address, town, county, postcode, country)
+
+    def search(self):
+        if self.q.lower().find("nowhere") != -1:
+            self.json_response = {}
+        else:
+            d = hashlib.md5(self.q.encode("utf-8")).digest()
+            self.json_response = { "lat": round(d[0] / 2.56 - 50, 4), "lng": round(d[1] / 1.28 - 100, 4) }
+        self.response = json.dumps(self.json_response)
+
+    def parse(self):
+        h = self.address_hash()
+        j = self.json_response
+        if len(j) == 0: return "0,0,%s" % h
+        return "%s,%s,%s" % (j["lat"], j["lng"], h)
+
+PROVIDERS = { "nominatim": Nominatim, "google": Google, "smcom": Smcom, "stub": Stub }
+
+class GeoStore(object):
+    """
+    Persistent store of geocodes in a SQLite file, keyed on a hash of the
+    provider and address. Results are kept for GEO_STORE_TTL days and 
+    addresses that could not be found for GEO_NOT_FOUND_TTL seconds.
+    """
+    def __init__(self, filename = GEO_STORE_FILE):
+        self.filename = filename
+        self.local = threading.local()
+
+    def _conn(self):
+        """ Returns the connection for the current thread, creating the database if necessary """
+        c = getattr(self.local, "conn", None)
+        if c is None:
+            path = os.path.dirname(self.filename)
+            if path != "" and not os.path.exists(path):
+                os.makedirs(path)
+            c = sqlite3.connect(self.filename, timeout=10, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("CREATE TABLE IF NOT EXISTS geocode (k TEXT NOT NULL PRIMARY KEY, latlon TEXT NOT NULL, expires REAL NOT NULL)")
+            self.local.conn = c
+        return c
+
+    def key(self, provider, q):
+        return hashlib.sha1(("%s:%s" % (provider, q)).encode("utf-8")).hexdigest()
+
+    def get(self, provider, q):
+        """ Returns the stored latlon for address q or None """
+        r = self._conn().execute("SELECT latlon, expires FROM geocode WHERE k=?", (self.key(provider, q),)).fetchone()
+        if r is None or r[1] < time.time(): return None
+        return r[0]
+
+    def put(self, provider, q, latlon):
+        ttl = GEO_STORE_TTL * 86400
+        if latlon.startswith("0,0,"): ttl = GEO_NOT_FOUND_TTL
+        self._conn().execute("INSERT OR REPLACE INTO geocode (k, latlon, expires) VALUES (?,?,?)", (self.key(provider, q), latlon, time.time() + ttl))
+
+    def remove_expired(self):
+        return self._conn().execute("DELETE FROM geocode WHERE expires < ?", (time.time(),)).rowcount
+
+store = GeoStore()
+
+class TokenBucket(object):
+    """
+    Limits requests to rate per second. Up to burst requests can be made
+    at once after a quiet period. A rate of 0 means no limit.
+    """
+    def __init__(self, rate, burst = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Waits until a request can be made """
+        if self.rate <= 0: return
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def get_bucket(provider):
+    """ Returns the token bucket for provider. Providers without an entry 
+        in GEO_RATE_LIMITS make one request every GEO_SLEEP_AFTER seconds """
+    with bucketslock:
+        if provider not in buckets:
+            rate = GEO_RATE_LIMITS.get(provider, GEO_SLEEP_AFTER > 0 and 1.0 / GEO_SLEEP_AFTER or 0)
+            buckets[provider] = TokenBucket(rate, max(1, int(rate)))
+        return buckets[provider]
+
+def get_provider(dbo, address, town, county, postcode, country = ""):
+    """
+    Returns a GeoProvider for the address with the set geocoding provider or None.
+    If no country was passed, the one set with the shelter details in settings 
+    is used, otherwise the country from the user's locale.
+    """
+    if country is None or country == "": 
+        country = asm3.configuration.organisation_country(dbo)
+        if country == "": country = asm3.i18n.get_country(dbo.locale)
+    if GEO_PROVIDER not in PROVIDERS:
+        asm3.al.error("unrecognised geo provider: %s" % GEO_PROVIDER, "geo.get_provider", dbo)
+        return None
+    return PROVIDERS[GEO_PROVIDER](dbo, address, town, county, postcode, country)
 
 def address_hash(address, town, county, postcode, country):
     """ Produces a hash of the address to include with latlon values """
@@ -167,52 +306,95 @@ def get_lat_long(dbo, address, town, county, postcode, country = ""):
         return None
 
     try:
-        # Synchronise this process to a single thread to prevent
-        # abusing our geo provider
-        lat_long_lock.acquire()
-
-        # Use the country passed. If no country was passed, check
-        # if one has been set with the shelter details in settings,
-        # otherwise use the country from the user's locale.
-        if country is None or country == "": 
-            country = asm3.configuration.organisation_country(dbo)
-            if country == "": country = asm3.i18n.get_country(dbo.locale)
-
-        g = None
-        if GEO_PROVIDER == "nominatim":
-            g = Nominatim(dbo, address, town, county, postcode, country)
-        elif GEO_PROVIDER == "google":
-            g = Google(dbo, address, town, county, postcode, country)
-        elif GEO_PROVIDER == "smcom":
-            g = Smcom(dbo, address, town, county, postcode, country)
-        else:
-            asm3.al.error("unrecognised geo provider: %s" % GEO_PROVIDER, "geo.get_lat_long", dbo)
-            return None
+        g = get_provider(dbo, address, town, county, postcode, country)
+        if g is None: return None
 
-        # Check the cache in case we already requested this address
-        cachekey = "nom:" + g.q
-        v = asm3.cachedisk.get(cachekey, dbo.database)
+        # Check the store in case we already looked this address up
+        v = store.get(GEO_PROVIDER, g.q)
         if v is not None:
-            asm3.al.debug("cache hit for address: %s = %s" % (cachekey, v), "geo.get_lat_long", dbo)
+            asm3.al.debug("store hit for address: %s = %s" % (g.q, v), "geo.get_lat_long", dbo)
             return v
 
-        # Call the service to get the data
+        # Wait our turn with the provider, call the service and
+        # parse the response to a lat/long value
+        get_bucket(GEO_PROVIDER).acquire()
         g.search()
-
-        # Parse the response to a lat/long value
         latlon = g.parse()
-        asm3.cachedisk.put(cachekey, dbo.database, latlon, 86400)
-
-        if GEO_SLEEP_AFTER > 0:
-            time.sleep(GEO_SLEEP_AFTER)
-
+        store.put(GEO_PROVIDER, g.q, latlon)
         return latlon
 
     except Exception as err:
         asm3.al.error(str(err), "geo.get_lat_long", dbo)
         return None
 
-    finally:
-        lat_long_lock.release()
+class GeoRequest(object):
+    """ An address to look up and the row to write the geocode to """
+    def __init__(self, dbo, table, rowid, address, town, county, postcode, country):
+        self.dbo = dbo.clone()
+        self.table = table
+        self.rowid = rowid
+        self.address = address
+        self.town = town
+        self.county = county
+        self.postcode = postcode
+        self.country = country
+        self.done = threading.Event()
+
+def queue_lat_long(dbo, table, rowid, address, town, county, postcode, country = ""):
+    """
+    Queues an address to be looked up in the background. The geocode is 
+    written to the WRITE_BACK column of table for rowid once it has been found.
+    Returns the GeoRequest.
+    """
+    if table not in WRITE_BACK:
+        raise KeyError("cannot write geocodes to %s" % table)
+    start_workers()
+    r = GeoRequest(dbo, table, rowid, address, town, county, postcode, country)
+    requests.put(r)
+    return r
+
+def wait_lat_long(georequests):
+    """ Waits until the addresses in a list of GeoRequests from 
+        queue_lat_long have been looked up and written """
+    for r in georequests:
+        r.done.wait()
+
+def write_lat_long(done):
+    """ Writes the geocodes for a list of (GeoRequest, latlon) with one
+        execute_many for each database and table """
+    groups = {}
+    for r, latlon in done:
+        if latlon is None: continue
+        k = (r.dbo.database, r.table)
+        if k not in groups: groups[k] = (r.dbo, [])
+        groups[k][1].append((latlon, r.rowid))
+    for (database, table), (dbo, batch) in groups.items():
+        try:
+            dbo.execute_many("UPDATE %s SET %s=? WHERE ID=?" % (table, WRITE_BACK[table]), batch)
+            asm3.al.debug("wrote %d geocodes to %s" % (len(batch), table), "geo.write_lat_long", dbo)
+        except Exception as err:
+            asm3.al.error("failed writing %d geocodes to %s: %s" % (len(batch), table, err), "geo.write_lat_long", dbo)
 
+def worker():
+    """ Looks up queued addresses. Geocodes are written when GEO_WRITE_BATCH have been
+        found or the queue is empty, after which the requests are marked done. """
+    done = []
+    while True:
+        try:
+            r = requests.get(timeout=1)
+            done.append((r, get_lat_long(r.dbo, r.address, r.town, r.county, r.postcode, r.country)))
+        except queue.Empty:
+            pass
+        if len(done) > 0 and (len(done) >= GEO_WRITE_BATCH or requests.empty()):
+            write_lat_long(done)
+            for r, latlon in done: r.done.set()
+            done = []
+
+def start_workers():
+    """ Starts the GEO_WORKERS worker threads if they are not running """
+    with workerslock:
+        while len(workers) < GEO_WORKERS:
+            t = threading.Thread(target=worker, daemon=True)
+            t.start()
+            workers.append(t)
 
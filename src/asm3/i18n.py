@@ -1,11 +1,12 @@
 
 import datetime
-import json
+import importlib
+import marshal
+import os
+import sys
+import threading
 import time
 
-# flake8: noqa - we have a lot of locales and this is convenient
-from asm3.locales import *
-
 VERSION = "44u [Mon 13 Jul 12:49:25 BST 2020]"
 BUILD = "07131249"
 
@@ -139,6 +140,74 @@ locale_maps = {
     "tr":       ( "Turkish", "Turkey", DDMY, "TL", PLURAL_ENGLISH, CURRENCY_PREFIX, 2, ",", " " )
 }
 
+# Translations are loaded from the locales package the first time each
+# locale is used. If there's an up to date compiled catalogue (a marshalled
+# dict of just the translated strings, see write_catalogues) it is read 
+# instead of importing the much larger locale module.
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")
+catalogues = {}
+catalogueslock = threading.Lock()
+
+def is_translated(s):
+    """ Returns True if s is a usable translation """
+    return s is not None and s != "" and not s.startswith("??") and not s.startswith("(??")
+
+def get_catalogue(locale):
+    """
+    Returns a dictionary of English phrase to translation for a locale
+    (after real_locale has been applied), or None if there isn't one.
+    """
+    if locale in catalogues: return catalogues[locale]
+    with catalogueslock:
+        if locale not in catalogues:
+            catalogues[locale] = load_catalogue(locale)
+        return catalogues[locale]
+
+def load_catalogue(locale):
+    """
+    Reads the translated strings for a locale from its compiled catalogue
+    if it is newer than the locale module, or the locale module if not.
+    Returns None if the locale does not exist.
+    """
+    if not locale.replace("_", "").isalnum(): return None
+    module = os.path.join(LOCALES_DIR, "locale_%s.py" % locale)
+    compiled = os.path.join(LOCALES_DIR, "locale_%s.cat" % locale)
+    try:
+        if os.path.exists(compiled) and (not os.path.exists(module) or os.path.getmtime(compiled) >= os.path.getmtime(module)):
+            with open(compiled, "rb") as f:
+                return marshal.load(f)
+    except Exception as err:
+        sys.stderr.write("i18n: could not read %s, using locale module: %s\n" % (compiled, err))
+    if not os.path.exists(module): return None
+    name = "asm3.locales.locale_%s" % locale
+    val = importlib.import_module(name).val
+    # Don't keep the module around, we only need the translated strings
+    sys.modules.pop(name, None)
+    try:
+        delattr(sys.modules["asm3.locales"], "locale_%s" % locale)
+    except AttributeError:
+        pass
+    return dict([ (k, v) for k, v in val.items() if is_translated(v) ])
+
+def write_catalogues(path = LOCALES_DIR):
+    """
+    Writes a compiled catalogue next to every locale module in path.
+    Returns the number written.
+    """
+    written = 0
+    for f in sorted(os.listdir(path)):
+        if not f.startswith("locale_") or not f.endswith(".py"): continue
+        locale = f[len("locale_"):-len(".py")]
+        catalogues.pop(locale, None)
+        # Make sure we read the module rather than an older catalogue
+        compiled = os.path.join(path, "locale_%s.cat" % locale)
+        if os.path.exists(compiled): os.unlink(compiled)
+        val = load_catalogue(locale)
+        with open(compiled, "wb") as fd:
+            marshal.dump(val, fd)
+        written += 1
+    return written
+
 def _(english, locale = "en"):
     return translate(english, locale)
 
@@ -191,24 +260,12 @@ def translate(english, locale = "en"):
     if locale == "en":
         return english
 
-    # Otherwise, look up the phrase in the correct
-    # module for our locale.
-    try:
-        lang = globals()["locale_" + locale]
-    except:
-        # The module doesn't exist for the locale, fall
-        # back to plain English translation
-        return english
-
-    # If the string isn't in our locale dictionary, fall back to English
-    if english not in lang.val: return english
-
-    # If the value hasn't been translated, fall back to English
-    s = lang.val[english]
-    if s is None or s == "" or s.startswith("??") or s.startswith("(??"):
-        return english
-    else:
-        return lang.val[english]
+    # Otherwise, look up the phrase in the catalogue for our locale.
+    # If the locale doesn't exist, the string isn't in it or hasn't been
+    # translated, fall back to English
+    lang = get_catalogue(locale)
+    if lang is None: return english
+    return lang.get(english, english)
 
 def ntranslate(number, translations, locale = "en"):
     """ Translates a phrase that deals with a number of something
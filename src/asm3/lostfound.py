@@ -12,7 +12,10 @@ import asm3.media
 import asm3.reports
 import asm3.utils
 import asm3.waitinglist
-from asm3.i18n import _, date_diff_days, now, subtract_years, python2display
+from asm3.i18n import _, now, subtract_years, python2display
+
+import bisect
+import time
 
 class LostFoundMatch:
     dbo = None
@@ -310,50 +313,383 @@ def send_email_from_form(dbo, username, post):
         asm3.log.add_log_email(dbo, username, post["lfmode"] == "lost" and asm3.log.LOSTANIMAL or asm3.log.FOUNDANIMAL, post.integer("lfid"), logtype, emailto, subject, body)
     return rv
 
+LOST_FIELDS = [ "ID", "OWNERNAME", "MICROCHIPNUMBER", "HOMETELEPHONE", "AREALOST", "AREAPOSTCODE", "AGEGROUP", "SEX", "SEXNAME",
+    "ANIMALTYPEID", "SPECIESNAME", "BREEDID", "BREEDNAME", "DISTFEAT", "BASECOLOURID", "BASECOLOURNAME", "DATELOST" ]
+
+FOUND_FIELDS = [ "ID", "OWNERNAME", "MICROCHIPNUMBER", "HOMETELEPHONE", "AREAFOUND", "AREAPOSTCODE", "AGEGROUP", "SEX", "SEXNAME",
+    "ANIMALTYPEID", "SPECIESNAME", "BREEDID", "BREEDNAME", "DISTFEAT", "BASECOLOURID", "BASECOLOURNAME", "DATEFOUND" ]
+
+SHELTER_FIELDS = [ "ID", "CODE", "ANIMALNAME", "IDENTICHIPNUMBER", "SPECIESID", "SPECIESNAME", "BREEDID", "BREED2ID", "BREEDNAME",
+    "BASECOLOURID", "BASECOLOURNAME", "AGEGROUP", "SEX", "SEXNAME", "ORIGINALOWNERADDRESS", "ORIGINALOWNERTOWN",
+    "ORIGINALOWNERPOSTCODE", "MARKINGS", "DATEBROUGHTIN" ]
+
+MATCH_STATE_TTL = 86400 * 7 # How long the state for incremental matching is kept
+
+def tokens(s):
+    """
+    Returns the list of words in s as compared by words()
+    """
+    if s is None: s = ""
+    return s.replace(",", " ").replace("\n", " ").lower().strip().split(" ")
+
 def words(str1, str2, maxpoints):
     """
     Evalutes words in string 1 for appearances in string 2
     Returns the number of points for 1 to 2 as a percentage of maxpoints
     """
-    if str1 is None: str1 = ""
-    if str2 is None: str2 = ""
-    str1 = str1.replace(",", " ").replace("\n", " ").lower().strip()
-    str2 = str2.replace(",", " ").replace("\n", " ").lower().strip()
+    return words_tokens(tokens(str1), set(tokens(str2)), maxpoints)
+
+def words_tokens(s1words, s2words, maxpoints):
+    """
+    words() for the pre-tokenised list s1words and set s2words
+    """
     matches = 0
-    s1words = str1.split(" ")
-    s2words = str2.split(" ")
     for w in s1words:
         if w in s2words: 
             matches += 1
     return int((float(matches) / float(len(s1words))) * float(maxpoints))
 
-def match(dbo, lostanimalid = 0, foundanimalid = 0, animalid = 0, limit = 0):
+def get_match_points(dbo):
+    """
+    Returns a dictionary of the points for each matching criteria,
+    the maximum total (max), the point floor (floor) and whether
+    to match shelter animals (shelter)
+    """
+    p = {
+        "species":      asm3.configuration.match_species(dbo),
+        "breed":        asm3.configuration.match_breed(dbo),
+        "age":          asm3.configuration.match_age(dbo),
+        "sex":          asm3.configuration.match_sex(dbo),
+        "arealost":     asm3.configuration.match_area_lost(dbo),
+        "features":     asm3.configuration.match_features(dbo),
+        "postcode":     asm3.configuration.match_postcode(dbo),
+        "colour":       asm3.configuration.match_colour(dbo),
+        "microchip":    asm3.configuration.match_microchip(dbo),
+        "within2weeks": asm3.configuration.match_within2weeks(dbo)
+    }
+    p["max"] = sum(p.values())
+    p["floor"] = asm3.configuration.match_point_floor(dbo)
+    p["shelter"] = asm3.configuration.match_include_shelter(dbo)
+    return p
+
+def unix_time(d):
+    """
+    Returns d as unix time the way date_diff_days calculates it, or None if it can't be
+    """
+    if d is None: return None
+    try:
+        return time.mktime(d.timetuple())
+    except:
+        return None
+
+class MatchIndex(object):
+    """
+    Indexes a list of found animals (or shelter animals if shelter is True)
+    by every value that can score points against a lost animal, so that
+    candidates() only has to return the animals that could possibly reach
+    the match point floor instead of every animal. The values compared
+    are extracted once for each animal, with the words tokenised and
+    dates converted the way words() and date_diff_days() do.
+    """
+    def __init__(self, rows, shelter, points):
+        self.rows = rows
+        self.shelter = shelter
+        self.points = points
+        self.values = [] # (microchip, species, breed, breed2, agegroup, sex, colour, postcode, area words, feature words, unix date)
+        self.microchip = {}
+        self.species = {}
+        self.breed = {}
+        self.age = {}
+        self.sex = {}
+        self.colour = {}
+        self.postcode = {}
+        self.postcodehits = {}
+        self.area = {}
+        self.features = {}
+        self.nodate = [] # Rows that always score the date points
+        dates = []
+        for i, r in enumerate(rows):
+            if shelter:
+                v = (r["IDENTICHIPNUMBER"], r["SPECIESID"], r["BREEDID"], r["BREED2ID"], r["AGEGROUP"], r["SEX"], r["BASECOLOURID"], 
+                    asm3.utils.nulltostr(r["ORIGINALOWNERPOSTCODE"]), set(tokens(r["ORIGINALOWNERADDRESS"])), set(tokens(r["MARKINGS"])), 
+                    unix_time(r["DATEBROUGHTIN"]))
+            else:
+                v = (r["MICROCHIPNUMBER"], r["ANIMALTYPEID"], r["BREEDID"], r["BREEDID"], r["AGEGROUP"], r["SEX"], r["BASECOLOURID"],
+                    r["AREAPOSTCODE"], set(tokens(r["AREAFOUND"])), set(tokens(r["DISTFEAT"])), unix_time(r["DATEFOUND"]))
+            self.values.append(v)
+            self.add(self.microchip, v[0], i)
+            self.add(self.species, v[1], i)
+            self.add(self.breed, v[2], i)
+            if v[3] != v[2]: self.add(self.breed, v[3], i)
+            self.add(self.age, v[4], i)
+            self.add(self.sex, v[5], i)
+            self.add(self.colour, v[6], i)
+            self.add(self.postcode, v[7], i)
+            for w in v[8]: self.add(self.area, w, i)
+            for w in v[9]: self.add(self.features, w, i)
+            if v[10] is None: self.nodate.append(i)
+            else: dates.append((v[10], i))
+        dates.sort()
+        self.dates = [ x[0] for x in dates ]
+        self.dateids = [ x[1] for x in dates ]
+
+    def add(self, index, value, i):
+        if value in index: index[value].append(i)
+        else: index[value] = [ i ]
+
+    def postcode_hits(self, postcode):
+        """ Rows with postcode (or containing postcode for shelter animals) """
+        if not self.shelter: return self.postcode.get(postcode, [])
+        if postcode not in self.postcodehits:
+            hits = []
+            for k, v in self.postcode.items():
+                if k.find(postcode) != -1: hits += v
+            self.postcodehits[postcode] = hits
+        return self.postcodehits[postcode]
+
+    def date_hits(self, lostux):
+        """ Returns a function for the rows within 2 weeks of the lost date and their count """
+        if lostux is None: return lambda: range(len(self.rows)), len(self.rows)
+        # date_diff_days(datelost, d) <= 14 when d - datelost < 15 days
+        k = bisect.bisect_left(self.dates, lostux + 15 * 86400)
+        return lambda: self.nodate + self.dateids[:k], len(self.nodate) + k
+
+    def candidates(self, lv):
+        """
+        Returns the sorted indexes of rows that could score at least the point floor against 
+        the lost animal values lv (from lost_values). 
+        The values the lost animal shares with the most rows are skipped while their points 
+        add up to less than the floor. Rows that share none of the other values can't match. 
+        For the rest, the points for the other values they share are added up and they are 
+        candidates if that plus the skipped points reaches the floor.
+        """
+        p = self.points
+        if p["floor"] <= 0: return range(len(self.rows))
+        microchip, species, breed, agegroup, sex, colour, postcode, lostarea, lostfeatures, lostux = lv
+        criteria = [] # (points, function returning hits, count)
+        def criterion(points, hits):
+            if points > 0: criteria.append((points, lambda: hits, len(hits)))
+        if microchip != "": criterion(p["microchip"], self.microchip.get(microchip, []))
+        criterion(p["species"], self.species.get(species, []))
+        criterion(p["breed"], self.breed.get(breed, []))
+        criterion(p["age"], self.age.get(agegroup, []))
+        criterion(p["sex"], self.sex.get(sex, []))
+        criterion(p["colour"], self.colour.get(colour, []))
+        criterion(p["postcode"], self.postcode_hits(postcode))
+        if p["within2weeks"] > 0:
+            hits, count = self.date_hits(lostux)
+            criteria.append((p["within2weeks"], hits, count))
+        # Each word is worth its share of the points for the field
+        for lostwords, index, points in ((lostarea, self.area, p["arealost"]), (lostfeatures, self.features, p["features"])):
+            for w in set(lostwords):
+                criterion(float(points) * lostwords.count(w) / len(lostwords), index.get(w, []))
+        criteria.sort(key=lambda x: x[2], reverse=True)
+        skipped = 0
+        acc = {}
+        for points, hits, count in criteria:
+            if skipped + points < p["floor"] - 0.000001:
+                skipped += points
+            else:
+                for i in hits(): acc[i] = acc.get(i, 0) + points
+        need = p["floor"] - skipped - 0.000001
+        return sorted([ i for i, v in acc.items() if v >= need ])
+
+    def score(self, lv, i):
+        """
+        Returns the match points for the lost animal values lv against row i
+        """
+        p = self.points
+        microchip, species, breed, agegroup, sex, colour, postcode, lostarea, lostfeatures, lostux = lv
+        fmicrochip, fspecies, fbreed, fbreed2, fagegroup, fsex, fcolour, fpostcode, farea, ffeatures, fux = self.values[i]
+        matchpoints = 0
+        if microchip != "" and microchip == fmicrochip: matchpoints += p["microchip"]
+        if species == fspecies: matchpoints += p["species"]
+        if breed == fbreed or breed == fbreed2: matchpoints += p["breed"]
+        if agegroup == fagegroup: matchpoints += p["age"]
+        if sex == fsex: matchpoints += p["sex"]
+        matchpoints += words_tokens(lostarea, farea, p["arealost"])
+        matchpoints += words_tokens(lostfeatures, ffeatures, p["features"])
+        if self.shelter:
+            if fpostcode.find(postcode) != -1: matchpoints += p["postcode"]
+        elif postcode == fpostcode: matchpoints += p["postcode"]
+        if colour == fcolour: matchpoints += p["colour"]
+        if lostux is None or fux is None or fux < lostux + 15 * 86400: matchpoints += p["within2weeks"]
+        if matchpoints > p["max"]: matchpoints = p["max"]
+        return matchpoints
+
+def lost_values(la):
+    """
+    Returns the values compared by MatchIndex for lost animal la
+    """
+    return (la["MICROCHIPNUMBER"], la["ANIMALTYPEID"], la["BREEDID"], la["AGEGROUP"], la["SEX"], la["BASECOLOURID"], 
+        la["AREAPOSTCODE"], tokens(la["AREALOST"]), tokens(la["DISTFEAT"]), unix_time(la["DATELOST"]))
+
+def lost_match(dbo, la, matchpoints, p):
+    """
+    Returns a LostFoundMatch for lost animal la with the lost fields and match points set
+    """
+    m = LostFoundMatch(dbo)
+    m.lid = la["ID"]
+    m.lcontactname = la["OWNERNAME"]
+    m.lmicrochip = la["MICROCHIPNUMBER"]
+    m.lcontactnumber = la["HOMETELEPHONE"]
+    m.larealost = la["AREALOST"]
+    m.lareapostcode = la["AREAPOSTCODE"]
+    m.lagegroup = la["AGEGROUP"]
+    m.lsexid = la["SEX"]
+    m.lsexname = la["SEXNAME"]
+    m.lspeciesid = la["ANIMALTYPEID"]
+    m.lspeciesname = la["SPECIESNAME"]
+    m.lbreedid = la["BREEDID"]
+    m.lbreedname = la["BREEDNAME"]
+    m.ldistinguishingfeatures = la["DISTFEAT"]
+    m.lbasecolourid = la["BASECOLOURID"]
+    m.lbasecolourname = la["BASECOLOURNAME"]
+    m.ldatelost = la["DATELOST"]
+    m.matchpoints = int((float(matchpoints) / float(p["max"])) * 100.0)
+    return m
+
+def found_match(dbo, la, fa, matchpoints, p):
+    """
+    Returns a LostFoundMatch for lost animal la and found animal fa
+    """
+    m = lost_match(dbo, la, matchpoints, p)
+    m.fid = fa["ID"]
+    m.fanimalid = 0
+    m.fcontactname = fa["OWNERNAME"]
+    m.fmicrochip = fa["MICROCHIPNUMBER"]
+    m.fcontactnumber = fa["HOMETELEPHONE"]
+    m.fareafound = fa["AREAFOUND"]
+    m.fareapostcode = fa["AREAPOSTCODE"]
+    m.fagegroup = fa["AGEGROUP"]
+    m.fsexid = fa["SEX"]
+    m.fsexname = fa["SEXNAME"]
+    m.fspeciesid = fa["ANIMALTYPEID"]
+    m.fspeciesname = fa["SPECIESNAME"]
+    m.fbreedid = fa["BREEDID"]
+    m.fbreedname = fa["BREEDNAME"]
+    m.fdistinguishingfeatures = fa["DISTFEAT"]
+    m.fbasecolourid = fa["BASECOLOURID"]
+    m.fbasecolourname = fa["BASECOLOURNAME"]
+    m.fdatefound = fa["DATEFOUND"]
+    return m
+
+def shelter_match(dbo, la, a, matchpoints, p):
+    """
+    Returns a LostFoundMatch for lost animal la and shelter animal a
+    """
+    m = lost_match(dbo, la, matchpoints, p)
+    m.fid = 0
+    m.fanimalid = a["ID"]
+    m.fcontactname = _("Shelter animal {0} '{1}'", dbo.locale).format(a["CODE"], a["ANIMALNAME"])
+    m.fmicrochip = a["IDENTICHIPNUMBER"]
+    m.fcontactnumber = a["SPECIESNAME"]
+    m.fareafound = "%s, %s" % (a["ORIGINALOWNERADDRESS"], a["ORIGINALOWNERTOWN"])
+    m.fareapostcode = a["ORIGINALOWNERPOSTCODE"]
+    m.fagegroup = a["AGEGROUP"]
+    m.fsexid = a["SEX"]
+    m.fsexname = a["SEXNAME"]
+    m.fspeciesid = a["SPECIESID"]
+    m.fspeciesname = a["SPECIESNAME"]
+    m.fbreedid = a["BREEDID"]
+    m.fbreedname = a["BREEDNAME"]
+    m.fdistinguishingfeatures = a["MARKINGS"]
+    m.fbasecolourid = a["BASECOLOURID"]
+    m.fbasecolourname = a["BASECOLOURNAME"]
+    m.fdatefound = a["DATEBROUGHTIN"]
+    return m
+
+def match_rows(dbo, lostanimals, foundanimals, shelteranimals, p, limit = 0):
+    """
+    Matches the lists of lost animals against found animals and shelter animals
+    with the points p from get_match_points.
+    limit: Stop when we hit this many matches (or 0 for all)
+    returns a list of LostFoundMatch objects, for each lost animal in turn its
+    found animal matches, then its shelter animal matches.
+    """
+    matches = []
+    findex = MatchIndex(foundanimals, False, p)
+    sindex = MatchIndex(shelteranimals, True, p)
+    asm3.asynctask.set_progress_max(dbo, len(lostanimals))
+    for la in lostanimals:
+        asm3.asynctask.increment_progress_value(dbo)
+        lv = lost_values(la)
+        for i in findex.candidates(lv):
+            if limit > 0 and len(matches) >= limit: return matches
+            matchpoints = findex.score(lv, i)
+            if matchpoints >= p["floor"]: matches.append(found_match(dbo, la, foundanimals[i], matchpoints, p))
+        for i in sindex.candidates(lv):
+            if limit > 0 and len(matches) >= limit: return matches
+            matchpoints = sindex.score(lv, i)
+            if matchpoints >= p["floor"]: matches.append(shelter_match(dbo, la, shelteranimals[i], matchpoints, p))
+    return matches
+
+def fingerprints(rows, fields):
+    """
+    Returns a dictionary of ID: hash of the matching fields for each row in rows
+    """
+    return { r.ID: asm3.utils.md5_hash_hex(repr([ r[f] for f in fields ])) for r in rows }
+
+def match_state(config, lostanimals, foundanimals, shelteranimals, matches):
+    """
+    Returns the state kept after a full match for match_incremental
+    """
+    return {
+        "config":   config,
+        "lost":     fingerprints(lostanimals, LOST_FIELDS),
+        "found":    fingerprints(foundanimals, FOUND_FIELDS),
+        "shelter":  fingerprints(shelteranimals, SHELTER_FIELDS),
+        "matches":  [ dict([ (k, v) for k, v in m.__dict__.items() if k != "dbo" ]) for m in matches ]
+    }
+
+def match_incremental(dbo, lostanimals, foundanimals, shelteranimals, p, state):
+    """
+    Matches only the lost, found and shelter animals that are new or changed since the
+    last run (as recorded in state), keeping the previous matches for the others.
+    returns the list of LostFoundMatch objects a full match would return.
+    """
+    lostfp = fingerprints(lostanimals, LOST_FIELDS)
+    foundfp = fingerprints(foundanimals, FOUND_FIELDS)
+    shelterfp = fingerprints(shelteranimals, SHELTER_FIELDS)
+    def changed(fp, previous):
+        return set([ k for k, v in fp.items() if previous.get(k) != v ])
+    changedlost = changed(lostfp, state["lost"])
+    changedfound = changed(foundfp, state["found"])
+    changedshelter = changed(shelterfp, state["shelter"])
+    asm3.al.debug("incremental match: %d/%d lost, %d/%d found, %d/%d shelter changed" % (len(changedlost), len(lostfp), 
+        len(changedfound), len(foundfp), len(changedshelter), len(shelterfp)), "lostfound.match_incremental", dbo)
+    # Keep previous matches between animals that are unchanged and still being matched
+    matches = []
+    for d in state["matches"]:
+        if d["lid"] not in lostfp or d["lid"] in changedlost: continue
+        if d["fid"] != 0 and (d["fid"] not in foundfp or d["fid"] in changedfound): continue
+        if d["fanimalid"] != 0 and (d["fanimalid"] not in shelterfp or d["fanimalid"] in changedshelter): continue
+        m = LostFoundMatch(dbo)
+        m.__dict__.update(d)
+        matches.append(m)
+    # Changed lost animals against everything, unchanged lost animals against the changed found/shelter animals
+    matches += match_rows(dbo, [ x for x in lostanimals if x.ID in changedlost ], foundanimals, shelteranimals, p)
+    matches += match_rows(dbo, [ x for x in lostanimals if x.ID not in changedlost ], 
+        [ x for x in foundanimals if x.ID in changedfound ], [ x for x in shelteranimals if x.ID in changedshelter ], p)
+    # Put them in the same order as a full match
+    lostpos = { x.ID: i for i, x in enumerate(lostanimals) }
+    foundpos = { x.ID: i for i, x in enumerate(foundanimals) }
+    shelterpos = { x.ID: i for i, x in enumerate(shelteranimals) }
+    matches.sort(key=lambda m: (lostpos[m.lid], m.fid == 0, foundpos[m.fid] if m.fid != 0 else shelterpos[m.fanimalid]))
+    return matches
+
+def match(dbo, lostanimalid = 0, foundanimalid = 0, animalid = 0, limit = 0, incremental = False):
     """
     Performs a lost and found match by going through all lost animals
     lostanimalid:   Compare this lost animal against all found animals
     foundanimalid:  Compare all lost animals against this found animal
     animalid:       Compare all lost animals against this shelter animal
     limit:          Stop when we hit this many matches (or 0 for all)
+    incremental:    For a full match, only compare the animals that are new or
+                    changed since the last full match instead of all of them
     returns a list of LostFoundMatch objects
     """
-    l = dbo.locale
-    batch = []
-    matches = []
-    matchspecies = asm3.configuration.match_species(dbo)
-    matchbreed = asm3.configuration.match_breed(dbo)
-    matchage = asm3.configuration.match_age(dbo)
-    matchsex = asm3.configuration.match_sex(dbo)
-    matcharealost = asm3.configuration.match_area_lost(dbo)
-    matchfeatures = asm3.configuration.match_features(dbo)
-    matchpostcode = asm3.configuration.match_postcode(dbo)
-    matchcolour = asm3.configuration.match_colour(dbo)
-    matchmicrochip = asm3.configuration.match_microchip(dbo)
-    matchdatewithin2weeks = asm3.configuration.match_within2weeks(dbo)
-    matchmax = matchspecies + matchbreed + matchage + matchsex + \
-        matcharealost + matchfeatures + matchpostcode + matchcolour + \
-        matchmicrochip + matchdatewithin2weeks
-    matchpointfloor = asm3.configuration.match_point_floor(dbo)
-    includeshelter = asm3.configuration.match_include_shelter(dbo)
+    p = get_match_points(dbo)
     fullmatch = animalid == 0 and lostanimalid == 0 and foundanimalid == 0
     # Ignore records older than 6 months to keep things useful
     giveup = dbo.today(offset=-182)
@@ -371,19 +707,20 @@ def match(dbo, lostanimalid = 0, foundanimalid = 0, animalid = 0, limit = 0):
     if len(lostanimals) > 0:
         oldestdate = lostanimals[0].DATELOST
 
-    # Get the set of found animals for comparison
-    foundanimals = None
-    if foundanimalid == 0:
+    # Get the set of found animals for comparison (if an animal id
+    # has been given don't check found animals)
+    foundanimals = []
+    if animalid == 0 and foundanimalid == 0:
         foundanimals = dbo.query(get_foundanimal_query(dbo) + \
             " WHERE a.ReturnToOwnerDate Is Null" \
             " AND a.DateFound >= ? ", [oldestdate])
-    else:
+    elif animalid == 0:
         foundanimals = dbo.query(get_foundanimal_query(dbo) + " WHERE a.ID = ?", [foundanimalid])
 
     # Get the set of shelter animals for comparison - anything brought in recently
     # that's 1. still on shelter or 2. was released to wild, transferred or escaped
-    shelteranimals = None
-    if includeshelter:
+    shelteranimals = []
+    if p["shelter"]:
         if animalid == 0:
             shelteranimals = dbo.query(asm3.animal.get_animal_query(dbo) + " WHERE " + \
                 "(a.Archived = 0 OR a.ActiveMovementType IN (3,4,7)) " \
@@ -391,144 +728,33 @@ def match(dbo, lostanimalid = 0, foundanimalid = 0, animalid = 0, limit = 0):
         else:
             shelteranimals = dbo.query(asm3.animal.get_animal_query(dbo) + " WHERE a.ID = ?", [animalid])
 
-    asm3.asynctask.set_progress_max(dbo, len(lostanimals))
-    for la in lostanimals:
-        asm3.asynctask.increment_progress_value(dbo)
-        # Stop if we've hit our limit
-        if limit > 0 and len(matches) >= limit:
-            break
-        # Found animals (if an animal id has been given don't
-        # check found animals)
-        if animalid == 0:
-            for fa in foundanimals:
-                matchpoints = 0
-                if la["MICROCHIPNUMBER"] != "" and la["MICROCHIPNUMBER"] == fa["MICROCHIPNUMBER"]: matchpoints += matchmicrochip
-                if la["ANIMALTYPEID"] == fa["ANIMALTYPEID"]: matchpoints += matchspecies
-                if la["BREEDID"] == fa["BREEDID"]: matchpoints += matchbreed
-                if la["AGEGROUP"] == fa["AGEGROUP"]: matchpoints += matchage
-                if la["SEX"] == fa["SEX"]: matchpoints += matchsex
-                matchpoints += words(la["AREALOST"], fa["AREAFOUND"], matcharealost)
-                matchpoints += words(la["DISTFEAT"], fa["DISTFEAT"], matchfeatures)
-                if la["AREAPOSTCODE"] == fa["AREAPOSTCODE"]: matchpoints += matchpostcode
-                if la["BASECOLOURID"] == fa["BASECOLOURID"]: matchpoints += matchcolour
-                if date_diff_days(la["DATELOST"], fa["DATEFOUND"]) <= 14: matchpoints += matchdatewithin2weeks
-                if matchpoints > matchmax: matchpoints = matchmax
-                if matchpoints >= matchpointfloor:
-                    m = LostFoundMatch(dbo)
-                    m.lid = la["ID"]
-                    m.lcontactname = la["OWNERNAME"]
-                    m.lmicrochip = la["MICROCHIPNUMBER"]
-                    m.lcontactnumber = la["HOMETELEPHONE"]
-                    m.larealost = la["AREALOST"]
-                    m.lareapostcode = la["AREAPOSTCODE"]
-                    m.lagegroup = la["AGEGROUP"]
-                    m.lsexid = la["SEX"]
-                    m.lsexname = la["SEXNAME"]
-                    m.lspeciesid = la["ANIMALTYPEID"]
-                    m.lspeciesname = la["SPECIESNAME"]
-                    m.lbreedid = la["BREEDID"]
-                    m.lbreedname = la["BREEDNAME"]
-                    m.ldistinguishingfeatures = la["DISTFEAT"]
-                    m.lbasecolourid = la["BASECOLOURID"]
-                    m.lbasecolourname = la["BASECOLOURNAME"]
-                    m.ldatelost = la["DATELOST"]
-                    m.fid = fa["ID"]
-                    m.fanimalid = 0
-                    m.fcontactname = fa["OWNERNAME"]
-                    m.fmicrochip = fa["MICROCHIPNUMBER"]
-                    m.fcontactnumber = fa["HOMETELEPHONE"]
-                    m.fareafound = fa["AREAFOUND"]
-                    m.fareapostcode = fa["AREAPOSTCODE"]
-                    m.fagegroup = fa["AGEGROUP"]
-                    m.fsexid = fa["SEX"]
-                    m.fsexname = fa["SEXNAME"]
-                    m.fspeciesid = fa["ANIMALTYPEID"]
-                    m.fspeciesname = fa["SPECIESNAME"]
-                    m.fbreedid = fa["BREEDID"]
-                    m.fbreedname = fa["BREEDNAME"]
-                    m.fdistinguishingfeatures = fa["DISTFEAT"]
-                    m.fbasecolourid = fa["BASECOLOURID"]
-                    m.fbasecolourname = fa["BASECOLOURNAME"]
-                    m.fdatefound = fa["DATEFOUND"]
-                    m.matchpoints = int((float(matchpoints) / float(matchmax)) * 100.0)
-                    matches.append(m)
-                    if fullmatch: 
-                        batch.append(m.toParams())
-                    if limit > 0 and len(matches) >= limit:
-                        break
-
-        # Shelter animals
-        if includeshelter:
-            for a in shelteranimals:
-                matchpoints = 0
-                if la["MICROCHIPNUMBER"] != "" and la["MICROCHIPNUMBER"] == a["IDENTICHIPNUMBER"]: matchpoints += matchmicrochip
-                if la["ANIMALTYPEID"] == a["SPECIESID"]: matchpoints += matchspecies
-                if la["BREEDID"] == a["BREEDID"] or la["BREEDID"] == a["BREED2ID"]: matchpoints += matchbreed
-                if la["BASECOLOURID"] == a["BASECOLOURID"]: matchpoints += matchcolour
-                if la["AGEGROUP"] == a["AGEGROUP"]: matchpoints += matchage
-                if la["SEX"] == a["SEX"]: matchpoints += matchsex
-                matchpoints += words(la["AREALOST"], a["ORIGINALOWNERADDRESS"], matcharealost)
-                matchpoints += words(la["DISTFEAT"], a["MARKINGS"], matchfeatures)
-                if asm3.utils.nulltostr(a["ORIGINALOWNERPOSTCODE"]).find(la["AREAPOSTCODE"]) != -1: matchpoints += matchpostcode
-                if date_diff_days(la["DATELOST"], a["DATEBROUGHTIN"]) <= 14: matchpoints += matchdatewithin2weeks
-                if matchpoints > matchmax: matchpoints = matchmax
-                if matchpoints >= matchpointfloor:
-                    m = LostFoundMatch(dbo)
-                    m.lid = la["ID"]
-                    m.lcontactname = la["OWNERNAME"]
-                    m.lmicrochip = la["MICROCHIPNUMBER"]
-                    m.lcontactnumber = la["HOMETELEPHONE"]
-                    m.larealost = la["AREALOST"]
-                    m.lareapostcode = la["AREAPOSTCODE"]
-                    m.lagegroup = la["AGEGROUP"]
-                    m.lsexid = la["SEX"]
-                    m.lsexname = la["SEXNAME"]
-                    m.lspeciesid = la["ANIMALTYPEID"]
-                    m.lspeciesname = la["SPECIESNAME"]
-                    m.lbreedid = la["BREEDID"]
-                    m.lbreedname = la["BREEDNAME"]
-                    m.ldistinguishingfeatures = la["DISTFEAT"]
-                    m.lbasecolourid = la["BASECOLOURID"]
-                    m.lbasecolourname = la["BASECOLOURNAME"]
-                    m.ldatelost = la["DATELOST"]
-                    m.fid = 0
-                    m.fanimalid = a["ID"]
-                    m.fcontactname = _("Shelter animal {0} '{1}'", l).format(a["CODE"], a["ANIMALNAME"])
-                    m.fmicrochip = a["IDENTICHIPNUMBER"]
-                    m.fcontactnumber = a["SPECIESNAME"]
-                    m.fareafound = "%s, %s" % (a["ORIGINALOWNERADDRESS"], a["ORIGINALOWNERTOWN"])
-                    m.fareapostcode = a["ORIGINALOWNERPOSTCODE"]
-                    m.fagegroup = a["AGEGROUP"]
-                    m.fsexid = a["SEX"]
-                    m.fsexname = a["SEXNAME"]
-                    m.fspeciesid = a["SPECIESID"]
-                    m.fspeciesname = a["SPECIESNAME"]
-                    m.fbreedid = a["BREEDID"]
-                    m.fbreedname = a["BREEDNAME"]
-                    m.fdistinguishingfeatures = a["MARKINGS"]
-                    m.fbasecolourid = a["BASECOLOURID"]
-                    m.fbasecolourname = a["BASECOLOURNAME"]
-                    m.fdatefound = a["DATEBROUGHTIN"]
-                    m.matchpoints = int((float(matchpoints) / float(matchmax)) * 100.0)
-                    matches.append(m)
-                    if fullmatch:
-                        batch.append(m.toParams())
-                    if limit > 0 and len(matches) >= limit:
-                        break
-
-    if fullmatch:
-        dbo.execute("DELETE FROM animallostfoundmatch")
-        sql = "INSERT INTO animallostfoundmatch (AnimalLostID, AnimalFoundID, AnimalID, LostContactName, LostContactNumber, " \
-            "LostArea, LostPostcode, LostAgeGroup, LostSex, LostSpeciesID, LostBreedID, LostFeatures, LostBaseColourID, LostDate, " \
-            "LostMicrochipNumber, FoundMicrochipNumber, " \
-            "FoundContactName, FoundContactNumber, FoundArea, FoundPostcode, FoundAgeGroup, FoundSex, FoundSpeciesID, FoundBreedID, " \
-            "FoundFeatures, FoundBaseColourID, FoundDate, MatchPoints) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
-        if len(batch) > 0:
-            dbo.execute_many(sql, batch)
+    if not fullmatch:
+        return match_rows(dbo, lostanimals, foundanimals, shelteranimals, p, limit)
+
+    # A full match keeps all matches in the animallostfoundmatch table, along with
+    # the state needed to match incrementally next time.
+    config = [ p, dbo.locale ]
+    state = asm3.cachedisk.get("lostfound_matchstate", dbo.database, expectedtype=dict)
+    if incremental and state is not None and state["config"] == config:
+        matches = match_incremental(dbo, lostanimals, foundanimals, shelteranimals, p, state)
+    else:
+        matches = match_rows(dbo, lostanimals, foundanimals, shelteranimals, p)
+    state = match_state(config, lostanimals, foundanimals, shelteranimals, matches)
+    asm3.cachedisk.put("lostfound_matchstate", dbo.database, state, MATCH_STATE_TTL)
+    if limit > 0: matches = matches[:limit]
+
+    dbo.execute("DELETE FROM animallostfoundmatch")
+    sql = "INSERT INTO animallostfoundmatch (AnimalLostID, AnimalFoundID, AnimalID, LostContactName, LostContactNumber, " \
+        "LostArea, LostPostcode, LostAgeGroup, LostSex, LostSpeciesID, LostBreedID, LostFeatures, LostBaseColourID, LostDate, " \
+        "LostMicrochipNumber, FoundMicrochipNumber, " \
+        "FoundContactName, FoundContactNumber, FoundArea, FoundPostcode, FoundAgeGroup, FoundSex, FoundSpeciesID, FoundBreedID, " \
+        "FoundFeatures, FoundBaseColourID, FoundDate, MatchPoints) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+    if len(matches) > 0:
+        dbo.execute_many(sql, [ m.toParams() for m in matches ])
 
     return matches
 
-def match_report(dbo, username = "system", lostanimalid = 0, foundanimalid = 0, animalid = 0, limit = 0):
+def match_report(dbo, username = "system", lostanimalid = 0, foundanimalid = 0, animalid = 0, limit = 0, incremental = False):
     """
     Generates the match report and returns it as a string
     """
@@ -545,7 +771,7 @@ def match_report(dbo, username = "system", lostanimalid = 0, foundanimalid = 0,
     def hr(): 
         return "<hr />"
     lastid = 0
-    matches = match(dbo, lostanimalid, foundanimalid, animalid, limit)
+    matches = match(dbo, lostanimalid, foundanimalid, animalid, limit, incremental)
     if len(matches) > 0:
         for m in matches:
             if lastid != m.lid:
@@ -594,10 +820,11 @@ def lostfound_last_match_count(dbo):
 
 def update_match_report(dbo):
     """
-    Updates the latest version of the lost/found match report 
+    Updates the latest version of the lost/found match report, only
+    matching the animals that have changed since the last update
     """
     asm3.al.debug("updating lost/found match report", "lostfound.update_match_report", dbo)
-    s = match_report(dbo, limit=1000)
+    s = match_report(dbo, limit=1000, incremental=True)
     count = lostfound_last_match_count(dbo)
     asm3.cachedisk.put("lostfound_report", dbo.database, s, 86400)
     asm3.cachedisk.put("lostfound_lastmatchcount", dbo.database, count, 86400)
@@ -813,6 +1040,7 @@ def delete_lostanimal(dbo, username, aid):
     """
     Deletes a lost animal
     """
+    asm3.media.delete_thumbnails_for_link(dbo, asm3.media.LOSTANIMAL, aid)
     dbo.delete("media", "LinkID=%d AND LinkTypeID=%d" % (aid, asm3.media.LOSTANIMAL), username)
     dbo.delete("diary", "LinkID=%d AND LinkType=%d" % (aid, asm3.diary.LOSTANIMAL), username)
     dbo.delete("log", "LinkID=%d AND LinkType=%d" % (aid, asm3.log.LOSTANIMAL), username)
@@ -824,6 +1052,7 @@ def delete_foundanimal(dbo, username, aid):
     """
     Deletes a found animal
     """
+    asm3.media.delete_thumbnails_for_link(dbo, asm3.media.FOUNDANIMAL, aid)
     dbo.delete("media", "LinkID=%d AND LinkTypeID=%d" % (aid, asm3.media.FOUNDANIMAL), username)
     dbo.delete("diary", "LinkID=%d AND LinkType=%d" % (aid, asm3.diary.FOUNDANIMAL), username)
     dbo.delete("log", "LinkID=%d AND LinkType=%d" % (aid, asm3.log.FOUNDANIMAL), username)
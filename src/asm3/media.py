@@ -26,6 +26,7 @@ MEDIATYPE_DOCUMENT_LINK = 1
 MEDIATYPE_VIDEO_LINK = 2
 
 DEFAULT_RESIZE_SPEC = "640x640" # If no valid resize spec is configured, the default to use
+THUMBNAIL_PATH = "/thumbnails" # DBFS folder where pre-scaled thumbnails of image media are stored
 MAX_PDF_PAGES = 50 # Do not scale PDFs with more than this many pages
 
 def mime_type(filename):
@@ -188,7 +189,7 @@ def get_image_file_data(dbo, mode, iid, seq = 0, justdate = False):
     def thumb_mrec(mm):
         if mm is None: return thumb_nopic()
         if justdate: return mm.DATE
-        return (mm.DATE, scale_image(asm3.dbfs.get_string_id(dbo, mm.DBFSID), asm3.configuration.thumbnail_size(dbo)))
+        return (mm.DATE, get_thumbnail(dbo, mm.DBFSID))
 
     if mode == "animal":
         if seq == 0:
@@ -353,6 +354,10 @@ def attach_file_from_form(dbo, username, linktype, linkid, post):
     path = get_dbfs_path(linkid, linktype)
     dbfsid = asm3.dbfs.put_string(dbo, medianame, path, filedata)
 
+    # Generate the thumbnail for images now so it's ready to serve
+    if ispicture:
+        create_thumbnail(dbo, dbfsid, imagedata=filedata)
+
     # Are the notes for an image blank and we're defaulting them from animal comments?
     if comments == "" and ispicture and linktype == ANIMAL and asm3.configuration.auto_media_notes(dbo):
         comments = asm3.animal.get_comments(dbo, int(linkid))
@@ -574,10 +579,14 @@ def update_file_content(dbo, username, mid, content):
     Updates the dbfs content for the file pointed to by media record mid
     content should be a bytes string
     """
-    m = dbo.first_row(dbo.query("SELECT DBFSID, MediaName FROM media WHERE ID=?", [mid]))
+    m = dbo.first_row(dbo.query("SELECT DBFSID, MediaName, MediaMimeType FROM media WHERE ID=?", [mid]))
     if m is None: raise IOError("media id %s does not exist" % mid)
     if m.DBFSID == 0: raise IOError("cannot update contents of DBFSID 0")
     asm3.dbfs.put_string_id(dbo, m.DBFSID, m.MEDIANAME, content)
+    # Any thumbnails of the old content are now stale
+    delete_thumbnails(dbo, m.DBFSID)
+    if m.MEDIAMIMETYPE == "image/jpeg":
+        create_thumbnail(dbo, m.DBFSID, imagedata=content)
     dbo.update("media", mid, { "Date": dbo.now(), "MediaSize": len(content) }, username, setLastChanged=False)
 
 def update_media_from_form(dbo, username, post):
@@ -598,6 +607,7 @@ def delete_media(dbo, username, mid):
     if not mr: return
     try:
         asm3.dbfs.delete_id(dbo, mr.DBFSID)
+        delete_thumbnails(dbo, mr.DBFSID)
     except Exception as err:
         asm3.al.error(str(err), "media.delete_media", dbo)
     dbo.delete("media", mid, username)
@@ -629,6 +639,71 @@ def rotate_media(dbo, username, mid, clockwise = True):
     update_file_content(dbo, username, mid, imagedata)
     asm3.audit.edit(dbo, username, "media", mid, "", "media id %d rotated, clockwise=%s" % (mid, str(clockwise)))
 
+def get_thumbnail_name(dbfsid, resizespec):
+    """ Returns the DBFS name of the thumbnail for dbfsid at resizespec """
+    return "%d-%s.jpg" % (int(dbfsid), resizespec)
+
+def get_thumbnail(dbo, dbfsid, resizespec = None):
+    """
+    Returns a thumbnail of the image in dbfsid scaled to resizespec 
+    (or the configured thumbnail size if not given).
+    The thumbnail is served from the thumbnail store, and created 
+    and stored if it does not exist yet.
+    """
+    if resizespec is None: resizespec = asm3.configuration.thumbnail_size(dbo)
+    thumbdata = asm3.dbfs.get_string(dbo, get_thumbnail_name(dbfsid, resizespec), THUMBNAIL_PATH)
+    if thumbdata is None or len(thumbdata) == 0:
+        thumbdata = create_thumbnail(dbo, dbfsid, resizespec)
+    return thumbdata
+
+def create_thumbnail(dbo, dbfsid, resizespec = None, imagedata = None):
+    """
+    Scales the image in dbfsid to resizespec (or the configured thumbnail
+    size) and puts it in the thumbnail store, replacing any existing one.
+    imagedata: The content of dbfsid if it is already loaded.
+    Returns the thumbnail image data.
+    """
+    if resizespec is None: resizespec = asm3.configuration.thumbnail_size(dbo)
+    if imagedata is None: imagedata = asm3.dbfs.get_string_id(dbo, dbfsid)
+    if imagedata is None or len(imagedata) == 0: return imagedata
+    thumbdata = scale_image(imagedata, resizespec)
+    asm3.dbfs.put_string(dbo, get_thumbnail_name(dbfsid, resizespec), THUMBNAIL_PATH, thumbdata)
+    return thumbdata
+
+def create_all_thumbnails(dbo):
+    """
+    Creates missing thumbnails at the configured thumbnail size 
+    for all image media in the database.
+    """
+    resizespec = asm3.configuration.thumbnail_size(dbo)
+    existing = set(asm3.dbfs.list_contents(dbo, THUMBNAIL_PATH))
+    mp = dbo.query("SELECT DBFSID FROM media WHERE MediaMimeType = 'image/jpeg' AND DBFSID > 0 ORDER BY ID DESC")
+    total = 0
+    for i, m in enumerate(mp):
+        if get_thumbnail_name(m.DBFSID, resizespec) in existing: continue
+        try:
+            create_thumbnail(dbo, m.DBFSID, resizespec)
+            total += 1
+        except Exception as err:
+            asm3.al.error("failed creating thumbnail for dbfsid %s: %s" % (m.DBFSID, err), "media.create_all_thumbnails", dbo)
+        if total > 0 and total % 100 == 0:
+            asm3.al.debug("created %d thumbnails (%d of %d)" % (total, i, len(mp)), "media.create_all_thumbnails", dbo)
+    asm3.al.debug("created %d thumbnails for %d images" % (total, len(mp)), "media.create_all_thumbnails", dbo)
+
+def delete_thumbnails(dbo, dbfsid):
+    """
+    Removes all stored thumbnails of dbfsid (at any size)
+    """
+    asm3.dbfs.delete_like(dbo, "%d-%%" % int(dbfsid), THUMBNAIL_PATH)
+
+def delete_thumbnails_for_link(dbo, linktype, linkid):
+    """
+    Removes the stored thumbnails of all media attached to a record.
+    Call before deleting the record's media.
+    """
+    for m in dbo.query("SELECT DBFSID FROM media WHERE LinkID=? AND LinkTypeID=? AND DBFSID > 0", (linkid, linktype)):
+        delete_thumbnails(dbo, m.DBFSID)
+
 def scale_image(imagedata, resizespec):
     """
     Produce a scaled version of an image. 
@@ -730,6 +805,7 @@ def remove_expired_media(dbo, username = "system"):
     rows = dbo.query("SELECT ID, DBFSID FROM media WHERE RetainUntil Is Not Null AND RetainUntil < ?", [ dbo.today() ])
     for r in rows:
         asm3.dbfs.delete_id(dbo, r.dbfsid) 
+        delete_thumbnails(dbo, r.dbfsid)
     dbo.execute("DELETE FROM media WHERE RetainUntil Is Not Null AND RetainUntil < ?", [ dbo.today() ])
     asm3.al.debug("removed %d expired media items (retain until)" % len(rows), "media.remove_expired_media", dbo)
     if asm3.configuration.auto_remove_document_media(dbo):
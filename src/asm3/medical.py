@@ -801,8 +801,9 @@ def insert_treatments(dbo, username, amid, requireddate, isstart = True):
     norecs = am.TIMINGRULE
     if norecs == 0: norecs = 1
 
+    rows = []
     for x in range(1, norecs+1):
-        dbo.insert("animalmedicaltreatment", {
+        rows.append({
             "AnimalID":         am.ANIMALID,
             "AnimalMedicalID":  amid,
             "DateRequired":     requireddate,
@@ -811,7 +812,8 @@ def insert_treatments(dbo, username, amid, requireddate, isstart = True):
             "TreatmentNumber":  x,
             "TotalTreatments":  norecs,
             "Comments":         ""
-        }, username)
+        })
+    dbo.insert_many("animalmedicaltreatment", rows, username)
 
     # Update the number of treatments given and remaining
     calculate_given_remaining(dbo, amid)
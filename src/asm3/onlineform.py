@@ -567,8 +567,9 @@ def clone_onlineform(dbo, username, formid):
         "*Description":         f.DESCRIPTION
     }, username, setCreated=False)
 
+    rows = []
     for ff in get_onlineformfields(dbo, formid):
-        dbo.insert("onlineformfield", {
+        rows.append({
             "OnlineFormID":     nfid,
             "FieldName":        ff.FIELDNAME,
             "FieldType":        ff.FIELDTYPE,
@@ -579,6 +580,7 @@ def clone_onlineform(dbo, username, formid):
             "Lookups":          ff.LOOKUPS,
             "*Tooltip":          ff.TOOLTIP
         })
+    dbo.insert_many("onlineformfield", rows)
 
 def insert_onlineformfield_from_form(dbo, username, post):
     """
@@ -647,8 +649,19 @@ def insert_onlineformincoming_from_form(dbo, post, remoteip):
     animalnamelabel = ""
     animalname = ""
     images = []
+    rows = []
     post.data["formreceived"] = "%s %s" % (asm3.i18n.python2display(dbo.locale, posteddate), asm3.i18n.format_time(posteddate))
 
+    # Read the definitions of all the form fields referenced by the posted keys in one go
+    fids = set()
+    for k in post.data.keys():
+        if k.find("_") != -1: fids.add(asm3.utils.cint(k[k.rfind("_")+1:]))
+    fids.discard(0)
+    formfields = {}
+    if len(fids) > 0:
+        for fld in dbo.query("SELECT ID, FieldType, Label, Tooltip, DisplayIndex FROM onlineformfield WHERE ID IN (%s)" % ",".join(str(x) for x in fids)):
+            formfields[fld.ID] = fld
+
     for k, v in post.data.items():
 
         if k not in IGNORE_FIELDS and not k.startswith("asmSelect"):
@@ -665,7 +678,7 @@ def insert_onlineformincoming_from_form(dbo, post, remoteip):
                 fieldname = k[0:k.rfind("_")]
                 v = v.strip() # no reason for whitespace, can't see it in preview and in address fields it makes a mess
                 if fid != 0:
-                    fld = dbo.first_row(dbo.query("SELECT FieldType, Label, Tooltip, DisplayIndex FROM onlineformfield WHERE ID = ?", [fid]))
+                    fld = formfields.get(fid)
                     if fld is not None:
                         label = fld.LABEL
                         displayindex = fld.DISPLAYINDEX
@@ -693,17 +706,13 @@ def insert_onlineformincoming_from_form(dbo, post, remoteip):
                         if fieldtype == FIELDTYPE_CHECKBOX and asm3.utils.nulltostr(tooltip) != "" and (v == "checked" or v == "on"):
                             if flags != "": flags += ","
                             flags += tooltip
-                            dbo.update("onlineformincoming", "CollationID=%s" % collationid, {
-                                "Flags":    flags
-                            })
                         # We decode images and put them into an images list so that they can
                         # be included as attachments with confirmation emails.
                         if fieldtype == FIELDTYPE_IMAGE and v.startswith("data:image/jpeg"):
                             # Remove prefix of data:image/jpeg;base64, and decode
                             images.append( ("%s.jpg" % fieldname, "image/jpeg", asm3.utils.base64decode(v[v.find(",")+1:])) )
 
-            # Do the insert
-            dbo.insert("onlineformincoming", {
+            rows.append({
                 "CollationID":      collationid,
                 "FormName":         formname,
                 "PostedDate":       posteddate,
@@ -713,7 +722,13 @@ def insert_onlineformincoming_from_form(dbo, post, remoteip):
                 "DisplayIndex":     displayindex,
                 "Host":             remoteip,
                 asm3.utils.iif(fieldtype == FIELDTYPE_RAWMARKUP, "*Value", "Value"): v # don't XSS escape raw markup by prefixing fieldname with *
-            }, generateID=False, setCreated=False)
+            })
+
+    # Write all the fields at once. Every row gets the final set of flags 
+    # gathered from checkbox fields above.
+    for r in rows:
+        r["Flags"] = flags
+    dbo.insert_many("onlineformincoming", rows, generateID=False, setCreated=False)
 
     # Sort out the preview of the first few fields
     fieldssofar = 0
@@ -1050,8 +1065,7 @@ def create_person(dbo, username, collationid):
         personid = asm3.person.insert_person_from_form(dbo, asm3.utils.PostedData(d, dbo.locale), username)
         # Since we created a brand new person, try and get a geocode for the address if present
         if "address" in d and "town" in d and "county" in d and "postcode" in d:
-            latlon = asm3.geo.get_lat_long(dbo, d["address"], d["town"], d["county"], d["postcode"])
-            if latlon is not None: asm3.person.update_latlong(dbo, personid, latlon)
+            asm3.geo.queue_lat_long(dbo, "owner", personid, d["address"], d["town"], d["county"], d["postcode"])
     personname = asm3.person.get_person_name_code(dbo, personid)
     attach_form(dbo, username, asm3.media.PERSON, personid, collationid)
     # Was there a reserveanimalname field? If so, create reservation(s) to the person if possible
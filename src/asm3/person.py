@@ -15,9 +15,10 @@ import asm3.reports
 import asm3.users
 import asm3.utils
 from asm3.i18n import _, add_days, date_diff_days, format_time, python2display, subtract_years, now
-from asm3.sitedefs import GEO_BATCH, GEO_LIMIT
+from asm3.sitedefs import DB_WRITE_BATCH_SIZE, GEO_BATCH, GEO_LIMIT
 
 import datetime
+import re
 
 ASCENDING = 0
 DESCENDING = 1
@@ -85,9 +86,10 @@ def embellish_adoption_warnings(dbo, p):
         p.INCIDENT = warn.INCIDENT
     return p
 
-def get_person_similar(dbo, email = "", mobile = "", surname = "", forenames = "", address = ""):
+def get_person_similar(dbo, email = "", mobile = "", surname = "", forenames = "", address = "", index = None):
     """
     Returns people with similar email, mobile, names and addresses to those supplied.
+    index: A PersonIndex to look the people up in instead of querying for them
     """
     # Consider the first word rather than first address line - typically house
     # number/name and unlikely to be the same for different people
@@ -99,6 +101,8 @@ def get_person_similar(dbo, email = "", mobile = "", surname = "", forenames = "
     if forenames.find(" ") != -1: forenames = forenames[0:forenames.find(" ")]
     surname = surname.replace("'", "`").lower().strip()
     email = email.replace("'", "`").lower().strip()
+    if index is not None and index.can_find(email, surname, forenames, address):
+        return index.find(dbo, email, mobile, surname, forenames, address)
     eq = []
     mq = []
     if email != "" and email.find("@") != -1 and email.find(".") != -1 and len(email) > 6:
@@ -109,6 +113,76 @@ def get_person_similar(dbo, email = "", mobile = "", surname = "", forenames = "
         "LOWER(o.OwnerForeNames) LIKE ? AND LOWER(o.OwnerAddress) LIKE ?", (surname, forenames + "%", address + "%"))
     return eq + mq + per
 
+class PersonIndex(object):
+    """
+    Indexes everyone in the owner table by the values get_person_similar 
+    compares (lower case email address, mobile number digits and lower case 
+    surname), so that similar people can be found for lots of records (eg: 
+    the rows of an import) without querying the owner table for each one.
+    Call update() after inserting or changing a person to keep it current.
+    """
+    def __init__(self, dbo):
+        self.people = {} # ID: (email, mobile, surname, forenames, address)
+        self.email = {}
+        self.mobile = {}
+        self.surname = {}
+        for r in dbo.query("SELECT ID, EmailAddress, MobileTelephone, OwnerSurname, OwnerForeNames, OwnerAddress FROM owner"):
+            self.add(r)
+
+    def add(self, r):
+        def norm(v):
+            if v is None: return None
+            return v.replace("'", "`").lower()
+        mobile = r.MOBILETELEPHONE is not None and re.sub(r"[^0-9]", "", r.MOBILETELEPHONE) or None
+        keys = (norm(r.EMAILADDRESS), mobile, norm(r.OWNERSURNAME), norm(r.OWNERFORENAMES), norm(r.OWNERADDRESS))
+        self.people[r.ID] = keys
+        for index, k in ((self.email, keys[0]), (self.mobile, keys[1]), (self.surname, keys[2])):
+            if k is None: continue
+            if k in index: index[k].add(r.ID)
+            else: index[k] = set([ r.ID ])
+
+    def remove(self, personid):
+        keys = self.people.pop(personid, None)
+        if keys is None: return
+        for index, k in ((self.email, keys[0]), (self.mobile, keys[1]), (self.surname, keys[2])):
+            if k in index: index[k].discard(personid)
+
+    def update(self, dbo, personid):
+        """ Reads person personid again after it has been inserted, changed or deleted """
+        self.remove(personid)
+        for r in dbo.query("SELECT ID, EmailAddress, MobileTelephone, OwnerSurname, OwnerForeNames, OwnerAddress FROM owner WHERE ID = ?", [personid]):
+            self.add(r)
+
+    def can_find(self, email, surname, forenames, address):
+        """ Returns False if any of the normalised values have wildcards that LIKE would treat differently """
+        for v in (email, surname, forenames, address):
+            if v.find("%") != -1 or v.find("_") != -1 or v.find("\\") != -1: return False
+        return True
+
+    def find_ids(self, email, mobile, surname, forenames, address):
+        """ Returns the IDs get_person_similar would for the normalised values given """
+        eq = []
+        mq = []
+        if email != "" and email.find("@") != -1 and email.find(".") != -1 and len(email) > 6:
+            eq = sorted(self.email.get(email, []))
+        if mobile != "" and len(mobile) > 6:
+            mq = sorted(self.mobile.get(str(asm3.utils.atoi(mobile)), []))
+        per = []
+        for pid in sorted(self.surname.get(surname, [])):
+            keys = self.people[pid]
+            if keys[3] is not None and keys[3].startswith(forenames) and keys[4] is not None and keys[4].startswith(address):
+                per.append(pid)
+        return eq + mq + per
+
+    def find(self, dbo, email, mobile, surname, forenames, address):
+        """ Returns the people rows get_person_similar would for the normalised values given """
+        ids = self.find_ids(email, mobile, surname, forenames, address)
+        if len(ids) == 0: return []
+        rows = {}
+        for r in dbo.query(get_person_query(dbo) + " WHERE o.ID IN (%s)" % ",".join([ str(x) for x in set(ids) ])):
+            rows[r.ID] = r
+        return [ rows[x] for x in ids if x in rows ]
+
 def get_person_name(dbo, personid):
     """
     Returns the full person name for an id
@@ -673,17 +747,16 @@ def update_owner_names(dbo):
     own = dbo.query("SELECT ID, OwnerCode, OwnerType, OwnerTitle, OwnerInitials, OwnerForeNames, OwnerSurname FROM owner")
     nameformat = asm3.configuration.owner_name_format(dbo)
     asm3.asynctask.set_progress_max(dbo, len(own))
-    for o in own:
-        if o.ownercode is None or o.ownercode == "":
-            dbo.update("owner", o.id, { 
-                "OwnerCode": calculate_owner_code(o.id, o.ownersurname),
-                "OwnerName": calculate_owner_name(dbo, o.ownertype, o.ownertitle, o.ownerinitials, o.ownerforenames, o.ownersurname, nameformat)
-            }, setRecordVersion=False, setLastChanged=False, writeAudit=False)
-        else:
-            dbo.update("owner", o.id, { 
-                "OwnerName": calculate_owner_name(dbo, o.ownertype, o.ownertitle, o.ownerinitials, o.ownerforenames, o.ownersurname, nameformat)
-            }, setRecordVersion=False, setLastChanged=False, writeAudit=False)
-        asm3.asynctask.increment_progress_value(dbo)
+    # Updates are sent DB_WRITE_BATCH_SIZE people at a time
+    for i in range(0, len(own), DB_WRITE_BATCH_SIZE):
+        rows = []
+        for o in own[i:i+DB_WRITE_BATCH_SIZE]:
+            values = { "OwnerName": calculate_owner_name(dbo, o.ownertype, o.ownertitle, o.ownerinitials, o.ownerforenames, o.ownersurname, nameformat) }
+            if o.ownercode is None or o.ownercode == "":
+                values["OwnerCode"] = calculate_owner_code(o.id, o.ownersurname)
+            rows.append((o.id, values))
+        dbo.update_many("owner", rows, setRecordVersion=False, setLastChanged=False, writeAudit=False)
+        asm3.asynctask.set_progress_value(dbo, i + len(rows))
     asm3.al.debug("regenerated %d owner names and codes" % len(own), "person.update_owner_names", dbo)
     return "OK %d" % len(own)
 
@@ -783,7 +856,7 @@ def insert_person_from_form(dbo, post, username, geocode=True):
             "%s" % (newvalue))
 
     # Look up a geocode for the person's address
-    if geocode: update_geocode(dbo, pid, "", post["address"], post["town"], post["county"], post["postcode"], post["country"])
+    if geocode: update_geocode(dbo, pid, "", post["address"], post["town"], post["county"], post["postcode"], post["country"], background=True)
 
     return pid
 
@@ -868,7 +941,7 @@ def update_person_from_form(dbo, post, username, geocode=True):
     asm3.additional.save_values_for_link(dbo, post, pid, "person")
 
     # Check/update the geocode for the person's address
-    if geocode: update_geocode(dbo, pid, post["latlong"], post["address"], post["town"], post["county"], post["postcode"], post["country"])
+    if geocode: update_geocode(dbo, pid, post["latlong"], post["address"], post["town"], post["county"], post["postcode"], post["country"], background=True)
 
 def update_remove_flag(dbo, username, personid, flag):
     """
@@ -1000,6 +1073,52 @@ def merge_flags(dbo, username, personid, flags):
     update_flags(dbo, username, personid, merged)
     return "|".join(merged) + "|"
 
+def merge_reparent_tables():
+    """
+    Returns the satellite records moved to a person when another is merged into it
+    as a list of (table, field, link type field, link type or -1, set last changed)
+    """
+    return [
+        ("adoption", "OwnerID", "", -1, True),
+        ("adoption", "RetailerID", "", -1, True),
+        ("adoption", "ReturnedByOwnerID", "", -1, True),
+        ("animal", "OriginalOwnerID", "", -1, True),
+        ("animal", "OwnerID", "", -1, True),
+        ("animal", "BroughtInByOwnerID", "", -1, True),
+        ("animal", "AdoptionCoordinatorID", "", -1, True),
+        ("animal", "OwnersVetID", "", -1, True),
+        ("animal", "CurrentVetID", "", -1, True),
+        ("animal", "NeuteredByVetID", "", -1, True),
+        ("animalcontrol", "CallerID", "", -1, True),
+        ("animalcontrol", "OwnerID", "", -1, True),
+        ("animalcontrol", "Owner2ID", "", -1, True),
+        ("animalcontrol", "Owner3ID", "", -1, True),
+        ("animalcontrol", "VictimID", "", -1, True),
+        ("animaltransport", "DriverOwnerID", "", -1, True),
+        ("animaltransport", "PickupOwnerID", "", -1, True),
+        ("animaltransport", "DropoffOwnerID", "", -1, True),
+        ("animallost", "OwnerID", "", -1, True),
+        ("animalfound", "OwnerID", "", -1, True),
+        ("animalmedicaltreatment", "AdministeringVetID", "", -1, True),
+        ("animaltest", "AdministeringVetID", "", -1, True),
+        ("animalvaccination", "AdministeringVetID", "", -1, True),
+        ("animalwaitinglist", "OwnerID", "", -1, True),
+        ("clinicappointment", "OwnerID", "", -1, True),
+        ("ownercitation", "OwnerID", "", -1, True),
+        ("ownerdonation", "OwnerID", "", -1, True),
+        ("ownerinvestigation", "OwnerID", "", -1, True),
+        ("ownerlicence", "OwnerID", "", -1, True),
+        ("ownerlookingfor", "OwnerID", "", -1, False),
+        ("ownertraploan", "OwnerID", "", -1, True),
+        ("ownervoucher", "OwnerID", "", -1, True),
+        ("users", "OwnerID", "", -1, True),
+        ("media", "LinkID", "LinkTypeID", asm3.media.PERSON, False),
+        ("diary", "LinkID", "LinkType", asm3.diary.PERSON, True),
+        ("log", "LinkID", "LinkType", asm3.log.PERSON, True)
+    ]
+
+MERGE_BATCH_SIZE = 50 # Number of people merged in each transaction by merge_people
+
 def merge_person(dbo, username, personid, mergepersonid):
     """
     Reparents all satellite records of mergepersonid onto
@@ -1014,115 +1133,112 @@ def merge_person(dbo, username, personid, mergepersonid):
     if personid == 0 or mergepersonid == 0:
         raise asm3.utils.ASMValidationError("Internal error: Cannot merge ID 0")
 
-    def reparent(table, field, linktypefield = "", linktype = -1, lastchanged = True):
+    merge_people(dbo, username, [ (personid, [ mergepersonid ]) ])
+
+def merge_people(dbo, username, clusters):
+    """
+    Merges clusters of people. clusters is a list of (personid, [ mergepersonids ]).
+    The contact info, flags and GDPR flags of each mergepersonid are merged into 
+    personid in turn. The satellite records of up to MERGE_BATCH_SIZE people are then 
+    reparented onto their personid in a single transaction, with one UPDATE for each 
+    table and cluster, and the merged people are deleted.
+    """
+    def merge_details(personid, mergepersonid):
+        mp = get_person(dbo, mergepersonid)
+        mp["address"] = mp.OWNERADDRESS
+        mp["town"] = mp.OWNERTOWN
+        mp["county"] = mp.OWNERCOUNTY
+        mp["postcode"] = mp.OWNERPOSTCODE
+        mp["country"] = mp.OWNERCOUNTRY
+        mp["hometelephone"] = mp.HOMETELEPHONE
+        mp["worktelephone"] = mp.WORKTELEPHONE
+        mp["mobiletelephone"] = mp.MOBILETELEPHONE
+        mp["emailaddress"] = mp.EMAILADDRESS
+        merge_person_details(dbo, username, personid, mp)
+        merge_flags(dbo, username, personid, mp.ADDITIONALFLAGS)
+        merge_gdpr_flags(dbo, username, personid, mp.GDPRCONTACTOPTIN)
+
+    def reparent_statements(personid, mergepersonids):
+        ids = ",".join([ str(x) for x in mergepersonids ])
+        stmts = []
+        for table, field, linktypefield, linktype, lastchanged in merge_reparent_tables():
+            values = { field: personid }
+            if lastchanged:
+                values["LastChangedBy"] = username
+                values["LastChangedDate"] = dbo.now()
+                values["RecordVersion"] = dbo.get_recordversion()
+            values = dbo.encode_str_before_write(values)
+            where = "%s IN (%s)" % (field, ids)
+            if linktype >= 0: where += " AND %s=%s" % (linktypefield, linktype)
+            stmts.append(("UPDATE %s SET %s WHERE %s" % (table, ",".join([ "%s=?" % x for x in values.keys() ]), where), list(values.values())))
+        # Reparent the audit records for the reparented records in the audit log
+        # by switching ParentLinks to the new ID.
+        for mergepersonid in mergepersonids:
+            stmts.append(("UPDATE audittrail SET ParentLinks = %s WHERE ParentLinks LIKE ?" % \
+                dbo.sql_replace("ParentLinks", "owner=%s " % mergepersonid, "owner=%s " % personid), [ "%%owner=%s %%" % mergepersonid ]))
+        return stmts
+
+    def reparent(stmts):
         try:
-            if linktype >= 0:
-                dbo.update(table, "%s=%s AND %s=%s" % (field, mergepersonid, linktypefield, linktype), 
-                    { field: personid }, username, 
-                    setLastChanged=lastchanged, setRecordVersion=lastchanged)
-            else:
-                dbo.update(table, "%s=%s" % (field, mergepersonid), 
-                    { field: personid }, username, setLastChanged=lastchanged, setRecordVersion=lastchanged)
+            dbo.execute_batch(stmts)
         except Exception as err:
-            asm3.al.error("error reparenting: %s -> %s, table=%s, field=%s, linktypefield=%s, linktype=%s, error=%s" % \
-                (mergepersonid, personid, table, field, linktypefield, linktype, err), "person.merge_person", dbo)
-
-
-    # Merge any contact info
-    mp = get_person(dbo, mergepersonid)
-    mp["address"] = mp.OWNERADDRESS
-    mp["town"] = mp.OWNERTOWN
-    mp["county"] = mp.OWNERCOUNTY
-    mp["postcode"] = mp.OWNERPOSTCODE
-    mp["country"] = mp.OWNERCOUNTRY
-    mp["hometelephone"] = mp.HOMETELEPHONE
-    mp["worktelephone"] = mp.WORKTELEPHONE
-    mp["mobiletelephone"] = mp.MOBILETELEPHONE
-    mp["emailaddress"] = mp.EMAILADDRESS
-    merge_person_details(dbo, username, personid, mp)
-
-    # Merge any flags from the target
-    merge_flags(dbo, username, personid, mp.ADDITIONALFLAGS)
-
-    # Merge any GDPR flags from the target
-    merge_gdpr_flags(dbo, username, personid, mp.GDPRCONTACTOPTIN)
-
-    # Reparent all satellite records
-    reparent("adoption", "OwnerID")
-    reparent("adoption", "RetailerID")
-    reparent("adoption", "ReturnedByOwnerID")
-    reparent("animal", "OriginalOwnerID")
-    reparent("animal", "OwnerID")
-    reparent("animal", "BroughtInByOwnerID")
-    reparent("animal", "AdoptionCoordinatorID")
-    reparent("animal", "OwnersVetID")
-    reparent("animal", "CurrentVetID")
-    reparent("animal", "NeuteredByVetID")
-    reparent("animalcontrol", "CallerID")
-    reparent("animalcontrol", "OwnerID")
-    reparent("animalcontrol", "Owner2ID")
-    reparent("animalcontrol", "Owner3ID")
-    reparent("animalcontrol", "VictimID")
-    reparent("animaltransport", "DriverOwnerID")
-    reparent("animaltransport", "PickupOwnerID")
-    reparent("animaltransport", "DropoffOwnerID")
-    reparent("animallost", "OwnerID")
-    reparent("animalfound", "OwnerID")
-    reparent("animalmedicaltreatment", "AdministeringVetID")
-    reparent("animaltest", "AdministeringVetID")
-    reparent("animalvaccination", "AdministeringVetID")
-    reparent("animalwaitinglist", "OwnerID")
-    reparent("clinicappointment", "OwnerID")
-    reparent("ownercitation", "OwnerID")
-    reparent("ownerdonation", "OwnerID")
-    reparent("ownerinvestigation", "OwnerID")
-    reparent("ownerlicence", "OwnerID")
-    reparent("ownerlookingfor", "OwnerID", lastchanged=False)
-    reparent("ownertraploan", "OwnerID")
-    reparent("ownervoucher", "OwnerID")
-    reparent("users", "OwnerID")
-    reparent("media", "LinkID", "LinkTypeID", asm3.media.PERSON, lastchanged=False)
-    reparent("diary", "LinkID", "LinkType", asm3.diary.PERSON)
-    reparent("log", "LinkID", "LinkType", asm3.log.PERSON)
-
-    # Reparent the audit records for the reparented records in the audit log
-    # by switching ParentLinks to the new ID.
-    dbo.execute("UPDATE audittrail SET ParentLinks = %s WHERE ParentLinks LIKE '%%owner=%s %%'" % \
-        ( dbo.sql_replace("ParentLinks", "owner=%s " % mergepersonid, "owner=%s " % personid), mergepersonid))
-
-    dbo.delete("owner", mergepersonid, username)
-    asm3.audit.move(dbo, username, "owner", personid, "", "Merged owner %d -> %d" % (mergepersonid, personid))
+            # Something failed and nothing was reparented, try each statement 
+            # on its own so that one bad table doesn't stop the others
+            asm3.al.error("error reparenting in batch, retrying individually: %s" % err, "person.merge_people", dbo)
+            for sql, params in stmts:
+                try:
+                    dbo.execute(sql, params)
+                except Exception as err:
+                    asm3.al.error("error reparenting: %s, error=%s" % (sql, err), "person.merge_people", dbo)
+
+    batch = []
+    merged = 0
+    for i, (personid, mergepersonids) in enumerate(clusters):
+        for mergepersonid in mergepersonids:
+            merge_details(personid, mergepersonid)
+        batch.append((personid, mergepersonids))
+        merged += len(mergepersonids)
+        if merged < MERGE_BATCH_SIZE and i < len(clusters) - 1: continue
+        stmts = []
+        for pid, mids in batch:
+            stmts += reparent_statements(pid, mids)
+        reparent(stmts)
+        for pid, mids in batch:
+            dbo.delete("owner", "ID IN (%s)" % ",".join([ str(x) for x in mids ]), username)
+            for mid in mids:
+                asm3.audit.move(dbo, username, "owner", pid, "", "Merged owner %d -> %d" % (mid, pid))
+        batch = []
+        merged = 0
+
+def get_duplicate_people(dbo):
+    """
+    Returns clusters of people with the same first name, last name and address
+    as a list of (personid, [ duplicate personids ]), where personid is the 
+    lowest ID in the cluster. The clusters are found with a single GROUP BY 
+    so that names and addresses are compared the same way the database would.
+    """
+    rows = dbo.query("SELECT o.ID, d.OwnerForeNames, d.OwnerSurname, d.OwnerAddress FROM owner o " \
+        "INNER JOIN (SELECT OwnerForeNames, OwnerSurname, OwnerAddress FROM owner " \
+        "WHERE OwnerForeNames Is Not Null AND OwnerSurname Is Not Null AND OwnerAddress Is Not Null " \
+        "GROUP BY OwnerForeNames, OwnerSurname, OwnerAddress HAVING COUNT(*) > 1) d " \
+        "ON o.OwnerForeNames = d.OwnerForeNames AND o.OwnerSurname = d.OwnerSurname AND o.OwnerAddress = d.OwnerAddress " \
+        "ORDER BY o.ID")
+    clusters = {}
+    for r in rows:
+        k = (r.OWNERFORENAMES, r.OWNERSURNAME, r.OWNERADDRESS)
+        if k in clusters: clusters[k][1].append(r.ID)
+        else: clusters[k] = (r.ID, [])
+    return sorted([ x for x in clusters.values() if len(x[1]) > 0 ])
 
 def merge_duplicate_people(dbo, username):
     """
-    Runs through every person in the database and attempts to find other people
-    with the same first name, last name and address. If any are found, they are
-    merged into this person via a call to merge_person
+    Finds all the people with the same first name, last name and address
+    and merges them into the person with the lowest ID.
     """
-    merged = 0
-    removed = [] # track people we've already merged and removed so we can skip them
-    people = dbo.query("SELECT ID, OwnerForeNames, OwnerSurname, OwnerAddress FROM owner ORDER BY ID")
-
-    asm3.al.info("Checking for duplicate people (%d records)" % len(people), "person.merge_duplicate_people", dbo)
-
-    for i, p in enumerate(people):
-
-        if p.ID in removed: continue
-
-        rows = dbo.query("SELECT ID FROM owner WHERE ID > ? AND OwnerForeNames = ? AND OwnerSurname = ? AND OwnerAddress = ?",
-            (p.ID, p.OWNERFORENAMES, p.OWNERSURNAME, p.OWNERADDRESS))
-
-        for mp in rows:
-
-            merged += 1
-
-            asm3.al.debug("found duplicate %s %s (%d of %d) id=%d, dupid=%d, merging" % \
-                (p.OWNERFORENAMES, p.OWNERSURNAME, i, len(people), p.ID, mp.ID), \
-                "person.merge_duplicate_people", dbo)
-
-            merge_person(dbo, username, p.ID, mp.ID)
-            removed.append(mp.ID)
-
+    clusters = get_duplicate_people(dbo)
+    merged = sum([ len(x[1]) for x in clusters ])
+    asm3.al.info("Found %d duplicate people records in %d groups" % (merged, len(clusters)), "person.merge_duplicate_people", dbo)
+    merge_people(dbo, username, clusters)
     asm3.al.info("Merged %d duplicate people records" % merged, "person.merge_duplicate_people", dbo)
 
 def update_pass_homecheck(dbo, user, personid, comments):
@@ -1141,11 +1257,13 @@ def update_pass_homecheck(dbo, user, personid, comments):
         com += "\n" + comments
         dbo.update("owner", personid, { "Comments": "%s\n%s" % (com, comments) }, user)
 
-def update_geocode(dbo, personid, latlon="", address="", town="", county="", postcode="", country=""):
+def update_geocode(dbo, personid, latlon="", address="", town="", county="", postcode="", country="", background=False):
     """
     Looks up the geocode for this person with the address info given.
     If latlon is already set to a value, checks the address hash to see if it
     matches and does not do the geocode if it does.
+    If background is True, the geocode is queued to be looked up and written
+    later by asm3.geo and latlon is returned unchanged.
     """
     # If an address hasn't been specified, look it up from the personid given
     if address == "":
@@ -1167,6 +1285,9 @@ def update_geocode(dbo, personid, latlon="", address="", town="", county="", pos
         if latlon.find(asm3.geo.address_hash(address, town, county, postcode, country)) != -1:
             return latlon
     # Do the geocode
+    if background:
+        asm3.geo.queue_lat_long(dbo, "owner", personid, address, town, county, postcode, country)
+        return latlon
     latlon = asm3.geo.get_lat_long(dbo, address, town, county, postcode, country)
     update_latlong(dbo, personid, latlon)
     return latlon
@@ -1206,6 +1327,7 @@ def delete_person(dbo, username, personid):
         raise asm3.utils.ASMValidationError(_("This person is linked to animal control and cannot be removed.", l))
     if dbo.query_int("SELECT COUNT(ID) FROM animaltransport WHERE DriverOwnerID=? OR PickupOwnerID=? OR DropoffOwnerID=?", (personid, personid, personid)):
         raise asm3.utils.ASMValidationError(_("This person is linked to animal transportation and cannot be removed.", l))
+    asm3.media.delete_thumbnails_for_link(dbo, asm3.media.PERSON, personid)
     dbo.delete("media", "LinkID=%d AND LinkTypeID=%d" % (personid, asm3.media.PERSON), username)
     dbo.delete("diary", "LinkID=%d AND LinkType=%d" % (personid, asm3.diary.PERSON), username)
     dbo.delete("log", "LinkID=%d AND LinkType=%d" % (personid, asm3.log.PERSON), username)
@@ -1560,6 +1682,7 @@ def update_missing_geocodes(dbo):
     """
     Goes through all people records without geocodes and completes
     the missing ones, using our configured bulk geocoding service.
+    The addresses are queued with asm3.geo and looked up by its workers.
     We limit this to LIMIT geocode requests per call so that databases with
     a lot of historical data don't end up tying up the daily
     batch for a long time, they'll just slowly complete over time.
@@ -1569,12 +1692,9 @@ def update_missing_geocodes(dbo):
         return
     people = dbo.query("SELECT ID, OwnerAddress, OwnerTown, OwnerCounty, OwnerPostcode " \
         "FROM owner WHERE LatLong Is Null OR LatLong = '' ORDER BY CreatedDate DESC", limit=GEO_LIMIT)
-    batch = []
-    for p in people:
-        latlong = asm3.geo.get_lat_long(dbo, p.OWNERADDRESS, p.OWNERTOWN, p.OWNERCOUNTY, p.OWNERPOSTCODE)
-        batch.append((latlong, p.ID))
-    dbo.execute_many("UPDATE owner SET LatLong = ? WHERE ID = ?", batch)
-    asm3.al.debug("updated %d person geocodes" % len(batch), "person.update_missing_geocodes", dbo)
+    georequests = [ asm3.geo.queue_lat_long(dbo, "owner", p.ID, p.OWNERADDRESS, p.OWNERTOWN, p.OWNERCOUNTY, p.OWNERPOSTCODE) for p in people ]
+    asm3.geo.wait_lat_long(georequests)
+    asm3.al.debug("updated %d person geocodes" % len(people), "person.update_missing_geocodes", dbo)
 
 def update_lookingfor_report(dbo):
     """
@@ -132,9 +132,13 @@ def get_publish_log(dbo, plid):
     """ Returns the log for a publish log ID """
     return dbo.query_string("SELECT LogData FROM publishlog WHERE ID = ?", [plid])
 
-def start_publisher(dbo, code, user = "", newthread = True):
-    """ Starts the publisher with code """
+def start_publisher(dbo, code, user = "", newthread = True, fullresync = False):
+    """ 
+    Starts the publisher with code 
+    fullresync: Send every animal, even those that haven't changed since they were last sent
+    """
     pc = PublishCriteria(asm3.configuration.publisher_presets(dbo))
+    if fullresync: pc.fullResync = True
     p = None
 
     if code == "html":
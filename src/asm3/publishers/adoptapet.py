@@ -352,7 +352,9 @@ class AdoptAPetPublisher(FTPPublisher):
                 self.uploadImages(an)
 
                 # Add the CSV line
-                csv.append( self.processAnimal(an) )
+                line = self.processAnimal(an)
+                csv.append(line)
+                self.fingerprintAnimal(an, line)
 
                 # Mark success in the log
                 self.logSuccess("Processed: %s: %s (%d of %d)" % ( an["SHELTERCODE"], an["ANIMALNAME"], anCount, len(animals)))
@@ -363,6 +365,12 @@ class AdoptAPetPublisher(FTPPublisher):
         # Mark published
         self.markAnimalsPublished(animals, first=True)
 
+        # AdoptAPet already has everything in this file
+        if not self.hasChanges():
+            self.log("No changes since pets.csv was last sent, not uploading")
+            self.cleanup()
+            return
+
         # Upload the datafiles
         mapfile = self.apMapFile(self.pc.includeColours)
         self.saveFile(os.path.join(self.publishDir, "import.cfg"), mapfile)
@@ -370,7 +378,8 @@ class AdoptAPetPublisher(FTPPublisher):
         self.log("Saving datafile and map, %s %s" % ("pets.csv", "import.cfg"))
         self.chdir("..", "")
         self.log("Uploading pets.csv")
-        self.upload("pets.csv")
+        if self.upload("pets.csv"):
+            self.saveFingerprints(animals)
         if not self.pc.noImportFile:
             self.log("Uploading import.cfg")
             self.upload("import.cfg")
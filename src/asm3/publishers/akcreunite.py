@@ -84,7 +84,7 @@ class AKCReunitePublisher(AbstractPublisher):
                 try:
                     # Post our document
                     self.log("Posting microchip registration document to %s: %s" % (url, j))
-                    r = asm3.utils.post_json(url, j, authheaders)
+                    r = self.http.post_json(url, j, authheaders)
                     self.log("Response %d, HTTP headers: %s, body: %s" % (r["status"], r["headers"], r["response"]))
 
                     # AKC return 202 Accepted for new registrations and
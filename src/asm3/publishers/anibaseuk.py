@@ -95,7 +95,7 @@ class AnibaseUKPublisher(AbstractPublisher):
                 try:
                     # Post the VetXML document
                     self.log("Posting microchip registration document to %s \n%s\n" % (ANIBASE_BASE_URL, x))
-                    r = asm3.utils.post_xml(ANIBASE_BASE_URL, x, authheaders)
+                    r = self.http.post_xml(ANIBASE_BASE_URL, x, authheaders)
                     self.log("Response %d, HTTP headers: %s, body: %s" % (r["status"], r["headers"], r["response"]))
                     if r["status"] != 200: raise Exception(r["response"])
 
@@ -3,22 +3,36 @@ import asm3.additional
 import asm3.al
 import asm3.animal
 import asm3.asynctask
+import asm3.cachedisk
 import asm3.configuration
 import asm3.dbfs
+import asm3.dbms.base
 import asm3.i18n
 import asm3.media
 import asm3.movement
 import asm3.utils
 import asm3.wordprocessor
-from asm3.sitedefs import MULTIPLE_DATABASES_PUBLISH_DIR, MULTIPLE_DATABASES_PUBLISH_FTP, SERVICE_URL
+from asm3.sitedefs import CACHE_PUBLISH_DATA, MULTIPLE_DATABASES_PUBLISH_DIR, MULTIPLE_DATABASES_PUBLISH_FTP, SERVICE_URL
+from asm3.sitedefs import PUBLISH_HTTP_WORKERS, PUBLISH_HTTP_TIMEOUT, PUBLISH_HTTP_RETRIES, PUBLISH_HTTP_BACKOFF, PUBLISH_HTTP_STANDIN, PUBLISH_RESEND_DAYS
 
+import collections
+import concurrent.futures
 import ftplib
 import glob
 import os
+import requests
 import shutil
 import sys
 import tempfile
 import threading
+import time
+import urllib.parse
+import urllib3
+
+IMAGE_WORKERS = 4 # Number of threads reading and scaling images for FTP publishers
+IMAGE_QUEUE_SIZE = 20 # Maximum number of images waiting to be uploaded before we block
+RETRY_STATUSES = ( 429, 502, 503, 504 ) # HTTP statuses that publisher requests are retried for
+IDEMPOTENT_METHODS = ( "GET", "HEAD", "OPTIONS", "PUT", "DELETE" ) # HTTP methods that are safe to send more than once
 
 def quietcallback(x):
     """ ftplib callback that does nothing instead of dumping to stdout """
@@ -33,11 +47,62 @@ def get_animal_data(dbo, pc=None, animalid=0, include_additional_fields=False, r
     strip_personal_data: Remove any personal data such as surrenderer, brought in by, etc.
     publisher_key: The publisher calling this function
     limit: Only return limit rows.
+    The full set is cached for CACHE_PUBLISH_DATA seconds, or until
+    one of the tables it is built from changes.
     """
     if pc is None:
         pc = PublishCriteria(asm3.configuration.publisher_presets(dbo))
-    
-    sql = get_animal_data_query(dbo, pc, animalid, publisher_key=publisher_key)
+
+    # A single animal is evaluated with just the animals it is bonded 
+    # to instead of building the whole set and then filtering it
+    if animalid != 0:
+        animalids = [ animalid ]
+        if pc.bondedAsSingle: animalids = get_bonded_animal_ids(dbo, animalid)
+        rows = get_animal_data_rows(dbo, pc, animalids, include_additional_fields, recalc_age_groups, strip_personal_data, publisher_key)
+        for r in rows:
+            if r.ID == animalid:
+                return [ r ]
+        return []
+
+    cache_key = ""
+    if CACHE_PUBLISH_DATA > 0:
+        cache_key = "publishdata:%s" % asm3.utils.md5_hash_hex("%s:%s:%s:%s:%s:%s:%s" % (dbo.get_table_changed(asm3.dbms.base.PUBLISH_DATA_TABLES), 
+            dbo.today(), pc, include_additional_fields, recalc_age_groups, strip_personal_data, publisher_key))
+        rows = asm3.cachedisk.get(cache_key, dbo.database, expectedtype=list)
+        if rows is not None:
+            asm3.al.debug("cache hit, %d rows" % len(rows), "publishers.base.get_animal_data", dbo)
+            if limit > 0: rows = rows[0:limit]
+            return [ r.copy() for r in rows ]
+
+    rows = get_animal_data_rows(dbo, pc, [], include_additional_fields, recalc_age_groups, strip_personal_data, publisher_key)
+
+    # Ordering
+    if pc.order == 0:
+        rows = sorted(rows, key=lambda k: k.MOSTRECENTENTRYDATE)
+    elif pc.order == 1:
+        rows = list(reversed(sorted(rows, key=lambda k: k.MOSTRECENTENTRYDATE)))
+    elif pc.order == 2:
+        rows = sorted(rows, key=lambda k: k.ANIMALNAME)
+    else:
+        rows = sorted(rows, key=lambda k: k.MOSTRECENTENTRYDATE)
+
+    if cache_key != "":
+        asm3.cachedisk.put(cache_key, dbo.database, [ r.copy() for r in rows ], CACHE_PUBLISH_DATA)
+
+    # If a limit was set, throw away extra rows
+    # (we do it here instead of a LIMIT clause as there's extra logic that throws
+    #  away rows above).
+    if limit > 0 and len(rows) > limit:
+        rows = rows[0:limit]
+
+    return rows
+
+def get_animal_data_rows(dbo, pc, animalids, include_additional_fields, recalc_age_groups, strip_personal_data, publisher_key):
+    """
+    Returns the unordered rows for get_animal_data. If animalids is
+    not empty, only those animals are considered.
+    """
+    sql = get_animal_data_query(dbo, pc, publisher_key=publisher_key, animalids=animalids)
     rows = dbo.query(sql, distincton="ID")
     asm3.al.debug("get_animal_data_query returned %d rows" % len(rows), "publishers.base.get_animal_data", dbo)
 
@@ -108,43 +173,24 @@ def get_animal_data(dbo, pc=None, animalid=0, include_additional_fields=False, r
         # always "wins" and becomes the first to be output
         rows = [ r for r in sorted(rows, key=lambda k: k.ID) if check_bonding(r) ]
 
-    # If animalid was set, only return that row or an empty set if it wasn't present
-    if animalid != 0:
-        for r in rows:
-            if r.ID == animalid:
-                return [ r ]
-        return []
-
-    # Ordering
-    if pc.order == 0:
-        rows = sorted(rows, key=lambda k: k.MOSTRECENTENTRYDATE)
-    elif pc.order == 1:
-        rows = list(reversed(sorted(rows, key=lambda k: k.MOSTRECENTENTRYDATE)))
-    elif pc.order == 2:
-        rows = sorted(rows, key=lambda k: k.ANIMALNAME)
-    else:
-        rows = sorted(rows, key=lambda k: k.MOSTRECENTENTRYDATE)
-
-    # If a limit was set, throw away extra rows
-    # (we do it here instead of a LIMIT clause as there's extra logic that throws
-    #  away rows above).
-    if limit > 0 and len(rows) > limit:
-        rows = rows[0:limit]
-
     return rows
 
-def get_animal_data_query(dbo, pc, animalid=0, publisher_key=""):
+def get_animal_data_query(dbo, pc, animalid=0, publisher_key="", animalids=[]):
     """
     Generate the adoptable animal query.
     publisher_key is used to generate an exclusion to remove animals who have 
         a flag called "Exclude from publisher_key" - this prevents animals
         eg: being sent to PetFinder (Exclude from petfinder)
+    animalid/animalids: Only consider these animals
     """
+    if animalid != 0: animalids = [ animalid ]
     sql = asm3.animal.get_animal_query(dbo)
+    if len(animalids) > 0:
+        sql += " WHERE a.ID IN (%s) AND (" % ",".join([ str(int(x)) for x in animalids ])
+    else:
+        sql += " WHERE ("
     # Always include non-dead courtesy listings
-    sql += " WHERE (a.DeceasedDate Is Null AND a.IsCourtesy = 1) OR (a.ID > 0"
-    if animalid != 0:
-        sql += " AND a.ID = " + str(animalid)
+    sql += "(a.DeceasedDate Is Null AND a.IsCourtesy = 1) OR (a.ID > 0"
     if not pc.includeCaseAnimals: 
         sql += " AND a.CrueltyCase = 0"
     if not pc.includeNonNeutered:
@@ -181,9 +227,30 @@ def get_animal_data_query(dbo, pc, animalid=0, publisher_key=""):
         moveor.append("(a.ActiveMovementType = %d)" % asm3.movement.FOSTER)
     if pc.includeTrial:
         moveor.append("(a.ActiveMovementType = %d AND a.HasTrialAdoption = 1)" % asm3.movement.ADOPTION)
-    sql += " AND (" + " OR ".join(moveor) + ")) ORDER BY a.ID"
+    sql += " AND (" + " OR ".join(moveor) + "))) ORDER BY a.ID"
     return sql
 
+def get_bonded_animal_ids(dbo, animalid):
+    """
+    Returns a sorted list of animalid and the ids of all animals bonded to it,
+    directly or through another bonded animal. Bonded animals are merged 
+    together by get_animal_data when bondedAsSingle is on, so these are 
+    the only animals that can affect how animalid is published.
+    """
+    ids = set([ animalid ])
+    new = [ animalid ]
+    while len(new) > 0:
+        inclause = ",".join([ str(int(x)) for x in new ])
+        rows = dbo.query("SELECT ID, BondedAnimalID, BondedAnimal2ID FROM animal " \
+            "WHERE ID IN (%s) OR BondedAnimalID IN (%s) OR BondedAnimal2ID IN (%s)" % (inclause, inclause, inclause))
+        new = []
+        for r in rows:
+            for aid in ( r.ID, r.BONDEDANIMALID, r.BONDEDANIMAL2ID ):
+                if aid and aid not in ids:
+                    ids.add(aid)
+                    new.append(aid)
+    return sorted(ids)
+
 def get_microchip_data(dbo, patterns, publishername, allowintake = True, organisation_email = ""):
     """
     Returns a list of animals with unpublished microchips.
@@ -398,6 +465,7 @@ class PublishCriteria(object):
     uploadAllImages = False
     uploadDirectly = False
     forceReupload = False
+    fullResync = False # Send every animal to third party publishers, even if it hasn't changed since it was last sent
     noImportFile = False # If a 3rd party has a seperate import disable upload
     generateJavascriptDB = False
     thumbnails = False
@@ -456,6 +524,7 @@ class PublishCriteria(object):
             if s == "clearexisting": self.clearExisting = True
             if s == "uploadall": self.uploadAllImages = True
             if s == "forcereupload": self.forceReupload = True
+            if s == "fullresync": self.fullResync = True
             if s == "generatejavascriptdb": self.generateJavascriptDB = True
             if s == "thumbnails": self.thumbnails = True
             if s == "checksocket": self.checkSocket = True
@@ -502,6 +571,7 @@ class PublishCriteria(object):
         if self.clearExisting: s += " clearexisting"
         if self.uploadAllImages: s += " uploadall"
         if self.forceReupload: s += " forcereupload"
+        if self.fullResync: s += " fullresync"
         if self.generateJavascriptDB: s += " generatejavascriptdb"
         if self.thumbnails: s += " thumbnails"
         if self.checkSocket: s += " checksocket"
@@ -526,6 +596,194 @@ class PublishCriteria(object):
         if self.publishDirectory is not None: s += " publishdirectory=" + self.publishDirectory
         return s.strip()
 
+class HTTPClient(object):
+    """
+    Outbound HTTP requests for a publisher. Requests go over a pooled 
+    keep-alive session, time out after PUBLISH_HTTP_TIMEOUT seconds and
+    are retried with backoff if they could not connect. Requests that
+    are safe to repeat (IDEMPOTENT_METHODS, or retry=True) are also
+    retried if they timed out or got a response in RETRY_STATUSES.
+    A POST that may have reached the service is never sent again, as 
+    that could register a microchip or create a listing twice.
+    The time each request took is recorded so that it can be written 
+    to the publish log.
+    If PUBLISH_HTTP_STANDIN is set, requests are sent there instead of
+    the real service (keeping the path and query).
+    The get/post functions take the same arguments and return the same
+    dict as their counterparts in asm3.utils, with an extra elapsed 
+    (seconds) and attempts.
+    """
+    def __init__(self, workers = PUBLISH_HTTP_WORKERS, timeout = PUBLISH_HTTP_TIMEOUT, retries = PUBLISH_HTTP_RETRIES, 
+        backoff = PUBLISH_HTTP_BACKOFF, standin = PUBLISH_HTTP_STANDIN):
+        self.workers = max(workers, 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.standin = standin
+        self.session = None
+        self.sessionLock = threading.Lock()
+        self.timings = [] # (method, url, status, elapsed, attempts) for each request made
+        self.timingsLock = threading.Lock()
+
+    def getSession(self):
+        """ Returns our session, creating it with a connection pool big enough for our workers """
+        with self.sessionLock:
+            if self.session is None:
+                self.session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            return self.session
+
+    def close(self):
+        """ Closes the session and any connections it has open """
+        with self.sessionLock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+    def getURL(self, url):
+        """ Returns the url to send a request for url to, taking into account PUBLISH_HTTP_STANDIN """
+        if self.standin == "": return url
+        u = urllib.parse.urlsplit(url)
+        s = urllib.parse.urlsplit(self.standin)
+        return urllib.parse.urlunsplit((s.scheme, s.netloc, s.path.rstrip("/") + u.path, u.query, u.fragment))
+
+    def getRetryDelay(self, attempt, r = None):
+        """ Returns the seconds to wait before retry attempt (1 for the first), using Retry-After if we got one """
+        if r is not None and asm3.utils.is_numeric(r.headers.get("Retry-After", "")):
+            return min(asm3.utils.cint(r.headers["Retry-After"]), 60)
+        return self.backoff * (2 ** (attempt - 1))
+
+    def isConnectFailure(self, err):
+        """ Returns True if requests exception err happened before the request was sent """
+        if isinstance(err, requests.exceptions.ConnectTimeout): return True
+        reason = getattr(err.args[0], "reason", None) if len(err.args) > 0 else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    def request(self, method, url, data = None, headers = None, cookies = None, files = None, stream = False, retry = None):
+        """
+        Sends a request, retrying it if it failed to connect. 
+        retry: If True, also retry if it timed out, lost the connection or got a 
+            response with a status in RETRY_STATUSES. This means the service may
+            get the request more than once. The default is True for 
+            IDEMPOTENT_METHODS and False for everything else.
+        Returns the requests response.
+        Raises the last error if every attempt failed without a response.
+        """
+        if retry is None: retry = method.upper() in IDEMPOTENT_METHODS
+        url = self.getURL(url)
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            r = None
+            try:
+                r = self.getSession().request(method, url, data=data, headers=headers, cookies=cookies, files=files, 
+                    timeout=self.timeout, stream=stream)
+                if not retry or r.status_code not in RETRY_STATUSES or attempt > self.retries: break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                if attempt > self.retries or not (retry or self.isConnectFailure(err)):
+                    self.addTiming(method, url, 0, start, attempt)
+                    raise
+            delay = self.getRetryDelay(attempt, r)
+            if r is not None: r.close()
+            time.sleep(delay)
+        self.addTiming(method, url, r.status_code, start, attempt)
+        r.attempts = attempt
+        r.elapsed_total = time.time() - start
+        return r
+
+    def result(self, r, response = None):
+        """ Returns the dict for response r that the asm3.utils functions return """
+        if response is None: response = r.text
+        return { "cookies": r.cookies, "headers": r.headers, "response": response, "status": r.status_code, 
+            "redirects": len(r.history), "requestheaders": r.request.headers, "requestbody": r.request.body,
+            "elapsed": r.elapsed_total, "attempts": r.attempts }
+
+    def addTiming(self, method, url, status, start, attempts):
+        with self.timingsLock:
+            self.timings.append((method, url, status, time.time() - start, attempts))
+
+    def get_url(self, url, headers = {}, cookies = {}):
+        """ Retrieves a URL as text """
+        return self.result(self.request("GET", url, headers=headers, cookies=cookies))
+
+    def get_image_url(self, url, headers = {}, cookies = {}):
+        """ Retrieves an image from a URL as a bytes string in response """
+        r = self.request("GET", url, headers=headers, cookies=cookies)
+        return self.result(r, r.content)
+
+    def post_data(self, url, data, contenttype = "", httpmethod = "", headers = {}, retry = None):
+        """ Posts data (str or bytes) to a URL as the body. httpmethod: POST by default. """
+        headers = dict(headers)
+        if contenttype != "": headers["Content-Type"] = contenttype
+        if isinstance(data, str): data = asm3.utils.str2bytes(data)
+        return self.result(self.request(httpmethod or "POST", url, data=data, headers=headers, retry=retry))
+
+    def post_form(self, url, fields, headers = {}, cookies = {}, retry = None):
+        """ Does a form post of a map of { name: value } fields """
+        return self.result(self.request("POST", url, data=fields, headers=headers, cookies=cookies, retry=retry))
+
+    def post_multipart(self, url, fields = None, files = None, headers = {}, cookies = {}, retry = None):
+        """ Does a multipart form post. files is a map of { name: (name, data, mime) } """
+        return self.result(self.request("POST", url, data=fields, files=files, headers=headers, cookies=cookies, retry=retry))
+
+    def post_json(self, url, json, headers = {}, retry = None):
+        """ Posts a JSON document (str or bytes) to a URL """
+        return self.post_data(url, json, contenttype="application/json", headers=headers, retry=retry)
+
+    def patch_json(self, url, json, headers = {}, retry = None):
+        """ Sends a JSON document (str or bytes) to a URL with the PATCH method """
+        return self.post_data(url, json, contenttype="application/json", httpmethod="PATCH", headers=headers, retry=retry)
+
+    def post_xml(self, url, xml, headers = {}, retry = None):
+        """ Posts an XML document (str or bytes) to a URL """
+        return self.post_data(url, xml, contenttype="text/xml", headers=headers, retry=retry)
+
+    def map(self, fn, items):
+        """
+        Calls fn(item) for each item on up to workers threads.
+        Yields (item, future) in the same order as items, so that the caller
+        can handle the results one at a time with future.result(). 
+        items can be a generator, it is only read ahead far enough to keep 
+        the workers busy. If the caller stops early, the calls that have 
+        not started yet are cancelled.
+        """
+        items = iter(items)
+        end = object()
+        pending = collections.deque()
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while True:
+                while len(pending) < self.workers * 2:
+                    item = next(items, end)
+                    if item is end: break
+                    pending.append((item, pool.submit(fn, item)))
+                if len(pending) == 0: break
+                yield pending.popleft()
+        finally:
+            for item, future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def getTimingsLog(self):
+        """
+        Returns lines for the publish log with the latency of each request
+        and a summary for all of them. The timings are cleared.
+        """
+        with self.timingsLock:
+            timings = self.timings
+            self.timings = []
+        if len(timings) == 0: return []
+        lines = [ "HTTP %s %s: %s in %0.3fs%s" % (method, url, status or "failed", elapsed, attempts > 1 and " (%d attempts)" % attempts or "") 
+            for method, url, status, elapsed, attempts in timings ]
+        elapsed = sorted([ x[3] for x in timings ])
+        lines.append("HTTP timings: %d requests, %d retried, total %0.2fs, mean %0.3fs, median %0.3fs, 95th %0.3fs, max %0.3fs" % (
+            len(timings), len([ x for x in timings if x[4] > 1 ]), sum(elapsed), sum(elapsed) / len(elapsed),
+            elapsed[len(elapsed) // 2], elapsed[min(int(len(elapsed) * 0.95), len(elapsed) - 1)], elapsed[-1]))
+        return lines
+
 class AbstractPublisher(threading.Thread):
     """
     Base class for all publishers
@@ -543,10 +801,21 @@ class AbstractPublisher(threading.Thread):
     locale = "en"
     lastError = ""
     logBuffer = []
+    http = None
+    httpWorkers = PUBLISH_HTTP_WORKERS
+    useFingerprints = True # Compare what we send with what we last sent so unchanged animals and images can be skipped
+    storedFingerprints = None # { animalid: (datahash, imagehash, sentdate) } for what we last sent
+    newFingerprints = {} # { animalid: (datahash, imagehash) } for what we are sending this time
+    imageFingerprints = {} # { animalid: imagehash } for the animals returned by getMatchingAnimals
+    imageFailures = set() # animal ids with images that failed to upload
 
     def __init__(self, dbo, publishCriteria):
         threading.Thread.__init__(self)
         self.dbo = dbo
+        self.http = HTTPClient(self.httpWorkers)
+        self.newFingerprints = {}
+        self.imageFingerprints = {}
+        self.imageFailures = set()
         self.locale = asm3.configuration.locale(dbo)
         self.pc = publishCriteria
         self.makePublishDirectory()
@@ -949,9 +1218,111 @@ class AbstractPublisher(threading.Thread):
         self.dbo.execute("DELETE FROM animalpublished WHERE PublishedTo = '%s' AND AnimalID IN (%s)" % (self.publisherKey, ",".join(inclause)))
         self.dbo.execute_many("INSERT INTO animalpublished (AnimalID, PublishedTo, SentDate, Extra) VALUES (?,?,?,?)", batch)
 
+    def getStoredFingerprints(self):
+        """
+        Returns the fingerprints of what we last sent to this publisher
+        as { animalid: (datahash, imagehash, sentdate) }
+        """
+        if self.storedFingerprints is None:
+            self.storedFingerprints = {}
+            for r in self.dbo.query("SELECT AnimalID, DataHash, ImageHash, SentDate FROM animalpublishedfingerprint WHERE PublishedTo = ?", [self.publisherKey]):
+                self.storedFingerprints[r.ANIMALID] = (r.DATAHASH, r.IMAGEHASH, r.SENTDATE)
+        return self.storedFingerprints
+
+    def getImageFingerprints(self, animals):
+        """
+        Returns { animalid: imagehash } for animals, covering the images
+        each animal has to publish and the options for scaling them, so
+        that changing, adding or removing an image changes the hash.
+        """
+        if len(animals) == 0: return {}
+        images = {}
+        for a in animals:
+            images[a["ID"]] = [ "%s:%s:%s:%s" % (self.getScaleSpec(self.pc.scaleImages), self.pc.thumbnails, self.pc.thumbnailSize, self.pc.uploadAllImages),
+                str(a["WEBSITEMEDIANAME"]) ]
+        rows = self.dbo.query("SELECT LinkID, MediaName, Date FROM media WHERE LinkTypeID = 0 AND MediaMimeType = 'image/jpeg' " \
+            "AND (ExcludeFromPublish = 0 OR ExcludeFromPublish Is Null) AND LinkID IN (%s) ORDER BY LinkID, ID" % ",".join([ str(int(x)) for x in images.keys() ]))
+        for r in rows:
+            images[r.LINKID].append("%s:%s" % (r.MEDIANAME, r.DATE))
+        return dict( (k, asm3.utils.md5_hash_hex("|".join(v))) for k, v in images.items() )
+
+    def isResendDue(self, stored):
+        """ Returns True if the stored fingerprint is old enough that we should send the animal again anyway """
+        return PUBLISH_RESEND_DAYS > 0 and stored[2] is not None and stored[2] < self.dbo.now(offset=PUBLISH_RESEND_DAYS * -1)
+
+    def fingerprintAnimal(self, an, data):
+        """
+        Records the fingerprint of data (the str, dict or list we are 
+        sending for animal an) and its images.
+        Returns True if the animal needs sending because it is new, 
+        has changed, is due to be resent or we are doing a full resync.
+        """
+        if not isinstance(data, str): data = asm3.utils.json(data)
+        fp = ( asm3.utils.md5_hash_hex(data), self.imageFingerprints.get(an["ID"], "") )
+        self.newFingerprints[an["ID"]] = fp
+        stored = self.getStoredFingerprints().get(an["ID"])
+        return self.pc.fullResync or stored is None or stored[0:2] != fp or self.isResendDue(stored)
+
+    def isImageChanged(self, an):
+        """
+        Returns True if the images for animal an need uploading because they
+        have changed since we last sent them (or forceReupload/fullResync are on,
+        or this publisher does not use fingerprints)
+        """
+        if not self.useFingerprints or self.pc.forceReupload or self.pc.fullResync: return True
+        stored = self.getStoredFingerprints().get(an["ID"])
+        return stored is None or stored[1] != self.imageFingerprints.get(an["ID"], "") or self.isResendDue(stored)
+
+    def getChanges(self):
+        """
+        Compares the animals fingerprinted this run with what we sent last time.
+        Returns (new, changed, unchanged, removed) lists of animal ids and logs the counts.
+        """
+        stored = self.getStoredFingerprints()
+        new = [ k for k in self.newFingerprints.keys() if k not in stored ]
+        changed = [ k for k, v in self.newFingerprints.items() if k in stored and (stored[k][0:2] != v or self.isResendDue(stored[k])) ]
+        unchanged = [ k for k, v in self.newFingerprints.items() if k in stored and k not in changed ]
+        removed = [ k for k in stored.keys() if k not in self.newFingerprints ]
+        self.log("Changes since last sent: %d new, %d changed, %d unchanged, %d removed%s" % (len(new), len(changed), len(unchanged), len(removed),
+            self.pc.fullResync and " (full resync, sending everything)" or ""))
+        return new, changed, unchanged, removed
+
+    def hasChanges(self):
+        """
+        Returns True if anything has changed since we last sent to this publisher.
+        File based publishers that send every animal each time use this to skip the upload.
+        """
+        new, changed, unchanged, removed = self.getChanges()
+        return self.pc.fullResync or len(new) > 0 or len(changed) > 0 or len(removed) > 0
+
+    def saveFingerprints(self, sent, unchanged = []):
+        """
+        Stores the fingerprints of the animals the service now has our 
+        current data for: sent were sent this run, unchanged were skipped 
+        because they were the same as last time. Any other animals are 
+        forgotten so that they will be sent again if they return.
+        """
+        stored = self.getStoredFingerprints()
+        now = self.dbo.now()
+        rows = {}
+        for a in sent:
+            if a["ID"] not in self.newFingerprints: continue
+            datahash, imagehash = self.newFingerprints[a["ID"]]
+            if a["ID"] in self.imageFailures: imagehash = ""
+            rows[a["ID"]] = ( a["ID"], self.publisherKey, datahash, imagehash, now )
+        for a in unchanged:
+            if a["ID"] not in self.newFingerprints or a["ID"] not in stored: continue
+            datahash, imagehash = self.newFingerprints[a["ID"]]
+            rows[a["ID"]] = ( a["ID"], self.publisherKey, datahash, imagehash, stored[a["ID"]][2] )
+        self.dbo.execute("DELETE FROM animalpublishedfingerprint WHERE PublishedTo = ?", [self.publisherKey])
+        if len(rows) > 0:
+            self.dbo.execute_many("INSERT INTO animalpublishedfingerprint (AnimalID, PublishedTo, DataHash, ImageHash, SentDate) VALUES (?,?,?,?,?)", list(rows.values()))
+        self.storedFingerprints = dict( (k, (v[2], v[3], v[4])) for k, v in rows.items() )
+
     def getMatchingAnimals(self, includeAdditionalFields=False):
         a = get_animal_data(self.dbo, self.pc, include_additional_fields=includeAdditionalFields, publisher_key=self.publisherKey)
         self.log("Got %d matching animals for publishing." % len(a))
+        if self.useFingerprints: self.imageFingerprints = self.getImageFingerprints(a)
         return a
 
     def saveFile(self, path, contents):
@@ -1001,8 +1372,12 @@ class AbstractPublisher(threading.Thread):
 
     def saveLog(self):
         """
-        Saves the log to the publishlog table
+        Saves the log to the publishlog table, along with the time
+        taken by any HTTP requests we made.
         """
+        self.http.close()
+        for line in self.http.getTimingsLog():
+            self.log(line)
         self.dbo.insert("publishlog", {
             "PublishDateTime":      self.publishDateTime,
             "Name":                 self.publisherKey,
@@ -1044,21 +1419,29 @@ class AbstractPublisher(threading.Thread):
         6 = 300x300
         7 = 95x95
         """
-        sizespec = ""
-        if scalesize == "" or scalesize == "1": return image
-        elif scalesize == "2": sizespec = "320x200"
-        elif scalesize == "3": sizespec = "640x400"
-        elif scalesize == "4": sizespec = "800x600"
-        elif scalesize == "5": sizespec = "1024x768"
-        elif scalesize == "6": sizespec = "300x300"
-        elif scalesize == "7": sizespec = "95x95"
-        else: sizespec = scalesize
+        sizespec = self.getScaleSpec(scalesize)
+        if sizespec == "": return image
         self.log("scaling %s to %s" % ( image, scalesize ))
         try:
             return asm3.media.scale_image_file(image, image, sizespec)
         except Exception as err:
             self.logError("Failed scaling image: %s" % err, sys.exc_info())
 
+    def getScaleSpec(self, scalesize):
+        """
+        Returns the resize spec for the scaleImage publish criteria (see
+        scaleImage above) or an empty string if no scaling is required.
+        """
+        scalesize = str(scalesize).strip()
+        if scalesize == "" or scalesize == "0" or scalesize == "1": return ""
+        elif scalesize == "2": return "320x200"
+        elif scalesize == "3": return "640x400"
+        elif scalesize == "4": return "800x600"
+        elif scalesize == "5": return "1024x768"
+        elif scalesize == "6": return "300x300"
+        elif scalesize == "7": return "95x95"
+        return scalesize
+
 class FTPPublisher(AbstractPublisher):
     """
     Base class for publishers that rely on FTP
@@ -1072,6 +1455,9 @@ class FTPPublisher(AbstractPublisher):
     currentDir = ""
     passive = True
     existingImageList = None
+    imagePool = None
+    imageQueue = None
+    imageQueueBusy = False
 
     def __init__(self, dbo, publishCriteria, ftphost, ftpuser, ftppassword, ftpport = 21, ftproot = "", passive = True):
         AbstractPublisher.__init__(self, dbo, publishCriteria)
@@ -1081,6 +1467,10 @@ class FTPPublisher(AbstractPublisher):
         self.ftpport = ftpport
         self.ftproot = ftproot
         self.passive = passive
+        self.imageQueue = collections.deque()
+        self.imageTimingsLock = threading.Lock()
+        self.imageTimings = collections.defaultdict(float)
+        self.imageCounts = collections.defaultdict(int)
 
     def unxssPass(self, s):
         """
@@ -1124,6 +1514,7 @@ class FTPPublisher(AbstractPublisher):
             return False
 
     def closeFTPSocket(self):
+        self.waitForImages()
         if not self.pc.uploadDirectly: return
         try:
             self.socket.quit()
@@ -1159,9 +1550,10 @@ class FTPPublisher(AbstractPublisher):
         is given, this throws it away and just uses the name with
         the temporary publishing directory.
         """
+        self.waitForImages()
         if filename.find(os.sep) != -1: filename = filename[filename.rfind(os.sep) + 1:]
-        if not self.pc.uploadDirectly: return
-        if not os.path.exists(os.path.join(self.publishDir, filename)): return
+        if not self.pc.uploadDirectly: return False
+        if not os.path.exists(os.path.join(self.publishDir, filename)): return False
         self.log("Uploading: %s" % filename)
         try:
             if self.pc.checkSocket: self.checkFTPSocket()
@@ -1169,12 +1561,15 @@ class FTPPublisher(AbstractPublisher):
             f = open(os.path.join(self.publishDir, filename), "rb")
             self.socket.storbinary("STOR %s" % filename, f, callback=quietcallback)
             f.close()
+            return True
         except Exception as err:
             self.logError("Failed uploading %s: %s" % (filename, err), sys.exc_info())
             self.log("reconnecting FTP socket to reset state")
             self.reconnectFTPSocket()
+            return False
 
     def lsdir(self):
+        self.waitForImages()
         if not self.pc.uploadDirectly: return []
         try:
             return self.socket.nlst()
@@ -1182,6 +1577,7 @@ class FTPPublisher(AbstractPublisher):
             self.logError("list: %s" % err)
 
     def mkdir(self, newdir):
+        self.waitForImages()
         if not self.pc.uploadDirectly: return
         self.log("FTP mkdir %s" % newdir)
         try:
@@ -1191,6 +1587,7 @@ class FTPPublisher(AbstractPublisher):
 
     def chdir(self, newdir, fromroot = ""):
         """ Changes FTP folder. Returns True on success, False for failure """
+        self.waitForImages()
         if not self.pc.uploadDirectly: return True
         self.log("FTP chdir to %s" % newdir)
         try:
@@ -1205,12 +1602,14 @@ class FTPPublisher(AbstractPublisher):
             return False
 
     def delete(self, filename):
+        self.waitForImages()
         try:
             self.socket.delete(filename)
         except Exception as err:
             self.log("delete %s: %s" % (filename, err))
 
     def clearExistingHTML(self):
+        self.waitForImages()
         try:
             oldfiles = glob.glob(os.path.join(self.publishDir, "*." + self.pc.extension))
             for f in oldfiles:
@@ -1226,6 +1625,7 @@ class FTPPublisher(AbstractPublisher):
             self.logError("warning: failed deleting from FTP server: %s" % err, sys.exc_info())
 
     def clearExistingImages(self):
+        self.waitForImages()
         try:
             oldfiles = glob.glob(os.path.join(self.publishDir, "*.jpg"))
             for f in oldfiles:
@@ -1243,6 +1643,11 @@ class FTPPublisher(AbstractPublisher):
         """
         Call when the publisher has completed to tidy up.
         """
+        self.waitForImages()
+        if self.imagePool is not None:
+            self.imagePool.shutdown()
+            self.imagePool = None
+        self.logImageTimings()
         self.closeFTPSocket()
         self.deletePublishDirectory()
         if save_log: self.saveLog()
@@ -1251,7 +1656,10 @@ class FTPPublisher(AbstractPublisher):
     def uploadImage(self, a, medianame, imagename):
         """
         Retrieves image with medianame from the DBFS to the publish
-        folder and uploads it via FTP with imagename
+        folder and uploads it via FTP with imagename.
+        Reading and scaling the image happens in the background on the
+        image worker pool, the upload is queued and sent in order
+        over our FTP socket as soon as the image is ready.
         """
         try:
             # Check if the image is already on the server if 
@@ -1265,23 +1673,132 @@ class FTPPublisher(AbstractPublisher):
                     return
             imagefile = os.path.join(self.publishDir, imagename)
             thumbnail = os.path.join(self.publishDir, "tn_" + imagename)
-            asm3.dbfs.get_file(self.dbo, medianame, "", imagefile)
-            self.log("Retrieved image: %d::%s::%s" % ( a["ID"], medianame, imagename ))
-            # If scaling is on, do it
-            if self.pc.scaleImages > 1:
-                self.scaleImage(imagefile, self.pc.scaleImages)
-            # If thumbnails are on, do it
-            if self.pc.thumbnails:
-                self.generateThumbnail(imagefile, thumbnail)
-            # Upload
-            if self.pc.uploadDirectly:
-                self.upload(imagefile)
-                if self.pc.thumbnails:
-                    self.upload(thumbnail)
+            if self.imagePool is None:
+                self.imagePool = concurrent.futures.ThreadPoolExecutor(max_workers=IMAGE_WORKERS)
+            future = self.imagePool.submit(self.prepareImage, medianame, imagefile, thumbnail)
+            self.imageQueue.append(("upload", future, (a["ID"], medianame, imagename, imagefile, thumbnail)))
+            # Send anything that's ready, only blocking if the queue is full
+            self.processImageQueue(IMAGE_QUEUE_SIZE)
         except Exception as err:
             self.logError("Failed uploading image %s: %s" % (medianame, err), sys.exc_info())
             return 0
 
+    def prepareImage(self, medianame, imagefile, thumbnail):
+        """
+        Runs on the image worker pool. Reads image medianame from the DBFS,
+        scales it and creates the thumbnail if required and writes them to
+        imagefile and thumbnail in the publish folder.
+        Scaled copies are read from the media thumbnail store (keyed by
+        the image's DBFS ID and size) so that unchanged images are not
+        scaled again on every run.
+        Returns a list of (dbfsid, sizespec, data) for newly scaled images
+        so that the uploader can add them to the thumbnail store.
+        """
+        # Use our own database object so that we never share an open
+        # connection or transaction with the publisher thread
+        dbo = self.dbo.clone()
+        dbfsid = dbo.query_int("SELECT DBFSID FROM media WHERE MediaName=?", [medianame])
+        original = []
+        newscaled = []
+        def get_original():
+            if len(original) == 0:
+                start = time.time()
+                if dbfsid > 0:
+                    original.append(asm3.dbfs.get_string_id(dbo, dbfsid))
+                else:
+                    original.append(asm3.dbfs.get_string(dbo, medianame))
+                self.addImageTiming("fetch", start)
+            return original[0]
+        def get_scaled(sizespec):
+            if dbfsid > 0:
+                start = time.time()
+                data = asm3.dbfs.get_string(dbo, asm3.media.get_thumbnail_name(dbfsid, sizespec), asm3.media.THUMBNAIL_PATH)
+                if data is not None and len(data) > 0:
+                    self.addImageTiming("cached", start)
+                    return data
+            data = get_original()
+            if data is None or len(data) == 0: return data
+            start = time.time()
+            scaled = asm3.media.scale_image(data, sizespec)
+            self.addImageTiming("scale", start)
+            if dbfsid > 0 and scaled is not data:
+                newscaled.append((dbfsid, sizespec, scaled))
+            return scaled
+        sizespec = self.getScaleSpec(self.pc.scaleImages)
+        if sizespec == "":
+            asm3.utils.write_binary_file(imagefile, get_original())
+        else:
+            asm3.utils.write_binary_file(imagefile, get_scaled(sizespec))
+        if self.pc.thumbnails:
+            asm3.utils.write_binary_file(thumbnail, get_scaled(self.pc.thumbnailSize))
+        return newscaled
+
+    def addImageTiming(self, stage, start):
+        """
+        Adds the time since start to the total for an image pipeline stage.
+        Called from the image workers as well as the publisher thread.
+        """
+        with self.imageTimingsLock:
+            self.imageTimings[stage] += time.time() - start
+            self.imageCounts[stage] += 1
+
+    def logImageTimings(self):
+        """
+        Writes the time spent in each stage of the image pipeline to the log
+        """
+        if len(self.imageCounts) == 0: return
+        self.log("Image timings: fetched %d (%0.2fs), scaled %d (%0.2fs), reused %d scaled (%0.2fs), uploaded %d (%0.2fs)" % ( 
+            self.imageCounts["fetch"], self.imageTimings["fetch"], 
+            self.imageCounts["scale"], self.imageTimings["scale"], 
+            self.imageCounts["cached"], self.imageTimings["cached"], 
+            self.imageCounts["upload"], self.imageTimings["upload"] ))
+
+    def processImageQueue(self, maxpending = 0):
+        """
+        Uploads queued images in the order they were queued.
+        Stops when the next image is still being prepared and there are 
+        no more than maxpending images in the queue. maxpending = 0 waits
+        for and uploads everything.
+        """
+        if self.imageQueueBusy: return
+        self.imageQueueBusy = True
+        try:
+            while len(self.imageQueue) > 0:
+                action, future, args = self.imageQueue[0]
+                if action == "upload" and not future.done() and len(self.imageQueue) <= maxpending: 
+                    break
+                self.imageQueue.popleft()
+                if action == "delete":
+                    self.log("delete: %s" % args)
+                    self.delete(args)
+                    continue
+                animalid, medianame, imagename, imagefile, thumbnail = args
+                try:
+                    newscaled = future.result()
+                    self.log("Retrieved image: %d::%s::%s" % ( animalid, medianame, imagename ))
+                    if self.pc.uploadDirectly:
+                        start = time.time()
+                        self.upload(imagefile)
+                        if self.pc.thumbnails:
+                            self.upload(thumbnail)
+                        self.addImageTiming("upload", start)
+                    for dbfsid, sizespec, data in newscaled:
+                        asm3.dbfs.put_string(self.dbo, asm3.media.get_thumbnail_name(dbfsid, sizespec), asm3.media.THUMBNAIL_PATH, data)
+                except Exception as err:
+                    self.imageFailures.add(animalid)
+                    self.logError("Failed uploading image %s: %s" % (medianame, err), sys.exc_info())
+        finally:
+            self.imageQueueBusy = False
+
+    def waitForImages(self):
+        """
+        Waits for and uploads all queued images. Called before any other 
+        FTP operation so that the order of commands sent to the server
+        is the same as if everything had been done in sequence.
+        """
+        if self.imageQueue is None or len(self.imageQueue) == 0: return
+        self.processImageQueue()
+
     def uploadImages(self, a, copyWithMediaIDAsName = False, limit = 0):
         """
         Uploads all the images for an animal as sheltercode-X.jpg if
@@ -1295,6 +1812,9 @@ class FTPPublisher(AbstractPublisher):
         are uploaded. If uploadAll is off, only the preferred
         image is uploaded.
         Images with the ExcludeFromPublish flag set are ignored.
+        If the animal's images haven't changed since we last sent them
+        to this publisher, nothing is uploaded but the number of images
+        the animal has on the server is still returned.
         """
         # The first image is always the preferred
         totalimages = 0
@@ -1309,21 +1829,24 @@ class FTPPublisher(AbstractPublisher):
         imagename = animalcode + ".jpg"
         if self.pc.uploadAllImages:
             imagename = animalcode + "-1.jpg"
+        # Skip uploading if the images are the same as last time
+        changed = self.isImageChanged(a)
+        if not changed:
+            self.log("%s: images unchanged since last sent, skipping" % animalcode)
         # If we're forcing reupload or the animal has
         # some recently changed images, remove all the images
         # for this animal before doing anything.
-        if self.pc.forceReupload or a["RECENTLYCHANGEDIMAGES"] > 0:
+        if changed and (self.pc.forceReupload or a["RECENTLYCHANGEDIMAGES"] > 0):
             if self.existingImageList is None:
                 self.existingImageList = self.lsdir()
             for ei in self.existingImageList:
                 if ei.startswith(animalcode):
-                    self.log("delete: %s" % ei)
-                    self.delete(ei)
+                    self.imageQueue.append(("delete", None, ei))
         # Save it to the publish directory
         totalimages = 1
-        self.uploadImage(a, animalweb, imagename)
+        if changed: self.uploadImage(a, animalweb, imagename)
         # If we're saving a copy with the media ID, do that too
-        if copyWithMediaIDAsName:
+        if changed and copyWithMediaIDAsName:
             self.uploadImage(a, animalweb, animalweb)
         # If upload all is set, we need to grab the rest of
         # the animal's images upto the limit. If the limit is
@@ -1342,7 +1865,7 @@ class FTPPublisher(AbstractPublisher):
                 # Get the image
                 otherpic = m["MEDIANAME"]
                 imagename = "%s-%d.jpg" % ( animalcode, totalimages )
-                self.uploadImage(a, otherpic, imagename)
+                if changed: self.uploadImage(a, otherpic, imagename)
         return totalimages
 
 
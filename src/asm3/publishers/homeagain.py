@@ -106,7 +106,7 @@ class HomeAgainPublisher(AbstractPublisher):
                 try:
                     # Post our VetXML document
                     self.log("Posting microchip registration document to %s: %s" % (url, x))
-                    r = asm3.utils.post_xml(url, x, authheaders)
+                    r = self.http.post_xml(url, x, authheaders)
                     self.log("Response %d, HTTP headers: %s, body: %s" % (r["status"], r["headers"], r["response"]))
                     if r["status"] != 200: raise Exception(r["response"])
 
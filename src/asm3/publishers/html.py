@@ -217,6 +217,7 @@ class HTMLPublisher(FTPPublisher):
     navbar = ""
     totalAnimals = 0
     user = "cron"
+    useFingerprints = False # Pages are regenerated every run, so we always upload images with them
 
     def __init__(self, dbo, publishCriteria, user):
         l = dbo.locale
@@ -139,7 +139,7 @@ class MaddiesFundPublisher(AbstractPublisher):
                 "password": password,
                 "grant_type": "password"
             }
-            r = asm3.utils.post_form(MADDIES_FUND_TOKEN_URL, fields)
+            r = self.http.post_form(MADDIES_FUND_TOKEN_URL, fields)
             token = asm3.utils.json_parse(r["response"])["access_token"]
             self.log("got access token: %s (%s)" % (token, r["response"]))
         except Exception as err:
@@ -174,7 +174,7 @@ class MaddiesFundPublisher(AbstractPublisher):
                     j = asm3.utils.json({ "Animals": thisbatch })
                     headers = { "Authorization": "Bearer %s" % token }
                     self.log("HTTP POST request %s: headers: '%s', body: '%s'" % (MADDIES_FUND_UPLOAD_URL, headers, j))
-                    r = asm3.utils.post_json(MADDIES_FUND_UPLOAD_URL, j, headers)
+                    r = self.http.post_json(MADDIES_FUND_UPLOAD_URL, j, headers)
                     if r["status"] != 200:
                         self.logError("HTTP %d response: %s" % (r["status"], r["response"]))
                     else:
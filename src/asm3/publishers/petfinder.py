@@ -131,14 +131,13 @@ class PetFinderPublisher(FTPPublisher):
                     self.cleanup()
                     return
 
-                if PETFINDER_SEND_PHOTOS_BY_FTP:
-                    self.uploadImages(an, False, 3)
-
                 if hide_unaltered and an.NEUTERED == 0:
                     self.log("%s is unaltered and petfinder_hide_unaltered == true" % an["ANIMALNAME"])
                     continue
 
-                csv.append( self.processAnimal(an, agebands) )
+                line = self.processAnimal(an, agebands)
+                csv.append(line)
+                self.fingerprintAnimal(an, line)
 
                 # Mark success in the log
                 self.logSuccess("Processed: %s: %s (%d of %d)" % ( an["SHELTERCODE"], an["ANIMALNAME"], anCount, len(animals)))
@@ -149,11 +148,25 @@ class PetFinderPublisher(FTPPublisher):
         # Mark published
         self.markAnimalsPublished(animals, first=True)
 
+        # PetFinder already has everything in this file
+        if not self.hasChanges():
+            self.log("No changes since %s was last sent, not uploading" % shelterid)
+            self.cleanup()
+            return
+
+        # Upload the photos for the animals in the file. We do this once we know
+        # the file is going, as forceReupload is always on for PetFinder.
+        if PETFINDER_SEND_PHOTOS_BY_FTP:
+            for an in animals:
+                if an["ID"] in self.newFingerprints:
+                    self.uploadImages(an, False, 3)
+
         # Upload the datafile
         self.chdir("..", "import")
         self.saveFile(os.path.join(self.publishDir, shelterid), "\n".join(csv))
         self.log("Uploading datafile, %s" % shelterid)
-        self.upload(shelterid)
+        if self.upload(shelterid):
+            self.saveFingerprints(animals)
         self.log("Uploaded %s" % shelterid)
         self.log("-- FILE DATA -- (csv)")
         self.log("\n".join(csv))
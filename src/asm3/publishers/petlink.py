@@ -111,7 +111,7 @@ class PetLinkPublisher(AbstractPublisher):
         }
         self.log("Uploading data file (%d csv lines) to %s..." % (len(csv), UPLOAD_URL))
         try:
-            r = asm3.utils.post_data(UPLOAD_URL, "\n".join(csv), headers=headers)
+            r = self.http.post_data(UPLOAD_URL, "\n".join(csv), headers=headers)
             response = r["response"]
 
             self.log("req hdr: %s, \nreq data: %s" % (r["requestheaders"], r["requestbody"]))
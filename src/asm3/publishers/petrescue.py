@@ -82,6 +82,7 @@ class PetRescuePublisher(AbstractPublisher):
 
         animals = self.getMatchingAnimals(includeAdditionalFields=True)
         processed = []
+        unchanged = []
 
         if len(animals) == 0:
             self.setLastError("No animals found to publish.")
@@ -90,27 +91,43 @@ class PetRescuePublisher(AbstractPublisher):
 
         headers = { "Authorization": "Token token=%s" % token, "Accept": "*/*" }
 
-        anCount = 0
-        for an in animals:
+        # PetRescue will insert/update accordingly based on whether remote_id/remote_source exists
+        url = PETRESCUE_URL + "listings"
+
+        def listings():
+            """ Builds the listing for each animal that has changed since we last sent it, the POSTs are sent by send on the http workers """
+            for i, an in enumerate(animals):
+                try:
+                    data = self.processAnimal(an, all_desexed, adoptable_in, suburb, state, postcode, contact_name, contact_number, contact_email)
+                    jsondata = asm3.utils.json(data)
+                    if not self.fingerprintAnimal(an, jsondata):
+                        self.log("%s - %s: unchanged since last sent, skipping" % (an["SHELTERCODE"], an["ANIMALNAME"]))
+                        unchanged.append(an)
+                        continue
+                    self.log("Sending POST to %s to create/update listing: %s" % (url, jsondata))
+                    yield i + 1, an, jsondata
+                except Exception as err:
+                    self.logError("Failed processing animal: %s, %s" % (str(an["SHELTERCODE"]), err), sys.exc_info())
+
+        def send(listing):
+            anCount, an, jsondata = listing
+            return self.http.post_json(url, jsondata, headers=headers)
+
+        results = self.http.map(send, listings())
+        for (anCount, an, jsondata), future in results:
             try:
-                anCount += 1
                 self.log("Processing: %s: %s (%d of %d)" % ( an["SHELTERCODE"], an["ANIMALNAME"], anCount, len(animals)))
                 self.updatePublisherProgress(self.getProgress(anCount, len(animals)))
 
                 # If the user cancelled, stop now
                 if self.shouldStopPublishing(): 
                     self.log("User cancelled publish. Stopping.")
+                    results.close()
                     self.resetPublisherProgress()
                     self.cleanup()
                     return
-      
-                data = self.processAnimal(an, all_desexed, adoptable_in, suburb, state, postcode, contact_name, contact_number, contact_email)
 
-                # PetRescue will insert/update accordingly based on whether remote_id/remote_source exists
-                url = PETRESCUE_URL + "listings"
-                jsondata = asm3.utils.json(data)
-                self.log("Sending POST to %s to create/update listing: %s" % (url, jsondata))
-                r = asm3.utils.post_json(url, jsondata, headers=headers)
+                r = future.result()
 
                 if r["status"] != 200:
                     self.logError("HTTP %d, headers: %s, response: %s" % (r["status"], r["headers"], r["response"]))
@@ -143,9 +160,9 @@ class PetRescuePublisher(AbstractPublisher):
         except Exception as err:
             self.logError("Failed finding listings to cancel: %s" % err, sys.exc_info())
 
-        # Cancel the inactive listings
-        for an in animals:
-            try:
+        def updates():
+            """ Works out the new status for each inactive listing, the PATCHes are sent by send_status on the http workers """
+            for an in animals:
                 status = "on_hold"
                 if an.ACTIVEMOVEMENTDATE is not None and an.ACTIVEMOVEMENTTYPE == 1: status = "rehomed"
                 elif an.DECEASEDDATE is not None or (an.ACTIVEMOVEMENTDATE is not None and an.ACTIVEMOVEMENTTYPE != 2): status = "removed"
@@ -153,29 +170,38 @@ class PetRescuePublisher(AbstractPublisher):
                 # We have the last status update in the LastStatus field (which is animalpublished.Extra for this animal)
                 # Don't send the same update again.
                 if an.LASTSTATUS != status:
-
-                    data = { "status": status }
-                    jsondata = asm3.utils.json(data)
+                    jsondata = asm3.utils.json({ "status": status })
                     url = PETRESCUE_URL + "listings/%s/SM%s" % (an.ID, self.dbo.database)
-
                     self.log("Sending PATCH to %s to update existing listing: %s" % (url, jsondata))
-                    r = asm3.utils.patch_json(url, jsondata, headers=headers)
+                    yield an, status, url, jsondata
 
-                    if r["status"] == 200:
-                        self.log("HTTP %d, headers: %s, response: %s" % (r["status"], r["headers"], r["response"]))
-                        self.logSuccess("%s - %s: Marked with new status %s" % (an.SHELTERCODE, an.ANIMALNAME, status))
+        def send_status(update):
+            an, status, url, jsondata = update
+            return self.http.patch_json(url, jsondata, headers=headers)
 
-                        # Update animalpublished for this animal with the status we just sent in the Extra field
-                        # so that it can be picked up next time.
-                        self.markAnimalPublished(an.ID, extra = status)
-                    else:
-                        self.logError("HTTP %d, headers: %s, response: %s" % (r["status"], r["headers"], r["response"]))
+        # Cancel the inactive listings
+        for (an, status, url, jsondata), future in self.http.map(send_status, updates()):
+            try:
+                r = future.result()
+
+                if r["status"] == 200:
+                    self.log("HTTP %d, headers: %s, response: %s" % (r["status"], r["headers"], r["response"]))
+                    self.logSuccess("%s - %s: Marked with new status %s" % (an.SHELTERCODE, an.ANIMALNAME, status))
+
+                    # Update animalpublished for this animal with the status we just sent in the Extra field
+                    # so that it can be picked up next time.
+                    self.markAnimalPublished(an.ID, extra = status)
+                else:
+                    self.logError("HTTP %d, headers: %s, response: %s" % (r["status"], r["headers"], r["response"]))
 
             except Exception as err:
                 self.logError("Failed closing listing for %s - %s: %s" % (an.SHELTERCODE, an.ANIMALNAME, err), sys.exc_info())
 
-        # Mark sent animals published
-        self.markAnimalsPublished(processed, first=True)
+        # Mark sent animals published, along with the unchanged ones PetRescue 
+        # already has so that they aren't treated as listings to cancel
+        self.markAnimalsPublished(processed + unchanged, first=True)
+        self.getChanges()
+        self.saveFingerprints(processed, unchanged)
 
         self.cleanup()
 
@@ -117,7 +117,7 @@ class PETtracUKPublisher(AbstractPublisher):
                 fields = self.processAnimal(an, orgname, orgserial, orgpostcode, orgpassword, registeroverseas, overseasorigin)
 
                 self.log("HTTP POST request %s: %s" % (PETTRAC_UK_POST_URL, str(fields)))
-                r = asm3.utils.post_form(PETTRAC_UK_POST_URL, fields)
+                r = self.http.post_form(PETTRAC_UK_POST_URL, fields)
                 self.log("HTTP response: %s" % r["response"])
 
                 # Return value is an XML fragment, look for "Registration completed successfully"
@@ -139,7 +139,7 @@ class PETtracUKPublisher(AbstractPublisher):
 
                         reregurl = PETTRAC_UK_POST_URL.replace("onlineregistration", "onlinereregistration")
                         self.log("HTTP multipart POST request %s: %s" % (reregurl, str(fields)))
-                        r = asm3.utils.post_multipart(reregurl, fields, { pdfname: (pdfname, pdf, "application/pdf" )} )
+                        r = self.http.post_multipart(reregurl, fields, { pdfname: (pdfname, pdf, "application/pdf" )} )
                         self.log("HTTP response: %s" % r["response"])
 
                         if r["response"].find("successfully") != -1:
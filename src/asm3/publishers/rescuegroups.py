@@ -107,7 +107,9 @@ class RescueGroupsPublisher(FTPPublisher):
                 # Upload images for this animal
                 totalimages = self.uploadImages(an, False, 4)
 
-                csv.append( self.processAnimal(an, totalimages, shelterid) )
+                line = self.processAnimal(an, totalimages, shelterid)
+                csv.append(line)
+                self.fingerprintAnimal(an, line)
 
                 # Mark success in the log
                 self.logSuccess("Processed: %s: %s (%d of %d)" % ( an["SHELTERCODE"], an["ANIMALNAME"], anCount, len(animals)))
@@ -117,6 +119,12 @@ class RescueGroupsPublisher(FTPPublisher):
         # Mark published
         self.markAnimalsPublished(animals, first=True)
 
+        # RescueGroups already has everything in this file
+        if not self.hasChanges():
+            self.log("No changes since pets.csv was last sent, not uploading")
+            self.cleanup()
+            return
+
         header = "orgID, animalID, status, lastUpdated, rescueID, name, summary, species, breed, " \
             "primaryBreed, secondaryBreed, sex, mixed, dogs, cats, kids, declawed, housetrained, age, " \
             "specialNeeds, altered, size, uptodate, color, coatLength, pattern, courtesy, description, pic1, " \
@@ -124,7 +132,8 @@ class RescueGroupsPublisher(FTPPublisher):
         self.saveFile(os.path.join(self.publishDir, "pets.csv"), header + "\n".join(csv))
         self.log("Uploading datafile %s" % "pets.csv")
         self.chdir("..", "import")
-        self.upload("pets.csv")
+        if self.upload("pets.csv"):
+            self.saveFingerprints(animals)
         self.log("Uploaded %s" % "pets.csv")
         self.log("-- FILE DATA --")
         self.log(header + "\n".join(csv))
@@ -96,6 +96,7 @@ class SavourLifePublisher(AbstractPublisher):
         preanimals = self.getMatchingAnimals(includeAdditionalFields=True)
         animals = [ x for x in preanimals if x.SPECIESID == 1 ] # We only want dogs
         processed = []
+        unchanged = []
 
         if len(animals) == 0:
             self.setLastError("No animals found to publish.")
@@ -107,7 +108,7 @@ class SavourLifePublisher(AbstractPublisher):
         jsondata = '{ "Username": "%s", "Password": "%s", "Key": "%s" }' % ( username, password, SAVOURLIFE_API_KEY )
         self.log("Token request to %s: %s" % ( url, jsondata))
         try:
-            r = asm3.utils.post_json(url, jsondata)
+            r = self.http.post_json(url, jsondata)
             if r["status"] != 200:
                 self.setLastError("Authentication failed.")
                 self.logError("HTTP %d, headers: %s, response: %s" % (r["status"], r["headers"], r["response"]))
@@ -121,31 +122,47 @@ class SavourLifePublisher(AbstractPublisher):
             self.cleanup()
             return
 
-        anCount = 0
-        for an in animals:
+        # SavourLife will insert/update accordingly based on whether DogId is null or not
+        url = SAVOURLIFE_URL + "setDog"
+
+        def listings():
+            """ Builds the listing for each dog that has changed since we last sent it, the POSTs are sent by send on the http workers """
+            for i, an in enumerate(animals):
+                try:
+                    # Do we already have a SavourLife ID for this animal?
+                    # This function returns None if no match is found
+                    dogid = asm3.animal.get_extra_id(self.dbo, an, asm3.animal.IDTYPE_SAVOURLIFE)
+                    data = self.processAnimal(an, dogid, postcode, state, suburb, username, token, interstate)
+                    # The token changes every run, leave it out of the fingerprint
+                    if not self.fingerprintAnimal(an, dict(data, Token=None)):
+                        self.log("%s - %s: unchanged since last sent, skipping" % (an["SHELTERCODE"], an["ANIMALNAME"]))
+                        unchanged.append(an)
+                        continue
+                    jsondata = asm3.utils.json(data)
+                    self.log("Sending POST to %s to create/update listing: %s" % (url, jsondata))
+                    yield i + 1, an, dogid, jsondata
+                except Exception as err:
+                    self.logError("Failed processing animal: %s, %s" % (str(an["SHELTERCODE"]), err), sys.exc_info())
+
+        def send(listing):
+            anCount, an, dogid, jsondata = listing
+            return self.http.post_json(url, jsondata)
+
+        results = self.http.map(send, listings())
+        for (anCount, an, dogid, jsondata), future in results:
             try:
-                anCount += 1
                 self.log("Processing: %s: %s (%d of %d)" % ( an["SHELTERCODE"], an["ANIMALNAME"], anCount, len(animals)))
                 self.updatePublisherProgress(self.getProgress(anCount, len(animals)))
 
                 # If the user cancelled, stop now
                 if self.shouldStopPublishing(): 
                     self.log("User cancelled publish. Stopping.")
+                    results.close()
                     self.resetPublisherProgress()
                     self.cleanup()
                     return
 
-                # Do we already have a SavourLife ID for this animal?
-                # This function returns None if no match is found
-                dogid = asm3.animal.get_extra_id(self.dbo, an, asm3.animal.IDTYPE_SAVOURLIFE)
-
-                data = self.processAnimal(an, dogid, postcode, state, suburb, username, token, interstate)
-
-                # SavourLife will insert/update accordingly based on whether DogId is null or not
-                url = SAVOURLIFE_URL + "setDog"
-                jsondata = asm3.utils.json(data)
-                self.log("Sending POST to %s to create/update listing: %s" % (url, jsondata))
-                r = asm3.utils.post_json(url, jsondata)
+                r = future.result()
 
                 if r["status"] != 200:
                     self.logError("HTTP %d, headers: %s, response: %s" % (r["status"], r["headers"], r["response"]))
@@ -219,7 +236,7 @@ class SavourLifePublisher(AbstractPublisher):
                         url = SAVOURLIFE_URL + "setDogAdopted"
                         jsondata = asm3.utils.json(data)
                         self.log("Sending POST to %s to mark animal '%s - %s' adopted: %s" % (url, an.SHELTERCODE, an.ANIMALNAME, jsondata))
-                        r = asm3.utils.post_json(url, jsondata)
+                        r = self.http.post_json(url, jsondata)
 
                         if r["status"] != 200:
                             self.logError("HTTP %d, headers: %s, response: %s" % (r["status"], r["headers"], r["response"]))
@@ -237,8 +254,11 @@ class SavourLifePublisher(AbstractPublisher):
         except Exception as err:
             self.logError("Failed finding potential dogs to mark adopted: %s" % err, sys.exc_info())
 
-        # Mark sent animals published
-        self.markAnimalsPublished(processed, first=True)
+        # Mark sent animals published, along with the unchanged ones SavourLife
+        # already has so that they can still be marked adopted later
+        self.markAnimalsPublished(processed + unchanged, first=True)
+        self.getChanges()
+        self.saveFingerprints(processed, unchanged)
 
         self.cleanup()
 
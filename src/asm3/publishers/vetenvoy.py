@@ -8,7 +8,7 @@ import asm3.utils
 # THIS CODE LEFT HERE IN CASE WE USE THEM FOR OTHER SERVICES IN FUTURE.
 # ============================================================================
 
-from .base import AbstractPublisher, get_microchip_data
+from .base import AbstractPublisher, HTTPClient, get_microchip_data
 from asm3.sitedefs import VETENVOY_US_VENDOR_USERID, VETENVOY_US_VENDOR_PASSWORD, VETENVOY_US_HOMEAGAIN_RECIPIENTID, VETENVOY_US_AKC_REUNITE_RECIPIENTID, VETENVOY_US_BASE_URL, VETENVOY_US_SYSTEM_ID
 
 import re
@@ -115,7 +115,7 @@ class VetEnvoyUSMicrochipPublisher(AbstractPublisher):
                 url = VETENVOY_US_BASE_URL + "Chip/NewConversationId"
                 self.log("Contacting vetenvoy to start a new conversation: %s" % url)
                 try:
-                    r = asm3.utils.get_url(url, authheaders)
+                    r = self.http.get_url(url, authheaders)
                     self.log("Got response: %s" % r["response"])
                     conversationid = re.findall('c id="(.+?)"', r["response"])
                     if len(conversationid) == 0:
@@ -126,7 +126,7 @@ class VetEnvoyUSMicrochipPublisher(AbstractPublisher):
 
                     # Now post the XML document
                     self.log("Posting microchip registration document: %s" % x)
-                    r = asm3.utils.post_xml(VETENVOY_US_BASE_URL + "Chip/" + conversationid, x, authheaders)
+                    r = self.http.post_xml(VETENVOY_US_BASE_URL + "Chip/" + conversationid, x, authheaders)
                     self.log("Response %d, HTTP headers: %s, body: %s" % (r["status"], r["headers"], r["response"]))
                     if r["status"] != 200: raise Exception(r["response"])
 
@@ -299,9 +299,10 @@ class VetEnvoyUSMicrochipPublisher(AbstractPublisher):
         # Start a new conversation with VetEnvoy's signup handler
         url = VETENVOY_US_BASE_URL + "AutoSignup/NewConversationId"
         asm3.al.debug("Contacting VetEnvoy to start a new signup conversation: %s" % url, "VetEnvoyMicrochipPublisher.signup", dbo)
+        http = HTTPClient(workers=1)
         try:
 
-            r = asm3.utils.get_url(url, authheaders)
+            r = http.get_url(url, authheaders)
             asm3.al.debug("Got response: %s" % r["response"], "VetEnvoyMicrochipPublisher.signup", dbo)
             conversationid = re.findall('c id="(.+?)"', r["response"])
             if len(conversationid) == 0:
@@ -311,7 +312,7 @@ class VetEnvoyUSMicrochipPublisher(AbstractPublisher):
 
             # Now post the XML signup document
             asm3.al.debug("Posting signup document: %s" % x, "VetEnvoyMicrochipPublisher.signup", dbo)
-            r = asm3.utils.post_xml(VETENVOY_US_BASE_URL + "AutoSignup/" + conversationid, asm3.utils.str2bytes(x), authheaders)
+            r = http.post_xml(VETENVOY_US_BASE_URL + "AutoSignup/" + conversationid, asm3.utils.str2bytes(x), authheaders)
             asm3.al.debug("Response %d, HTTP headers: %s, body: %s" % (r["status"], r["headers"], r["response"]), "VetEnvoyMicrochipPublisher.signup", dbo)
             if r["status"] != 200: raise Exception(r["response"])
 
@@ -329,6 +330,9 @@ class VetEnvoyUSMicrochipPublisher(AbstractPublisher):
             asm3.al.error("Failed during autosignup: %s" % em, "VetEnvoyMicrochipPublisher.signup", dbo, sys.exc_info())
             raise asm3.utils.ASMValidationError("Failed during autosignup")
 
+        finally:
+            http.close()
+
 class AllVetEnvoyPublisher(AbstractPublisher):
     """ Publisher class that runs all VetEnvoy publishers in one go. This is needed because
         all of VetEnvoy is enabled at once rather than individuals publishers """
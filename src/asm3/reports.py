@@ -14,6 +14,9 @@ from asm3.sitedefs import BASE_URL, QR_IMG_SRC, URL_REPORTS
 HEADER = 0
 FOOTER = 1
 
+# Characters that denote a field token has ended
+VALID_TOKEN_END = (" ", "\n", "\r", ",", "<", ">", "&" , "[", "]", "{", "}", ".", "$", "*", ":", ";", "!", "%", "^", "(", ")", "@", "~", "/", "\\", "'", "\"", "|")
+
 DEFAULT_REPORT_HEADER = """
 <!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">
 <html>
@@ -648,6 +651,64 @@ class GroupDescriptor:
     lastGroupStartPosition = 0
     lastGroupEndPosition = 0
 
+class CompiledBlock(object):
+    """
+    A report block (header, body, group header/footer) parsed once into 
+    literal text and $FIELD tokens for the columns of a resultset, so
+    that every row can be substituted in a single pass.
+    If a token runs straight into another (eg: $A$B), the output can depend on 
+    the values substituted, so compiled is False and the block must be 
+    substituted field by field with Report._ReplaceFields instead.
+    """
+    def __init__(self, block, columns):
+        self.literals = [] # The text between tokens, one more than fields
+        self.fields = [] # The column name for each token
+        self.compiled = self._compile(block, columns)
+
+    def _compile(self, block, columns):
+        lc = block.lower()
+        if len(lc) != len(block): return False
+        names = {}
+        for k in columns:
+            lk = k.lower()
+            if lk == "" or any(c in VALID_TOKEN_END for c in lk):
+                # Column names containing end characters (eg: COUNT(*)) cannot
+                # be tokenised, give up if the block refers to one
+                if lc.find("$" + lk) != -1: return False
+                continue
+            names[lk] = k
+        def token_end(p):
+            """ Returns the position of the character that ends the token starting at p """
+            r = p + 1
+            while r < len(lc) and lc[r] not in VALID_TOKEN_END: r += 1
+            return r
+        def is_token(p, r):
+            return r < len(lc) and lc[p+1:r] in names
+        pos = 0
+        p = lc.find("$")
+        while p != -1:
+            r = token_end(p)
+            if r < len(lc) and lc[r] == "$" and is_token(r, token_end(r)):
+                return False
+            if is_token(p, r):
+                self.literals.append(block[pos:p])
+                self.fields.append(names[lc[p+1:r]])
+                pos = r
+            p = lc.find("$", p + 1)
+        self.literals.append(block[pos:])
+        return True
+
+    def render(self, values):
+        """
+        Returns the block with the tokens substituted. 
+        values is a dict of column name to substituted value.
+        """
+        out = [ self.literals[0] ]
+        for i, f in enumerate(self.fields):
+            out.append(values[f])
+            out.append(self.literals[i+1])
+        return "".join(out)
+
 class Report:
     dbo = None
     user = ""
@@ -662,10 +723,24 @@ class Report:
     omitCriteria = False
     omitHeaderFooter = False
     isSubReport = False
-    output = ""
     
     def __init__(self, dbo):
         self.dbo = dbo
+        self.outputParts = []
+        self.compiledBlocks = {}
+        self.formatters = {}
+
+    @property
+    def output(self):
+        """ The report output so far, parts appended are only joined when it is read """
+        if len(self.outputParts) == 0: return ""
+        if len(self.outputParts) > 1:
+            self.outputParts = [ "".join(self.outputParts) ]
+        return self.outputParts[0]
+
+    @output.setter
+    def output(self, s):
+        self.outputParts = [ s ]
 
     def _ReadReport(self, reportId):
         """
@@ -722,8 +797,7 @@ class Report:
             return s
 
     def _Append(self, s):
-        self.output += str(s)
-        return self.output
+        self.outputParts.append(str(s))
 
     def _p(self, s):
         self._Append("<p>%s</p>" % s)
@@ -738,8 +812,7 @@ class Report:
         up the parser after substitution.
         s is the html string, k is the fieldname, v is the value
         """
-        # Characters that denote a field token has ended
-        validend = (" ", "\n", "\r", ",", "<", ">", "&" , "[", "]", "{", "}", ".", "$", "*", ":", ";", "!", "%", "^", "(", ")", "@", "~", "/", "\\", "'", "\"", "|")
+        validend = VALID_TOKEN_END
         lc = s.lower()
         tok = lc.find("$")
         while tok != -1:
@@ -753,6 +826,51 @@ class Report:
             tok = lc.find("$", tok+1) 
         return s
         
+    def _ReplaceAllFields(self, s, row):
+        """
+        Replaces the field tokens in s with the display values of all the 
+        fields in row. Gives the same output as calling _ReplaceFields for
+        each field, but s is only parsed once per report and only the fields 
+        it refers to are formatted.
+        """
+        cb = self.compiledBlocks.get(s)
+        if cb is None:
+            cb = CompiledBlock(s, row.keys())
+            self.compiledBlocks[s] = cb
+        if not cb.compiled:
+            for k, v in row.items():
+                s = self._ReplaceFields(s, k, self._DisplayValue(k, v))
+            return s
+        values = {}
+        for k in cb.fields:
+            if k not in values:
+                values[k] = self._FormatField(k, row[k]).replace("{", "&#123;").replace("}", "&#125;").replace("$", "&#36;")
+        return cb.render(values)
+
+    def _FormatField(self, k, v):
+        """
+        Returns the same display value as _DisplayValue, using a formatter
+        function for field k that is worked out once per report.
+        """
+        f = self.formatters.get(k)
+        if f is None:
+            l = self.dbo.locale
+            def display_date(v):
+                # If the time is midnight, omit it
+                if str(v).find("00:00:00") != -1:
+                    return asm3.i18n.python2display(l, v)
+                return "%s %s" % (asm3.i18n.python2display(l, v), asm3.i18n.format_time(v))
+            currency = asm3.utils.is_currency(k)
+            def f(v):
+                if v is None: return ""
+                if asm3.utils.is_date(v): return display_date(v)
+                sv = str(v)
+                if sv.find("00:00:00.00") != -1: return display_date(v)
+                if currency: return asm3.i18n.format_currency(l, v)
+                return sv
+            self.formatters[k] = f
+        return f(v)
+
     def _DisplayValue(self, k, v):
         """
         Returns the display version of any value
@@ -793,8 +911,7 @@ class Report:
 
         # Replace any fields in the block based on the last row
         # in the group
-        for k, v in rs[gd.lastGroupEndPosition].items():
-            out = self._ReplaceFields(out, k, self._DisplayValue(k, v))
+        out = self._ReplaceAllFields(out, rs[gd.lastGroupEndPosition])
 
         # Replace any of our special header/footer tokens
         out = self._SubstituteTemplateHeaderFooter(out)
@@ -1516,6 +1633,7 @@ class Report:
         """
         Does the work of generating the report content
         """
+        self.compiledBlocks = {}
 
         # String indexes within report html string to where 
         # tokens begin and end
@@ -1720,9 +1838,7 @@ class Report:
 
             # Make a temp string to hold the body block 
             # while we substitute fields for tags
-            tempbody = cbody
-            for k, v in rs[row].items():
-                tempbody = self._ReplaceFields(tempbody, k, self._DisplayValue(k, v))
+            tempbody = self._ReplaceAllFields(cbody, rs[row])
 
             # Update the last value for each group
             for gd in groups:
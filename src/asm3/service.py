@@ -150,12 +150,12 @@ def safe_cache_key(method, qs):
     """ 
     Reads the parameters from querystring and throws away 
     any parameters that are not in CACHE_PROTECT_METHODS for the method.
-    If the method appears in AUTH_METHODS, whitelists the username/password params.
+    If the method appears in AUTH_METHODS, whitelists the username/password/token params.
     """
     if qs.startswith("?"): qs = qs[1:]
     whitelist = [ "method", "account" ]
     if method in AUTH_METHODS:
-        whitelist += [ "username", "password" ]
+        whitelist += [ "username", "password", "token" ]
     whitelist += CACHE_PROTECT_METHODS[method]
     out = []
     for p in qs.split("&"):
@@ -322,6 +322,7 @@ def handler(post, path, remoteip, referer, querystring):
     account = post["account"]
     username = post["username"]
     password = post["password"]
+    token = post["token"]
     method = post["method"]
     animalid = post.integer("animalid")
     formid = post.integer("formid")
@@ -375,10 +376,17 @@ def handler(post, path, remoteip, referer, querystring):
         if not asm3.configuration.service_auth_enabled(dbo):
             asm3.al.error("Service API for auth methods is disabled (%s)" % method, "service.handler", dbo)
             return ("text/plain", 0, 0, "ERROR: Service API for authenticated methods is disabled")
-        user = asm3.users.authenticate(dbo, username, password)
-        if user is None:
-            asm3.al.error("auth failed - %s/%s is not a valid username/password from %s" % (username, password, remoteip), "service.handler", dbo)
-            return ("text/plain", 0, 0, "ERROR: Invalid username and password")
+        if token != "":
+            user = asm3.users.authenticate_token(dbo, token)
+            if user is None:
+                asm3.al.error("auth failed - invalid, revoked or expired token from %s" % remoteip, "service.handler", dbo)
+                return ("text/plain", 0, 0, "ERROR: Invalid token")
+            username = user["USERNAME"]
+        else:
+            user = asm3.users.authenticate(dbo, username, password)
+            if user is None:
+                asm3.al.error("auth failed - %s/%s is not a valid username/password from %s" % (username, password, remoteip), "service.handler", dbo)
+                return ("text/plain", 0, 0, "ERROR: Invalid username and password")
         securitymap = asm3.users.get_security_map(dbo, user["USERNAME"])
 
     # Get the preferred locale and timezone for the site
@@ -90,6 +90,34 @@ DB_TIME_LOG_OVER = get_integer("db_time_log_over", 0)
 # Time out queries that take longer than this (ms) to run
 DB_TIMEOUT = get_integer("db_timeout", 0)
 
+# Keep a pool of up to this many open connections per database and reuse 
+# them between requests (0 to open a new connection for every query)
+DB_POOL_SIZE = get_integer("db_pool_size", 0)
+
+# Close pooled connections that have been idle for longer than this many seconds
+DB_POOL_IDLE_TIMEOUT = get_integer("db_pool_idle_timeout", 300)
+
+# How many seconds to wait for a free connection when the pool is full
+DB_POOL_WAIT = get_integer("db_pool_wait", 30)
+
+# Number of rows fetched at a time from the server by streaming queries (Database.query_stream)
+DB_STREAM_BATCH_SIZE = get_integer("db_stream_batch_size", 1000)
+
+# Maximum number of rows sent in a single multi-row INSERT by bulk writes (Database.insert_many)
+DB_WRITE_BATCH_SIZE = get_integer("db_write_batch_size", 250)
+
+# Database dumps (cron.py maint_db_dump*): number of rows in each multi-row INSERT 
+# or COPY block, whether to write INSERT statements or PostgreSQL COPY blocks (insert/copy),
+# how many tables to dump at once in separate threads and whether to gzip the output
+DB_DUMP_BATCH_SIZE = get_integer("db_dump_batch_size", 100)
+DB_DUMP_FORMAT = get_string("db_dump_format", "insert")
+DB_DUMP_WORKERS = get_integer("db_dump_workers", 1)
+DB_DUMP_COMPRESS = get_boolean("db_dump_compress", False)
+
+# CSV imports write this many rows in each transaction. If an import is cancelled
+# or fails, importing the same file again carries on after the last rows written.
+CSV_IMPORT_CHUNK_SIZE = get_integer("csv_import_chunk_size", 100)
+
 # URLs for ASM services
 URL_NEWS = get_string("url_news", "https://sheltermanager.com/repo/asm_news.html")
 URL_REPORTS = get_string("url_reports", "https://sheltermanager.com/repo/reports.txt")
@@ -103,6 +131,13 @@ SESSION_SECURE_COOKIE = get_boolean("session_secure_cookie", False)
 # Output debug info on sessions
 SESSION_DEBUG = get_boolean("session_debug", False)
 
+# How many seconds a verified username and password is remembered for so that
+# repeated service calls don't have to hash the password again (0 to disable).
+# Cache keys are a keyed hash of the credentials, if no secret is given a
+# random one is used by each process.
+AUTH_CACHE_TTL = get_integer("auth_cache_ttl", 300)
+AUTH_CACHE_SECRET = get_string("auth_cache_secret", "")
+
 # The host/port that memcached is running on if it is to be used.
 # If memcache is not available, an in memory dictionary will be
 # used instead.
@@ -135,6 +170,26 @@ CACHE_COMMON_QUERIES = get_boolean("cache_common_queries", False)
 # to their max-age headers in the disk cache
 CACHE_SERVICE_RESPONSES = get_boolean("cache_service_responses", False)
 
+# Cache the adoptable animal data used by the service and publishers in
+# the disk cache for this many seconds (0 to disable). Cached data is
+# thrown away as soon as an animal, movement or media record changes.
+CACHE_PUBLISH_DATA = get_integer("cache_publish_data", 300)
+
+# Where cached values are stored (see asm3/cachebackend.py):
+# lru    - a size bounded dictionary in each process
+# sqlite - a single file in DISK_CACHE shared by all processes on this host
+# file   - one pickle file per value in DISK_CACHE
+# If MEMCACHIER_SERVERS is set, memcache is always used for the memory cache.
+CACHE_MEM_BACKEND = get_string("cache_mem_backend", "lru")
+CACHE_DISK_BACKEND = get_string("cache_disk_backend", "file")
+
+# The maximum number of values to keep in the lru cache backend
+CACHE_LRU_MAX_ITEMS = get_integer("cache_lru_max_items", 10000)
+
+# The file and maximum number of values for the sqlite cache backend
+CACHE_SQLITE_FILE = get_string("cache_sqlite_file", os.path.join(DISK_CACHE, "cache.db"))
+CACHE_SQLITE_MAX_ITEMS = get_integer("cache_sqlite_max_items", 100000)
+
 # If EMAIL_ERRORS is set to True, all errors from the site
 # are emailed to ADMIN_EMAIL and the user is given a generic
 # error page. If set to False, debug information is output.
@@ -183,6 +238,11 @@ GEO_BATCH = get_boolean("geo_batch", False)             # Whether or not to try
 GEO_LIMIT = get_integer("geo_limit", 100)               # How many geocodes to lookup as part of the batch
 GEO_LOOKUP_TIMEOUT = get_integer("geo_lookup_timeout", 5) # Timeout in seconds when doing geocode lookups
 GEO_SLEEP_AFTER = get_integer("geo_sleep_after", 1)     # Sleep for seconds after a request to throttle (nominatim has a 1/s limit)
+GEO_RATE_LIMITS = get_dict("geo_rate_limits", {})      # Requests per second for each provider, eg: { "google": 10 } (others use 1/geo_sleep_after)
+GEO_STORE_FILE = get_string("geo_store_file", os.path.join(DISK_CACHE, "geocodes.db")) # SQLite file geocodes are kept in
+GEO_STORE_TTL = get_integer("geo_store_ttl", 180)       # Days to keep geocodes in the store
+GEO_WORKERS = get_integer("geo_workers", 2)             # Threads looking up queued geocodes in each process
+GEO_WRITE_BATCH = get_integer("geo_write_batch", 50)    # Write queued geocodes back to the database in batches of this size
 
 # Enable the database field on login and allow login to multiple databases
 MULTIPLE_DATABASES = get_boolean("multiple_databases", False)
@@ -190,6 +250,21 @@ MULTIPLE_DATABASES_TYPE = get_string("multiple_databases_type", "map")
 # { "alias": { "dbtype": "MYSQL", "host": "localhost", "port": 3306, "username": "root", "password": "root", "database": "asm" } }
 MULTIPLE_DATABASES_MAP = get_dict("multiple_databases_map")
 
+# Running cron.py in schedule mode for multiple databases
+CRON_SCHEDULE_WORKERS = get_integer("cron_schedule_workers", 4)     # How many databases to run at once
+CRON_SCHEDULE_TIMEOUT = get_integer("cron_schedule_timeout", 3600)  # Seconds a database can run before it is stopped
+CRON_SCHEDULE_RETRIES = get_integer("cron_schedule_retries", 1)     # Times to retry a database that failed or timed out
+
+# HTTP requests made by third party publishers
+PUBLISH_HTTP_WORKERS = get_integer("publish_http_workers", 4)       # Requests each publisher can have in flight at once
+PUBLISH_HTTP_TIMEOUT = get_integer("publish_http_timeout", 30)      # Seconds to wait for a connection or response
+PUBLISH_HTTP_RETRIES = get_integer("publish_http_retries", 2)       # Times to retry a request that failed to connect or got 429/502/503/504
+PUBLISH_HTTP_BACKOFF = get_integer("publish_http_backoff", 1)       # Seconds to wait before the first retry, doubled for each one after
+PUBLISH_HTTP_STANDIN = get_string("publish_http_standin", "")       # eg: http://localhost:8099 - send all publisher requests here instead
+
+# Third party publishers only send animals that changed since they were last sent
+PUBLISH_RESEND_DAYS = get_integer("publish_resend_days", 7)         # Days before an unchanged animal is sent again, 0 = only send changes
+
 # FTP hosts and URLs for third party publishing services
 ADOPTAPET_FTP_HOST = get_string("adoptapet_ftp_host", "autoupload.adoptapet.com")
 AKC_REUNITE_BASE_URL = get_string("akc_reunite_base_url", "")
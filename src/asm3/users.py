@@ -8,9 +8,16 @@ import asm3.dbupdate
 import asm3.i18n
 import asm3.utils
 
+from asm3.sitedefs import AUTH_CACHE_SECRET, AUTH_CACHE_TTL
+
+import hashlib
+import hmac
 import os
 import sys
 
+# The secret used to hash credentials for the verified credential cache
+AUTH_CACHE_KEY = asm3.utils.str2bytes(AUTH_CACHE_SECRET) if AUTH_CACHE_SECRET != "" else os.urandom(32)
+
 # Security flags
 ADD_ANIMAL                      = "aa"
 CHANGE_ANIMAL                   = "ca"
@@ -245,19 +252,68 @@ def add_security_flag(securitymap, flag):
         securitymap += flag + " *"
     return securitymap
 
+def auth_cache_key(dbo, username, password):
+    """
+    Returns the verified credential cache key for a username and password.
+    It is a keyed hash so the cache never holds anything that could be
+    used to recover or test a password.
+    """
+    s = "%s\0%s\0%s" % (dbo.database, username.upper(), password)
+    return "auth:%s" % hmac.new(AUTH_CACHE_KEY, asm3.utils.str2bytes(s), hashlib.sha256).hexdigest()
+
+def auth_cache_digest(dbpassword):
+    """
+    Returns a keyed hash of a user's stored password hash. This is
+    what the verified credential cache holds to tell whether the
+    password has changed, rather than the stored hash itself.
+    """
+    return hmac.new(AUTH_CACHE_KEY, asm3.utils.str2bytes(dbpassword.strip()), hashlib.sha256).hexdigest()
+
 def authenticate(dbo, username, password):
     """
     Authenticates whether a username and password are valid.
     Returns None if authentication failed, or a user row
+    Credentials that verify are remembered for AUTH_CACHE_TTL seconds
+    along with a keyed hash of the password hash they matched. The
+    user's current hash must still give the same digest for a cached
+    entry to be used, so changing or resetting a password invalidates
+    it in every process.
     """
     username = username.upper()
+    key = None
+    if AUTH_CACHE_TTL > 0:
+        key = auth_cache_key(dbo, username, password)
+        cached = asm3.cachemem.get(key)
+        if cached is not None:
+            userid, digest = cached
+            u = dbo.query("SELECT * FROM users WHERE ID=?", [userid])
+            if len(u) == 1 and u[0].USERNAME.upper() == username and hmac.compare_digest(auth_cache_digest(u[0].PASSWORD), digest): 
+                return u[0]
+            asm3.cachemem.delete(key)
     # Do not use any login inputs directly in database queries
     for u in dbo.query("SELECT ID, UserName, Password FROM users"):
         if username == u.USERNAME.upper():
             dbpassword = u.PASSWORD.strip()
             if verify_password(password, dbpassword):
                 u = dbo.query("SELECT * FROM users WHERE ID=?", [u.ID])
-                if len(u) == 1: return u[0]
+                if len(u) == 1: 
+                    if key is not None: asm3.cachemem.put(key, [ u[0].ID, auth_cache_digest(dbpassword) ], AUTH_CACHE_TTL)
+                    return u[0]
+    return None
+
+def authenticate_token(dbo, token):
+    """
+    Authenticates an API token.
+    Returns None if the token is not valid, has been revoked or
+    has expired, or a user row
+    """
+    if token is None or token.strip() == "": return None
+    # Only the hash of a token is stored, so that is what we look up
+    t = dbo.query("SELECT UserID, Expires FROM usertoken WHERE TokenHash=? AND Revoked=0", [asm3.utils.sha256_hash_hex(token.strip())])
+    if len(t) == 0: return None
+    if t[0].EXPIRES is not None and t[0].EXPIRES < dbo.now(): return None
+    u = dbo.query("SELECT * FROM users WHERE ID=?", [t[0].USERID])
+    if len(u) == 1: return u[0]
     return None
 
 def authenticate_ip(user, remoteip):
@@ -356,6 +412,7 @@ def change_password(dbo, username, oldpassword, newpassword):
     if None is authenticate(dbo, username, oldpassword):
         raise asm3.utils.ASMValidationError(asm3.i18n._("Password is incorrect.", l))
     dbo.execute("UPDATE users SET Password = ? WHERE UserName LIKE ?", (hash_password(newpassword), username))
+    asm3.cachemem.delete(auth_cache_key(dbo, username, oldpassword))
 
 def get_locale_override(dbo, username):
     """
@@ -600,6 +657,7 @@ def delete_user(dbo, username, uid):
     Deletes the selected user
     """
     dbo.delete("userrole", "UserID=%d" % uid)
+    dbo.delete("usertoken", "UserID=%d" % uid)
     dbo.delete("users", uid, username)
 
 def insert_role_from_form(dbo, username, post):
@@ -636,9 +694,40 @@ def delete_role(dbo, username, rid):
 def reset_password(dbo, userid, password):
     """
     Resets the password for the given user to "password"
+    Cached credentials for the old password stop matching the new hash.
     """
     dbo.update("users", userid, { "Password": hash_password(password) })
 
+def get_tokens(dbo, userid):
+    """
+    Returns the API tokens for a user (the tokens themselves are not stored)
+    """
+    return dbo.query("SELECT ID, UserID, Description, Expires, Revoked, CreatedBy, CreatedDate " \
+        "FROM usertoken WHERE UserID = ? ORDER BY CreatedDate", [userid])
+
+def insert_token(dbo, username, userid, description = "", expires = None):
+    """
+    Creates a new API token for userid that can be passed to the 
+    service API instead of a username and password.
+    Returns the token. Only a hash of it is stored, so this is
+    the only time it can be read.
+    """
+    token = asm3.utils.base64encode(os.urandom(30)).replace("+", "-").replace("/", "_")
+    dbo.insert("usertoken", {
+        "UserID":       userid,
+        "TokenHash":    asm3.utils.sha256_hash_hex(token),
+        "Description":  description,
+        "Expires":      expires,
+        "Revoked":      0
+    }, username)
+    return token
+
+def revoke_token(dbo, username, tokenid):
+    """
+    Revokes an API token so it can no longer be used
+    """
+    dbo.update("usertoken", tokenid, { "Revoked": 1 }, username)
+
 def update_session(session):
     """
     Updates and reloads stored session data, triggers reloading of config.js by changing config_ts
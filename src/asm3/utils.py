@@ -8,9 +8,12 @@ from asm3.sitedefs import BASE_URL, MULTIPLE_DATABASES, SMTP_SERVER, FROM_ADDRES
 
 import base64
 import codecs
+import csv as extcsv
 import datetime
 import decimal
+import functools
 import hashlib
+import io
 import json as extjson
 import os
 import re
@@ -795,15 +798,15 @@ def uuid_str():
 def pbkdf2_hash_hex(plaintext, salt="", algorithm="sha1", iterations=1000):
     """ Returns a hex pbkdf2 hash of the plaintext given. 
         If salt is not given, a random salt is generated.
-        We have implementations for both python2 and python3
+        On python3 this uses hashlib's native pbkdf2_hmac, which gives
+        the same hashes as our pure python implementations.
         The return type is str whatever version of python.
     """
     if salt == "": salt = base64.b64encode(os.urandom(16))
-    hashfunc = getattr(hashlib, algorithm)
     if sys.version_info[0] > 2: # PYTHON3
-        import asm3.pbkdf2.pbkdf23
-        return str(asm3.pbkdf2.pbkdf23.pbkdf2(hashfunc, str2bytes(plaintext), str2bytes(salt), iterations, 24).hex())
+        return str(hashlib.pbkdf2_hmac(algorithm, str2bytes(plaintext), str2bytes(salt), iterations, 24).hex())
     else:
+        hashfunc = getattr(hashlib, algorithm)
         import asm3.pbkdf2.pbkdf22
         return str(asm3.pbkdf2.pbkdf22.pbkdf2_hex(str2bytes(plaintext), str2bytes(salt), iterations, 24, hashfunc))
 
@@ -883,51 +886,45 @@ def csv_parse(s):
     Assumes data has been decoded appropriately to unicode/str by the caller.
     Assumes the first row is the column/header names
     return value is a list of dictionaries.
-    We've basically implemented DictCSVReader ourselves because subclassing 
-    csvreader in a way that works for Python 2 and 3 is a nightmare and more code than
-    just doing it yourself.
-    """
-    if s[0:3] == "\xef\xbb\xbf": s = s[3:] # strip any utf-8 BOM if included (should not be necessary with utf-8-sig)
-    s = s.replace("\r\n", "\n")
-    s = s.replace("\r", "\n")
-    rows = [] # parsed rows
-    pos = [0, 0, False] # line start position, item start position and EOF 
-    def readline():
-        # Finds the next line ending and returns the line as a list of items
-        items = []
-        inquoted = False
-        rpos = pos[0] # read position marker, start at the line
-        while True:
-            if s[rpos:rpos+1] == "\"": inquoted = not inquoted
-            if not inquoted and (s[rpos:rpos+1] == "," or s[rpos:rpos+1] == "\n" or rpos == len(s)): 
-                # Hit delimiter, line break or end of file - parse the item
-                item = s[pos[1]:rpos]
-                pos[1] = rpos+1 # advance next item start position
-                if item.startswith("\""): item = item[1:]
-                if item.endswith("\""): item = item[0:len(item)-1]
-                # Turn the item into an ascii/xmlcharrefreplace string
-                item = item.encode("ascii", "xmlcharrefreplace")
-                if sys.version_info[0] > 2: item = item.decode("ascii") # PYTHON3 turn it back into str
-                items.append(item)
-            if not inquoted and (s[rpos:rpos+1] == "\n" or rpos == len(s)):
-                # Hit line break or end of file, move to the next line and return our set
-                pos[0] = rpos+1
-                if rpos == len(s): pos[2] = True # EOF
-                return items
-            rpos += 1
-    # Read the columns from the first row
-    cols = readline()
-    if len(cols) == 0: return rows # Empty file
-    # Iterate the rest of the data and construct dictionaries of the column/rows
-    while True:
-        items = readline()
-        d = {}
-        for i, c in enumerate(cols):
-            if i < len(items): d[c] = items[i]
-        if len(d) > 1: # Don't append empty rows (can also be empty string in first col)
-            rows.append(d)
-        if pos[2]: break # EOF
-    return rows
+    """
+    return list(csv_reader(s))
+
+def csv_reader(f, encoding = "utf-8-sig"):
+    """
+    Reads CSV data from f, which can be a binary file (decoded with 
+    encoding as it is read), a bytes string or a unicode string.
+    Assumes the first row is the column/header names.
+    Yields a dictionary for each row as it is read. Values are ascii
+    strings with any other characters as xml character references and
+    line breaks inside quoted values are always \n. Rows with fewer 
+    than two values are skipped.
+    """
+    if is_bytes(f): f = BytesIO(f)
+    elif is_unicode(f): f = StringIO(f)
+    wrapper = None
+    if not isinstance(f, io.TextIOBase): f = wrapper = io.TextIOWrapper(f, encoding=encoding, newline="")
+    extcsv.field_size_limit(2147483647) # values can be whole images as data URIs
+    def item(v):
+        if v.find("\r") != -1: v = v.replace("\r\n", "\n").replace("\r", "\n")
+        if not v.isascii(): v = v.encode("ascii", "xmlcharrefreplace").decode("ascii")
+        return v
+    cols = None
+    try:
+        for items in extcsv.reader(f):
+            if cols is None:
+                # strip any utf-8 BOM if included (should not be necessary with utf-8-sig)
+                if len(items) > 0 and items[0].startswith("\ufeff"): items[0] = items[0][1:]
+                if len(items) > 0 and items[0].startswith("\xef\xbb\xbf"): items[0] = items[0][3:]
+                cols = [ item(x) for x in items ]
+                continue
+            d = {}
+            for i, c in enumerate(cols):
+                if i < len(items): d[c] = item(items[i])
+            if len(d) > 1: # Don't return empty rows (can also be empty string in first col)
+                yield d
+    finally:
+        # Leave a file we were given open for the caller
+        if wrapper is not None: wrapper.detach()
 
 def csv(l, rows, cols = None, includeheader = True):
     """
@@ -1033,8 +1030,84 @@ def substitute_tags(searchin, tags, use_xml_escaping = True, opener = "&lt;&lt;"
     if not use_xml_escaping:
         opener = opener.replace("&lt;", "<").replace("&gt;", ">")
         closer = closer.replace("&lt;", "<").replace("&gt;", ">")
+    return compile_template(searchin, opener, closer).render(tags, use_xml_escaping and escape_tag_value or None)
+
+def escape_tag_value(v):
+    """
+    XML escapes a tag value for substitute_tags unless it is an image
+    """
+    if v.lower().startswith("<img"): return v
+    return v.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+# The number of compiled templates kept by compile_template
+TEMPLATE_CACHE_SIZE = 50
 
-    s = searchin
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(template, opener = "&lt;&lt;", closer = "&gt;&gt;"):
+    """
+    Returns a CompiledTemplate for template. Templates are cached by their
+    content, so rendering the same template for many sets of tags (eg: bulk
+    email, documents generated from the same template) only tokenises it once.
+    """
+    return CompiledTemplate(template, opener, closer)
+
+class CompiledTemplate(object):
+    """
+    A template split into its literal text and tag segments so that it
+    can be rendered with a single join rather than rebuilding the whole
+    string for every tag.
+    Rendering gives the same output as the original scan in substitute_tags,
+    including its rescanning of substituted values for further tags.
+    """
+    def __init__(self, template, opener, closer):
+        self.template = template
+        self.opener = opener
+        self.closer = closer
+        self.literals = [] # The text before each tag, with the text after the last tag at the end
+        self.tags = [] # Tuples of uppercased tag name and the position after its closer in template
+        pos = 0
+        sp = template.find(opener)
+        while sp != -1:
+            ep = template.find(closer, sp + len(opener))
+            if ep == -1: break # No end marker for this tag, stop processing
+            self.literals.append(template[pos:sp])
+            pos = ep + len(closer)
+            self.tags.append( (template[sp + len(opener):ep].upper(), pos) )
+            sp = template.find(opener, pos)
+        self.literals.append(template[pos:])
+
+    def render(self, tags, escape = None):
+        """
+        Returns the template with the values in the tags dictionary substituted.
+        escape is an optional function called on each value before output.
+        """
+        out = []
+        literals = self.literals
+        opener = self.opener
+        olen = len(opener) - 1
+        for i, (tag, end) in enumerate(self.tags):
+            out.append(literals[i])
+            newval = ""
+            if tag in tags:
+                newval = tags[tag]
+                if newval is not None:
+                    newval = str(newval)
+                    if escape is not None: newval = escape(newval)
+            newval = str(newval)
+            # If a value contains an opener (or the start of one that carries on
+            # into the template) the rest needs scanning again with it included
+            if newval.find(opener) != -1 or (olen > 0 and (newval[-olen:] + self.template[end:end+olen]).find(opener) != -1):
+                out.append(_substitute_tags_scan(newval + self.template[end:], tags, escape, opener, self.closer))
+                return "".join(out)
+            out.append(newval)
+        out.append(literals[-1])
+        return "".join(out)
+
+def _substitute_tags_scan(s, tags, escape, opener, closer):
+    """
+    Substitutes tags by scanning and rebuilding s for every tag found. 
+    Only used by CompiledTemplate when substituted values contain further tags.
+    """
     sp = s.find(opener)
     while sp != -1:
         ep = s.find(closer, sp + len(opener))
@@ -1045,10 +1118,7 @@ def substitute_tags(searchin, tags, use_xml_escaping = True, opener = "&lt;&lt;"
                 newval = tags[matchtag]
                 if newval is not None:
                     newval = str(newval)
-                    if use_xml_escaping and not newval.lower().startswith("<img"):
-                        newval = newval.replace("&", "&amp;")
-                        newval = newval.replace("<", "&lt;")
-                        newval = newval.replace(">", "&gt;")
+                    if escape is not None: newval = escape(newval)
             s = s[0:sp] + str(newval) + s[ep + len(closer):]
             sp = s.find(opener, sp)
         else:
@@ -1065,6 +1135,12 @@ def md5_hash_hex(s):
     s = m.hexdigest()
     return s
 
+def sha256_hash_hex(s):
+    """
+    Returns a sha256 hash of a string
+    """
+    return hashlib.sha256(str2bytes(s)).hexdigest()
+
 def get_asm_news(dbo):
     """ Retrieves the latest asm news from the server """
     try:
@@ -1672,10 +1748,13 @@ def send_bulk_email(dbo, fromadd, subject, body, rows, contenttype):
     rows is a list of dictionaries of tag tokens with real values to substitute
     contenttype is either "plain" or "html"
     """
+    # Tokenise the subject and body once and render them for each recipient
+    csubject = compile_template(subject, "<<", ">>")
+    cbody = compile_template(body)
     def do_send():
         for r in rows:
-            ssubject = substitute_tags(subject, r, False, opener = "<<", closer = ">>")
-            sbody = substitute_tags(body, r)
+            ssubject = csubject.render(r)
+            sbody = cbody.render(r, escape_tag_value)
             toadd = r["EMAILADDRESS"]
             if toadd is None or toadd.strip() == "": continue
             asm3.al.debug("sending bulk email: to=%s, subject=%s" % (toadd, ssubject), "utils.send_bulk_email", dbo)
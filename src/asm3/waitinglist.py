@@ -172,6 +172,7 @@ def delete_waitinglist(dbo, username, wid):
     """
     Deletes a waiting list record
     """
+    asm3.media.delete_thumbnails_for_link(dbo, asm3.media.WAITINGLIST, wid)
     dbo.delete("media", "LinkID=%d AND LinkTypeID=%d" % (wid, asm3.media.WAITINGLIST), username)
     dbo.delete("diary", "LinkID=%d AND LinkType=%d" % (wid, asm3.diary.WAITINGLIST), username)
     dbo.delete("log", "LinkID=%d AND LinkType=%d" % (wid, asm3.log.WAITINGLIST), username)
@@ -1536,40 +1536,23 @@ def substitute_tags(searchin, tags, use_xml_escaping = True, opener = "&lt;&lt;"
     in "searchin". opener and closer denote the start of a tag,
     if use_xml_escaping is set to true, then tags are XML escaped when
     output and opener/closer are escaped.
+    The template is compiled once and cached (see asm3.utils.compile_template)
     """
     if not use_xml_escaping:
         opener = opener.replace("&lt;", "<").replace("&gt;", ">")
         closer = closer.replace("&lt;", "<").replace("&gt;", ">")
+    return asm3.utils.compile_template(searchin, opener, closer).render(tags, use_xml_escaping and escape_tag_value or None)
 
-    s = searchin
-    sp = s.find(opener)
-    while sp != -1:
-        ep = s.find(closer, sp + len(opener))
-        if ep != -1:
-            matchtag = s[sp + len(opener):ep].upper()
-            newval = ""
-            if matchtag in tags:
-                newval = tags[matchtag]
-                if newval is not None:
-                    newval = str(newval)
-                    # Escape xml entities unless the replacement tag is an
-                    # image, URL or contains HTML entities
-                    if use_xml_escaping and \
-                        not newval.lower().startswith("<img") and \
-                        not newval.lower().find("&#") != -1 and \
-                        not newval.lower().find("/>") != -1 and \
-                        not newval.lower().startswith("<table") and \
-                        not newval.lower().startswith("http") and \
-                        not newval.lower().startswith("image?"):
-                        newval = newval.replace("&", "&amp;")
-                        newval = newval.replace("<", "&lt;")
-                        newval = newval.replace(">", "&gt;")
-            s = s[0:sp] + str(newval) + s[ep + len(closer):]
-            sp = s.find(opener, sp)
-        else:
-            # No end marker for this tag, stop processing
-            break
-    return s
+def escape_tag_value(v):
+    """
+    Escapes xml entities in a tag value unless the replacement tag is an
+    image, URL or contains HTML entities
+    """
+    lv = v.lower()
+    if lv.startswith("<img") or lv.find("&#") != -1 or lv.find("/>") != -1 or \
+        lv.startswith("<table") or lv.startswith("http") or lv.startswith("image?"):
+        return v
+    return v.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
 def substitute_template(dbo, templateid, tags, imdata = None):
     """
@@ -1821,40 +1821,40 @@ class batch(JSONEndpoint):
     def post_genfigyear(self, o):
         l = o.locale
         if o.post.date("taskdate") is None: raise asm3.utils.ASMValidationError("no date parameter")
-        asm3.asynctask.function_task(o.dbo, _("Regenerate annual animal figures for", l), asm3.animal.update_animal_figures_annual, o.dbo, o.post.date("taskdate").year)
+        return asm3.asynctask.function_task(o.dbo, _("Regenerate annual animal figures for", l), asm3.animal.update_animal_figures_annual, o.dbo, o.post.date("taskdate").year) or ""
 
     def post_genfigmonth(self, o):
         l = o.locale
         if o.post.date("taskdate") is None: raise asm3.utils.ASMValidationError("no date parameter")
-        asm3.asynctask.function_task(o.dbo, _("Regenerate monthly animal figures for", l), asm3.animal.update_animal_figures, o.dbo, o.post.date("taskdate").month, o.post.date("taskdate").year)
+        return asm3.asynctask.function_task(o.dbo, _("Regenerate monthly animal figures for", l), asm3.animal.update_animal_figures, o.dbo, o.post.date("taskdate").month, o.post.date("taskdate").year) or ""
 
     def post_genshelterpos(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Recalculate on-shelter animal locations", l), asm3.animal.update_on_shelter_animal_statuses, o.dbo)
+        return asm3.asynctask.function_task(o.dbo, _("Recalculate on-shelter animal locations", l), asm3.animal.update_on_shelter_animal_statuses, o.dbo) or ""
 
     def post_genallpos(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Recalculate ALL animal locations", l), asm3.animal.update_all_animal_statuses, o.dbo)
+        return asm3.asynctask.function_task(o.dbo, _("Recalculate ALL animal locations", l), asm3.animal.update_all_animal_statuses, o.dbo) or ""
 
     def post_genallvariable(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Recalculate ALL animal ages/times", l), asm3.animal.update_all_variable_animal_data, o.dbo)
+        return asm3.asynctask.function_task(o.dbo, _("Recalculate ALL animal ages/times", l), asm3.animal.update_all_variable_animal_data, o.dbo) or ""
 
     def post_genlookingfor(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Regenerate 'Person looking for' report", l), asm3.person.update_lookingfor_report, o.dbo)
+        return asm3.asynctask.function_task(o.dbo, _("Regenerate 'Person looking for' report", l), asm3.person.update_lookingfor_report, o.dbo) or ""
 
     def post_genownername(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Regenerate person names in selected format", l), asm3.person.update_owner_names, o.dbo)
+        return asm3.asynctask.function_task(o.dbo, _("Regenerate person names in selected format", l), asm3.person.update_owner_names, o.dbo) or ""
 
     def post_genownerflags(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Regenerate person flags column", l), asm3.person.update_missing_builtin_flags, o.dbo)
+        return asm3.asynctask.function_task(o.dbo, _("Regenerate person flags column", l), asm3.person.update_missing_builtin_flags, o.dbo) or ""
 
     def post_genlostfound(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Regenerate 'Match lost and found animals' report", l), asm3.lostfound.update_match_report, o.dbo)
+        return asm3.asynctask.function_task(o.dbo, _("Regenerate 'Match lost and found animals' report", l), asm3.lostfound.update_match_report, o.dbo) or ""
 
 class calendarview(JSONEndpoint):
     url = "calendarview"
@@ -2214,9 +2214,9 @@ class csvexport_animals(ASMEndpoint):
             return v
         else:
             l = o.locale
-            asm3.asynctask.function_task(o.dbo, _("Export Animals as CSV", l), asm3.csvimport.csvexport_animals, 
+            taskid = asm3.asynctask.function_task(o.dbo, _("Export Animals as CSV", l), asm3.csvimport.csvexport_animals, 
                 o.dbo, o.post["filter"], o.post["animals"], o.post.boolean("includeimage") == 1)
-            self.redirect("task")
+            self.redirect("task?taskid=%s" % (taskid or ""))
 
 class csvimport(JSONEndpoint):
     url = "csvimport"
@@ -2228,11 +2228,11 @@ class csvimport(JSONEndpoint):
 
     def post_all(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Import a CSV file", l), asm3.csvimport.csvimport, 
+        taskid = asm3.asynctask.function_task(o.dbo, _("Import a CSV file", l), asm3.csvimport.csvimport, 
             o.dbo, o.post.filedata(), o.post["encoding"], o.user, 
             o.post.boolean("createmissinglookups") == 1, o.post.boolean("cleartables") == 1, 
             o.post.boolean("checkduplicates") == 1)
-        self.redirect("task")
+        self.redirect("task?taskid=%s" % (taskid or ""))
 
 class csvimport_paypal(JSONEndpoint):
     url = "csvimport_paypal"
@@ -2248,9 +2248,9 @@ class csvimport_paypal(JSONEndpoint):
 
     def post_all(self, o):
         l = o.locale
-        asm3.asynctask.function_task(o.dbo, _("Import a PayPal CSV file", l), asm3.csvimport.csvimport_paypal, o.dbo, \
+        taskid = asm3.asynctask.function_task(o.dbo, _("Import a PayPal CSV file", l), asm3.csvimport.csvimport_paypal, o.dbo, \
             o.post.filedata(), o.post.integer("type"), o.post.integer("payment"), o.post["flags"], o.user, o.post["encoding"])
-        self.redirect("task")
+        self.redirect("task?taskid=%s" % (taskid or ""))
 
 class diary(ASMEndpoint):
     url = "diary"
@@ -5006,7 +5006,7 @@ class publish(JSONEndpoint):
         else:
             # If a publishing mode is requested, start that publisher
             # running on a background thread
-            asm3.publish.start_publisher(dbo, mode, user=o.user, newthread=True)
+            asm3.publish.start_publisher(dbo, mode, user=o.user, newthread=True, fullresync=o.post.boolean("fullresync"))
         return { "failed": failed }
 
     def post_poll(self, o):
@@ -5569,17 +5569,31 @@ class systemusers(JSONEndpoint):
         for uid in o.post.integer_list("ids"):
             asm3.users.reset_password(o.dbo, uid, o.post["password"])
 
+    def post_tokens(self, o):
+        self.check(asm3.users.EDIT_USER)
+        return asm3.utils.json(asm3.users.get_tokens(o.dbo, o.post.integer("userid")))
+
+    def post_createtoken(self, o):
+        self.check(asm3.users.EDIT_USER)
+        return asm3.users.insert_token(o.dbo, o.user, o.post.integer("userid"), o.post["description"], o.post.date("expires"))
+
+    def post_revoketoken(self, o):
+        self.check(asm3.users.EDIT_USER)
+        for tid in o.post.integer_list("ids"):
+            asm3.users.revoke_token(o.dbo, o.user, tid)
+
 class task(JSONEndpoint):
     url = "task"
 
     def controller(self, o):
-        return { }
+        return { "taskid": o.post["taskid"] }
    
     def post_poll(self, o):
-        return "%s|%d|%s|%s" % (asm3.asynctask.get_task_name(o.dbo), asm3.asynctask.get_progress_percent(o.dbo), asm3.asynctask.get_last_error(o.dbo), asm3.asynctask.get_return_value(o.dbo))
+        taskid = o.post["taskid"]
+        return "%s|%d|%s|%s" % (asm3.asynctask.get_task_name(o.dbo, taskid), asm3.asynctask.get_progress_percent(o.dbo, taskid), asm3.asynctask.get_last_error(o.dbo, taskid), asm3.asynctask.get_return_value(o.dbo, taskid))
 
     def post_stop(self, o):
-        asm3.asynctask.set_cancel(o.dbo, True)
+        asm3.asynctask.set_cancel(o.dbo, True, o.post["taskid"])
 
 class test(JSONEndpoint):
     url = "test"
@@ -6,6 +6,7 @@ import os, sys
 sys.path.append(os.getcwd())
 
 from asm3 import al
+from asm3 import animalcontrol
 from asm3 import audit
 from asm3 import animal
 from asm3 import cachedisk
@@ -15,6 +16,7 @@ from asm3 import db
 from asm3 import dbfs
 from asm3 import dbupdate
 from asm3 import diary
+from asm3 import financial
 from asm3 import i18n
 from asm3 import lostfound
 from asm3 import media
@@ -26,14 +28,27 @@ from asm3 import reports as extreports
 from asm3 import utils
 from asm3 import waitinglist
 from asm3.sitedefs import LOCALE, TIMEZONE, MULTIPLE_DATABASES, MULTIPLE_DATABASES_TYPE, MULTIPLE_DATABASES_MAP
+from asm3.sitedefs import CRON_SCHEDULE_WORKERS, CRON_SCHEDULE_TIMEOUT, CRON_SCHEDULE_RETRIES
+from asm3.sitedefs import DB_DUMP_COMPRESS, DB_DUMP_FORMAT
 
+import multiprocessing
 import time
 
+SCHEDULE_MODES = [ "all", "daily", "publish_3pty", "reports_email" ] # Modes that can be run with schedule
+SCHEDULE_TIMINGS_TTL = 86400 * 30 # How long the previous run times for databases are kept
+
+timings = [] # Tasks timed by ttask in this process for the schedule report
+
 def ttask(fn, dbo):
     """ Runs a function and times how long it takes """
     x = time.time()
-    fn(dbo)
-    elapsed = time.time() - x
+    ok = False
+    try:
+        fn(dbo)
+        ok = True
+    finally:
+        elapsed = time.time() - x
+        timings.append({ "task": fn.__name__, "elapsed": round(elapsed, 3), "ok": ok })
     if elapsed > 10:
         al.warn("complete in %0.2f sec" % elapsed, fn.__name__, dbo)
     else:
@@ -82,8 +97,9 @@ def daily(dbo):
         # Update animal litter counts
         ttask(animal.update_active_litters, dbo)
 
-        # Find any missing person geocodes
+        # Find any missing person and incident geocodes
         ttask(person.update_missing_geocodes, dbo)
+        ttask(animalcontrol.update_missing_dispatch_geocodes, dbo)
 
         # Clear out any old audit logs
         ttask(audit.clean, dbo)
@@ -121,6 +137,12 @@ def daily(dbo):
         # Send fosterer medical reports
         ttask(movement.send_fosterer_emails, dbo)
 
+        # Verify the home page alert counters
+        ttask(animal.check_alert_counters, dbo)
+
+        # Verify the account balance index
+        ttask(financial.check_balance_index, dbo)
+
     except:
         em = str(sys.exc_info()[0])
         al.error("FAIL: running batch tasks: %s" % em, "cron.daily", dbo, sys.exc_info())
@@ -136,16 +158,16 @@ def reports_email(dbo):
         em = str(sys.exc_info()[0])
         al.error("FAIL: running daily email of reports_email: %s" % em, "cron.reports_email", dbo, sys.exc_info())
 
-def publish_3pty(dbo):
+def publish_3pty(dbo, fullresync=False):
     try:
         publishers = configuration.publishers_enabled(dbo)
         freq = configuration.publisher_sub24_frequency(dbo)
         for p in publishers.split(" "):
             # Services that we do more frequently than 24 hours are handled by 3pty_sub24
-            if publish.PUBLISHER_LIST[p]["sub24hour"] and freq != 0: continue
+            if publish.PUBLISHER_LIST[p]["sub24hour"] and freq != 0 and not fullresync: continue
             # We do html/ftp publishing separate from other publishers
             if p == "html": continue
-            publish.start_publisher(dbo, p, user="system", newthread=False)
+            publish.start_publisher(dbo, p, user="system", newthread=False, fullresync=fullresync)
     except:
         em = str(sys.exc_info()[0])
         al.error("FAIL: uncaught error running third party publishers: %s" % em, "cron.publish_3pty", dbo, sys.exc_info())
@@ -198,6 +220,30 @@ def maint_recode_shelter(dbo):
         em = str(sys.exc_info()[0])
         al.error("FAIL: uncaught error running maint_recode_shelter: %s" % em, "cron.maint_recode_shelter", dbo, sys.exc_info())
 
+def maint_alert_counters(dbo):
+    try:
+        differences = animal.check_alert_counters(dbo)
+        print("%d alert counters differed from the alerts query" % differences)
+    except:
+        em = str(sys.exc_info()[0])
+        al.error("FAIL: uncaught error running maint_alert_counters: %s" % em, "cron.maint_alert_counters", dbo, sys.exc_info())
+
+def maint_balance_index(dbo):
+    try:
+        written = financial.rebuild_balance_index(dbo)
+        print("Rebuilt balance index with %d monthly totals" % written)
+    except:
+        em = str(sys.exc_info()[0])
+        al.error("FAIL: uncaught error running maint_balance_index: %s" % em, "cron.maint_balance_index", dbo, sys.exc_info())
+
+def maint_balance_index_check(dbo):
+    try:
+        differences = financial.check_balance_index(dbo)
+        print("%d balance index totals differed from the transactions" % differences)
+    except:
+        em = str(sys.exc_info()[0])
+        al.error("FAIL: uncaught error running maint_balance_index_check: %s" % em, "cron.maint_balance_index_check", dbo, sys.exc_info())
+
 def maint_animal_figures(dbo):
     try:
         animal.update_all_animal_statuses(dbo)
@@ -233,43 +279,47 @@ def maint_db_fix_preferred_photos(dbo):
 
 def maint_db_dump(dbo):
     try:
-        for x in dbupdate.dump(dbo):
-            print(utils.cunicode(x).encode("utf-8"))
+        dbupdate.write_dump(dbupdate.dump(dbo, copyFormat = DB_DUMP_FORMAT == "copy"), sys.stdout.buffer, DB_DUMP_COMPRESS)
     except:
         em = str(sys.exc_info()[0])
         al.error("FAIL: uncaught error running maint_db_dump: %s" % em, "cron.maint_db_dump", dbo, sys.exc_info())
 
 def maint_db_dump_hsqldb(dbo):
     try:
-        for x in dbupdate.dump_hsqldb(dbo):
-            print(utils.cunicode(x).encode("utf-8"))
+        dbupdate.write_dump(dbupdate.dump_hsqldb(dbo), sys.stdout.buffer, DB_DUMP_COMPRESS)
     except:
         em = str(sys.exc_info()[0])
         al.error("FAIL: uncaught error running maint_db_dump_hsqldb: %s" % em, "cron.maint_db_dump_hsqldb", dbo, sys.exc_info())
 
 def maint_db_dump_dbfs_base64(dbo):
     try:
-        for x in dbupdate.dump_dbfs_base64(dbo):
-            print(utils.cunicode(x).encode("utf-8"))
+        dbupdate.write_dump(dbupdate.dump_dbfs_base64(dbo), sys.stdout.buffer, DB_DUMP_COMPRESS)
     except:
         em = str(sys.exc_info()[0])
         al.error("FAIL: uncaught error running maint_db_dump_dbfs_base64: %s" % em, "cron.maint_db_dump_dbfs_base64", dbo, sys.exc_info())
 
 def maint_db_dump_merge(dbo):
     try:
-        print(utils.cunicode(dbupdate.dump_merge(dbo)).encode("utf-8"))
+        dbupdate.write_dump(dbupdate.dump_merge(dbo), sys.stdout.buffer, DB_DUMP_COMPRESS)
     except:
         em = str(sys.exc_info()[0])
         al.error("FAIL: uncaught error running maint_db_dump_merge: %s" % em, "cron.maint_db_dump_merge", dbo, sys.exc_info())
 
 def maint_db_dump_smcom(dbo):
     try:
-        for x in dbupdate.dump_smcom(dbo):
-            print(utils.cunicode(x).encode("utf-8"))
+        dbupdate.write_dump(dbupdate.dump_smcom(dbo, copyFormat = DB_DUMP_FORMAT == "copy"), sys.stdout.buffer, DB_DUMP_COMPRESS)
     except:
         em = str(sys.exc_info()[0])
         al.error("FAIL: uncaught error running maint_db_dump: %s" % em, "cron.maint_db_dump_smcom", dbo, sys.exc_info())
 
+def maint_db_load(dbo):
+    try:
+        loaded = dbupdate.load(dbo, dbupdate.read_dump(sys.stdin.buffer))
+        al.info("loaded %d statements" % loaded, "cron.maint_db_load", dbo)
+    except:
+        em = str(sys.exc_info()[0])
+        al.error("FAIL: uncaught error running maint_db_load: %s" % em, "cron.maint_db_load", dbo, sys.exc_info())
+
 def maint_db_dump_animalcsv(dbo):
     try:
         print(utils.csv(dbo.locale, animal.get_animal_find_advanced(dbo, { "logicallocation" : "all", "includedeceased": "true", "includenonshelter": "true" })))
@@ -363,6 +413,13 @@ def maint_disk_cache(dbo):
         em = str(sys.exc_info()[0])
         al.error("FAIL: uncaught error running remove_expired: %s" % em, "cron.maint_disk_cache", dbo, sys.exc_info())
 
+def maint_create_thumbnails(dbo):
+    try:
+        media.create_all_thumbnails(dbo)
+    except:
+        em = str(sys.exc_info()[0])
+        al.error("FAIL: uncaught error running maint_create_thumbnails: %s" % em, "cron.maint_create_thumbnails", dbo, sys.exc_info())
+
 def maint_scale_animal_images(dbo):
     try:
         media.scale_all_animal_images(dbo)
@@ -416,6 +473,8 @@ def run(dbo, mode):
         reports_email(dbo)
     elif mode == "publish_3pty":
         publish_3pty(dbo)
+    elif mode == "publish_3pty_full":
+        publish_3pty(dbo, fullresync=True)
     elif mode == "publish_3pty_sub24":
         publish_3pty_sub24(dbo)
     elif mode == "publish_html":
@@ -424,6 +483,8 @@ def run(dbo, mode):
         maint_recode_all(dbo)
     elif mode == "maint_recode_shelter":
         maint_recode_shelter(dbo)
+    elif mode == "maint_create_thumbnails":
+        maint_create_thumbnails(dbo)
     elif mode == "maint_scale_animal_images":
         maint_scale_animal_images(dbo)
     elif mode == "maint_scale_odts":
@@ -434,8 +495,14 @@ def run(dbo, mode):
         maint_switch_dbfs_storage(dbo)
     elif mode == "maint_variable_data":
         maint_variable_data(dbo)
+    elif mode == "maint_alert_counters":
+        maint_alert_counters(dbo)
     elif mode == "maint_animal_figures":
         maint_animal_figures(dbo)
+    elif mode == "maint_balance_index":
+        maint_balance_index(dbo)
+    elif mode == "maint_balance_index_check":
+        maint_balance_index_check(dbo)
     elif mode == "maint_animal_figures_annual":
         maint_animal_figures_annual(dbo)
     elif mode == "maint_db_diagnostic":
@@ -456,6 +523,8 @@ def run(dbo, mode):
         maint_db_dump_personcsv(dbo)
     elif mode == "maint_db_dump_hsqldb":
         maint_db_dump_hsqldb(dbo)
+    elif mode == "maint_db_load":
+        maint_db_load(dbo)
     elif mode == "maint_db_install":
         maint_db_install(dbo)
     elif mode == "maint_db_reinstall":
@@ -515,6 +584,114 @@ def run_override_database(mode, dbtype, host, port, username, password, database
     dbo.connection = dbo.connect()
     run(dbo, mode)
 
+def schedule_worker(mode, alias, conn):
+    """
+    Runs mode for database alias in a scheduler child process and
+    sends the outcome and task timings back down conn.
+    """
+    global timings
+    timings = []
+    ok = False
+    try:
+        dbo = db.get_database(alias)
+        dbo.alias = alias
+        if dbo.database == "FAIL":
+            al.error("invalid database alias '%s'" % alias, "cron.schedule_worker")
+        else:
+            dbo.timeout = 0
+            dbo.connection = dbo.connect()
+            def task(dbo):
+                run(dbo, mode)
+            task.__name__ = mode
+            ttask(task, dbo)
+            ok = True
+    except:
+        em = str(sys.exc_info()[0])
+        al.error("FAIL: uncaught error running %s for %s: %s" % (mode, alias, em), "cron.schedule_worker", None, sys.exc_info())
+    conn.send({ "ok": ok, "tasks": timings })
+    conn.close()
+
+def schedule_start(mode, job):
+    """ Starts a child process to run mode for the scheduler job """
+    job["attempt"] += 1
+    job["conn"], child = multiprocessing.Pipe(duplex=False)
+    job["process"] = multiprocessing.Process(target=schedule_worker, args=(mode, job["alias"], child))
+    job["process"].start()
+    job["start"] = time.time()
+    child.close()
+
+def schedule_check(job):
+    """
+    Returns the outcome of the scheduler job if it has finished (ok, failed or
+    timeout), stopping it if it has run for longer than CRON_SCHEDULE_TIMEOUT.
+    Returns None if it is still running.
+    """
+    p = job["process"]
+    if job["conn"].poll():
+        try:
+            job["result"] = job["conn"].recv()
+        except EOFError:
+            pass
+    if p.is_alive():
+        if time.time() - job["start"] <= CRON_SCHEDULE_TIMEOUT: return None
+        p.terminate()
+        p.join(10)
+        return "timeout"
+    p.join()
+    if "result" not in job and job["conn"].poll():
+        try:
+            job["result"] = job["conn"].recv()
+        except EOFError:
+            pass
+    job["conn"].close()
+    if p.exitcode == 0 and job.get("result", {}).get("ok"): return "ok"
+    return "failed"
+
+def run_schedule(mode, aliases):
+    """
+    Runs mode for each database alias in a separate process, up to
+    CRON_SCHEDULE_WORKERS at once. Databases that took longest last time
+    are started first. Databases that run past CRON_SCHEDULE_TIMEOUT are
+    stopped, failed and stopped databases are retried up to
+    CRON_SCHEDULE_RETRIES times. Prints a JSON report of every attempt with
+    its tasks timed by ttask and returns the number of databases that failed.
+    """
+    x = time.time()
+    previous = cachedisk.get("cron_schedule_timings", "cron", expectedtype=dict) or {}
+    def last_elapsed(alias):
+        return previous.get("%s:%s" % (alias, mode), 0)
+    pending = [ { "alias": a, "attempt": 0 } for a in sorted(aliases, key=last_elapsed, reverse=True) ]
+    running = []
+    runs = []
+    failed = []
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < max(CRON_SCHEDULE_WORKERS, 1):
+            job = pending.pop(0)
+            schedule_start(mode, job)
+            running.append(job)
+        time.sleep(0.2)
+        for job in running[:]:
+            status = schedule_check(job)
+            if status is None: continue
+            running.remove(job)
+            elapsed = time.time() - job["start"]
+            runs.append({ "alias": job["alias"], "mode": mode, "attempt": job["attempt"], "status": status,
+                "elapsed": round(elapsed, 3), "tasks": job.get("result", {}).get("tasks", []) })
+            if status == "ok":
+                previous["%s:%s" % (job["alias"], mode)] = elapsed
+                al.info("%s for %s complete in %0.2f sec" % (mode, job["alias"], elapsed), "cron.run_schedule")
+            elif job["attempt"] <= CRON_SCHEDULE_RETRIES:
+                al.warn("%s for %s %s after %0.2f sec, retrying" % (mode, job["alias"], status, elapsed), "cron.run_schedule")
+                pending.append({ "alias": job["alias"], "attempt": job["attempt"] })
+            else:
+                al.error("%s for %s %s after %0.2f sec" % (mode, job["alias"], status, elapsed), "cron.run_schedule")
+                previous["%s:%s" % (job["alias"], mode)] = elapsed
+                failed.append(job["alias"])
+    cachedisk.put("cron_schedule_timings", "cron", previous, SCHEDULE_TIMINGS_TTL)
+    print(utils.json({ "mode": mode, "workers": CRON_SCHEDULE_WORKERS, "elapsed": round(time.time() - x, 3),
+        "failed": failed, "runs": runs }))
+    return len(failed)
+
 def print_usage():
     print("Usage: cron.py mode [alias]")
     print("")
@@ -523,14 +700,25 @@ def print_usage():
     print("")
     print("   Or: cron.py mode dbtype host port username password database alias")
     print("")
+    print("   Or: cron.py schedule mode [alias ...]")
+    print("")
+    print("           runs mode (%s) for each alias given, or all databases" % ", ".join(SCHEDULE_MODES))
+    print("           in multi database/map mode, in parallel separate processes")
+    print("           and prints a JSON timing report")
+    print("")
     print("mode is one of:")
     print("       all - runs daily and all publish_* tasks")
     print("       daily - daily batch tasks")
     print("       reports_email - email reports with dailyemail set (run this target once per hour)")
     print("       publish_html - publish html/ftp")
     print("       publish_3pty - run all 3rd party publishers")
+    print("       publish_3pty_full - run all 3rd party publishers, sending every animal even if unchanged")
+    print("       maint_alert_counters - verify the home page alert counters and rebuild them if wrong")
     print("       maint_animal_figures - calculate all monthly/annual figures for all time")
     print("       maint_animal_figures_annual - calculate all annual figures for all time")
+    print("       maint_balance_index - rebuild the monthly account totals used for balances")
+    print("       maint_balance_index_check - verify the monthly account totals and rebuild any accounts that are wrong")
+    print("       maint_create_thumbnails - create any missing stored thumbnails for image media")
     print("       maint_db_diagnostic - run database diagnostics")
     print("       maint_db_fix_preferred_photos - fix/reset preferred flags for all photo media to latest")
     print("       maint_db_dump - produce a dump of INSERT statements to recreate the db")
@@ -541,6 +729,7 @@ def print_usage():
     print("       maint_db_dump_hsqldb - produce a complete HSQLDB file for ASM2")
     print("       maint_db_dump_smcom - produce an SQL dump for import into sheltermanager.com")
     print("       maint_db_install - install structure/data into a new empty database")
+    print("       maint_db_load - load a dump made by maint_db_dump* from stdin (can be gzipped)")
     print("       maint_db_reinstall - wipe the db and reinstall all default data and templates")
     print("       maint_db_reinstall_default_onlineforms - reloads default online forms")
     print("       maint_db_reinstall_default_templates - reloads default document/publishing templates")
@@ -558,7 +747,16 @@ def print_usage():
     print("       maint_variable_data - recalculate all variable data for all animals")
 
 if __name__ == "__main__": 
-    if len(sys.argv) == 2 and not MULTIPLE_DATABASES:
+    if len(sys.argv) >= 3 and sys.argv[1] == "schedule" and sys.argv[2] in SCHEDULE_MODES and MULTIPLE_DATABASES \
+        and (len(sys.argv) > 3 or MULTIPLE_DATABASES_TYPE == "map"):
+        # schedule mode for a list of aliases or all map databases
+        aliases = sys.argv[3:] or list(MULTIPLE_DATABASES_MAP.keys())
+        sys.exit(run_schedule(sys.argv[2], aliases) and 1 or 0)
+    elif len(sys.argv) >= 2 and sys.argv[1] == "schedule":
+        # schedule with an unrecognised mode, or no databases to run it for
+        print_usage()
+        sys.exit(1)
+    elif len(sys.argv) == 2 and not MULTIPLE_DATABASES:
         # mode argument given and we have a single database
         run_default_database(sys.argv[1])
     elif len(sys.argv) == 2 and MULTIPLE_DATABASES and MULTIPLE_DATABASES_TYPE == "map":
@@ -36,8 +36,8 @@ $(function() {
         },
 
         runmode: async function(btn, formdata) {
-            await common.ajax_post("batch", formdata);
-            common.route("task");
+            let taskid = await common.ajax_post("batch", formdata);
+            common.route("task?taskid=" + taskid);
         },
 
         bind: function() {
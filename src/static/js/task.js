@@ -58,7 +58,7 @@ $(function() {
 
             $("#button-stop").button().click(async function() {
                 $("#button-stop").button("disable");
-                await common.ajax_post("task", "mode=stop");
+                await common.ajax_post("task", "mode=stop&taskid=" + encodeURIComponent(task.taskid));
                 $("#button-stop").button("enable");
                 task.forcestop = true;
             });
@@ -68,6 +68,7 @@ $(function() {
         sync: function() {
 
             task.polling = true;
+            task.taskid = controller.taskid;
 
             if (controller.failed) {
                 $("#alreadyrunning").fadeIn().delay(task.poll_interval).fadeOut();
@@ -78,7 +79,7 @@ $(function() {
         },
 
         poll: async function() {
-            let result = await common.ajax_post("task", "mode=poll");
+            let result = await common.ajax_post("task", "mode=poll&taskid=" + encodeURIComponent(task.taskid));
             let [taskname, progress, lasterror, returnvalue] = result.split("|");
             let newtext = _("{0} is running ({1}&#37; complete).").replace("{0}", taskname).replace("{1}", progress);
             $("#progress").progressbar("option", "value", parseInt(progress, 10));
@@ -158,6 +159,7 @@ $(function() {
         },
 
         forcestop: false,    // true if the user hit stop
+        taskid: "",          // the task we are watching, blank for the most recently started
         polling: false,      // true if the screen is polling the server for updates
         poll_interval: 5000, // time between polls in ms
 
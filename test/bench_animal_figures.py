@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for the animal figures inventory. Compares the time taken to
+calculate the daily on shelter, on foster and litter counts for a month
+with get_animal_figures_inventory against running the per day COUNT 
+queries, checks they agree and times a full update_animal_figures and 
+update_animal_figures_annual.
+
+Usage: bench_animal_figures.py [year] [month]
+"""
+
+import base
+import datetime
+import sys
+import time
+
+import asm3.animal
+import asm3.lookups
+
+def per_day_inventory(dbo, month, year):
+    """ The daily counts calculated with one COUNT query per day, species and type """
+    days = asm3.animal.last_of_month(datetime.datetime(year, month, 1)).day
+    inventory = { "SP_ONSHELTER": {}, "SP_ONFOSTER": {}, "SP_LITTERS": {}, "AT_ONSHELTER": {}, "AT_ONFOSTER": {} }
+    for sp in asm3.lookups.get_species(dbo):
+        sid = sp["ID"]
+        inventory["SP_ONSHELTER"][sid] = [0] + [ asm3.animal.get_number_animals_on_shelter(dbo, datetime.datetime(year, month, i), sid) for i in range(1, days + 1) ]
+        inventory["SP_ONFOSTER"][sid] = [0] + [ asm3.animal.get_number_animals_on_foster(dbo, datetime.datetime(year, month, i), sid) for i in range(1, days + 1) ]
+        inventory["SP_LITTERS"][sid] = [0] + [ asm3.animal.get_number_litters_on_shelter(dbo, datetime.datetime(year, month, i), sid) for i in range(1, days + 1) ]
+    for at in asm3.lookups.get_animal_types(dbo):
+        tid = at["ID"]
+        inventory["AT_ONSHELTER"][tid] = [0] + [ asm3.animal.get_number_animals_on_shelter(dbo, datetime.datetime(year, month, i), 0, tid) for i in range(1, days + 1) ]
+        inventory["AT_ONFOSTER"][tid] = [0] + [ asm3.animal.get_number_animals_on_foster(dbo, datetime.datetime(year, month, i), 0, tid) for i in range(1, days + 1) ]
+    return inventory
+
+def timed(fn, *args):
+    start = time.time()
+    rv = fn(*args)
+    return rv, time.time() - start
+
+def main():
+    dbo = base.get_dbo()
+    today = datetime.datetime.today()
+    year = len(sys.argv) > 1 and int(sys.argv[1]) or today.year
+    month = len(sys.argv) > 2 and int(sys.argv[2]) or today.month
+    perday, tperday = timed(per_day_inventory, dbo, month, year)
+    engine, tengine = timed(asm3.animal.get_animal_figures_inventory, dbo, month, year)
+    mismatches = 0
+    for code, keys in perday.items():
+        for key, counts in keys.items():
+            if engine[code].get(key, [0] * len(counts)) != counts:
+                mismatches += 1
+                print("MISMATCH %s %s: per day %s, inventory %s" % (code, key, counts, engine[code].get(key)))
+    print("inventory %04d-%02d: per day queries %0.3fs, inventory %0.3fs (%0.1fx), %d mismatches" % 
+        (year, month, tperday, tengine, tperday / max(tengine, 0.001), mismatches))
+    dummy, tmonthly = timed(asm3.animal.update_animal_figures, dbo, month, year)
+    dummy, tannual = timed(asm3.animal.update_animal_figures_annual, dbo, year)
+    print("update_animal_figures %0.3fs, update_animal_figures_annual %0.3fs" % (tmonthly, tannual))
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
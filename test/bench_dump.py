@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for database dumps. Times dumping the test database with one
+INSERT statement per row (as dbupdate.dump used to), with multi-row 
+INSERTs, as COPY blocks, gzipped and with tables dumped in parallel. 
+Then loads the INSERT and COPY dumps into new SQLite databases with 
+dbupdate.load and checks every table has the same number of rows.
+
+Usage: bench_dump.py [workers]
+"""
+
+import base
+import io
+import os
+import sys
+import tempfile
+import time
+
+import asm3.db
+import asm3.dbupdate
+
+def old_dump(dbo):
+    """ Dumps every table with a single row INSERT per row """
+    for t in asm3.dbupdate.TABLES:
+        yield "DELETE FROM %s;\n" % t
+        try:
+            for x in dbo.query_to_insert_sql("SELECT * FROM %s" % t, t):
+                yield x
+        except:
+            pass
+
+def timed_dump(dump, compress = False):
+    start = time.time()
+    f = io.BytesIO()
+    asm3.dbupdate.write_dump(dump, f, compress)
+    return f.getvalue(), time.time() - start
+
+def counts(dbo):
+    rv = {}
+    for t in asm3.dbupdate.TABLES:
+        try:
+            rv[t] = dbo.query_int("SELECT COUNT(*) FROM %s" % t)
+        except:
+            pass
+    return rv
+
+def load(dbo, data):
+    """ Loads data into a new SQLite database and returns it with the time taken """
+    ldbo = asm3.db.get_dbo("SQLITE")
+    ldbo.database = os.path.join(tempfile.mkdtemp(), "load.db")
+    ldbo.installpath = dbo.installpath
+    ldbo.locale = dbo.locale
+    asm3.dbupdate.install_db_structure(ldbo)
+    start = time.time()
+    asm3.dbupdate.load(ldbo, asm3.dbupdate.read_dump(io.BytesIO(data)))
+    return ldbo, time.time() - start
+
+def main():
+    workers = len(sys.argv) > 1 and int(sys.argv[1]) or 4
+    dbo = base.get_dbo()
+    old, told = timed_dump(old_dump(dbo))
+    print("single row INSERTs: %0.3fs, %d bytes" % (told, len(old)))
+    dumps = { "single row INSERTs": old }
+    for name, dump, compress in (
+        ("multi-row INSERTs", lambda: asm3.dbupdate.dump(dbo, workers = 1), False),
+        ("COPY", lambda: asm3.dbupdate.dump(dbo, copyFormat = True, workers = 1), False),
+        ("multi-row INSERTs, gzip", lambda: asm3.dbupdate.dump(dbo, workers = 1), True),
+        ("multi-row INSERTs, %d workers" % workers, lambda: asm3.dbupdate.dump(dbo, workers = workers), False)):
+        data, t = timed_dump(dump(), compress)
+        dumps[name] = data
+        print("%s: %0.3fs, %d bytes (%0.1fx)" % (name, t, len(data), told / max(t, 0.001)))
+    mismatches = 0
+    if dumps["multi-row INSERTs"] != dumps["multi-row INSERTs, %d workers" % workers]: mismatches += 1
+    expected = counts(dbo)
+    for name in ("single row INSERTs", "multi-row INSERTs", "COPY", "multi-row INSERTs, gzip"):
+        ldbo, t = load(dbo, dumps[name])
+        got = counts(ldbo)
+        bad = [ k for k in expected if expected[k] != got.get(k) ]
+        if len(bad) > 0:
+            print("%s: row counts differ for %s" % (name, ", ".join(bad)))
+            mismatches += 1
+        print("load %s: %0.3fs" % (name, t))
+    print("%d mismatches" % mismatches)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for account balances. Adds years of transactions between a
+set of new accounts, then compares working out opening balances and the
+accounts screen totals by summing accountstrx (as get_balance_to_date
+and get_accounts used to) against the monthly totals in the balance
+index. Checks the balances agree and the index verifies. The accounts
+and transactions are removed afterwards.
+
+Usage: bench_financial.py [transactions] [accounts]
+"""
+
+import base
+import datetime
+import random
+import sys
+import time
+
+import asm3.financial
+
+START = datetime.datetime(2012, 1, 1)
+
+def scan_balance(dbo, accountid, todate):
+    """ Returns the balance of accountid to todate by summing accountstrx """
+    return dbo.query_int("SELECT SUM(Amount) FROM accountstrx WHERE DestinationAccountID = ? AND TrxDate < ?", (accountid, todate)) - \
+        dbo.query_int("SELECT SUM(Amount) FROM accountstrx WHERE SourceAccountID = ? AND TrxDate < ?", (accountid, todate))
+
+def scan_totals(dbo, accountids):
+    """ Returns the dest/src totals for every account by summing accountstrx """
+    return dict( (a, (dbo.query_int("SELECT SUM(Amount) FROM accountstrx WHERE DestinationAccountID = ?", [a]),
+        dbo.query_int("SELECT SUM(Amount) FROM accountstrx WHERE SourceAccountID = ?", [a]))) for a in accountids )
+
+def timed(fn, *args):
+    start = time.time()
+    rv = fn(*args)
+    return rv, time.time() - start
+
+def main():
+    random.seed(1)
+    ntrx = len(sys.argv) > 1 and int(sys.argv[1]) or 50000
+    naccounts = len(sys.argv) > 2 and int(sys.argv[2]) or 10
+    dbo = base.get_dbo()
+    dbo.execute("DELETE FROM accounts WHERE Code LIKE 'Benchbal%'")
+    accountids = [ dbo.insert("accounts", { "Code": "Benchbal%d" % i, "Archived": 0, "AccountType": asm3.financial.BANK,
+        "DonationTypeID": 0, "CostTypeID": 0, "Description": "Bench" }, "test", writeAudit=False) for i in range(naccounts) ]
+    ids = dbo.get_ids("accountstrx", ntrx)
+    rows = []
+    for i in range(ntrx):
+        src, dest = random.sample(accountids, 2)
+        rows.append((ids[i], START + datetime.timedelta(days=random.randint(0, 3650)), "Bench", random.randint(0, 1),
+            random.randint(1, 10000), src, dest, 0, 0, "test", dbo.now(), "test", dbo.now()))
+    dbo.execute_many("INSERT INTO accountstrx (ID, TrxDate, Description, Reconciled, Amount, SourceAccountID, DestinationAccountID, " \
+        "AnimalCostID, OwnerDonationID, CreatedBy, CreatedDate, LastChangedBy, LastChangedDate) " \
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    mismatches = 0
+    try:
+        written, trebuild = timed(asm3.financial.rebuild_balance_index, dbo)
+        print("%d transactions, %d accounts: rebuilt index of %d monthly totals in %0.3fs" % (ntrx, naccounts, written, trebuild))
+        dates = [ START + datetime.timedelta(days=random.randint(0, 3700)) for i in range(20) ]
+        scanned, tscan = timed(lambda: [ scan_balance(dbo, a, d) for a in accountids for d in dates ])
+        indexed, tindexed = timed(lambda: [ asm3.financial.get_balance_to_date(dbo, a, d) for a in accountids for d in dates ])
+        mismatches += len([ x for x, y in zip(scanned, indexed) if x != y ])
+        print("%d opening balances: scan %0.3fs, indexed %0.3fs (%0.1fx)" % (len(scanned), tscan, tindexed, tscan / max(tindexed, 0.001)))
+        scanned, tscan = timed(scan_totals, dbo, accountids)
+        totals, tindexed = timed(asm3.financial.get_account_totals, dbo)
+        mismatches += len([ a for a in accountids if scanned[a] != totals.get(a, (0, 0))[:2] ])
+        print("accounts screen totals: scan %0.3fs, indexed %0.3fs (%0.1fx)" % (tscan, tindexed, tscan / max(tindexed, 0.001)))
+        differences, tcheck = timed(asm3.financial.check_balance_index, dbo)
+        mismatches += differences
+        print("checked index in %0.3fs" % tcheck)
+    finally:
+        for a in accountids:
+            asm3.financial.delete_account(dbo, "", a)
+    print("%d mismatches" % mismatches)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for interpreter startup. Times importing code.py and cron.py
+in a fresh interpreter and reports peak memory, with locales loaded on
+demand by asm3.i18n and with every locale module imported up front
+(as they used to be). Also checks that translations from the compiled
+catalogues match the locale modules for every string and locale.
+
+Usage: bench_import.py [runs]
+"""
+
+import base
+import os
+import subprocess
+import sys
+
+import asm3.i18n
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+SNIPPET = """
+import importlib.util, resource, sys, time
+start = time.time()
+if %(eager)s:
+    import asm3.locales
+    from asm3.locales import *
+spec = importlib.util.spec_from_file_location("asm_%(module)s", "%(module)s.py")
+m = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(m)
+import asm3.i18n
+asm3.i18n._("Animal", "fr")
+print("%%0.3f %%d" %% (time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+"""
+
+def time_import(module, eager, runs):
+    """ Returns the median import time and peak memory (KB) for module over runs """
+    times = []
+    mem = []
+    for i in range(runs):
+        out = subprocess.check_output([ sys.executable, "-c", SNIPPET % { "module": module, "eager": eager } ], cwd=SRC)
+        t, m = out.decode("utf-8").strip().split("\n")[-1].split(" ")
+        times.append(float(t))
+        mem.append(int(m))
+    return sorted(times)[len(times) // 2], sorted(mem)[len(mem) // 2]
+
+def check_translations():
+    """ Compares every string in every locale module with asm3.i18n.translate """
+    import importlib
+    mismatches = 0
+    for f in sorted(os.listdir(asm3.i18n.LOCALES_DIR)):
+        if not f.startswith("locale_") or not f.endswith(".py"): continue
+        locale = f[len("locale_"):-len(".py")]
+        val = importlib.import_module("asm3.locales.locale_%s" % locale).val
+        for k, v in val.items():
+            expected = asm3.i18n.is_translated(v) and v or k
+            if expected != asm3.i18n.translate(k, locale): mismatches += 1
+    return mismatches
+
+def main():
+    runs = len(sys.argv) > 1 and int(sys.argv[1]) or 5
+    for module in ("cron", "code"):
+        tlazy, mlazy = time_import(module, False, runs)
+        teager, meager = time_import(module, True, runs)
+        print("import %s.py: all locales %0.3fs %dKB, on demand %0.3fs %dKB (%0.1fx)" %
+            (module, teager, meager, tlazy, mlazy, teager / max(tlazy, 0.001)))
+    mismatches = check_translations()
+    print("%d mismatches" % mismatches)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for lost and found matching. Builds sets of lost, found and
+shelter animals and compares the indexed matcher used by
+asm3.lostfound.match against scoring every lost animal with every
+found and shelter animal. Then changes some of the animals and compares
+an incremental match against a full one. Checks the matches agree.
+
+Usage: bench_lostfound.py [lost] [found] [shelter]
+"""
+
+import base
+import datetime
+import random
+import sys
+import time
+
+import asm3.dbms.base
+import asm3.lostfound
+from asm3.i18n import date_diff_days
+
+POINTS = { "species": 5, "breed": 5, "age": 5, "sex": 5, "arealost": 5, "features": 5, "postcode": 5,
+    "colour": 5, "microchip": 50, "within2weeks": 5, "max": 95, "floor": 20, "shelter": True }
+
+STREETS = [ "street%d" % i for i in range(300) ] + [ "road", "lane", "park", "close" ]
+FEATURES = [ "feature%d" % i for i in range(100) ] + [ "white", "black", "collar", "tag" ]
+AGES = [ "Baby", "Young", "Adult", "Senior" ]
+
+def make_row(i, kind):
+    r = asm3.dbms.base.ResultRow()
+    chip = random.random() < 0.3 and "9770000%05d" % random.randint(0, 2000) or ""
+    area = " ".join(random.sample(STREETS, random.randint(2, 4))) + ", Town%d" % random.randint(0, 20)
+    features = " ".join(random.sample(FEATURES, random.randint(0, 4)))
+    d = datetime.datetime(2021, 1, 1) + datetime.timedelta(days=random.randint(0, 180))
+    postcode = "PC%d" % random.randint(0, 200)
+    r.ID = i
+    r.AGEGROUP = random.choice(AGES)
+    r.SEX = random.randint(0, 2)
+    r.SEXNAME = "Sex"
+    r.BREEDID = random.randint(1, 50)
+    r.BREEDNAME = "Breed"
+    r.BASECOLOURID = random.randint(1, 20)
+    r.BASECOLOURNAME = "Colour"
+    r.SPECIESNAME = "Species"
+    if kind == "shelter":
+        r.CODE = "A%05d" % i
+        r.ANIMALNAME = "Animal %d" % i
+        r.IDENTICHIPNUMBER = chip
+        r.SPECIESID = random.randint(1, 3)
+        r.BREED2ID = random.random() < 0.2 and random.randint(1, 50) or r.BREEDID
+        r.ORIGINALOWNERADDRESS = area
+        r.ORIGINALOWNERTOWN = "Town"
+        r.ORIGINALOWNERPOSTCODE = random.random() < 0.2 and None or "%s 1AB" % postcode
+        r.MARKINGS = features
+        r.DATEBROUGHTIN = d
+    else:
+        r.OWNERNAME = "Owner %d" % i
+        r.HOMETELEPHONE = "0123"
+        r.MICROCHIPNUMBER = chip
+        r.ANIMALTYPEID = random.randint(1, 3)
+        r.AREAPOSTCODE = postcode
+        r.DISTFEAT = features
+        r.AREALOST = area
+        r.AREAFOUND = area
+        r.DATELOST = d
+        r.DATEFOUND = d
+    return r
+
+def scan(lostanimals, foundanimals, shelteranimals, p):
+    """ Scores every lost animal against every found and shelter animal as match used to """
+    words = asm3.lostfound.words
+    matches = []
+    for la in lostanimals:
+        for fa in foundanimals:
+            matchpoints = 0
+            if la["MICROCHIPNUMBER"] != "" and la["MICROCHIPNUMBER"] == fa["MICROCHIPNUMBER"]: matchpoints += p["microchip"]
+            if la["ANIMALTYPEID"] == fa["ANIMALTYPEID"]: matchpoints += p["species"]
+            if la["BREEDID"] == fa["BREEDID"]: matchpoints += p["breed"]
+            if la["AGEGROUP"] == fa["AGEGROUP"]: matchpoints += p["age"]
+            if la["SEX"] == fa["SEX"]: matchpoints += p["sex"]
+            matchpoints += words(la["AREALOST"], fa["AREAFOUND"], p["arealost"])
+            matchpoints += words(la["DISTFEAT"], fa["DISTFEAT"], p["features"])
+            if la["AREAPOSTCODE"] == fa["AREAPOSTCODE"]: matchpoints += p["postcode"]
+            if la["BASECOLOURID"] == fa["BASECOLOURID"]: matchpoints += p["colour"]
+            if date_diff_days(la["DATELOST"], fa["DATEFOUND"]) <= 14: matchpoints += p["within2weeks"]
+            if matchpoints > p["max"]: matchpoints = p["max"]
+            if matchpoints >= p["floor"]:
+                matches.append((la.ID, fa.ID, 0, int((float(matchpoints) / float(p["max"])) * 100.0)))
+        for a in shelteranimals:
+            matchpoints = 0
+            if la["MICROCHIPNUMBER"] != "" and la["MICROCHIPNUMBER"] == a["IDENTICHIPNUMBER"]: matchpoints += p["microchip"]
+            if la["ANIMALTYPEID"] == a["SPECIESID"]: matchpoints += p["species"]
+            if la["BREEDID"] == a["BREEDID"] or la["BREEDID"] == a["BREED2ID"]: matchpoints += p["breed"]
+            if la["BASECOLOURID"] == a["BASECOLOURID"]: matchpoints += p["colour"]
+            if la["AGEGROUP"] == a["AGEGROUP"]: matchpoints += p["age"]
+            if la["SEX"] == a["SEX"]: matchpoints += p["sex"]
+            matchpoints += words(la["AREALOST"], a["ORIGINALOWNERADDRESS"], p["arealost"])
+            matchpoints += words(la["DISTFEAT"], a["MARKINGS"], p["features"])
+            if (a["ORIGINALOWNERPOSTCODE"] or "").find(la["AREAPOSTCODE"]) != -1: matchpoints += p["postcode"]
+            if date_diff_days(la["DATELOST"], a["DATEBROUGHTIN"]) <= 14: matchpoints += p["within2weeks"]
+            if matchpoints > p["max"]: matchpoints = p["max"]
+            if matchpoints >= p["floor"]:
+                matches.append((la.ID, 0, a.ID, int((float(matchpoints) / float(p["max"])) * 100.0)))
+    return matches
+
+def keys(matches):
+    return [ (m.lid, m.fid, m.fanimalid, m.matchpoints) for m in matches ]
+
+def change(rows, kind, nextid):
+    """ Changes 2% of rows, removes 1% and adds 1% new ones """
+    rows = [ r for r in rows if random.random() > 0.01 ]
+    for i in range(len(rows)):
+        if random.random() < 0.02: rows[i] = make_row(rows[i].ID, kind)
+    return rows + [ make_row(nextid + i + 1, kind) for i in range(len(rows) // 100) ]
+
+def timed(fn, *args):
+    start = time.time()
+    rv = fn(*args)
+    return rv, time.time() - start
+
+def main():
+    random.seed(1)
+    nlost = len(sys.argv) > 1 and int(sys.argv[1]) or 2000
+    nfound = len(sys.argv) > 2 and int(sys.argv[2]) or 2000
+    nshelter = len(sys.argv) > 3 and int(sys.argv[3]) or 1000
+    dbo = base.get_dbo()
+    lostanimals = sorted([ make_row(i + 1, "lost") for i in range(nlost) ], key=lambda r: r.DATELOST)
+    foundanimals = [ make_row(i + 1, "found") for i in range(nfound) ]
+    shelteranimals = [ make_row(i + 1, "shelter") for i in range(nshelter) ]
+    scanned, tscan = timed(scan, lostanimals, foundanimals, shelteranimals, POINTS)
+    indexed, tindexed = timed(asm3.lostfound.match_rows, dbo, lostanimals, foundanimals, shelteranimals, POINTS)
+    mismatches = scanned != keys(indexed) and 1 or 0
+    print("%d lost x %d found, %d shelter, %d matches: scan %0.3fs, indexed %0.3fs (%0.1fx)" %
+        (nlost, nfound, nshelter, len(scanned), tscan, tindexed, tscan / max(tindexed, 0.001)))
+    s = asm3.lostfound.match_state([], lostanimals, foundanimals, shelteranimals, indexed)
+    lostanimals = sorted(change(lostanimals, "lost", nlost), key=lambda r: r.DATELOST)
+    foundanimals = change(foundanimals, "found", nfound)
+    shelteranimals = change(shelteranimals, "shelter", nshelter)
+    full, tfull = timed(asm3.lostfound.match_rows, dbo, lostanimals, foundanimals, shelteranimals, POINTS)
+    incremental, tincremental = timed(asm3.lostfound.match_incremental, dbo, lostanimals, foundanimals, shelteranimals, POINTS, s)
+    if keys(full) != keys(incremental): mismatches += 1
+    print("after changing 2%% and adding/removing 1%%: full %0.3fs, incremental %0.3fs (%0.1fx)" %
+        (tfull, tincremental, tfull / max(tincremental, 0.001)))
+    print("%d mismatches" % mismatches)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for publisher change detection. Posts a set of listings to a
+local stand-in service that takes latency seconds per request, the way
+the PetRescue and SavourLife publishers do. Then changes some of the
+listings and compares sending everything again (a full resync, as
+every run used to) against sending only what the stored fingerprints
+say has changed. Checks that exactly the changed listings were sent.
+The fingerprints are removed afterwards.
+
+Usage: bench_publish_fingerprint.py [listings] [latency]
+"""
+
+import base
+import http.server
+import random
+import sys
+import threading
+import time
+
+import asm3.dbms.base
+import asm3.publishers.base
+import asm3.utils
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    latency = 0.02
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(Handler.latency)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def make_animal(i):
+    a = asm3.dbms.base.ResultRow()
+    a.ID = i
+    a.ANIMALNAME = "Animal %d" % i
+    a.DESCRIPTION = "A lovely animal. " * random.randint(5, 20)
+    return a
+
+def publish(dbo, url, animals, fullresync):
+    """ Sends the animals that need sending like a listing publisher, returns the ids sent """
+    pc = asm3.publishers.base.PublishCriteria()
+    pc.fullResync = fullresync
+    p = asm3.publishers.base.AbstractPublisher(dbo, pc)
+    p.initLog("benchfingerprint", "Bench Publisher")
+    sent = []
+    unchanged = []
+    def listings():
+        for a in animals:
+            data = { "remote_id": a.ID, "name": a.ANIMALNAME, "description": a.DESCRIPTION }
+            if not p.fingerprintAnimal(a, data):
+                unchanged.append(a)
+                continue
+            yield a, asm3.utils.json(data)
+    for (a, jsondata), future in p.http.map(lambda x: p.http.post_json(url, x[1]), listings()):
+        if future.result()["status"] == 200: sent.append(a)
+    p.saveFingerprints(sent, unchanged)
+    p.http.close()
+    p.deletePublishDirectory()
+    return [ a.ID for a in sent ]
+
+def timed(fn, *args):
+    start = time.time()
+    rv = fn(*args)
+    return rv, time.time() - start
+
+def main():
+    random.seed(1)
+    n = len(sys.argv) > 1 and int(sys.argv[1]) or 300
+    Handler.latency = len(sys.argv) > 2 and float(sys.argv[2]) or 0.02
+    dbo = base.get_dbo()
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/listings" % server.server_address[1]
+    mismatches = 0
+    try:
+        animals = [ make_animal(i + 1) for i in range(n) ]
+        sent, tfirst = timed(publish, dbo, url, animals, False)
+        mismatches += len(sent) != n and 1 or 0
+        changed = set(random.sample([ a.ID for a in animals ], max(n // 50, 1)))
+        for a in animals:
+            if a.ID in changed: a.DESCRIPTION += " Now house trained."
+        sent, tdelta = timed(publish, dbo, url, animals, False)
+        mismatches += len(changed.symmetric_difference(sent))
+        sent, tfull = timed(publish, dbo, url, animals, True)
+        mismatches += len(sent) != n and 1 or 0
+        print("%d listings, %0.3fs latency: first run %0.3fs, after changing %d: full resync %0.3fs, changes only %0.3fs (%0.1fx)" %
+            (n, Handler.latency, tfirst, len(changed), tfull, tdelta, tfull / max(tdelta, 0.001)))
+    finally:
+        server.shutdown()
+        server.server_close()
+        dbo.execute("DELETE FROM animalpublishedfingerprint WHERE PublishedTo = 'benchfingerprint'")
+    print("%d mismatches" % mismatches)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
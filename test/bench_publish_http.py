@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for publisher HTTP requests. Starts a local stand-in for a
+listing service that takes latency seconds to answer each request and
+fails one in every twenty with a 503. Compares posting a set of listings
+one at a time with asm3.utils.post_json (as the publishers used to)
+against sending them over pooled connections on the workers of
+asm3.publishers.base.HTTPClient. Checks every listing got its own
+response back, in order.
+
+Usage: bench_publish_http.py [listings] [latency] [workers]
+"""
+
+import base
+import http.server
+import sys
+import threading
+import time
+
+import asm3.publishers.base
+import asm3.utils
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    latency = 0.05
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with Handler.lock:
+            Handler.requests += 1
+            fail = Handler.requests % 20 == 0
+        time.sleep(Handler.latency)
+        if fail:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def listing(i):
+    return asm3.utils.json({ "remote_id": i, "name": "Animal %d" % i, "description": "A lovely animal. " * 20 })
+
+def sequential(url, n):
+    """ Posts each listing in turn, retrying failures once """
+    responses = []
+    for i in range(n):
+        r = asm3.utils.post_json(url, listing(i))
+        if r["status"] == 503: r = asm3.utils.post_json(url, listing(i))
+        responses.append(r["response"])
+    return responses
+
+def concurrent(url, n, workers):
+    """ Posts the listings on the workers of an HTTPClient, the stand-in does nothing with a 503 so they are safe to retry """
+    c = asm3.publishers.base.HTTPClient(workers=workers, backoff=0)
+    responses = [ f.result()["response"] for i, f in c.map(lambda i: c.post_json(url, listing(i), retry=True), range(n)) ]
+    c.close()
+    print(c.getTimingsLog()[-1])
+    return responses
+
+def timed(fn, *args):
+    start = time.time()
+    rv = fn(*args)
+    return rv, time.time() - start
+
+def main():
+    n = len(sys.argv) > 1 and int(sys.argv[1]) or 200
+    Handler.latency = len(sys.argv) > 2 and float(sys.argv[2]) or 0.05
+    workers = len(sys.argv) > 3 and int(sys.argv[3]) or asm3.publishers.base.PUBLISH_HTTP_WORKERS
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/listings" % server.server_address[1]
+    try:
+        expected = [ listing(i) for i in range(n) ]
+        seq, tseq = timed(sequential, url, n)
+        con, tcon = timed(concurrent, url, n, workers)
+        mismatches = len([ x for x, y in zip(expected, seq) if x != y ]) + len([ x for x, y in zip(expected, con) if x != y ])
+        mismatches += abs(n - len(seq)) + abs(n - len(con))
+        print("%d listings, %0.3fs latency: sequential %0.3fs, %d workers %0.3fs (%0.1fx)" %
+            (n, Handler.latency, tseq, workers, tcon, tseq / max(tcon, 0.001)))
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("%d mismatches" % mismatches)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
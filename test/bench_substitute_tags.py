@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for tag substitution. Renders a 200KB document template and
+a bulk email subject and body for 5,000 recipients with the compiled
+templates used by substitute_tags, compares the output and time against
+rescanning and rebuilding the whole string for every tag.
+
+Usage: bench_substitute_tags.py [templatekb] [recipients]
+"""
+
+import base
+import sys
+import time
+
+import asm3.utils
+import asm3.wordprocessor
+
+TAGS = [ "OWNERNAME", "OWNERFORENAMES", "OWNERSURNAME", "OWNERADDRESS", "OWNERTOWN", "OWNERCOUNTY", "OWNERPOSTCODE",
+    "EMAILADDRESS", "ANIMALNAME", "SHELTERCODE", "SPECIESNAME", "BREEDNAME", "DATEOFBIRTH", "CURRENTDATE", "ORGANISATION" ]
+
+def make_template(size, opener = "&lt;&lt;", closer = "&gt;&gt;"):
+    """ Builds a document of roughly size characters with a tag every 20 words or so """
+    para = []
+    for i, t in enumerate(TAGS):
+        para.append("<text:p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor %s%s%s incididunt.</text:p>" % (opener, t, closer))
+    para = "\n".join(para)
+    return (para * (size // len(para) + 1))[:size]
+
+def make_rows(count):
+    rows = []
+    for i in range(count):
+        r = {}
+        for t in TAGS:
+            r[t] = "%s value %d & <more>" % (t.lower(), i)
+        r["EMAILADDRESS"] = "person%d@example.com" % i
+        rows.append(r)
+    return rows
+
+def timed(fn, *args):
+    start = time.time()
+    rv = fn(*args)
+    return rv, time.time() - start
+
+def render_scan(template, rows, escape, opener, closer):
+    return [ asm3.utils._substitute_tags_scan(template, r, escape, opener, closer) for r in rows ]
+
+def render_compiled(template, rows, escape, opener, closer):
+    asm3.utils.compile_template.cache_clear()
+    return [ asm3.utils.compile_template(template, opener, closer).render(r, escape) for r in rows ]
+
+def main():
+    size = len(sys.argv) > 1 and int(sys.argv[1]) * 1024 or 200 * 1024
+    count = len(sys.argv) > 2 and int(sys.argv[2]) or 5000
+    mismatches = 0
+    # A single large document template, eg: ODT content.xml
+    template = make_template(size)
+    rows = make_rows(20)
+    scan, tscan = timed(render_scan, template, rows, asm3.wordprocessor.escape_tag_value, "&lt;&lt;", "&gt;&gt;")
+    compiled, tcompiled = timed(render_compiled, template, rows, asm3.wordprocessor.escape_tag_value, "&lt;&lt;", "&gt;&gt;")
+    if scan != compiled: mismatches += 1
+    print("document %dKB x %d: scan %0.3fs, compiled %0.3fs (%0.1fx)" % (size // 1024, len(rows), tscan, tcompiled, tscan / max(tcompiled, 0.001)))
+    # Bulk email subject and body for many recipients
+    subject = "Hello <<OWNERFORENAMES>>, news about <<ANIMALNAME>>"
+    body = make_template(4096)
+    rows = make_rows(count)
+    def scan_email():
+        return render_scan(subject, rows, None, "<<", ">>") + render_scan(body, rows, asm3.utils.escape_tag_value, "&lt;&lt;", "&gt;&gt;")
+    def compiled_email():
+        return render_compiled(subject, rows, None, "<<", ">>") + render_compiled(body, rows, asm3.utils.escape_tag_value, "&lt;&lt;", "&gt;&gt;")
+    scan, tscan = timed(scan_email)
+    compiled, tcompiled = timed(compiled_email)
+    if scan != compiled: mismatches += 1
+    print("bulk email x %d: scan %0.3fs, compiled %0.3fs (%0.1fx)" % (count, tscan, tcompiled, tscan / max(tcompiled, 0.001)))
+    print("%d mismatches" % mismatches)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
@@ -21,6 +21,14 @@ import test_animal
 suitea = unittest.makeSuite(test_animal.TestAnimal, 'test')
 fullsuite.append(suitea)
 
+import test_asynctask
+suiteasync = unittest.makeSuite(test_asynctask.TestAsyncTask, 'test')
+fullsuite.append(suiteasync)
+
+import test_cachebackend
+suitecache = unittest.makeSuite(test_cachebackend.TestCacheBackend, 'test')
+fullsuite.append(suitecache)
+
 import test_clinic
 suiteclinic = unittest.makeSuite(test_clinic.TestClinic, 'test')
 fullsuite.append(suiteclinic)
@@ -33,6 +41,14 @@ import test_dbfs
 suitedbfs = unittest.makeSuite(test_dbfs.TestDBFS, 'test')
 fullsuite.append(suitedbfs)
 
+import test_dbupdate
+suitedbupdate = unittest.makeSuite(test_dbupdate.TestDBUpdate, 'test')
+fullsuite.append(suitedbupdate)
+
+import test_dbms
+suitedbms = unittest.makeSuite(test_dbms.TestDBMS, 'test')
+fullsuite.append(suitedbms)
+
 import test_diary
 suitediary = unittest.makeSuite(test_diary.TestDiary, 'test')
 fullsuite.append(suitediary)
@@ -3,6 +3,7 @@ import unittest
 import base
 
 import asm3.additional
+import asm3.dbms.base
 import asm3.utils
 
 class TestAdditional(unittest.TestCase):
@@ -36,7 +37,27 @@ class TestAdditional(unittest.TestCase):
         asm3.additional.get_additional_fields_ids(base.get_dbo(), [], "animal")
 
     def test_get_field_definitions(self):
-        assert len(asm3.additional.get_field_definitions(base.get_dbo(), "animal")) > 0
+        dbo = base.get_dbo()
+        assert len(asm3.additional.get_field_definitions(dbo, "animal")) > 0
+        # The cache should be cleared when a field is changed
+        asm3.additional.update_field_from_form(dbo, "test", asm3.utils.PostedData({ "id": self.nid, "name": "cachename", 
+            "label": "l", "type": "0", "link": "0", "displayindex": "1" }, "en"))
+        assert "cachename" in [ f.FIELDNAME for f in asm3.additional.get_field_definitions(dbo, "animal") ]
+
+    def test_append_to_results(self):
+        dbo = base.get_dbo()
+        asm3.additional.insert_additional(dbo, 0, 1, self.nid, "Yes")
+        rows = [ asm3.dbms.base.ResultRow(ID=1), asm3.dbms.base.ResultRow(ID=0) ]
+        asm3.additional.append_to_results(dbo, rows, "animal")
+        for r in rows:
+            for af in asm3.additional.get_additional_fields(dbo, r.ID, "animal"):
+                assert r[af.FIELDNAME.upper()] == af.VALUE
+        assert rows[0].ADDNAME == "Yes" and rows[1].ADDNAME is None
+        # A value under another link type must not be picked up for animals
+        asm3.additional.insert_additional(dbo, asm3.additional.PERSON, 0, self.nid, "Person")
+        rows = asm3.additional.append_to_results(dbo, [ asm3.dbms.base.ResultRow(ID=0) ], "animal")
+        assert rows[0].ADDNAME is None
+        dbo.execute("DELETE FROM additional WHERE AdditionalFieldID = ?", [self.nid])
 
     def test_get_fields(self):
         assert len(asm3.additional.get_fields(base.get_dbo())) > 0
@@ -72,7 +93,11 @@ class TestAdditional(unittest.TestCase):
         asm3.additional.update_field_from_form(base.get_dbo(), "test", post)
 
     def test_save_values_for_link(self):
-        asm3.additional.save_values_for_link(base.get_dbo(), asm3.utils.PostedData({}, "en"), 0, "animal")
+        dbo = base.get_dbo()
+        asm3.additional.save_values_for_link(dbo, asm3.utils.PostedData({}, "en"), 0, "animal")
+        asm3.additional.save_values_for_link(dbo, asm3.utils.PostedData({ "a.0.%d" % self.nid: "on" }, "en"), 1, "animal")
+        assert dbo.query_string("SELECT Value FROM additional WHERE LinkID = 1 AND AdditionalFieldID = ?", [self.nid]) == "1"
+        dbo.execute("DELETE FROM additional WHERE AdditionalFieldID = ?", [self.nid])
 
     def test_merge_values_for_link(self):
         asm3.additional.merge_values_for_link(base.get_dbo(), asm3.utils.PostedData({}, "en"), 0, "animal")
@@ -46,6 +46,14 @@ class TestAnimal(unittest.TestCase):
     def test_get_alerts(self):
         assert len(asm3.animal.get_alerts(base.get_dbo())) > 0
 
+    def test_alert_counters(self):
+        dbo = base.get_dbo()
+        a = asm3.animal.get_animal(dbo, self.nid)
+        before = asm3.animal.get_alerts(dbo, str(a.SHELTERLOCATION))[0].NOTADOPT
+        dbo.update("animal", self.nid, { "IsNotAvailableForAdoption": 1 })
+        assert before + 1 == asm3.animal.get_alerts(dbo, str(a.SHELTERLOCATION))[0].NOTADOPT
+        assert 0 == asm3.animal.check_alert_counters(dbo)
+
     def test_get_stats(self):
         assert len(asm3.animal.get_stats(base.get_dbo())) > 0
 
@@ -264,6 +272,14 @@ class TestAnimal(unittest.TestCase):
     def test_update_on_shelter_animal_statuses(self):
         asm3.animal.update_on_shelter_animal_statuses(base.get_dbo())
 
+    def test_index_movements(self):
+        dbo = base.get_dbo()
+        movements = dbo.query(asm3.animal.get_animal_movement_status_query(dbo) + " ORDER BY MovementDate DESC")
+        idx = asm3.animal.index_movements(movements)
+        assert sum([ len(v) for v in idx.values() ]) == len(movements)
+        assert asm3.animal.get_indexed_movements(idx, -1) == []
+        asm3.animal.update_animal_status(dbo, self.nid, movements=idx)
+
     def test_update_animal_check_bonds(self):
         asm3.animal.update_animal_check_bonds(base.get_dbo(), self.nid)
 
@@ -276,6 +292,16 @@ class TestAnimal(unittest.TestCase):
         asm3.animal.update_animal_figures(base.get_dbo())
         asm3.animal.update_animal_figures_annual(base.get_dbo())
 
+    def test_get_animal_figures_inventory(self):
+        dbo = base.get_dbo()
+        d = base.today()
+        inventory = asm3.animal.get_animal_figures_inventory(dbo, d.month, d.year)
+        speciesid = asm3.animal.get_animal(dbo, self.nid)["SPECIESID"]
+        counts = inventory["SP_ONSHELTER"].get(speciesid, [0] * 32)
+        assert counts[d.day] == asm3.animal.get_number_animals_on_shelter(dbo, d, speciesid)
+        counts = inventory["SP_ONFOSTER"].get(speciesid, [0] * 32)
+        assert counts[d.day] == asm3.animal.get_number_animals_on_foster(dbo, d, speciesid)
+
     def test_auto_cancel_holds(self):
         asm3.animal.auto_cancel_holds(base.get_dbo())
 
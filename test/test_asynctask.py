@@ -0,0 +1,67 @@
+import unittest
+import base
+
+import asm3.asynctask
+
+import threading
+
+class TestAsyncTask(unittest.TestCase):
+
+    def test_function_task(self):
+        dbo = base.get_dbo()
+        started = threading.Event()
+        finish = threading.Event()
+        def fn(name):
+            asm3.asynctask.set_progress_max(dbo, 1000)
+            for i in range(500):
+                asm3.asynctask.increment_progress_value(dbo)
+            started.set()
+            finish.wait(10)
+            return name
+        t1 = asm3.asynctask.function_task(dbo, "Task one", fn, "one")
+        t2 = asm3.asynctask.function_task(dbo, "Task two", fn, "two")
+        assert t1 is not None and t2 is not None and t1 != t2
+        # Only one task with the same name at a time
+        assert asm3.asynctask.function_task(dbo, "Task one", fn, "one") is None
+        started.wait(10)
+        assert asm3.asynctask.is_task_running(dbo)
+        assert "Task one" == asm3.asynctask.get_task_name(dbo, t1)
+        finish.set()
+        for t in threading.enumerate():
+            if isinstance(t, asm3.asynctask.FuncThread): t.join(10)
+        assert not asm3.asynctask.is_task_running(dbo, t1)
+        assert "NONE" == asm3.asynctask.get_task_name(dbo, t1)
+        assert "one" == asm3.asynctask.get_return_value(dbo, t1)
+        assert "two" == asm3.asynctask.get_return_value(dbo, t2)
+
+    def test_function_task_concurrent(self):
+        dbo = base.get_dbo()
+        finish = threading.Event()
+        ids = []
+        def start(i):
+            ids.append(asm3.asynctask.function_task(dbo, "Concurrent %d" % i, finish.wait, 10))
+        starters = [ threading.Thread(target=start, args=(i,)) for i in range(asm3.asynctask.MAX_TASKS * 2) ]
+        for t in starters: t.start()
+        for t in starters: t.join()
+        # No more than MAX_TASKS can start and every one that did is in the list of tasks
+        started = [ x for x in ids if x is not None ]
+        assert len(started) == asm3.asynctask.MAX_TASKS
+        assert set(started) == set([ x[0] for x in asm3.asynctask.get_running_tasks(dbo) ])
+        finish.set()
+        for t in threading.enumerate():
+            if isinstance(t, asm3.asynctask.FuncThread): t.join(10)
+        assert len(asm3.asynctask.get_running_tasks(dbo)) == 0
+
+    def test_progress(self):
+        dbo = base.get_dbo()
+        asm3.asynctask.set_task_name(dbo, "Progress")
+        asm3.asynctask.set_progress_max(dbo, 200)
+        asm3.asynctask.set_progress_value(dbo, 0)
+        for i in range(100):
+            asm3.asynctask.increment_progress_value(dbo)
+        assert 50 == asm3.asynctask.get_progress_percent(dbo)
+        asm3.asynctask.set_cancel(dbo, True, asm3.asynctask.DEFAULT_TASK)
+        assert asm3.asynctask.get_cancel(dbo)
+        asm3.asynctask.reset(dbo)
+        assert not asm3.asynctask.get_cancel(dbo)
+        assert "NONE" == asm3.asynctask.get_task_name(dbo, asm3.asynctask.DEFAULT_TASK)
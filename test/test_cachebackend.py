@@ -0,0 +1,50 @@
+
+import os, tempfile, unittest
+import base
+
+import asm3.cachebackend
+
+class TestCacheBackend(unittest.TestCase):
+
+    def check_backend(self, b):
+        b.put("test", "k1", { "a": 1 }, 60)
+        assert b.get("test", "k1") == { "a": 1 }
+        assert b.get("test", "nokey") is None
+        assert b.exists("test", "k1")
+        b.put("test", "n", 1, 60)
+        assert b.increment("test", "n") == 2
+        assert b.increment("test", "n", 5) == 7
+        assert b.increment("test", "nokey") is None
+        b.put("test", "expired", 1, -1)
+        assert b.get("test", "expired") is None
+        b.delete("test", "k1")
+        assert b.get("test", "k1") is None
+        s = b.stats()
+        assert s["hits"] == 1 and s["misses"] == 3
+
+    def test_lru(self):
+        b = asm3.cachebackend.LRUCacheBackend(maxitems = 3)
+        self.check_backend(b)
+        for i in range(0, 5):
+            b.put("test", i, i, 60)
+        assert b.get("test", 0) is None
+        assert b.get("test", 4) == 4
+        assert b.stats()["evictions"] > 0
+
+    def test_sqlite(self):
+        fname = os.path.join(tempfile.mkdtemp(), "cache.db")
+        b = asm3.cachebackend.SQLiteCacheBackend(fname, maxitems = 3)
+        self.check_backend(b)
+        # A second backend on the same file sees the same values
+        b.put("test", "shared", "yes", 60)
+        assert asm3.cachebackend.SQLiteCacheBackend(fname).get("test", "shared") == "yes"
+        for i in range(0, 5):
+            b.put("test", str(i), i, 60 + i)
+        b.sweep()
+        assert b.get("test", "4") == 4
+        assert b.stats()["evictions"] > 0
+
+    def test_file(self):
+        b = asm3.cachebackend.FileCacheBackend(tempfile.mkdtemp())
+        self.check_backend(b)
+
@@ -2,17 +2,61 @@
 import unittest
 import base
 
+import asm3.cachedisk
 import asm3.csvimport
 
+import io
+
 class TestCSVImport(unittest.TestCase):
 
     def tearDown(self):
-        base.execute("DELETE FROM animal WHERE AnimalName = 'TestioCSV'")
+        base.execute("DELETE FROM animal WHERE AnimalName LIKE 'TestioCSV%'")
+        base.execute("DELETE FROM owner WHERE OwnerSurname LIKE 'TestioCSV%'")
+        asm3.csvimport.CSV_IMPORT_CHUNK_SIZE = 100
 
     def test_csvimport(self):
         csvdata = "ANIMALNAME,ANIMALSEX,ANIMALAGE\n\"TestioCSV\",\"Male\",\"2\"\n"
         asm3.csvimport.csvimport(base.get_dbo(), csvdata)
 
+    def test_csvimport_chunks(self):
+        dbo = base.get_dbo()
+        asm3.csvimport.CSV_IMPORT_CHUNK_SIZE = 3
+        csvdata = "ANIMALNAME,ANIMALAGE,ANIMALSPECIES,PERSONLASTNAME,PERSONEMAIL\n" + \
+            "".join([ "TestioCSV%d,2,Cat,TestioCSV,csv@example.com\n" % i for i in range(10) ])
+        out = asm3.csvimport.csvimport(dbo, io.BytesIO(csvdata.encode("utf-8")), checkduplicates=True)
+        assert out.startswith("<p>10 success, 0 errors</p>")
+        assert 10 == dbo.query_int("SELECT COUNT(*) FROM animal WHERE AnimalName LIKE 'TestioCSV%'")
+        assert 1 == dbo.query_int("SELECT COUNT(*) FROM owner WHERE OwnerSurname = 'TestioCSV'")
+        assert dbo.connection is None
+
+    def test_csvimport_private_transaction(self):
+        # The import must not commit or end a transaction on the Database it is given
+        dbo = base.get_dbo()
+        csvdata = "ANIMALNAME,ANIMALSEX,ANIMALAGE\n\"TestioCSV\",\"Male\",\"2\"\n"
+        dbo.begin()
+        try:
+            out = asm3.csvimport.csvimport(dbo, csvdata)
+            assert out.startswith("<p>1 success, 0 errors</p>")
+            assert dbo.in_transaction and dbo.connection is not None
+        finally:
+            dbo.rollback()
+
+    def test_csvimport_resume(self):
+        dbo = base.get_dbo()
+        csvdata = "ANIMALNAME,ANIMALSEX,ANIMALAGE\n" + "".join([ "TestioCSV%d,Male,2\n" % i for i in range(5) ])
+        key = "csvimport:%s" % asm3.csvimport.csv_checksum(csvdata, "utf-8-sig", False, False, False)
+        asm3.cachedisk.put(key, dbo.database, { "rowno": 3, "errors": [] }, 60)
+        asm3.csvimport.csvimport(dbo, csvdata)
+        assert [ "TestioCSV3", "TestioCSV4" ] == [ r.ANIMALNAME for r in dbo.query("SELECT AnimalName FROM animal WHERE AnimalName LIKE 'TestioCSV%' ORDER BY AnimalName") ]
+        assert asm3.cachedisk.get(key, dbo.database) is None
+
+    def test_lookupcache(self):
+        dbo = base.get_dbo()
+        lookups = asm3.csvimport.LookupCache(dbo)
+        for v in ("Cat", " cat ", "Nothing like it"):
+            assert asm3.csvimport.gkl(dbo, { "S": v }, "S", "species", "SpeciesName", False, lookups) == \
+                asm3.csvimport.gkl(dbo, { "S": v }, "S", "species", "SpeciesName", False)
+
     def test_csvexport_animals(self):
         asm3.csvimport.csvexport_animals(base.get_dbo(), "all")
 
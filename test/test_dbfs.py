@@ -3,6 +3,7 @@ import unittest
 import base
 
 import asm3.dbfs
+import asm3.media
 
 class TestDBFS(unittest.TestCase):
 
@@ -49,7 +50,11 @@ class TestDBFS(unittest.TestCase):
         assert len(asm3.dbfs.get_report_images(base.get_dbo())) > 0
 
     def test_delete_orphaned_media(self):
-        asm3.dbfs.delete_orphaned_media(base.get_dbo())
+        dbo = base.get_dbo()
+        orphan = asm3.media.get_thumbnail_name(dbo.query_int("SELECT MAX(ID) FROM dbfs") + 1000, "100x100")
+        asm3.dbfs.put_string(dbo, orphan, asm3.media.THUMBNAIL_PATH, b"thumb")
+        asm3.dbfs.delete_orphaned_media(dbo)
+        assert orphan not in asm3.dbfs.list_contents(dbo, asm3.media.THUMBNAIL_PATH)
 
     def test_switch_storage(self):
         asm3.dbfs.switch_storage(base.get_dbo())
@@ -0,0 +1,168 @@
+
+import threading
+import unittest
+import base
+
+import asm3.dbms.base
+import asm3.dbms.pool
+
+class TestDBMS(unittest.TestCase):
+
+    def test_query_stream(self):
+        dbo = base.get_dbo()
+        sql = "SELECT ID, SpeciesName FROM species ORDER BY ID"
+        rows = dbo.query(sql)
+        streamed = list(dbo.query_stream(sql, batchsize=2))
+        assert len(rows) == len(streamed)
+        for r, s in zip(rows, streamed):
+            assert r.ID == s.ID
+            assert r["SPECIESNAME"] == s["SPECIESNAME"]
+            assert r.SPECIESNAME == s["SpeciesName"]
+
+    def test_query_stream_params(self):
+        dbo = base.get_dbo()
+        rows = list(dbo.query_stream("SELECT ID FROM species WHERE ID = ?", [1]))
+        assert len(rows) == 1 and rows[0].ID == 1
+        assert list(dbo.query_stream("SELECT ID FROM species WHERE ID = ?", [-1])) == []
+
+    def test_stream_row(self):
+        r = asm3.dbms.base.StreamRow({ "ID": 0, "NAME": 1 }, (5, "Fred"))
+        assert r.id == 5 and r.NAME == "Fred" and r["name"] == "Fred"
+        assert "ID" in r and "Name" in r and "FOO" not in r
+        assert r.get("FOO", "x") == "x"
+        assert sorted(r.keys()) == [ "ID", "NAME" ]
+        r.NAME = "Bob"
+        assert r["NAME"] == "Bob"
+        c = r.copy()
+        assert isinstance(c, asm3.dbms.base.ResultRow) and c.NAME == "Bob"
+        with self.assertRaises(AttributeError):
+            r.FOO
+        with self.assertRaises(KeyError):
+            r["FOO"] = 1
+
+    def test_query_to_insert_sql(self):
+        dbo = base.get_dbo()
+        sql = list(dbo.query_to_insert_sql("SELECT * FROM species", "species"))
+        assert len(sql) == dbo.query_int("SELECT COUNT(*) FROM species")
+        assert sql[0].startswith("INSERT INTO species (")
+
+    def test_get_ids(self):
+        dbo = base.get_dbo()
+        ids = dbo.get_ids("log", 5)
+        assert len(ids) == 5 and ids == list(range(ids[0], ids[0] + 5))
+        assert dbo.get_id("log") == ids[-1] + 1
+        assert dbo.get_ids("log", 0) == []
+
+    def test_insert_update_many(self):
+        dbo = base.get_dbo()
+        rows = [ { "LogTypeID": 1, "LinkID": 1, "LinkType": 0, "Date": dbo.now(), "Comments": "Don't %d" % i } for i in range(10) ]
+        ids = dbo.insert_many("log", rows, "test")
+        idlist = ",".join(str(x) for x in ids)
+        assert len(ids) == 10
+        assert dbo.query_int("SELECT COUNT(*) FROM log WHERE ID IN (%s)" % idlist) == 10
+        assert dbo.query_string("SELECT Comments FROM log WHERE ID = ?", [ids[3]]) == "Don't 3"
+        assert dbo.query_string("SELECT CreatedBy FROM log WHERE ID = ?", [ids[3]]) == "test"
+        assert dbo.query_int("SELECT COUNT(*) FROM audittrail WHERE TableName = 'log' AND Action = 0 AND LinkID IN (%s)" % idlist) == 10
+        dbo.update_many("log", [ (iid, { "Comments": "Changed" }) for iid in ids ], "test")
+        assert dbo.query_int("SELECT COUNT(*) FROM log WHERE Comments = 'Changed' AND ID IN (%s)" % idlist) == 10
+        desc = dbo.query_string("SELECT Description FROM audittrail WHERE TableName = 'log' AND Action = 1 AND LinkID = ?", [ids[0]])
+        assert "COMMENTS: Don't 0 ==> Changed" in desc
+        dbo.execute("DELETE FROM log WHERE ID IN (%s)" % idlist)
+
+    def test_transaction(self):
+        dbo = base.get_dbo()
+        dbo.begin()
+        try:
+            dbo.savepoint("t1")
+            kept = dbo.insert("log", { "LogTypeID": 1, "LinkID": 1, "LinkType": 0, "Date": dbo.now(), "Comments": "Kept" }, "test", writeAudit=False)
+            dbo.release_savepoint("t1")
+            dbo.savepoint("t2")
+            undone = dbo.insert("log", { "LogTypeID": 1, "LinkID": 1, "LinkType": 0, "Date": dbo.now(), "Comments": "Undone" }, "test", writeAudit=False)
+            dbo.rollback_savepoint("t2")
+            dbo.commit()
+        except:
+            dbo.rollback()
+            raise
+        assert dbo.connection is None
+        assert dbo.query_string("SELECT Comments FROM log WHERE ID = ?", [kept]) == "Kept"
+        assert dbo.query_int("SELECT COUNT(*) FROM log WHERE ID = ?", [undone]) == 0
+        dbo.delete("log", kept, writeAudit=False)
+
+    def test_pool(self):
+        dbo = base.get_dbo()
+        p = asm3.dbms.pool.ConnectionPool("test", maxsize=2)
+        c = p.acquire(dbo)
+        assert p.stats()["inuse"] == 1
+        p.release(c)
+        assert p.stats()["idle"] == 1 and p.stats()["inuse"] == 0
+        # A second release of the same connection must not put it back twice
+        p.release(c)
+        assert p.stats()["idle"] == 1 and p.stats()["inuse"] == 0
+        # Nor can a stale release hand back a connection another thread is using
+        got = []
+        acquired = threading.Event()
+        done = threading.Event()
+        def other():
+            got.append(p.acquire(dbo))
+            acquired.set()
+            done.wait()
+            p.release(got[0])
+        t = threading.Thread(target=other)
+        t.start()
+        acquired.wait()
+        assert got[0] is c
+        p.release(c)
+        assert p.stats()["idle"] == 0 and p.stats()["inuse"] == 1
+        done.set()
+        t.join()
+        assert p.stats()["idle"] == 1 and p.stats()["inuse"] == 0
+        p.close_all()
+        assert p.stats()["idle"] == 0
+
+    def test_track_changes(self):
+        dbo = base.get_dbo()
+        stamped = []
+        def set_table_changed(table):
+            stamped.append(table)
+            return asm3.dbms.base.Database.set_table_changed(dbo, table)
+        dbo.set_table_changed = set_table_changed
+        # Statements that change nothing do not count
+        dbo.execute("UPDATE log SET Comments = 'x' WHERE ID = -1")
+        assert stamped == []
+        # Each table is recorded once per transaction, when it is committed
+        dbo.begin()
+        try:
+            ids = [ dbo.insert("log", { "LogTypeID": 1, "LinkID": 1, "LinkType": 0, "Date": dbo.now(), "Comments": "Tracked" }, "test", writeAudit=False) for i in range(3) ]
+            assert stamped == []
+            dbo.commit()
+        except:
+            dbo.rollback()
+            raise
+        assert stamped == [ "log" ]
+        idlist = ",".join(str(x) for x in ids)
+        # and once per batch
+        stamped.clear()
+        dbo.execute_batch([ ("UPDATE species SET SpeciesName = SpeciesName WHERE ID = ?", [ (1,), (2,) ]), 
+            ("UPDATE log SET Comments = 'x' WHERE ID IN (%s)" % idlist, None),
+            ("UPDATE log SET Comments = 'y' WHERE ID IN (%s)" % idlist, None) ])
+        assert stamped == [ "log" ]
+        # Nothing is recorded for a transaction that is rolled back
+        stamped.clear()
+        dbo.begin()
+        dbo.execute("DELETE FROM log WHERE ID IN (%s)" % idlist)
+        dbo.rollback()
+        assert stamped == []
+        dbo.execute("DELETE FROM log WHERE ID IN (%s)" % idlist)
+        assert stamped == [ "log" ]
+
+    def test_clone(self):
+        dbo = base.get_dbo()
+        dbo.locale = "en_GB"
+        dbo.begin()
+        try:
+            c = dbo.clone()
+            assert c.database == dbo.database and c.locale == "en_GB"
+            assert c.connection is None and not c.in_transaction
+            assert c.query_int("SELECT COUNT(*) FROM species") > 0
+        finally:
+            dbo.rollback()
@@ -0,0 +1,68 @@
+
+import gzip, io, unittest
+import base
+
+import asm3.dbupdate
+
+class TestDBUpdate(unittest.TestCase):
+
+    def rows(self, dbo):
+        return [ dict(r) for r in dbo.query("SELECT * FROM lksex ORDER BY ID") ]
+
+    def check_load(self, copyFormat):
+        dbo = base.get_dbo()
+        before = self.rows(dbo)
+        dump = "".join(asm3.dbupdate.dump_table(dbo, "lksex", "lksex", batchSize = 2, copyFormat = copyFormat))
+        assert asm3.dbupdate.load(dbo, io.StringIO(dump)) > 0
+        assert before == self.rows(dbo)
+
+    def test_dump_insert(self):
+        dbo = base.get_dbo()
+        dump = "".join(asm3.dbupdate.dump_table(dbo, "lksex", "lksex", batchSize = 2))
+        count = dbo.query_int("SELECT COUNT(*) FROM lksex")
+        assert dump.count("INSERT INTO") == (count + 1) // 2
+        self.check_load(False)
+
+    def test_dump_copy(self):
+        dbo = base.get_dbo()
+        dump = "".join(asm3.dbupdate.dump_table(dbo, "lksex", "lksex", copyFormat = True))
+        assert dump.find("COPY lksex (") != -1
+        self.check_load(True)
+
+    def test_load_rollback(self):
+        # A dump that fails part way through must not leave its DELETE applied
+        dbo = base.get_dbo()
+        before = self.rows(dbo)
+        dump = "BEGIN;\nDELETE FROM lksex;\n" + "UPDATE lksex SET Sex = Sex WHERE ID = 0;\n" * 200 + \
+            "INSERT INTO nosuchtable (ID) VALUES (1);\nCOMMIT;\n"
+        try:
+            asm3.dbupdate.load(dbo, io.StringIO(dump))
+            assert False, "load should have failed"
+        except AssertionError:
+            raise
+        except Exception:
+            pass
+        assert before == self.rows(dbo)
+
+    def test_read_statements(self):
+        dump = "BEGIN;\nINSERT INTO t (A) VALUES ('x;\n'';\ny'),\n(null);\nCOPY t (A, B) FROM stdin;\n1\t\\N\n\\.\nCOMMIT;\n"
+        s = list(asm3.dbupdate.read_statements(io.StringIO(dump)))
+        assert s[0] == ("BEGIN;", None)
+        assert s[1] == ("INSERT INTO t (A) VALUES ('x;\n'';\ny'),\n(null);", None)
+        assert s[2] == ("COPY t (A, B) FROM stdin;", [ "1\t\\N\n" ])
+        assert s[3] == ("COMMIT;", None)
+
+    def test_dump_parallel(self):
+        def fn(x):
+            for i in range(3): yield "%s%d\r\n" % (x, i)
+        out = "".join(asm3.dbupdate.dump_parallel([ "a", "b", "c", "d" ], fn, 3))
+        assert out == "".join([ "".join(fn(x)) for x in "abcd" ])
+
+    def test_write_read_dump(self):
+        for compress in (False, True):
+            f = io.BytesIO()
+            asm3.dbupdate.write_dump([ "INSERT INTO t (A) VALUES ('é\r\n');\n" ], f, compress)
+            if compress: assert gzip.decompress(f.getvalue()) is not None
+            f.seek(0)
+            assert asm3.dbupdate.read_dump(f).read() == "INSERT INTO t (A) VALUES ('é\r\n');\n"
+
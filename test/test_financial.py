@@ -1,8 +1,9 @@
 
-import unittest
+import datetime, unittest
 import base
 
 import asm3.financial
+import asm3.i18n
 import asm3.utils
 
 class TestFinancial(unittest.TestCase):
@@ -133,6 +134,43 @@ class TestFinancial(unittest.TestCase):
         asm3.financial.update_trx_from_form(base.get_dbo(), "test", post)
         asm3.financial.delete_trx(base.get_dbo(), "test", tid)
 
+    def test_balance_index(self):
+        dbo = base.get_dbo()
+        base.execute("DELETE FROM accounts WHERE Code LIKE 'Testbal%'")
+        bank = asm3.financial.insert_account_from_form(dbo, "test", asm3.utils.PostedData({ "code": "Testbal1", "type": "1", "description": "Test" }, "en"))
+        income = asm3.financial.insert_account_from_form(dbo, "test", asm3.utils.PostedData({ "code": "Testbal2", "type": "5", "description": "Test" }, "en"))
+        tids = []
+        for i in range(6):
+            post = asm3.utils.PostedData({
+                "trxdate": asm3.i18n.python2display("en", datetime.datetime(2019, 11, 1) + datetime.timedelta(days=i * 20)),
+                "deposit": str(100 * (i + 1)),
+                "withdrawal": "0",
+                "accountid": str(bank),
+                "otheraccount": "Testbal2",
+                "reconciled": i % 2 == 0 and "1" or "0",
+                "description": "Test"
+            }, "en")
+            tids.append(asm3.financial.insert_trx_from_form(dbo, "test", post))
+        asm3.financial.mark_reconciled(dbo, tids[1])
+        post = asm3.utils.PostedData({ "trxid": str(tids[2]), "trxdate": "02/15/2020", "deposit": "0", "withdrawal": "50", 
+            "accountid": str(bank), "otheraccount": "Testbal2", "description": "Test" }, "en")
+        asm3.financial.update_trx_from_form(dbo, "test", post)
+        asm3.financial.delete_trx(dbo, "test", tids[3])
+        start = datetime.datetime(1900, 1, 1)
+        for d in ( datetime.datetime(2019, 11, 1), datetime.datetime(2019, 12, 10), datetime.datetime(2020, 2, 16), datetime.datetime(2021, 1, 1) ):
+            for rec in ( asm3.financial.BOTH, asm3.financial.RECONCILED, asm3.financial.NONRECONCILED ):
+                for ac in ( bank, income ):
+                    assert asm3.financial.get_balance_to_date(dbo, ac, d, rec) == asm3.financial.get_trx_balance(dbo, ac, start, d, rec)
+                    assert asm3.financial.get_balance_fromto_date(dbo, ac, datetime.datetime(2019, 11, 5), d, rec) == \
+                        asm3.financial.get_trx_balance(dbo, ac, datetime.datetime(2019, 11, 5), d, rec)
+        assert asm3.financial.check_balance_index(dbo) == 0
+        base.execute("UPDATE accountsbalance SET Deposit = Deposit + 1 WHERE AccountID = %d" % bank)
+        assert asm3.financial.check_balance_index(dbo) > 0
+        assert asm3.financial.check_balance_index(dbo) == 0
+        asm3.financial.delete_account(dbo, "test", bank)
+        asm3.financial.delete_account(dbo, "test", income)
+        assert dbo.query_int("SELECT COUNT(*) FROM accountsbalance WHERE AccountID IN (%d, %d)" % (bank, income)) == 0
+
     def test_voucher_crud(self):
         data = {
             "personid": "1",
@@ -1,11 +1,60 @@
-
-import unittest
+import os, tempfile, time, unittest
 import base
 
 import asm3.geo
+import asm3.person
+import asm3.utils
 
 class TestGeo(unittest.TestCase):
  
     def test_get_lat_long(self):
         assert asm3.geo.get_lat_long(base.get_dbo(), "109 Greystones Road", "Rotherham", "South Yorkshire", "S60 2AH", "England") is not None
 
+    def use_stub(self):
+        provider, store = asm3.geo.GEO_PROVIDER, asm3.geo.store
+        asm3.geo.GEO_PROVIDER = "stub"
+        asm3.geo.store = asm3.geo.GeoStore(os.path.join(tempfile.mkdtemp(), "geocodes.db"))
+        def restore():
+            asm3.geo.GEO_PROVIDER, asm3.geo.store = provider, store
+        self.addCleanup(restore)
+
+    def test_get_lat_long_stub(self):
+        self.use_stub()
+        dbo = base.get_dbo()
+        latlon = asm3.geo.get_lat_long(dbo, "1 Test Street", "Testville", "Testshire", "TE1 ST1", "England")
+        assert latlon is not None and not latlon.startswith("0,0,")
+        assert latlon == asm3.geo.store.get("stub", asm3.geo.get_provider(dbo, "1 Test Street", "Testville", "Testshire", "TE1 ST1", "England").q)
+        assert latlon == asm3.geo.get_lat_long(dbo, "1 Test Street", "Testville", "Testshire", "TE1 ST1", "England")
+        assert asm3.geo.get_lat_long(dbo, "1 Nowhere Street", "Testville", "Testshire", "TE1 ST1", "England").startswith("0,0,")
+        assert asm3.geo.get_lat_long(dbo, "", "", "", "") is None
+
+    def test_token_bucket(self):
+        b = asm3.geo.TokenBucket(20)
+        start = time.time()
+        for i in range(5): b.acquire()
+        assert time.time() - start >= 0.19
+        b = asm3.geo.TokenBucket(0)
+        start = time.time()
+        for i in range(100): b.acquire()
+        assert time.time() - start < 0.1
+
+    def test_queue_lat_long(self):
+        self.use_stub()
+        dbo = base.get_dbo()
+        data = {
+            "title": "Mr",
+            "forenames": "Geo",
+            "surname": "Testing",
+            "ownertype": "1",
+            "address": "2 Test Street",
+            "town": "Testville"
+        }
+        post = asm3.utils.PostedData(data, "en")
+        pid = asm3.person.insert_person_from_form(dbo, post, "test", geocode=False)
+        r = asm3.geo.queue_lat_long(dbo, "owner", pid, "2 Test Street", "Testville", "", "")
+        assert r.dbo is not dbo
+        asm3.geo.wait_lat_long([ r ])
+        expected = asm3.geo.get_lat_long(dbo, "2 Test Street", "Testville", "", "")
+        assert expected == asm3.person.get_person(dbo, pid).LATLONG
+        asm3.person.delete_person(dbo, "test", pid)
+
@@ -77,6 +77,19 @@ class TestLostFound(unittest.TestCase):
     def test_update_match_report(self):
         asm3.lostfound.update_match_report(base.get_dbo())
 
+    def test_match(self):
+        matches = asm3.lostfound.match(base.get_dbo(), lostanimalid=self.laid)
+        assert self.faid in [ m.fid for m in matches ]
+
+    def test_match_incremental(self):
+        dbo = base.get_dbo()
+        def keys(matches):
+            return [ (m.lid, m.fid, m.fanimalid, m.matchpoints) for m in matches ]
+        full = asm3.lostfound.match(dbo)
+        assert keys(full) == keys(asm3.lostfound.match(dbo, incremental=True))
+        dbo.update("animalfound", self.faid, { "AnimalTypeID": 2, "AreaFound": "Elsewhere" })
+        assert keys(asm3.lostfound.match(dbo)) == keys(asm3.lostfound.match(dbo, incremental=True))
+
     def test_get_lost_person_name(self):
         asm3.lostfound.get_lost_person_name(base.get_dbo(), self.laid)
 
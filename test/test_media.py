@@ -2,7 +2,7 @@
 import unittest
 import base, base64
 
-import asm3.animal, asm3.media
+import asm3.animal, asm3.configuration, asm3.dbfs, asm3.media
 import asm3.utils
 
 class TestMedia(unittest.TestCase):
@@ -21,11 +21,42 @@ class TestMedia(unittest.TestCase):
         data = f.read()
         f.close()
         post = asm3.utils.PostedData({ "filename": "image.jpg", "filetype": "image/jpeg", "filedata": "data:image/jpeg;base64,%s" % asm3.utils.base64encode(data) }, "en")
-        asm3.media.attach_file_from_form(base.get_dbo(), "test", asm3.media.ANIMAL, nid, post)
+        mid = asm3.media.attach_file_from_form(base.get_dbo(), "test", asm3.media.ANIMAL, nid, post)
+        m = asm3.media.get_media_by_id(base.get_dbo(), mid)
+        tname = asm3.media.get_thumbnail_name(m.DBFSID, asm3.configuration.thumbnail_size(base.get_dbo()))
+        assert tname in asm3.dbfs.list_contents(base.get_dbo(), asm3.media.THUMBNAIL_PATH)
+        assert len(asm3.media.get_image_file_data(base.get_dbo(), "animalthumb", nid)[1]) > 0
+        asm3.media.rotate_media(base.get_dbo(), "test", mid)
+        asm3.media.delete_media(base.get_dbo(), "test", mid)
+        assert tname not in asm3.dbfs.list_contents(base.get_dbo(), asm3.media.THUMBNAIL_PATH)
         asm3.animal.delete_animal(base.get_dbo(), "test", nid)
  
+    def test_delete_animal_thumbnails(self):
+        data = {
+            "animalname": "Testio",
+            "estimatedage": "1",
+            "animaltype": "1",
+            "entryreason": "1",
+            "species": "1"
+        }
+        post = asm3.utils.PostedData(data, "en")
+        nid, code = asm3.animal.insert_animal_from_form(base.get_dbo(), post, "test")
+        f = open(base.PATH + "../src/media/reports/nopic.jpg", "rb")
+        data = f.read()
+        f.close()
+        post = asm3.utils.PostedData({ "filename": "image.jpg", "filetype": "image/jpeg", "filedata": "data:image/jpeg;base64,%s" % asm3.utils.base64encode(data) }, "en")
+        mid = asm3.media.attach_file_from_form(base.get_dbo(), "test", asm3.media.ANIMAL, nid, post)
+        m = asm3.media.get_media_by_id(base.get_dbo(), mid)
+        tname = asm3.media.get_thumbnail_name(m.DBFSID, asm3.configuration.thumbnail_size(base.get_dbo()))
+        assert tname in asm3.dbfs.list_contents(base.get_dbo(), asm3.media.THUMBNAIL_PATH)
+        asm3.animal.delete_animal(base.get_dbo(), "test", nid)
+        assert tname not in asm3.dbfs.list_contents(base.get_dbo(), asm3.media.THUMBNAIL_PATH)
+
     def test_remove_expired_media(self):
         asm3.media.remove_expired_media(base.get_dbo())
 
     def test_get_media_export(self):
         asm3.media.get_media_export(base.get_dbo())
+
+    def test_create_all_thumbnails(self):
+        asm3.media.create_all_thumbnails(base.get_dbo())
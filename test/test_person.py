@@ -32,6 +32,15 @@ class TestPerson(unittest.TestCase):
     def test_get_person_similar(self):
         assert len(asm3.person.get_person_similar(base.get_dbo(), "", "", "Testing", "Test", "123 street")) > 0
 
+    def test_get_person_similar_index(self):
+        dbo = base.get_dbo()
+        index = asm3.person.PersonIndex(dbo)
+        def ids(rows):
+            return [ r.ID for r in rows ]
+        for args in [ ("", "", "Testing", "Test", "123 street"), ("test@nowhere.com", "", "Nobody", "", "") ]:
+            assert ids(asm3.person.get_person_similar(dbo, *args)) == ids(asm3.person.get_person_similar(dbo, *args, index=index))
+        assert self.nid in ids(asm3.person.get_person_similar(dbo, "", "", "Testing", "Test", "123 street", index=index))
+
     def test_get_person_name(self):
         assert "" != asm3.person.get_person_name(base.get_dbo(), self.nid)
 
@@ -120,6 +129,22 @@ class TestPerson(unittest.TestCase):
         mid = asm3.person.insert_person_from_form(base.get_dbo(), post, "test", geocode=False)
         asm3.person.merge_person(base.get_dbo(), "test", self.nid, mid)
 
+    def test_merge_duplicate_people(self):
+        dbo = base.get_dbo()
+        data = {
+            "title": "Mr",
+            "forenames": "Test",
+            "surname": "Testing",
+            "ownertype": "1",
+            "address": "123 test street"
+        }
+        post = asm3.utils.PostedData(data, "en")
+        mid = asm3.person.insert_person_from_form(dbo, post, "test", geocode=False)
+        assert mid in [ m for pid, mids in asm3.person.get_duplicate_people(dbo) for m in mids ]
+        asm3.person.merge_duplicate_people(dbo, "test")
+        assert asm3.person.get_person(dbo, mid) is None
+        assert [] == asm3.person.get_duplicate_people(dbo)
+
     def test_get_person_embedded(self):
         assert asm3.person.get_person_embedded(base.get_dbo(), self.nid) is not None
 
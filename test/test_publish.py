@@ -1,10 +1,15 @@
 
+import http.server
+import requests
+import socket
+import threading
 import unittest
 import base
 
 import asm3.animal
 import asm3.configuration
 import asm3.publishers
+import asm3.publishers.vetenvoy
 import asm3.utils
 
 class TestPublish(unittest.TestCase):
@@ -33,9 +38,143 @@ class TestPublish(unittest.TestCase):
     def test_get_animal_data(self):
         assert len(asm3.publishers.base.get_animal_data(base.get_dbo())) > 0
 
+    def test_get_animal_data_single(self):
+        dbo = base.get_dbo()
+        rows = [ r for r in asm3.publishers.base.get_animal_data(dbo) if r.ID == self.nid ]
+        assert rows == asm3.publishers.base.get_animal_data(dbo, animalid=self.nid)
+        assert [] == asm3.publishers.base.get_animal_data(dbo, animalid=-1)
+
+    def test_get_animal_data_cache(self):
+        dbo = base.get_dbo()
+        asm3.publishers.base.get_animal_data(dbo)
+        dbo.update("animal", self.nid, { "AnimalName": "Testio Changed" })
+        rows = [ r for r in asm3.publishers.base.get_animal_data(dbo) if r.ID == self.nid ]
+        assert "Testio Changed" == rows[0].ANIMALNAME
+
+    def test_get_bonded_animal_ids(self):
+        assert [ self.nid ] == asm3.publishers.base.get_bonded_animal_ids(base.get_dbo(), self.nid)
+
     def test_get_microchip_data(self):
         asm3.publishers.base.get_microchip_data(base.get_dbo(), [ "0", "1", "2", "3", "4", "5", "6", "7", "8", "9" ], "test")
 
+    def test_fingerprints(self):
+        dbo = base.get_dbo()
+        def publisher(fullresync=False):
+            pc = asm3.publishers.base.PublishCriteria(asm3.configuration.publisher_presets(dbo))
+            pc.fullResync = fullresync
+            p = asm3.publishers.base.AbstractPublisher(dbo, pc)
+            p.initLog("testfingerprint", "Test Publisher")
+            a = [ x for x in p.getMatchingAnimals() if x.ID == self.nid ][0]
+            return p, a
+        p, a = publisher()
+        assert p.fingerprintAnimal(a, { "name": "Testio" })
+        assert p.isImageChanged(a)
+        p.saveFingerprints([ a ])
+        # Nothing has changed
+        p, a = publisher()
+        assert not p.fingerprintAnimal(a, { "name": "Testio" })
+        assert not p.isImageChanged(a)
+        assert not p.hasChanges()
+        p.saveFingerprints([], [ a ])
+        # The data changed
+        p, a = publisher()
+        assert p.fingerprintAnimal(a, { "name": "Testio Changed" })
+        assert p.hasChanges()
+        # A full resync sends everything
+        p, a = publisher(True)
+        assert p.fingerprintAnimal(a, { "name": "Testio" })
+        assert p.isImageChanged(a)
+        # Unchanged animals are sent again after PUBLISH_RESEND_DAYS
+        dbo.execute("UPDATE animalpublishedfingerprint SET SentDate = ? WHERE PublishedTo = 'testfingerprint'", [ dbo.today(offset=-400) ])
+        p, a = publisher()
+        assert p.fingerprintAnimal(a, { "name": "Testio" }) == (asm3.publishers.base.PUBLISH_RESEND_DAYS > 0)
+        # The animal is no longer being sent
+        p, a = publisher()
+        assert p.hasChanges()
+        p.saveFingerprints([])
+        assert 0 == dbo.query_int("SELECT COUNT(*) FROM animalpublishedfingerprint WHERE PublishedTo = 'testfingerprint'")
+        # Publishers that do not use fingerprints always upload images
+        p, a = publisher()
+        p.saveFingerprints([ a ])
+        p, a = publisher()
+        p.useFingerprints = False
+        assert p.isImageChanged(a)
+        p.saveFingerprints([])
+
+    def test_http_client(self):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            failures = 1
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if Handler.failures > 0:
+                    Handler.failures -= 1
+                    self.send_response(503)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            do_PUT = do_POST
+            def log_message(self, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            c = asm3.publishers.base.HTTPClient(workers=3, retries=1, backoff=0, standin="http://127.0.0.1:%d" % server.server_address[1])
+            assert "http://127.0.0.1:%d/listings?a=1" % server.server_address[1] == c.getURL("https://example.com/listings?a=1")
+            # A POST the service answered is not sent again, a PUT is
+            r = c.post_json("https://example.com/listings", '{ "id": 0 }')
+            assert 503 == r["status"] and 1 == r["attempts"]
+            Handler.failures = 1
+            r = c.post_data("https://example.com/listings/0", '{ "id": 0 }', httpmethod="PUT")
+            assert 200 == r["status"] and 2 == r["attempts"]
+            results = [ (i, f.result()["response"]) for i, f in c.map(lambda i: c.post_json("https://example.com/listings", str(i)), range(20)) ]
+            assert [ (i, str(i)) for i in range(20) ] == results
+            c.close()
+            log = c.getTimingsLog()
+            assert 23 == len(log) and log[-1].startswith("HTTP timings: 22 requests, 1 retried")
+            # A POST that could not connect was never sent, so it is retried
+            sock = socket.socket()
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+            sock.close()
+            d = asm3.publishers.base.HTTPClient(retries=1, backoff=0, standin="http://127.0.0.1:%d" % port)
+            self.assertRaises(requests.exceptions.ConnectionError, d.post_json, "https://example.com/listings", "{}")
+            assert 2 == d.timings[0][4]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    # vetenvoy
+    def test_vetenvoy_signup(self):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def respond(self, body):
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def do_GET(self):
+                self.respond(b'<c id="conv1" />')
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                assert self.path.endswith("/AutoSignup/conv1")
+                self.respond(b'<u id="user1" pwd="secret1" />')
+            def log_message(self, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        baseurl = asm3.publishers.vetenvoy.VETENVOY_US_BASE_URL
+        try:
+            asm3.publishers.vetenvoy.VETENVOY_US_BASE_URL = "http://127.0.0.1:%d/" % server.server_address[1]
+            post = asm3.utils.PostedData({ "firstname": "Test", "lastname": "Testing", "practicename": "Test Vets" }, "en")
+            assert ("user1", "secret1") == asm3.publishers.vetenvoy.VetEnvoyUSMicrochipPublisher.signup(base.get_dbo(), post)
+        finally:
+            asm3.publishers.vetenvoy.VETENVOY_US_BASE_URL = baseurl
+            server.shutdown()
+            server.server_close()
 
     # html 
     def test_get_adoptable_animals(self):
@@ -59,3 +59,14 @@ class TestReports(unittest.TestCase):
         asm3.reports.install_recommended_smcom_reports(base.get_dbo(), "test") # Calls get_reports to do the install
 
     
+
+    def test_replace_all_fields(self):
+        r = asm3.reports.Report(base.get_dbo())
+        row = { "ID": 5, "NAME": "A {b} $c", "NAMES": None, "COUNT(*)": 2 }
+        for block in [ "<p>$ID $name, $Names.</p>", "$$TITLE$$ $ID$NAME $ID", "$COUNT(*) $ID", "$id" ]:
+            expected = block
+            for k, v in row.items():
+                expected = r._ReplaceFields(expected, k, r._DisplayValue(k, v))
+            assert r._ReplaceAllFields(block, row) == expected
+        assert r._ReplaceAllFields("<p>$ID $name</p>", row) == "<p>5 A &#123;b&#125; &#36;c</p>"
+        assert asm3.reports.CompiledBlock("$ID$NAME ", row.keys()).compiled == False
@@ -1,11 +1,26 @@
 
 import unittest
-#import base
+import base
 
+import asm3.cachemem
 import asm3.users
 
 class TestUsers(unittest.TestCase):
 
+    uid = 0
+
+    def setUp(self):
+        self.uid = base.get_dbo().insert("users", {
+            "UserName":     "testtoken",
+            "RealName":     "Test Token",
+            "Password":     asm3.users.hash_password("letmein"),
+            "SuperUser":    1,
+            "RecordVersion": 0
+        }, "test", setCreated=False)
+
+    def tearDown(self):
+        asm3.users.delete_user(base.get_dbo(), "test", self.uid)
+
     def test_hash_password(self):
         assert asm3.users.hash_password("password", "plain") == "plain:password"
         assert asm3.users.hash_password("letmein", "md5") == "md5:0d107d09f5bbe40cade3de5c71e9e9b7"
@@ -21,3 +36,30 @@ class TestUsers(unittest.TestCase):
         assert asm3.users.verify_password("letmein", "md5java:d107d09f5bbe40cade3de5c71e9e9b7")
         assert asm3.users.verify_password("letmein", "md5:0d107d09f5bbe40cade3de5c71e9e9b7")
 
+    def test_authenticate(self):
+        dbo = base.get_dbo()
+        assert asm3.users.authenticate(dbo, "testtoken", "letmein").ID == self.uid
+        # Second time is from the verified credential cache
+        assert asm3.users.authenticate(dbo, "TestToken", "letmein").ID == self.uid
+        # The cache must not hold the stored password hash
+        cached = asm3.cachemem.get(asm3.users.auth_cache_key(dbo, "TESTTOKEN", "letmein"))
+        dbpassword = dbo.query_string("SELECT Password FROM users WHERE ID=?", [self.uid])
+        assert cached is not None and dbpassword not in cached
+        assert asm3.users.authenticate(dbo, "testtoken", "wrong") is None
+        asm3.users.reset_password(dbo, self.uid, "newpass")
+        assert asm3.users.authenticate(dbo, "testtoken", "letmein") is None
+        assert asm3.users.authenticate(dbo, "testtoken", "newpass").ID == self.uid
+        asm3.users.change_password(dbo, "testtoken", "newpass", "letmein")
+        assert asm3.users.authenticate(dbo, "testtoken", "newpass") is None
+
+    def test_tokens(self):
+        dbo = base.get_dbo()
+        token = asm3.users.insert_token(dbo, "test", self.uid, "website")
+        expired = asm3.users.insert_token(dbo, "test", self.uid, "old", dbo.today(offset=-1))
+        assert asm3.users.authenticate_token(dbo, token).ID == self.uid
+        assert asm3.users.authenticate_token(dbo, expired) is None
+        assert asm3.users.authenticate_token(dbo, "notatoken") is None
+        tokens = asm3.users.get_tokens(dbo, self.uid)
+        assert 2 == len(tokens)
+        asm3.users.revoke_token(dbo, "test", [ t.ID for t in tokens if t.DESCRIPTION == "website" ][0])
+        assert asm3.users.authenticate_token(dbo, token) is None
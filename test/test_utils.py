@@ -1,5 +1,5 @@
 
-import datetime, unittest
+import datetime, io, unittest
 import base
 
 import asm3.utils
@@ -31,6 +31,25 @@ class TestUtils(unittest.TestCase):
         assert rows[0]["FIELD1"].find("quoted") != -1
         assert len(rows[0]) == 2
 
+    def test_csv_reader(self):
+        data = u"A,B\r\n\"x, y\",\"\u00e9\"\r\n\r\n\"a\r\nb\",\"say \"\"hi\"\"\"\r\n".encode("utf-8")
+        f = io.BytesIO(data)
+        rows = list(asm3.utils.csv_reader(f))
+        assert rows == [ { "A": "x, y", "B": "&#233;" }, { "A": "a\nb", "B": "say \"hi\"" } ]
+        assert not f.closed
+        assert rows == asm3.utils.csv_parse(data.decode("utf-8"))
+
+    def test_substitute_tags(self):
+        tags = { "NAME": "Fred & <Bob>", "IMG": "<img src=x>", "NESTED": "<<NAME>>" }
+        assert asm3.utils.substitute_tags("Hi &lt;&lt;name&gt;&gt;, &lt;&lt;img&gt;&gt;&lt;&lt;MISSING&gt;&gt;.", tags) == "Hi Fred &amp; &lt;Bob&gt;, <img src=x>."
+        assert asm3.utils.substitute_tags("Hi <<Name>>", tags, False, "<<", ">>") == "Hi Fred & <Bob>"
+        assert asm3.utils.substitute_tags("<<NESTED>>!", tags, False, "<<", ">>") == "Fred & <Bob>!"
+        assert asm3.utils.substitute_tags("Unclosed &lt;&lt;NAME", tags) == "Unclosed &lt;&lt;NAME"
+        t = asm3.utils.compile_template("<<NAME>> and <<NAME>>", "<<", ">>")
+        assert t is asm3.utils.compile_template("<<NAME>> and <<NAME>>", "<<", ">>")
+        assert t.render({ "NAME": "x" }) == "x and x"
+        assert t.render({ "NAME": "y" }) == "y and y"
+
     def test_html_to_text(self):
         data = "<!DOCTYPE html>" \
             "<html><body><p>Unordered</p><ul><li>item 1</li><li>item 2</li></ul>" \